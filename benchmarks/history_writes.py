@@ -0,0 +1,130 @@
+"""Benchmark de turnos persistidos por segundo en logs.db.
+
+Compara dos formas de guardar un turno terminado (conversación + respuesta
++ un fragmento) sobre una BD temporal migrada por llm:
+
+- "antes": lo que hacía ChatHistory hasta ahora — una conexión nueva y un
+  commit por operación (conversación, respuesta, fragmento, enlace), con el
+  journal por defecto, cerrando la conexión después de cada una.
+- "después": ChatHistory.add_history_entry(..., conversation_name=...),
+  con la conexión persistente del hilo, WAL + synchronous=NORMAL y un solo
+  commit por turno.
+- "cola": ChatHistory.queue_history_entry, como lo usa LLMClient; el
+  escritor de fondo agrupa los turnos que se acumulan en una transacción.
+  Se mide hasta que flush() devuelve.
+
+No necesita GTK:
+
+    python benchmarks/history_writes.py --turns 500
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ulid import ULID
+
+from gtk_llm_chat.db_operations import ChatHistory
+from gtk_llm_chat.persistence_writer import persistence_writer
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def legacy_turn(db_path, cid, prompt, response, fragment):
+    """Reproduce la secuencia previa: connect/commit/close por operación."""
+    now = datetime.now(timezone.utc).isoformat()
+    conn = _connect(db_path)
+    conn.execute("INSERT OR IGNORE INTO conversations (id, name, model) VALUES (?, ?, ?)",
+                 (cid, 'bench', 'm'))
+    conn.commit()
+    conn.close()
+
+    response_id = str(ULID()).lower()
+    conn = _connect(db_path)
+    conn.execute("""
+        INSERT INTO responses (id, model, prompt, response, conversation_id, datetime_utc)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (response_id, 'm', prompt, response, cid, now))
+    conn.commit()
+    conn.close()
+
+    content_hash = hashlib.sha256(fragment.encode('utf-8')).hexdigest()
+    conn = _connect(db_path)
+    row = conn.execute("SELECT id FROM fragments WHERE hash = ?", (content_hash,)).fetchone()
+    if row:
+        fragment_id = row['id']
+    else:
+        cursor = conn.execute(
+            "INSERT INTO fragments (content, hash, source, datetime_utc) VALUES (?, ?, ?, ?)",
+            (fragment, content_hash, 'bench', now))
+        conn.commit()
+        fragment_id = cursor.lastrowid
+    conn.close()
+
+    conn = _connect(db_path)
+    conn.execute(
+        'INSERT INTO prompt_fragments (response_id, fragment_id, "order") VALUES (?, ?, 0)',
+        (response_id, fragment_id))
+    conn.commit()
+    conn.close()
+
+
+def run(label, turns, write_turn):
+    start = time.perf_counter()
+    for i in range(turns):
+        write_turn(i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:8s} {turns} turnos en {elapsed:.3f} s -> {turns / elapsed:,.0f} turnos/s")
+    return turns / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=500)
+    parser.add_argument('--response-size', type=int, default=2000,
+                        help="caracteres por respuesta")
+    args = parser.parse_args()
+    response = ("lorem ipsum " * (args.response_size // 12 + 1))[:args.response_size]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = os.path.join(tmp, 'legacy.db')
+        # Migrar con ChatHistory y volver al journal por defecto (el de antes).
+        migrated = ChatHistory(legacy_db)
+        migrated.get_connection().execute("PRAGMA journal_mode=DELETE")
+        migrated.close_connection()
+        before = run('antes', args.turns, lambda i: legacy_turn(
+            legacy_db, f"c{i % 10}", f"prompt {i}", response, 'fragmento común'))
+
+        history = ChatHistory(os.path.join(tmp, 'logs.db'))
+        after = run('después', args.turns, lambda i: history.add_history_entry(
+            f"c{i % 10}", f"prompt {i}", response, 'm',
+            fragments=['fragmento común'], conversation_name='bench'))
+        history.close_connection()
+
+        queued = ChatHistory(os.path.join(tmp, 'queued.db'))
+        queued.create_conversation_if_not_exists('c0', 'bench', 'm')
+        start = time.perf_counter()
+        for i in range(args.turns):
+            queued.queue_history_entry(
+                f"c{i % 10}", f"prompt {i}", response, 'm',
+                fragments=['fragmento común'], conversation_name='bench')
+        persistence_writer.flush()
+        elapsed = time.perf_counter() - start
+        print(f"{'cola':8s} {args.turns} turnos en {elapsed:.3f} s -> "
+              f"{args.turns / elapsed:,.0f} turnos/s  {persistence_writer.stats()}")
+
+    print(f"mejora: x{after / before:.1f}")
+
+
+if __name__ == '__main__':
+    main()
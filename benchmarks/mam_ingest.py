@@ -0,0 +1,168 @@
+"""Benchmark de la reconciliación de páginas MAM con la caché XMPP.
+
+Reproduce un catch-up de MAM sobre un archivo sintético de `--messages`
+mensajes de un contacto, en páginas de `--page`. Una parte ya está en la
+caché como filas en vivo (sin mam_id, algunas con la hora desfasada) y hay
+turnos con streaming (seed + correcciones XEP-0308) y aprobaciones:
+
+- "antes": lo que hacía XmppConversation._reconcile_mam_page, mensaje a
+  mensaje: attach_mam_to_request_id, attach_mam_to_recent_message y
+  record_message, cada uno con sus SELECT y su commit;
+- "después": XmppHistory.ingest_mam_page, una transacción por página.
+
+Cuenta sentencias SQL y commits por página, mide la latencia por página y
+comprueba que las dos bases terminan iguales. No necesita GTK:
+
+    python benchmarks/mam_ingest.py --messages 10000 --page 50
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gtk_llm_chat.xmpp_history import XmppHistory, fold_mam_corrections
+
+JID = "agent@example.org"
+APPROVE = [{"label": "Allow", "value": "/approve"}, {"label": "Deny", "value": "/deny"}]
+WORDS = "ok sure build test deploy logs error retry done fixed check review".split()
+
+
+def build_archive(messages, live_ratio, seed=1):
+    """(página MAM completa, filas en vivo ya en caché)."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    archive, live = [], []
+    i = 0
+    while len(archive) < messages:
+        when = start + timedelta(seconds=30 * i)
+        ts = when.isoformat()
+        mam_id = f"mam-{len(archive):06d}"
+        kind = rng.random()
+        body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+        if kind < 0.45:
+            item = (body, "out", ts, mam_id, [], [], None, None)
+        elif kind < 0.55:
+            item = (f"Approval needed: {body}", "in", ts, mam_id, APPROVE, [],
+                    f"req-{i}", None)
+        elif kind < 0.75:
+            # Turno con streaming: seed y dos correcciones.
+            request_id = f"req-{i}"
+            archive.append((body, "in", ts, mam_id, [], [], request_id, None))
+            for n in (1, 2):
+                archive.append((f"{body} (+{n})", "in",
+                                (when + timedelta(seconds=n)).isoformat(),
+                                f"{mam_id}-{n}", [], [], None, request_id))
+            if rng.random() < live_ratio:
+                live.append((f"{body} (+2)", "in", ts, None, None, request_id))
+            i += 1
+            continue
+        else:
+            item = (body, "in", ts, mam_id, [], [], None, None)
+        archive.append(item)
+        if rng.random() < live_ratio:
+            skew = timedelta(seconds=rng.randint(-20, 20))
+            quick = json.dumps(item[4]) if item[4] else None
+            live.append((item[0], item[1], (when + skew).isoformat(), None, quick, item[6]))
+        i += 1
+    return archive[:messages], live
+
+
+def open_history(path, live):
+    history = XmppHistory(path)
+    conn = history.get_connection()
+    conn.executemany(
+        "INSERT INTO messages (bare_jid, body, direction, timestamp, mam_id, "
+        "quick_responses, request_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(JID,) + row for row in live])
+    history._rebuild_pending_approvals(conn)
+    conn.commit()
+    return history
+
+
+def legacy_page(history, messages):
+    folded = fold_mam_corrections(
+        messages, lambda replace_id, body: history.update_by_request_id(JID, replace_id, body))
+    decisions = []
+    for item in folded:
+        body, direction, timestamp, mam_id, quick, commands, request_id = item
+        if request_id and history.attach_mam_to_request_id(JID, request_id, timestamp, mam_id):
+            decisions.append((item, None))
+            continue
+        if history.attach_mam_to_recent_message(
+                JID, body, direction, timestamp, mam_id, quick_responses=quick,
+                commands=commands, request_id=request_id):
+            decisions.append((item, None))
+            continue
+        decisions.append((item, history.record_message(
+            JID, body, direction, timestamp, mam_id, quick_responses=quick,
+            commands=commands, request_id=request_id)))
+    return decisions
+
+
+def run(label, history, pages, ingest):
+    counts = {'statements': 0, 'commits': 0}
+
+    def trace(sql):
+        counts['statements'] += 1
+        counts['commits'] += sql.strip().upper().startswith('COMMIT')
+
+    conn = history.get_connection()
+    conn.set_trace_callback(trace)
+    latencies, new = [], 0
+    for page in pages:
+        start = time.perf_counter()
+        decisions = ingest(history, page)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        new += sum(1 for _item, inserted in decisions if inserted)
+    conn.set_trace_callback(None)
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:8s} total {sum(latencies):8.0f} ms  "
+          f"p50 {statistics.median(ordered):7.2f} ms  p95 {p95:7.2f} ms/página  "
+          f"sentencias/página {counts['statements'] / len(pages):7.1f}  "
+          f"commits/página {counts['commits'] / len(pages):5.1f}  nuevos {new}")
+    return sum(latencies)
+
+
+def table(history):
+    conn = history.get_connection()
+    return [tuple(row) for row in conn.execute(
+        "SELECT body, direction, timestamp, mam_id, quick_responses, commands, request_id "
+        "FROM messages ORDER BY id")] + [tuple(row) for row in conn.execute(
+            "SELECT message_id FROM pending_approvals ORDER BY message_id")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--page', type=int, default=50)
+    parser.add_argument('--live-ratio', type=float, default=0.3,
+                        help="fracción del archivo que ya está en caché sin mam_id")
+    args = parser.parse_args()
+
+    archive, live = build_archive(args.messages, args.live_ratio)
+    pages = [archive[i:i + args.page] for i in range(0, len(archive), args.page)]
+    print(f"{len(archive)} mensajes en {len(pages)} páginas, "
+          f"{len(live)} filas en vivo en caché")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = open_history(os.path.join(tmp, 'before.db'), live)
+        after = open_history(os.path.join(tmp, 'after.db'), live)
+        legacy_ms = run('antes', before, pages, legacy_page)
+        ingest_ms = run('después', after, pages,
+                        lambda history, page: history.ingest_mam_page(JID, page))
+        same = table(before) == table(after)
+        print(f"mejora total: x{legacy_ms / ingest_ms:.1f}  bases iguales: {same}")
+        before.close_connection()
+        after.close_connection()
+
+
+if __name__ == '__main__':
+    main()
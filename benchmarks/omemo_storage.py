@@ -0,0 +1,157 @@
+"""Benchmark del almacén de claves OMEMO: JSON completo vs. SQLite por lotes.
+
+Reproduce las escrituras de claves que hace python-omemo al cifrar y
+descifrar un mensaje, sobre una base de claves sintética con el mismo
+esquema de nombres (device lists, sesiones con su ratchet, prekeys):
+
+- cifrar para un contacto con `--devices` dispositivos: por dispositivo,
+  namespaces + active (la limpieza de encrypt_msg_async) y el estado de la
+  sesión; más la device list propia;
+- descifrar: el estado de la sesión del remitente y su trust.
+
+"antes" es JSONStorage: cada store() reescribe el JSON entero con fsync
+(omemo_store.write_json_keys). "después" es SQLiteKeyStore con un batch()
+por mensaje, como OMEMOEngine. Mide la latencia de almacenamiento por
+mensaje y los bytes escritos; la criptografía no cambia entre ambos y no
+se incluye. No necesita GTK ni python-omemo:
+
+    python benchmarks/omemo_storage.py --contacts 50 --messages 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gtk_llm_chat.omemo_store import SQLiteKeyStore, write_json_keys
+
+NS = "urn:xmpp:omemo:2"
+_BASE64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+
+def _blob(rng, size):
+    return ''.join(rng.choice(_BASE64) for _ in range(size))
+
+
+def _session(rng, session_size):
+    return {'root_chain': _blob(rng, 44), 'sending_chain': _blob(rng, 44),
+            'receiving_chain': _blob(rng, 44), 'counter': rng.randrange(1000),
+            'skipped_message_keys': [[_blob(rng, 44), rng.randrange(1000), _blob(rng, 44)]
+                                     for _ in range(session_size // 140)]}
+
+
+def build_keys(contacts, devices, prekeys, session_size, seed=1):
+    """Base de claves sintética con la forma de la de python-omemo."""
+    rng = random.Random(seed)
+    data = {'/own_device_id': 12345, '/own_identity_key': _blob(rng, 64)}
+    data[f'/{NS}/x3dh/pre_keys'] = {str(i): _blob(rng, 64) for i in range(prekeys)}
+    data[f'/{NS}/x3dh/signed_pre_key'] = _blob(rng, 160)
+    for c in range(contacts):
+        jid = f"contact{c}@example.org"
+        ids = [1000 + c * devices + d for d in range(devices)]
+        data[f'/devices/{jid}/list'] = ids
+        for device_id in ids:
+            key = f'/devices/{jid}/{device_id}'
+            data[f'{key}/namespaces'] = [NS]
+            data[f'{key}/active'] = {NS: True}
+            data[f'{key}/identity_key'] = _blob(rng, 44)
+            data[f'/{NS}/{jid}/{device_id}/session'] = _session(rng, session_size)
+            data[f'/trust/{jid}/{device_id}'] = 'trusted'
+    return data
+
+
+def message_writes(rng, data, contacts, devices, session_size, outgoing):
+    """Las (clave, valor) que escribe un mensaje cifrado o descifrado."""
+    c = rng.randrange(contacts)
+    jid = f"contact{c}@example.org"
+    ids = data[f'/devices/{jid}/list']
+    writes = []
+    if outgoing:
+        for device_id in ids:
+            key = f'/devices/{jid}/{device_id}'
+            writes.append((f'{key}/namespaces', [NS]))
+            writes.append((f'{key}/active', {NS: True}))
+            writes.append((f'/{NS}/{jid}/{device_id}/session', _session(rng, session_size)))
+        writes.append(('/devices/me@example.org/list', [12345]))
+    else:
+        device_id = rng.choice(ids)
+        writes.append((f'/{NS}/{jid}/{device_id}/session', _session(rng, session_size)))
+        writes.append((f'/trust/{jid}/{device_id}', 'trusted'))
+    return writes
+
+
+def run_json(path, data, traces):
+    data = dict(data)
+    write_json_keys(path, data)
+    latencies, written = [], 0
+    for writes in traces:
+        start = time.perf_counter()
+        for key, value in writes:
+            data[key] = value
+            written += write_json_keys(path, data)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies, written, os.path.getsize(path)
+
+
+def run_sqlite(path, json_path, data, traces):
+    write_json_keys(json_path, data)
+    store = SQLiteKeyStore(path, json_path)   # migra el JSON, como al actualizar
+    before = store.stats()['bytes_written']
+    latencies = []
+    for writes in traces:
+        start = time.perf_counter()
+        with store.batch():
+            for key, value in writes:
+                store.store(key, value)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    stats = store.stats()
+    store.close()
+    size = sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+    return latencies, stats['bytes_written'] - before, size, stats
+
+
+def report(label, latencies, written, size, messages):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:8s} p50 {statistics.median(ordered):8.2f} ms  p95 {p95:8.2f} ms  "
+          f"escrito/mensaje {written / messages / 1024:9.1f} KiB  "
+          f"archivo {size / 1024:,.0f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=50)
+    parser.add_argument('--devices', type=int, default=3, help="dispositivos por contacto")
+    parser.add_argument('--prekeys', type=int, default=100)
+    parser.add_argument('--session-size', type=int, default=2000,
+                        help="bytes aproximados del estado de cada sesión")
+    parser.add_argument('--messages', type=int, default=200)
+    args = parser.parse_args()
+
+    data = build_keys(args.contacts, args.devices, args.prekeys, args.session_size)
+    rng = random.Random(2)
+    traces = [message_writes(rng, data, args.contacts, args.devices, args.session_size,
+                             outgoing=i % 2 == 0)
+              for i in range(args.messages)]
+    print(f"{len(data)} claves, {args.messages} mensajes (mitad cifrados, mitad descifrados), "
+          f"{sum(len(t) for t in traces) / len(traces):.1f} store() por mensaje")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_latencies, json_written, json_size = run_json(
+            os.path.join(tmp, 'keys.json'), data, traces)
+        report('antes', json_latencies, json_written, json_size, args.messages)
+        sql_latencies, sql_written, sql_size, stats = run_sqlite(
+            os.path.join(tmp, 'keys.sqlite3'), os.path.join(tmp, 'legacy.json'), data, traces)
+        report('después', sql_latencies, sql_written, sql_size, args.messages)
+        print(f"sqlite: {stats}")
+
+    speedup = statistics.median(json_latencies) / statistics.median(sql_latencies)
+    print(f"mejora p50: x{speedup:.1f}  bytes: x{json_written / max(1, sql_written):.0f}")
+
+
+if __name__ == '__main__':
+    main()
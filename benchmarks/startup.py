@@ -0,0 +1,207 @@
+"""Benchmark del arranque por fases (--benchmark-startup).
+
+Lanza la aplicación N veces con --benchmark-startup; cada arranque imprime
+una línea STARTUP_BENCHMARK con lo que tardó cada fase (imports de llm, gi
+y Adw, load_plugins, load_styles, setup_icon_theme, conexión y migraciones
+de ChatHistory, resolución del modelo) y los instantes window_shown y
+first_frame, y sale. Aquí se agregan min/p50/p95/max por fase y se escribe
+todo como JSON, para comparar ramas o detectar regresiones en CI.
+
+Necesita GTK y un display; sin DISPLAY ni WAYLAND_DISPLAY se envuelve cada
+arranque en xvfb-run (o se fuerza con --xvfb):
+
+    python benchmarks/startup.py --runs 10 --output startup.json
+    xvfb-run -a python benchmarks/startup.py --runs 10
+
+Con --cold cada arranque usa un LLM_USER_PATH vacío (sin logs.db: entran
+las migraciones); si no, usa el directorio de llm del usuario.
+
+Con --importtime los arranques corren con `python -X importtime` y el
+informe agrega el tiempo de import por subsistema (gtk, llm, llm-plugins,
+markdown, nbxmpp, omemo, gstreamer, app), para detectar que algo pesado
+volvió a importarse antes del primer frame. importtime añade su propio
+coste, así que conviene comparar esos arranques sólo entre sí.
+
+Con --restore 1,10,30 cada cantidad arranca sobre un LLM_USER_PATH con
+ese número de conversaciones guardadas en window_session.json, y el
+informe agrega first_window_restored (primera ventana pintada) y
+all_windows_restored (la última) por cantidad:
+
+    python benchmarks/startup.py --restore 1,10,30 --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from gtk_llm_chat.startup_timing import importtime_report, parse_report
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(values):
+    return {'min': round(min(values), 3), 'p50': round(statistics.median(values), 3),
+            'p95': round(percentile(values, 95), 3), 'max': round(max(values), 3),
+            'runs': len(values)}
+
+
+def aggregate(reports):
+    """min/p50/p95/max de cada fase, marca y del total entre los arranques."""
+    phases, marks, totals, imports = {}, {}, [], {}
+    for report in reports:
+        for name, entry in report.get('imports', {}).get('subsystems', {}).items():
+            imports.setdefault(name, []).append(entry['self_ms'])
+        for name, phase in report['phases'].items():
+            phases.setdefault(name, []).append(phase['ms'])
+        for name, ms in report['marks'].items():
+            marks.setdefault(name, []).append(ms)
+        if report.get('total_ms') is not None:
+            totals.append(report['total_ms'])
+    return {'phases': {name: summarize(v) for name, v in sorted(phases.items())},
+            'marks': {name: summarize(v) for name, v in sorted(marks.items())},
+            'total_ms': summarize(totals) if totals else None,
+            'imports': {name: summarize(v) for name, v in sorted(imports.items())}}
+
+
+def seed_restore(user_dir, count, turns):
+    """logs.db con `count` conversaciones de `turns` turnos; devuelve los
+    descriptores de window_session.json que las reabren."""
+    from gtk_llm_chat.db_operations import ChatHistory
+    history = ChatHistory(os.path.join(user_dir, 'logs.db'))
+    response = "respuesta de ejemplo con algo de **markdown** y `código`. " * 10
+    descriptors = []
+    for i in range(count):
+        cid = f"01bench{i:019d}"
+        for turn in range(turns):
+            history.add_history_entry(cid, f"pregunta {turn}", response, 'gpt-4o-mini',
+                                      conversation_name=f"Conversación {i}")
+        descriptors.append({'type': 'llm', 'cid': cid})
+    descriptors[-1]['focused'] = True
+    history.database.close()
+    return descriptors
+
+
+def write_session(user_dir, descriptors):
+    # La aplicación reescribe el archivo al salir: se restaura antes de cada arranque.
+    with open(os.path.join(user_dir, 'window_session.json'), 'w') as f:
+        json.dump({'windows': descriptors}, f)
+
+
+def command(args):
+    cmd = [sys.executable] + (['-X', 'importtime'] if args.importtime else [])
+    cmd += ['-m', 'gtk_llm_chat.main', '--benchmark-startup']
+    if args.model and not args.restore:
+        cmd += ['--model', args.model]
+    headless = not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    if args.xvfb or headless:
+        if not shutil.which('xvfb-run'):
+            sys.exit("sin display y sin xvfb-run: "
+                     "instala xvfb o ejecuta en una sesión gráfica")
+        cmd = ['xvfb-run', '-a'] + cmd
+    return cmd
+
+
+def run_once(cmd, env, timeout, importtime=False):
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True,
+                          timeout=timeout)
+    wall_ms = (time.perf_counter() - start) * 1000.0
+    report = parse_report(proc.stdout)
+    if report is None:
+        sys.stderr.write(proc.stdout[-2000:] + proc.stderr[-2000:])
+        raise RuntimeError(f"el arranque no emitió informe (código {proc.returncode})")
+    report['wall_ms'] = round(wall_ms, 3)
+    if importtime:
+        report['imports'] = importtime_report(proc.stderr)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1,
+                        help="arranques descartados (caché de disco, .pyc)")
+    parser.add_argument('--model', help="modelo a cargar (por defecto, el de llm)")
+    parser.add_argument('--cold', action='store_true',
+                        help="LLM_USER_PATH vacío en cada arranque")
+    parser.add_argument('--xvfb', action='store_true', help="forzar xvfb-run")
+    parser.add_argument('--importtime', action='store_true',
+                        help="agregar python -X importtime por subsistema")
+    parser.add_argument('--restore',
+                        help="cantidades de conversaciones a restaurar, p.ej. 1,10,30")
+    parser.add_argument('--turns', type=int, default=20,
+                        help="turnos por conversación con --restore")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--output', help="archivo JSON (por defecto, stdout)")
+    args = parser.parse_args()
+
+    cmd = command(args)
+    if args.restore:
+        counts = [int(count) for count in args.restore.split(',')]
+        result = {'command': cmd, 'restore': {}}
+        for count in counts:
+            with tempfile.TemporaryDirectory() as user_dir:
+                descriptors = seed_restore(user_dir, count, args.turns)
+                env = dict(os.environ, LLM_USER_PATH=user_dir)
+
+                def launch():
+                    write_session(user_dir, descriptors)
+                    return run_once(cmd, env, args.timeout, args.importtime)
+
+                reports = run_series(args, launch, f"restaurar {count}")
+            result['restore'][str(count)] = {'runs': reports, 'summary': summary_of(reports)}
+    else:
+        def launch():
+            env = dict(os.environ)
+            with tempfile.TemporaryDirectory() as user_dir:
+                if args.cold:
+                    env['LLM_USER_PATH'] = user_dir
+                return run_once(cmd, env, args.timeout, args.importtime)
+
+        reports = run_series(args, launch, "arranque")
+        result = {'command': cmd, 'cold': args.cold, 'runs': reports,
+                  'summary': summary_of(reports)}
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def run_series(args, launch, label):
+    reports = []
+    for i in range(args.warmup + args.runs):
+        report = launch()
+        if i < args.warmup:
+            continue
+        reports.append(report)
+        marks = report['marks']
+        line = (f"{label} {len(reports)}/{args.runs}: primer frame "
+                f"{marks.get('first_frame', float('nan')):.0f} ms")
+        if 'all_windows_restored' in marks:
+            line += (f", primera restaurada {marks['first_window_restored']:.0f} ms"
+                     f", todas {marks['all_windows_restored']:.0f} ms")
+        print(line, file=sys.stderr)
+    return reports
+
+
+def summary_of(reports):
+    summary = aggregate(reports)
+    summary['wall_ms'] = summarize([r['wall_ms'] for r in reports])
+    return summary
+
+
+if __name__ == '__main__':
+    main()
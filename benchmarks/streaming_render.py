@@ -0,0 +1,112 @@
+"""Benchmark del render en streaming de MessageWidget.update_content.
+
+Simula una respuesta de ~50 KB (párrafos, listas, fences y tablas) que llega
+en chunks pequeños, como los que emite LLMClient._process_stream, y mide el
+tiempo de cada update_content con el render incremental frente al render
+completo (el comportamiento anterior: _set_message_content con todo el
+texto acumulado en cada chunk).
+
+Necesita GTK 4; en una máquina sin sesión gráfica:
+
+    xvfb-run -a python benchmarks/streaming_render.py
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gi
+gi.require_version('Gtk', '4.0')
+gi.require_version('Adw', '1')
+from gi.repository import Adw, GLib, Gtk
+
+from gtk_llm_chat.widgets import Message, MessageWidget
+
+
+def synthetic_response(size):
+    """Markdown variado de al menos `size` caracteres."""
+    sections = [
+        "## Sección {n}\n\n"
+        "Este es un párrafo de relleno con **negrita**, *cursiva* y "
+        "`código inline` para que markdown_to_pango tenga trabajo real. "
+        "Sigue un poco más de texto para ocupar varias líneas.\n\n",
+        "- primer punto de la lista {n}\n- segundo punto\n- tercer punto\n\n",
+        "```python\ndef funcion_{n}(x):\n    return x * {n}\n```\n\n",
+        "| col a | col b |\n| ----- | ----- |\n| {n} | valor |\n| x | y |\n\n",
+    ]
+    out = []
+    total = 0
+    n = 0
+    while total < size:
+        chunk = sections[n % len(sections)].format(n=n)
+        out.append(chunk)
+        total += len(chunk)
+        n += 1
+    return ''.join(out)
+
+
+def iter_chunks(text, chunk_size):
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size]
+
+
+def pump_events():
+    context = GLib.MainContext.default()
+    while context.pending():
+        context.iteration(False)
+
+
+def run(text, chunk_size, incremental):
+    widget = MessageWidget(Message('', sender='assistant'))
+    window = Gtk.Window()
+    window.set_child(widget)
+    window.present()
+    pump_events()
+    timings = []
+    accumulated = ''
+    for chunk in iter_chunks(text, chunk_size):
+        accumulated += chunk
+        started = time.perf_counter()
+        if incremental:
+            widget.update_content(accumulated)
+        else:
+            widget._set_message_content(Message.compact_blank_lines(accumulated))
+        timings.append((time.perf_counter() - started) * 1000)
+        pump_events()
+    window.destroy()
+    return timings
+
+
+def report(label, timings):
+    ordered = sorted(timings)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{label:12} chunks={len(timings)} total={sum(timings):.0f}ms "
+          f"mean={statistics.mean(timings):.2f}ms "
+          f"p50={statistics.median(timings):.2f}ms p95={p95:.2f}ms "
+          f"max={ordered[-1]:.2f}ms last={timings[-1]:.2f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=50_000,
+                        help='Tamaño de la respuesta sintética en caracteres')
+    parser.add_argument('--chunk', type=int, default=16,
+                        help='Caracteres por chunk')
+    parser.add_argument('--skip-full', action='store_true',
+                        help='No medir el render completo (lento a propósito)')
+    args = parser.parse_args(argv)
+
+    Adw.init()
+    text = synthetic_response(args.size)
+    print(f"respuesta={len(text)} caracteres, chunk={args.chunk}")
+    report('incremental', run(text, args.chunk, incremental=True))
+    if not args.skip_full:
+        report('completo', run(text, args.chunk, incremental=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Resumen de las métricas por turno escritas con --metrics-log.
+
+Cada línea del archivo es un turno (ver gtk_llm_chat/turn_metrics.py).
+Aquí se agrupan por versión de la aplicación y modelo y se informan
+p50/p95 de TTFT, tok/s, intervalo entre tokens (p90 de cada turno),
+latencia de entrega a la UI y guardado, para comparar modelos o detectar
+regresiones entre builds:
+
+    gtk-llm-chat --metrics-log ~/turns.jsonl
+    python benchmarks/turn_metrics.py ~/turns.jsonl [otro.jsonl ...]
+
+No necesita GTK.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gtk_llm_chat.turn_metrics import load_metrics
+
+FIELDS = ('ttft_ms', 'tokens_per_s', 'inter_token_p90_ms', 'queue_ms',
+          'flush_mean_ms', 'persist_ms')
+
+
+def _quantiles(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    if len(values) == 1:
+        return {'p50': values[0], 'p95': values[0]}
+    cuts = statistics.quantiles(values, n=20, method='inclusive')
+    return {'p50': round(statistics.median(values), 3), 'p95': round(cuts[18], 3)}
+
+
+def summarize(records):
+    """{'<versión> <modelo>': {'turns', 'failed', campo: {p50, p95}}}"""
+    groups = {}
+    for record in records:
+        key = f"{record.get('version') or 'dev'} {record.get('model')}"
+        groups.setdefault(key, []).append(record)
+    summary = {}
+    for key, turns in sorted(groups.items()):
+        entry = {'turns': len(turns),
+                 'failed': sum(1 for t in turns if not t.get('success'))}
+        for field in FIELDS:
+            entry[field] = _quantiles(t.get(field) for t in turns if t.get('success'))
+        summary[key] = entry
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', help="archivos JSON lines de --metrics-log")
+    args = parser.parse_args()
+    records = []
+    for path in args.paths:
+        records.extend(load_metrics(path))
+    print(json.dumps(summarize(records), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -14,10 +14,15 @@ require_versions({"Gtk": "4.0", "Adw": "1"})
 from gi.repository import Gtk, Adw, Gio, Gdk, GLib
 import locale
 import gettext
-import llm
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from .db_operations import ChatHistory
+from . import startup_timing
+from .context_budget import get_context_store
+from .conversation_cache import conversation_cache
+from .generation_scheduler import generation_scheduler, parse_provider_limits
+from .persistence_writer import persistence_writer
+from .render_cache import render_cache
 from .xmpp_lifecycle import XmppLifecycle
 
 _ = gettext.gettext
@@ -49,6 +54,8 @@ class LLMChatApplication(Adw.Application):
             flags=Gio.ApplicationFlags.HANDLES_COMMAND_LINE
         )
 
+        # Opciones de la línea de comandos (main.parse_args / llm_gui).
+        self.config = config or {}
         self._shutting_down = False  # Bandera para controlar proceso de cierre
         self._window_by_cid = {}  # Mapa de CID -> ventana
         self._opening_conversation_keys = set()
@@ -56,6 +63,11 @@ class LLMChatApplication(Adw.Application):
         # primer arranque; las reinvocaciones single-instance no re-restauran.
         self._session_restored = False
         self.xmpp_lifecycle = XmppLifecycle()
+        self.import_warmup = None  # ImportWarmup, tras el primer frame
+        # ChatHistory compartido por todas las ventanas (ver get_chat_history()).
+        self._chat_history = None
+        self._session_restore = None  # RestorePipeline del arranque
+        self._benchmark_reported = False
         self._xmpp_lifecycle_handler_ids = []
         
         debug_print("LLMChatApplication.__init__: Verificando si se necesita configuración inicial...")
@@ -139,9 +151,11 @@ class LLMChatApplication(Adw.Application):
             from .resource_manager import resource_manager
             
             # Configurar sin threading para evitar conflictos
-            style_manager.load_styles()
+            with startup_timing.phase('load_styles'):
+                style_manager.load_styles()
             if not resource_manager._icon_theme_configured:
-                resource_manager.setup_icon_theme()
+                with startup_timing.phase('setup_icon_theme'):
+                    resource_manager.setup_icon_theme()
             debug_print("Recursos básicos configurados en do_startup")
             
         except Exception as e:
@@ -153,11 +167,22 @@ class LLMChatApplication(Adw.Application):
 
         self.hold()  # Asegura que la aplicación no termine prematuramente
 
+        # Un único pool de generación para todas las ventanas LLM.
+        generation_scheduler.configure(
+            workers=self.config.get('generation_workers'),
+            provider_limits=parse_provider_limits(self.config.get('provider_limits')))
+
         # XMPP pertenece al ciclo de vida de la aplicación, no al de una
         # ventana. Arrancarlo en idle permite presentar GTK primero y evita que
         # un estado de sesión sin ventanas deje el proceso vivo pero offline.
         self.xmpp_lifecycle.account_loading()
         GLib.idle_add(self._start_configured_xmpp_session)
+        # Con la ventana ya pintada, importar en segundo plano lo que los
+        # módulos de la ventana ya no cargan (ver import_warmup.py).
+        if not self.config.get('benchmark_startup'):
+            # (El benchmark sale tras el primer frame: su informe de imports
+            # debe mostrar sólo lo que se importó antes.)
+            GLib.idle_add(self._start_import_warmup, priority=GLib.PRIORITY_LOW)
 
         APP_NAME = "gtk-llm-chat"
         if getattr(sys, 'frozen', False):
@@ -251,6 +276,16 @@ class LLMChatApplication(Adw.Application):
             self.xmpp_lifecycle.session_error(error)
         return GLib.SOURCE_REMOVE
 
+    def _start_import_warmup(self):
+        from .import_warmup import ImportWarmup, default_tasks
+        from .xmpp_account import is_omemo_enabled
+        try:
+            omemo = is_omemo_enabled()
+        except Exception:
+            omemo = False
+        self.import_warmup = ImportWarmup(default_tasks(omemo=omemo)).start()
+        return GLib.SOURCE_REMOVE
+
     def OpenConversation(self, cid):
         """Abrir (o enfocar) una conversación dado un CID.
 
@@ -270,6 +305,16 @@ class LLMChatApplication(Adw.Application):
         # Guardar el estado de las ventanas abiertas para restaurarlo al
         # próximo arranque (misma sesión de ventanas que al salir).
         self._save_session_state()
+        # El historial se escribe en un hilo daemon: lo que siga en cola al
+        # salir se perdería.
+        if not persistence_writer.flush(timeout=5):
+            debug_print(f"[writer] cola sin vaciar al salir: {persistence_writer.stats()}")
+        debug_print(f"[render] caché de markdown: {render_cache.stats()}")
+        debug_print(f"[scheduler] generación: {generation_scheduler.stats()}")
+        debug_print(f"[context] conversaciones: {conversation_cache.stats()}")
+        if self._chat_history is not None:
+            debug_print(f"[db] logs.db: {self._chat_history.database.stats()}")
+            self._chat_history.database.close()
         if hasattr(self, 'dbus_registration_id'):
             connection = Gio.bus_get_sync(Gio.BusType.SESSION, None)
             connection.unregister_object(self.dbus_registration_id)
@@ -341,6 +386,7 @@ class LLMChatApplication(Adw.Application):
             return
         descriptors = []
         seen = set()
+        active = self.get_active_window()
         for window in self.get_windows():
             try:
                 descriptor = self._window_descriptor(window)
@@ -353,6 +399,8 @@ class LLMChatApplication(Adw.Application):
             if key in seen:
                 continue
             seen.add(key)
+            if window is active:
+                descriptor['focused'] = True
             descriptors.append(descriptor)
         try:
             with open(path, 'w', encoding='utf-8') as f:
@@ -376,44 +424,104 @@ class LLMChatApplication(Adw.Application):
             return []
 
     def _restore_session_state(self):
-        """Reabre las ventanas guardadas al salir. Devuelve True si abrió
-        al menos una."""
-        descriptors = self._load_session_descriptors()
+        """Reabre las ventanas guardadas al salir. Devuelve True si había
+        alguna que restaurar: las ventanas aparecen después, de a una por
+        frame y la enfocada primero (ver session_restore.py); si al final
+        no se pudo abrir ninguna, se abre la ventana por defecto."""
+        descriptors = [
+            d for d in self._load_session_descriptors()
+            if (d.get('type') == 'llm' and d.get('cid'))
+            or (d.get('type') == 'xmpp' and d.get('bare_jid'))]
         if not descriptors:
             return False
-        # La sesión XMPP se crea de forma perezosa; solo si hay algún
-        # contacto XMPP que restaurar.
-        xmpp_session = None
-        restored = 0
-        for descriptor in descriptors:
-            dtype = descriptor.get('type')
-            try:
-                if dtype == 'llm':
-                    cid = descriptor.get('cid')
-                    if cid:
-                        self.open_conversation_window({
-                            'cid': cid,
-                            '_window_geometry': descriptor.get('geometry'),
-                        })
-                        restored += 1
-                elif dtype == 'xmpp':
-                    bare_jid = descriptor.get('bare_jid')
-                    if not bare_jid:
-                        continue
-                    if xmpp_session is None:
-                        xmpp_session = self.get_xmpp_session_for_roster()
-                    if xmpp_session is None:
-                        debug_print(
-                            "No hay cuenta XMPP: no se restaura la conversación "
-                            f"con {bare_jid}")
-                        continue
-                    self.open_xmpp_conversation(
-                        xmpp_session, bare_jid,
-                        window_geometry=descriptor.get('geometry'))
-                    restored += 1
-            except Exception as e:
-                debug_print(f"Error restaurando ventana {descriptor}: {e}")
-        return restored > 0
+        from .chat_window import LLMChatWindow
+        from .session_restore import RestorePipeline
+        chat_history = self.get_chat_history()
+        page_size = LLMChatWindow._LLM_HISTORY_PAGE_SIZE
+
+        def prepare(descriptor):
+            # Hilo del pool: nada de GTK. Las conversaciones XMPP dependen de
+            # la sesión del main loop y no se preparan.
+            if descriptor['type'] != 'llm':
+                return None
+            cid = descriptor['cid']
+            backend = self.build_backend({'kind': 'llm', 'cid': cid}, chat_history)
+            backend.prepare()
+            history = (chat_history.get_conversation(cid),
+                       chat_history.get_conversation_history_page(cid, limit=page_size))
+            return {'backend': backend, 'history': history}
+
+        def materialize(descriptor, prepared):
+            geometry = descriptor.get('geometry')
+            if descriptor['type'] == 'llm':
+                target = {'kind': 'llm', 'cid': descriptor['cid'],
+                          'config': {'_window_geometry': geometry}}
+                if prepared is not None:
+                    target['backend'] = prepared['backend']
+                    target['config']['_prefetched_history'] = prepared['history']
+                return self.open_conversation(target)
+            # La sesión XMPP se crea de forma perezosa; solo si hay algún
+            # contacto XMPP que restaurar (después se reutiliza).
+            session = self.get_xmpp_session_for_roster()
+            if session is None:
+                debug_print("No hay cuenta XMPP: no se restaura la conversación "
+                            f"con {descriptor['bare_jid']}")
+                return None
+            return self.open_xmpp_conversation(
+                session, descriptor['bare_jid'], window_geometry=geometry)
+
+        # Sin ventanas abiertas la aplicación terminaría al volver de
+        # activate: se retiene hasta que el pipeline acabe.
+        self.hold()
+        self._session_restore = RestorePipeline(
+            descriptors, prepare, materialize, post=GLib.idle_add,
+            after_frame=self._after_window_frame,
+            on_done=self._on_session_restored).start()
+        return True
+
+    def _after_window_frame(self, window, callback):
+        """Llama a `callback` una vez, tras el siguiente frame pintado de
+        `window` (o al rato, si la ventana no llega a pintarse)."""
+        fired = []
+
+        def fire():
+            if not fired:
+                fired.append(True)
+                callback()
+            return GLib.SOURCE_REMOVE
+
+        frame_clock = window.get_frame_clock()
+        if frame_clock is not None:
+            handler = {}
+
+            def on_after_paint(clock):
+                clock.disconnect(handler['id'])
+                fire()
+
+            handler['id'] = frame_clock.connect('after-paint', on_after_paint)
+            window.queue_draw()
+        GLib.timeout_add(500 if frame_clock is not None else 16, fire)
+
+    def _on_session_restored(self, pipeline):
+        if pipeline.windows:
+            # La que tenía el foco se abrió primero: que quede encima.
+            pipeline.windows[0].present()
+        else:
+            self._open_default_window()
+        self.release()
+        if pipeline.windows and self.config.get('benchmark_startup'):
+            self.finish_startup_benchmark()
+
+    def finish_startup_benchmark(self):
+        """Con --benchmark-startup, imprime el informe y sale. Lo llama cada
+        ventana tras su primer frame; mientras la restauración de sesión
+        siga abriendo ventanas se espera a que termine."""
+        restore = self._session_restore
+        if self._benchmark_reported or (restore is not None and not restore.done):
+            return
+        self._benchmark_reported = True
+        startup_timing.emit()
+        GLib.idle_add(self.quit)
 
     def _open_default_window(self):
         """Abre la ventana por defecto: siempre el roster (en una ventana
@@ -599,9 +707,12 @@ class LLMChatApplication(Adw.Application):
             session = descriptor['session']
             return session.get_conversation(descriptor['jid'])
 
-        from .llm_client import LLMClient
-        from llm import get_default_model
+        with startup_timing.phase('import_llm'):
+            from .llm_client import LLMClient
+            from llm import get_default_model
         config = dict(self.config or {})
+        # El --cid de la línea de comandos no es el de cualquier conversación.
+        config.pop('cid', None)
         config.update(descriptor.get('config') or {})
         cid = descriptor.get('cid')
         if cid:
@@ -613,7 +724,12 @@ class LLMChatApplication(Adw.Application):
             default_model_id = get_default_model()
             if default_model_id:
                 config['model'] = default_model_id
-        return LLMClient(config, chat_history)
+        backend = LLMClient(config, chat_history)
+        if cid:
+            # Con model_prefetch, modelo e historial se cargan mientras se
+            # construye la ventana (no-op si no está activo).
+            backend.prefetch()
+        return backend
 
     def open_conversation(self, descriptor):
         """Abre —o enfoca, si ya está abierta— la ventana de una conversación.
@@ -642,9 +758,12 @@ class LLMChatApplication(Adw.Application):
                 return None
             self._opening_conversation_keys.add(key)
 
-        chat_history = ChatHistory()
+        chat_history = self.get_chat_history()
         try:
-            backend = self.build_backend(descriptor, chat_history)
+            # La restauración de sesión trae el backend ya preparado.
+            backend = descriptor.get('backend')
+            if backend is None:
+                backend = self.build_backend(descriptor, chat_history)
             config = dict(descriptor.get('config') or {})
             if descriptor.get('cid'):
                 config['cid'] = descriptor['cid']
@@ -667,6 +786,16 @@ class LLMChatApplication(Adw.Application):
             if key is not None:
                 self._opening_conversation_keys.discard(key)
 
+    def get_chat_history(self):
+        """El ChatHistory de logs.db que comparten ventanas, LLMClient y roster.
+
+        Antes cada ventana abría el suyo, con sus propias conexiones por hilo
+        al mismo archivo; ahora todos usan el pool de lectura y la escritora
+        única del HistoryDatabase (ver history_database.py)."""
+        if self._chat_history is None:
+            self._chat_history = ChatHistory()
+        return self._chat_history
+
     def _register_llm_window_when_ready(self, window, backend):
         """Una conversación LLM nueva no tiene cid hasta que el backend lo crea;
         en ese momento se registra, para que un segundo clic la enfoque en vez de
@@ -688,11 +817,17 @@ class LLMChatApplication(Adw.Application):
                 la ventana muestra el roster y espera selección.
         """
         debug_print(f"Creando nueva ventana con configuración: {config}")
+        if self.config.get('benchmark_startup'):
+            # La ventana es quien detecta el primer frame y cierra la app.
+            config = dict(config, benchmark_startup=True,
+                          start_time=self.config.get('start_time'))
+        if self.config.get('show_turn_metrics'):
+            config = dict(config, show_turn_metrics=True)
 
         from .chat_window import LLMChatWindow
         from .resource_manager import resource_manager
         if chat_history is None:
-            chat_history = ChatHistory()
+            chat_history = self.get_chat_history()
 
         # Crear la nueva ventana con la configuración
         window = LLMChatWindow(application=self, config=config, chat_history=chat_history,
@@ -782,8 +917,7 @@ class LLMChatApplication(Adw.Application):
         has_history = False
         if cid and chat_history:
             try:
-                history_entries = chat_history.get_conversation_history(cid)
-                has_history = bool(history_entries)
+                has_history = chat_history.has_conversation_history(cid)
             except Exception as e:
                 debug_print(f"Error consultando historial para CID {cid}: {e}")
 
@@ -810,6 +944,10 @@ class LLMChatApplication(Adw.Application):
                 debug_print(f"Eliminando conversación con CID: {cid}")
                 if cid:
                     window.chat_history.delete_conversation(cid)
+                    conversation_cache.invalidate(cid)
+                    store = get_context_store(os.path.dirname(window.chat_history.db_path))
+                    if store is not None:
+                        store.forget_conversation(cid)
                     # Cerrar solo la ventana actual en lugar de toda la aplicación
                     window.close()
             dialog.destroy()
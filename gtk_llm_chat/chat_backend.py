@@ -25,9 +25,25 @@ Reglas del contrato (ver specs/001-xmpp-backend/design.md):
   mensaje recibido, junto con el request_id (stanza id) de ese mensaje
   para poder correlacionar una futura 'response-correction'. Backends que
   no lo soportan simplemente no la emiten.
+- 'turn-metrics' entrega, al cerrar cada turno generado, un dict con sus
+  tiempos (cola, primer token, intervalos entre tokens, tok/s, entrega a
+  la UI, guardado; ver turn_metrics.py). Puede llegar después de
+  'finished'. Sólo la emiten backends que generan (LLMClient).
+- 'queue-position' informa que el turno que la ventana muestra espera un
+  hueco en generation_scheduler, con cuántos turnos tiene por delante; -1
+  cuando arranca. Backends sin cola no la emiten.
+- 'history-saved' llega cuando el escritor de fondo ya aplicó el turno de
+  la conversación (su cid) en logs.db; después de 'finished'. Sólo
+  LLMClient, que guarda en logs.db.
 """
 from gi.repository import GObject
 
+from .chat_application import _
+
+# Título de una conversación nueva. Vive aquí y no en llm_client para que la
+# ventana pueda usarlo sin importar llm.
+DEFAULT_CONVERSATION_NAME = lambda: _("New Conversation")  # noqa: E731
+
 
 class ChatBackend(GObject.Object):
     """Base para backends de conversación. Duck-typed: la ventana solo
@@ -79,6 +95,9 @@ class ChatBackend(GObject.Object):
         'history-actions': (GObject.SignalFlags.RUN_LAST, None,
                             (str, str, object, object, object)),
         'history-complete': (GObject.SignalFlags.RUN_LAST, None, (bool,)),
+        'turn-metrics': (GObject.SignalFlags.RUN_LAST, None, (object,)),
+        'queue-position': (GObject.SignalFlags.RUN_LAST, None, (int,)),
+        'history-saved': (GObject.SignalFlags.RUN_LAST, None, (str,)),
     }
 
     def send_message(self, prompt: str):
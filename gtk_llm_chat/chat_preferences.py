@@ -0,0 +1,97 @@
+"""Preferencias del sidebar que sobreviven al reinicio.
+
+El modelo de cada conversación queda en logs.db
+(ChatHistory.update_conversation_model) y el modelo por defecto lo guarda
+llm (llm.set_default_model). Las demás opciones del sidebar que no son de
+una conversación van en `gtk_llm_chat_preferences.json` del directorio de
+usuario de llm, como el catálogo de modelos: nunca en logs.db, que es de
+`llm` (ver docs/data-model.md).
+
+Un valor en la config de la ventana (línea de comandos o el sidebar de
+esta sesión) manda sobre el guardado; `resolve(config, key)` lo aplica.
+No depende de gi.
+"""
+import json
+import os
+import threading
+
+from .debug_utils import debug_print
+
+PREFERENCES_FILE = "gtk_llm_chat_preferences.json"
+DEFAULTS = {
+    # Al detener una generación, guardar lo recibido marcado como truncado.
+    'keep_partial_on_cancel': True,
+}
+
+
+class ChatPreferences:
+    def __init__(self, user_dir):
+        self.path = os.path.join(str(user_dir), PREFERENCES_FILE)
+        self._lock = threading.Lock()
+        self._values = None
+
+    def _load(self):
+        if self._values is None:
+            values = {}
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    values = {k: v for k, v in data.items() if k in DEFAULTS}
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                debug_print(f"[preferences] no se pudo leer {self.path}: {e}")
+            self._values = values
+        return self._values
+
+    def get(self, key):
+        with self._lock:
+            return self._load().get(key, DEFAULTS[key])
+
+    def set(self, key, value):
+        """Guarda `value` y reescribe el archivo (de una vez, vía os.replace)."""
+        if key not in DEFAULTS:
+            raise KeyError(key)
+        with self._lock:
+            values = self._load()
+            values[key] = value
+            data = dict(values)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            debug_print(f"[preferences] no se pudo guardar {self.path}: {e}")
+
+    def resolve(self, config, key):
+        """config[key] si la ventana lo fijó; si no, lo guardado."""
+        value = (config or {}).get(key)
+        return self.get(key) if value is None else value
+
+
+def keeps_answer(text, success, cancelled, keep_partial):
+    """Si el turno va al historial: terminado, o detenido con
+    keep_partial_on_cancel; nunca sin texto."""
+    if not (text and text.strip()):
+        return False
+    if cancelled:
+        return bool(keep_partial)
+    return success
+
+
+_preferences = {}
+_preferences_lock = threading.Lock()
+
+
+def get_preferences(user_dir=None):
+    """Preferencias compartidas del directorio de usuario de llm."""
+    if user_dir is None:
+        from .platform_utils import llm_user_dir
+        user_dir = llm_user_dir()
+    user_dir = str(user_dir)
+    with _preferences_lock:
+        if user_dir not in _preferences:
+            _preferences[user_dir] = ChatPreferences(user_dir)
+        return _preferences[user_dir]
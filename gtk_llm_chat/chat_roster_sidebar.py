@@ -7,6 +7,7 @@ visualmente "modo LLM" y "modo XMPP".
 """
 import gi
 import json
+import threading
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 from gi.repository import Gtk, Adw, Gdk, GLib
@@ -16,7 +17,11 @@ from .chat_sidebar import ChatSidebar
 from .db_operations import ChatHistory
 from .debug_utils import debug_print
 from .resource_manager import resource_manager
-from .xmpp_client import XmppSession
+from .search_index import snippet_to_markup
+from .xmpp_presence import PRESENCE_AWAY, PRESENCE_BUSY, PRESENCE_OFFLINE, PRESENCE_ONLINE
+
+# Resultados de búsqueda que se muestran (los mejores por bm25).
+_SEARCH_LIMIT = 30
 
 
 def _display_name(bare_jid, name=None):
@@ -47,6 +52,10 @@ class ChatRosterSidebar(Gtk.Box):
         self._on_xmpp_account = on_xmpp_account
         self._rows = {}
         self._handler_ids = []
+        self._search_text = ''
+        # Cada búsqueda lleva un número; las respuestas de hilos ya superados
+        # por otra tecla se descartan.
+        self._search_generation = 0
 
         self.stack = Gtk.Stack()
         self.stack.set_transition_type(Gtk.StackTransitionType.SLIDE_LEFT_RIGHT)
@@ -63,6 +72,10 @@ class ChatRosterSidebar(Gtk.Box):
 
         self.append(self.stack)
         self._populate()
+        # Pone el índice al día con lo escrito mientras la app estaba cerrada
+        # (incluido el CLI de llm); corre en el hilo propio del índice.
+        if self.chat_history.search_index is not None:
+            self.chat_history.search_index.schedule_sync()
 
         if self.xmpp_session is not None:
             self._handler_ids = [
@@ -92,6 +105,15 @@ class ChatRosterSidebar(Gtk.Box):
 
         page.append(header)
 
+        if self.chat_history.search_index is not None:
+            self.search_entry = Gtk.SearchEntry(
+                placeholder_text=_("Search conversations and messages"))
+            self.search_entry.set_margin_start(6)
+            self.search_entry.set_margin_end(6)
+            self.search_entry.set_margin_bottom(6)
+            self.search_entry.connect('search-changed', self._on_search_changed)
+            page.append(self.search_entry)
+
         scroll = Gtk.ScrolledWindow(
             hscrollbar_policy=Gtk.PolicyType.NEVER,
             vscrollbar_policy=Gtk.PolicyType.AUTOMATIC)
@@ -123,6 +145,10 @@ class ChatRosterSidebar(Gtk.Box):
         self._rows = {}
 
     def _populate(self):
+        if self._search_text:
+            # Con una búsqueda activa, refrescar es repetirla.
+            self._start_search(self._search_text)
+            return
         self._clear()
         self._append_llm_conversations()
         self._append_xmpp_contacts()
@@ -146,6 +172,75 @@ class ChatRosterSidebar(Gtk.Box):
             row.cid = conv.get('id')
             self.list_box.append(row)
 
+    # --- Búsqueda ---
+
+    def _on_search_changed(self, entry):
+        self._search_text = entry.get_text().strip()
+        if self._search_text:
+            self._start_search(self._search_text)
+        else:
+            self._search_generation += 1
+            self._populate()
+
+    def _start_search(self, text):
+        """Consulta el índice FTS en un hilo: con historiales grandes la
+        consulta y los nombres de conversación no deben frenar el tecleo."""
+        self._search_generation += 1
+        generation = self._search_generation
+        index = self.chat_history.search_index
+        chat_history = self.chat_history
+
+        def worker():
+            try:
+                results = index.search(text, limit=_SEARCH_LIMIT)
+                titles = {}
+                for result in results:
+                    cid = result['conversation']
+                    if result['source'] == 'llm' and cid not in titles:
+                        conv = chat_history.get_conversation(cid)
+                        titles[cid] = (conv or {}).get('name') or cid
+            except Exception as e:
+                debug_print(f"[search] búsqueda falló: {e}")
+                results, titles = [], {}
+            finally:
+                index.close_connection()
+                chat_history.close_connection()
+            GLib.idle_add(self._show_search_results, generation, results, titles)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _show_search_results(self, generation, results, titles):
+        if generation != self._search_generation:
+            return False
+        self._clear()
+        self.list_box.append(self._section_label(_("Search Results")))
+        if not results:
+            row = Adw.ActionRow(title=_("No matches"))
+            row.set_selectable(False)
+            self.list_box.append(row)
+            return False
+
+        roster = self.xmpp_session.roster_items if self.xmpp_session is not None else {}
+        for result in results:
+            conversation = result['conversation']
+            if result['source'] == 'llm':
+                title = titles.get(conversation) or conversation
+            else:
+                item = roster.get(conversation, {})
+                title = _display_name(conversation, item.get('name'))
+            row = Adw.ActionRow(title=GLib.markup_escape_text(title))
+            row.set_subtitle(snippet_to_markup(result['snippet'], GLib.markup_escape_text))
+            row.set_subtitle_lines(2)
+            row.set_activatable(True)
+            if result['source'] == 'llm':
+                row.chat_kind = "llm"
+                row.cid = conversation
+            else:
+                row.chat_kind = "xmpp"
+                row.bare_jid = conversation
+            self.list_box.append(row)
+        return False
+
     def _contacts_by_activity(self):
         """Contactos por actividad reciente: la conversación que se acaba de
         mover, arriba. Los que no tienen historial van al final por nombre, en
@@ -195,7 +290,7 @@ class ChatRosterSidebar(Gtk.Box):
                 if avatar is not None:
                     row.add_prefix(avatar)
                 dot = self._presence_dot(
-                    item.get('presence', XmppSession.PRESENCE_OFFLINE))
+                    item.get('presence', PRESENCE_OFFLINE))
                 row.add_prefix(dot)
                 self.list_box.append(row)
                 self._rows[bare_jid] = (row, dot)
@@ -295,13 +390,13 @@ class ChatRosterSidebar(Gtk.Box):
 
     def _presence_dot(self, state):
         dot = Gtk.Image.new_from_icon_name("media-record-symbolic")
-        if state == XmppSession.PRESENCE_ONLINE:
+        if state == PRESENCE_ONLINE:
             dot.add_css_class("success")
             dot.set_tooltip_text(_("Online"))
-        elif state == XmppSession.PRESENCE_BUSY:
+        elif state == PRESENCE_BUSY:
             dot.add_css_class("error")
             dot.set_tooltip_text(_("Busy"))
-        elif state == XmppSession.PRESENCE_AWAY:
+        elif state == PRESENCE_AWAY:
             dot.add_css_class("warning")
             dot.set_tooltip_text(_("Away"))
         else:
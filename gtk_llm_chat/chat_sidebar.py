@@ -5,6 +5,7 @@ from gi.repository import Gtk, Adw, GObject, GLib, Gdk
 import os
 
 from .chat_application import _
+from .chat_preferences import get_preferences
 from .model_selector import ModelSelectorWidget
 from .model_selection import ModelSelectionManager
 from .resource_manager import resource_manager
@@ -104,6 +105,14 @@ class ChatSidebar(Gtk.Box):
         delete_row.set_activatable(True)  # Hacerla accionable
         delete_row.connect("activated", lambda x: self.get_root().get_application().on_delete_activate(None, None))
         conversation_group.add(delete_row)
+
+        # Qué hacer con lo ya generado al pulsar Detener (ver LLMClient.cancel)
+        keep_partial_row = Adw.SwitchRow(title=_("Keep Partial Answers"),
+                                         subtitle=_("Save what was generated when stopped"))
+        keep_partial_row.set_active(
+            get_preferences().resolve(self.config, 'keep_partial_on_cancel'))
+        keep_partial_row.connect("notify::active", self._on_keep_partial_toggled)
+        conversation_group.add(keep_partial_row)
         
         main_vbox.append(conversation_group)
         
@@ -163,6 +172,23 @@ class ChatSidebar(Gtk.Box):
         parameters_group.add(self.system_prompt_row)
         self._update_system_prompt_row_subtitle() # Actualizar subtítulo inicial
 
+        # Cuántos turnos previos ve el modelo (0: toda la conversación) y
+        # cuántos tokens estimados pueden ocupar (ver context_budget.py)
+        self.context_turns_row = self._context_limit_row(
+            _("Context Turns"), _("0 sends the whole conversation"),
+            'context_turns', upper=500, step=1)
+        parameters_group.add(self.context_turns_row)
+        self.context_tokens_row = self._context_limit_row(
+            _("Context Token Budget"), _("0 means no limit"),
+            'context_tokens', upper=1000000, step=1000)
+        parameters_group.add(self.context_tokens_row)
+
+        summary_row = Adw.SwitchRow(title=_("Summarize Older Turns"),
+                                    subtitle=_("Replace turns left out by a running summary"))
+        summary_row.set_active(bool(self.config.get('context_summary')))
+        summary_row.connect("notify::active", self._on_context_summary_toggled)
+        parameters_group.add(summary_row)
+
         self.stack.add_titled(parameters_page_box, "parameters", _("Parameters"))
 
         # Añadir el stack al sidebar
@@ -174,6 +200,7 @@ class ChatSidebar(Gtk.Box):
         # Si ya tenemos llm_client, programar la actualización del modelo
         if self.llm_client:
             self.llm_client.connect('ready', self._on_model_loaded)
+            self.llm_client.connect('turn-metrics', self._on_turn_metrics)
             # Programar la actualización con el modelo actual
             GLib.idle_add(self.update_model_button)
             # Configurar visibilidad inicial del botón de modelo por defecto
@@ -218,6 +245,13 @@ class ChatSidebar(Gtk.Box):
             if window and hasattr(window, 'split_view'):
                 GLib.timeout_add(100, lambda: window.split_view.set_show_sidebar(False))
 
+    def _on_keep_partial_toggled(self, row, _pspec):
+        self.config['keep_partial_on_cancel'] = row.get_active()
+        if self.llm_client:
+            self.llm_client.config['keep_partial_on_cancel'] = row.get_active()
+        # Vale también para las próximas ventanas y sesiones.
+        get_preferences().set('keep_partial_on_cancel', row.get_active())
+
     def _on_api_key_status_changed(self, selector, provider_key, needs_key, has_key):
         """Manejador cuando cambia el estado de la API key."""
         debug_print(f"ChatSidebar: API key status changed for {provider_key}: needs_key={needs_key}, has_key={has_key}")
@@ -293,6 +327,39 @@ class ChatSidebar(Gtk.Box):
                   debug_print(f"Error setting temperature in LLM client: {e}")
         self._update_temperature_subtitle() # Actualizar subtítulo de temperatura
 
+    def _context_limit_row(self, title, subtitle, key, upper, step):
+        row = Adw.ActionRow(title=title, subtitle=subtitle)
+        adjustment = Gtk.Adjustment(value=int(self.config.get(key) or 0), lower=0,
+                                    upper=upper, step_increment=step,
+                                    page_increment=step * 10)
+        spin = Gtk.SpinButton(adjustment=adjustment, digits=0)
+        spin.set_valign(Gtk.Align.CENTER)
+        adjustment.connect("value-changed", self._on_context_limit_changed, key)
+        row.add_suffix(spin)
+        row.set_activatable_widget(spin)
+        return row
+
+    def _on_context_limit_changed(self, adjustment, key):
+        value = int(adjustment.get_value())
+        self.config[key] = value
+        if self.llm_client:
+            self.llm_client.config[key] = value
+
+    def _on_context_summary_toggled(self, row, _pspec):
+        self.config['context_summary'] = row.get_active()
+        if self.llm_client:
+            self.llm_client.config['context_summary'] = row.get_active()
+
+    def _on_turn_metrics(self, _client, metrics):
+        """Tamaño estimado del último prompt, junto al presupuesto."""
+        if metrics.get('prompt_tokens_est') is None:
+            return
+        subtitle = _("Last prompt: ~{} tokens, {} earlier turns").format(
+            metrics['prompt_tokens_est'], metrics.get('context_turns') or 0)
+        if metrics.get('summarized_turns'):
+            subtitle += " · " + _("{} summarized").format(metrics['summarized_turns'])
+        self.context_tokens_row.set_subtitle(subtitle)
+
     def _update_temperature_subtitle(self):
         """Actualiza el subtítulo de la fila de temperatura con el valor actual."""
         if hasattr(self, 'adjustment') and hasattr(self, 'temperature_row'):
@@ -4,22 +4,27 @@ import os
 import re
 import sys
 import time
+import threading
 import locale
+from collections import deque
 import gettext
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 from gi.repository import Gtk, Adw, Gio, Gdk, GLib, GObject, Pango
 
-from .llm_client import LLMClient, DEFAULT_CONVERSATION_NAME
-from .widgets import Message, MessageWidget, ErrorWidget
+from .chat_backend import DEFAULT_CONVERSATION_NAME
+from .widgets import Message, MessageWidget, ErrorWidget, build_render_plan
+from .transcript import TranscriptModel
+from .turn_metrics import format_summary
+from .render_pool import render_pool
+from .generation_scheduler import generation_scheduler
+from . import startup_timing
 from .db_operations import ChatHistory
 from .chat_application import _
-from llm import get_default_model
 from .style_manager import style_manager
 from .resource_manager import resource_manager
 from .debug_utils import debug_print
-from .xmpp_client import XmppSession
-from .voice_recorder import VoiceRecorder, VoiceRecorderError
+from .xmpp_presence import PRESENCE_AWAY, PRESENCE_BUSY, PRESENCE_OFFLINE, PRESENCE_ONLINE
 from .audio_utils import audio_mime_for_file
 import traceback
 
@@ -59,6 +64,17 @@ class LLMChatWindow(Adw.ApplicationWindow):
     _TOOL_OUTPUT_MIN_HEIGHT = 260
     _TOOL_OUTPUT_MAX_HEIGHT = 560
     _TOOL_OUTPUT_HEIGHT_FRACTION = 0.42
+    # Burbujas con widget vivo (ver transcript.py). Al pasar de
+    # LIVE_LIMIT + PAGE_SIZE se ocultan las más viejas; subir al borde
+    # superior materializa otra página.
+    _TRANSCRIPT_LIVE_LIMIT = 120
+    _TRANSCRIPT_PAGE_SIZE = 40
+    # Turnos (prompt + respuesta) por página de logs.db: la primera página
+    # llena justo la ventana viva del transcript.
+    _LLM_HISTORY_PAGE_SIZE = 60
+    # Tiempo por frame para instanciar burbujas de historial desde sus render
+    # plans (ver _queue_history_bubbles): el resto del frame es para GTK.
+    _BUBBLE_FILL_BUDGET_MS = 8
 
     def __init__(self, config=None, chat_history=None, backend=None,
                  xmpp_session=None, **kwargs):
@@ -71,6 +87,8 @@ class LLMChatWindow(Adw.ApplicationWindow):
         # Conectar señal de cierre de ventana
         self.connect('close-request', self._on_close_request)
         self.connect('show', self._on_window_show)  # Connect to the 'show' signal
+        # La ventana activa tiene prioridad en la cola de generación.
+        self.connect('notify::is-active', self._on_active_changed)
 
         # Inicializar flags para carga de historial
         self._history_loaded = False
@@ -78,6 +96,18 @@ class LLMChatWindow(Adw.ApplicationWindow):
         # Burbujas ya pintadas (ver _history_bubble_key): el catch-up de MAM
         # solapa hacia atrás y reenvía mensajes que ya están en pantalla.
         self._history_keys = set()
+        # Todos los mensajes de la conversación en orden cronológico; sólo
+        # los más recientes tienen MessageWidget en messages_box.
+        self._transcript = TranscriptModel(
+            lambda message: self._comparable_ts(message.timestamp))
+        # Paginación keyset del historial LLM: (datetime_utc, id) de la fila
+        # más vieja ya cargada; None cuando no queda nada más atrás.
+        self._llm_history_cursor = None
+        self._llm_history_loading = False
+        # Burbujas de historial esperando su render plan, en el orden en que
+        # se materializan: (entrada del transcript, cómo insertarla).
+        self._bubble_fill_queue = deque()
+        self._bubble_fill_tick_id = None
         # Contacto para el que está construido el sidebar de ajustes (ver
         # _update_settings_panel): sin esto se reconstruía en cada latido.
         self._settings_panel_for = None
@@ -102,6 +132,9 @@ class LLMChatWindow(Adw.ApplicationWindow):
 
         # Asegurar que config no sea None
         self.config = config or {}
+        # (conversación, primera página) que la restauración de sesión ya
+        # leyó en un hilo de fondo; lo consume _on_backend_ready.
+        self._prefetched_history = self.config.pop('_prefetched_history', None)
         
         # Extraer cid de la configuración
         self.cid = self.config.get('cid')
@@ -129,6 +162,9 @@ class LLMChatWindow(Adw.ApplicationWindow):
         self._xmpp_session = None
         self._composing_timeout_id = None
         self._streaming_finalize_timeout_ids = {}
+        # (widget, tick_id) del render de streaming pendiente para el
+        # próximo frame (ver _queue_stream_render).
+        self._stream_render_tick = None
         self._delivery_widgets = {}
         self._pending_delivery_widgets = {}
         self._typing_row = None
@@ -148,7 +184,7 @@ class LLMChatWindow(Adw.ApplicationWindow):
         self._sticky_response_items = []
         self._sticky_response_next_id = 0
         self._voice_state = VoiceRecordState.IDLE
-        self._voice_recorder: VoiceRecorder | None = None
+        self._voice_recorder = None  # VoiceRecorder; GStreamer se carga al grabar
         self._voice_file_path: str | None = None
         self._voice_duration: float = 0.0
         self._voice_timer_id: int | None = None
@@ -214,7 +250,7 @@ class LLMChatWindow(Adw.ApplicationWindow):
         self.title_widget = Adw.WindowTitle.new(title, "")
         self.title_presence_dot = Gtk.Image.new_from_icon_name("media-record-symbolic")
         self._title_presence_css = set()
-        self._set_title_presence_state(XmppSession.PRESENCE_OFFLINE)
+        self._set_title_presence_state(PRESENCE_OFFLINE)
         self.title_presence_dot.set_valign(Gtk.Align.CENTER)
         self.title_presence_dot.set_visible(False)
 
@@ -574,6 +610,15 @@ class LLMChatWindow(Adw.ApplicationWindow):
         style_manager.apply_to_widget(self.model_badge, "model-badge")
         input_actions.append(self.model_badge)
 
+        # Métricas del último turno (TTFT · tok/s) junto al badge, si se
+        # pidieron con --show-metrics; el detalle completo va en el tooltip.
+        self.turn_metrics_label = Gtk.Label()
+        self.turn_metrics_label.add_css_class('caption')
+        self.turn_metrics_label.add_css_class('dim-label')
+        self.turn_metrics_label.add_css_class('numeric')
+        self.turn_metrics_label.set_visible(False)
+        input_actions.append(self.turn_metrics_label)
+
         # Qué está haciendo el agente ahora mismo (Trabajando, Usando
         # herramienta: X…). Vacío cuando no hay nada que contar.
         self.activity_label = Gtk.Label()
@@ -672,6 +717,9 @@ class LLMChatWindow(Adw.ApplicationWindow):
         # Agregar soporte para cancelación
         self.current_message_widget = None
         self.accumulated_response = ""
+        # Turnos LLM enviados y sin 'finished' (el primero es el que rellena
+        # current_message_widget; el resto espera en generation_scheduler).
+        self._llm_turns_in_flight = 0
         self._delivery_widgets = {}
         self._pending_delivery_widgets = {}
         self._message_widgets_by_id = {}
@@ -702,8 +750,8 @@ class LLMChatWindow(Adw.ApplicationWindow):
         if self.backend is not None:
             # Desconectar las señales explícitamente antes de soltar la
             # referencia: shutdown()/cancel() no garantiza que el backend
-            # deje de emitir (p.ej. LLMClient.cancel() es un no-op, su hilo
-            # de streaming sigue corriendo y llamando GLib.idle_add). Sin
+            # deje de emitir (p.ej. tras LLMClient.cancel() su hilo de
+            # streaming termina por su cuenta y aún encola idles). Sin
             # esto, una señal tardía del backend viejo llega igual a estos
             # mismos handlers y corrompe el estado de la conversación nueva
             # (self.cid, self.accumulated_response, current_message_widget).
@@ -736,8 +784,12 @@ class LLMChatWindow(Adw.ApplicationWindow):
         # anterior bloquean permanentemente _load_and_display_history.
         self._history_loaded = False
         self._history_displayed = False
+        self._llm_history_cursor = None
+        self._cancel_bubble_fill()
+        self._flush_stream_render()
         self.current_message_widget = None
         self.accumulated_response = ""
+        self._llm_turns_in_flight = 0
         self._xmpp_history_batch = []
         self._xmpp_history_actions_batch = []
         self._xmpp_history_loaded = False
@@ -829,6 +881,7 @@ class LLMChatWindow(Adw.ApplicationWindow):
     def _begin_recording(self):
         if self._voice_state != VoiceRecordState.IDLE:
             return
+        from .voice_recorder import VoiceRecorder, VoiceRecorderError
         try:
             self._voice_recorder = VoiceRecorder()
             self._voice_file_path = self._voice_recorder.start()
@@ -977,7 +1030,7 @@ class LLMChatWindow(Adw.ApplicationWindow):
         ts = datetime.now(timezone.utc).isoformat()
         body = self._voice_file_path or ''
         mime = audio_mime_for_file(self._voice_file_path)
-        history.record_message(
+        history.queue_message(
             self.backend.bare_jid, body, 'out', ts,
             attachment_url=None,
             attachment_mime_type=mime or RECORDING_MIME,
@@ -1041,6 +1094,9 @@ class LLMChatWindow(Adw.ApplicationWindow):
         self._clear_sticky_response_cards()
         for child in list(self.messages_box):
             self.messages_box.remove(child)
+        # Sin burbujas, las claves de la conversación anterior harían que
+        # insert() trate los mensajes de la nueva como ya mostrados u ocultos.
+        self._transcript.clear()
         # Deshacer el binding show-sidebar <-> botón toggle del bind anterior;
         # si no, cada _bind_backend acumularía otro binding sobre la misma
         # propiedad (fuga y comportamiento errático al alternar toggles).
@@ -1115,11 +1171,15 @@ class LLMChatWindow(Adw.ApplicationWindow):
                 backend.connect('encryption-state', self._on_encryption_state),
                 backend.connect('quick-responses', self._on_quick_responses),
                 backend.connect('commands', self._on_commands),
+                backend.connect('turn-metrics', self._on_turn_metrics),
+                backend.connect('queue-position', self._on_queue_position),
+                backend.connect('history-saved', self._on_history_saved),
             ]
             # Adjuntar sólo se ofrece si el backend sabe subir archivos
             # (XMPP vía XEP-0363); el backend LLM local no.
             self.attach_button.set_visible(hasattr(backend, 'send_file'))
             self.mic_button.set_visible(hasattr(backend, 'send_file'))
+            self._on_active_changed()
             # El cid sale de la config, no del backend: LLMClient.get_conversation_id()
             # fuerza la carga del modelo y, si aún no hay conversación, se INVENTA
             # una nueva — con lo que la ventana acababa apuntando a una conversación
@@ -1151,6 +1211,11 @@ class LLMChatWindow(Adw.ApplicationWindow):
         if backend is not None and is_xmpp and session.is_connected:
             GLib.idle_add(
                 self._on_backend_ready, backend, backend.get_display_name())
+        # Lo mismo con un LLMClient preparado por la restauración de sesión:
+        # cargó el modelo (y emitió 'ready') antes de que existiera la ventana.
+        if backend is not None and not is_xmpp and self._prefetched_history is not None:
+            GLib.idle_add(
+                self._on_backend_ready, backend, backend.get_display_name())
 
         # El historial NO se pide aquí. Lo carga _on_backend_ready, que es
         # cuando el backend está de verdad listo: en XMPP eso significa sesión
@@ -1737,6 +1802,8 @@ class LLMChatWindow(Adw.ApplicationWindow):
             self.activity_label.set_label("")
 
     def _on_stop_clicked(self, _button):
+        # cancel() corta también los turnos encolados detrás.
+        self._llm_turns_in_flight = 0
         if self.backend is not None:
             self.backend.cancel()
         # No esperamos al backend para devolver el control: si cancel() no
@@ -1820,6 +1887,15 @@ class LLMChatWindow(Adw.ApplicationWindow):
             message, use_markdown=use_markdown, avatar_path=avatar_path,
             avatar_anchor=avatar_anchor,
             on_retry=self._retry_message if sender == 'user' else None)
+        _entry, live = self._transcript.insert(message, message_widget)
+        if not live:
+            # Más viejo que la ventana viva (historial repuesto con mensajes
+            # ocultos): no va por el camino en vivo. Queda en el transcript
+            # con su widget, que _reveal_older_bubbles antepone al subir.
+            if DEBUG:
+                debug_print(f"[insert] hidden sender={sender} "
+                            f"hidden={self._transcript.hidden_count}")
+            return message_widget
         self._last_live_sender = sender
         if DEBUG:
             debug_print(f"[send] display_message sender={sender} len={len(str(content or ''))}")
@@ -1863,6 +1939,7 @@ class LLMChatWindow(Adw.ApplicationWindow):
             self._scroll_to_bottom_messaging(force=force)
         else:
             self._scroll_to_bottom_after_layout(force=force)
+        self._release_offscreen_bubbles()
         if DEBUG:
             debug_print(f"[send] display_message done sender={sender}")
 
@@ -2101,16 +2178,16 @@ class LLMChatWindow(Adw.ApplicationWindow):
         for css_class in getattr(self, '_title_presence_css', set()):
             self.title_presence_dot.remove_css_class(css_class)
         css_classes = set()
-        state = presence or XmppSession.PRESENCE_OFFLINE
-        if state == XmppSession.PRESENCE_BUSY:
+        state = presence or PRESENCE_OFFLINE
+        if state == PRESENCE_BUSY:
             label = _("Busy")
             css_classes.add("error")
             visible = True
-        elif state == XmppSession.PRESENCE_AWAY:
+        elif state == PRESENCE_AWAY:
             label = _("Away")
             css_classes.add("warning")
             visible = True
-        elif state == XmppSession.PRESENCE_ONLINE:
+        elif state == PRESENCE_ONLINE:
             label = _("Online")
             css_classes.add("success")
             visible = True
@@ -2176,11 +2253,11 @@ class LLMChatWindow(Adw.ApplicationWindow):
                     self.tool_output_panel.set_visible(False)
             availability = str(telemetry.get('availability') or telemetry.get('activity') or '').lower()
             if availability in ('busy', 'processing', 'working'):
-                self._set_title_presence_state(XmppSession.PRESENCE_BUSY)
+                self._set_title_presence_state(PRESENCE_BUSY)
             elif availability in ('away', 'paused', 'xa'):
-                self._set_title_presence_state(XmppSession.PRESENCE_AWAY)
+                self._set_title_presence_state(PRESENCE_AWAY)
             elif availability == 'available':
-                self._set_title_presence_state(XmppSession.PRESENCE_ONLINE)
+                self._set_title_presence_state(PRESENCE_ONLINE)
                 if self._telemetry_tool_widget is not None:
                     self._telemetry_tool_widget.set_streaming(False)
                 self._telemetry_tool_widget = None
@@ -2211,8 +2288,7 @@ class LLMChatWindow(Adw.ApplicationWindow):
             if not (self._is_progress_seed(body)
                     or self._is_tool_activity_message(body)):
                 continue
-            if widget.get_parent() == self.messages_box:
-                self.messages_box.remove(widget)
+            self._remove_message_widget(widget)
             self._message_widgets_by_id.pop(request_id, None)
             self._tool_output_request_ids.discard(request_id)
             self._tool_history_request_ids.discard(request_id)
@@ -2259,6 +2335,16 @@ class LLMChatWindow(Adw.ApplicationWindow):
         self.model_badge.set_tooltip_text(text)
         self.model_badge.set_visible(True)
 
+    def _on_turn_metrics(self, _backend, metrics):
+        if not self.config.get('show_turn_metrics'):
+            return
+        summary = format_summary(metrics)
+        self.turn_metrics_label.set_label(summary)
+        self.turn_metrics_label.set_tooltip_text("\n".join(
+            f"{key}: {value}" for key, value in sorted(metrics.items())
+            if value is not None and key not in ('timestamp', 'cid', 'version')))
+        self.turn_metrics_label.set_visible(bool(summary))
+
     def _on_model_badge_clicked(self, _button):
         """Los ajustes del modelo son distintos según quién lo gobierne: en LLM
         los decide esta app (panel de parámetros del sidebar); con un agente los
@@ -2852,7 +2938,13 @@ class LLMChatWindow(Adw.ApplicationWindow):
         if self.cid:
             debug_print(f"Verificando conversación existente para CID: {self.cid}")
             try:
-                conversation = self.chat_history.get_conversation(self.cid)
+                prefetched, self._prefetched_history = self._prefetched_history, None
+                # Sólo si sigue siendo la conversación de la ventana.
+                if prefetched is not None and (prefetched[0] or {}).get('id') == self.cid:
+                    conversation, history_entries = prefetched
+                else:
+                    conversation, history_entries = (
+                        self.chat_history.get_conversation(self.cid), None)
                 if conversation:
                     debug_print(f"Conversación encontrada en BD: {conversation}")
                     # Usar el título de la conversación si existe
@@ -2865,8 +2957,11 @@ class LLMChatWindow(Adw.ApplicationWindow):
                         self.set_conversation_name(title)
                         debug_print(f"Título actualizado para conversación (name): {title}")
                     
-                    # Cargar explícitamente los mensajes de la conversación
-                    history_entries = self.chat_history.get_conversation_history(self.cid)
+                    # Sólo la página más reciente; las anteriores se piden al
+                    # subir hasta el borde (ver _load_older_llm_history).
+                    if history_entries is None:
+                        history_entries = self.chat_history.get_conversation_history_page(
+                            self.cid, limit=self._LLM_HISTORY_PAGE_SIZE)
                     
                     if history_entries:
                         debug_print(f"Se encontraron {len(history_entries)} mensajes para mostrar")
@@ -2894,6 +2989,8 @@ class LLMChatWindow(Adw.ApplicationWindow):
                 return
             for child in list(self.messages_box):
                 self.messages_box.remove(child)
+            self._cancel_bubble_fill()
+            self._transcript.clear()
             self._history_displayed = False
             self._xmpp_backfill_remaining = 2
             self._xmpp_history_batch = []
@@ -2966,13 +3063,20 @@ class LLMChatWindow(Adw.ApplicationWindow):
             # El lote se pinta por timestamp, no por su procedencia: de dónde
             # venga (carga inicial, backfill, scroll hacia arriba) no dice nada
             # sobre si es más nuevo o más viejo que lo que ya hay en pantalla.
+            # Los widgets se crean después, desde render plans preparados
+            # fuera del hilo de GTK: primero los más nuevos.
+            pending = []
             for body, direction, timestamp, was_encrypted, encryption_namespace in batch:
                 if (direction == 'in' and
                         (Message.compact_blank_lines(body), timestamp)
                         in approval_message_keys):
                     continue
-                self._add_history_bubble(body, direction, timestamp,
-                                         was_encrypted, encryption_namespace)
+                entry = self._add_history_bubble(body, direction, timestamp,
+                                                 was_encrypted, encryption_namespace,
+                                                 deferred=True)
+                if entry is not None:
+                    pending.append(entry)
+            self._queue_history_bubbles(reversed(pending), self._insert_bubble_by_timestamp)
             self._history_displayed = True
         for body, timestamp, quick_responses, commands, request_id in action_batch:
             self._restore_history_actions(
@@ -2994,6 +3098,7 @@ class LLMChatWindow(Adw.ApplicationWindow):
         # porque el usuario está leyendo hacia atrás a propósito.
         if batch and not self._loading_older_history:
             self._scroll_to_bottom_after_layout()
+            self._release_offscreen_bubbles()
         # Se consume aquí: si se quedara puesto, el siguiente mensaje que llegue
         # tampoco bajaría y el chat volvería a "no seguir el fondo".
         self._loading_older_history = False
@@ -3290,8 +3395,12 @@ class LLMChatWindow(Adw.ApplicationWindow):
                 dt.isoformat() if dt is not None else None)
 
     def _add_history_bubble(self, body, direction, timestamp,
-                            was_encrypted=False, encryption_namespace=None):
-        """Pinta un mensaje del historial en su sitio, si no estaba ya."""
+                            was_encrypted=False, encryption_namespace=None,
+                            deferred=False):
+        """Pinta un mensaje del historial en su sitio, si no estaba ya.
+
+        Con `deferred` sólo lo agrega al transcript y devuelve la entrada
+        viva, sin widget, para _queue_history_bubbles."""
         key = self._history_bubble_key(body, direction, timestamp)
         # Una clave sin fecha no identifica nada (dos mensajes iguales sin
         # timestamp colisionarían), así que ésas no se deduplican.
@@ -3306,7 +3415,86 @@ class LLMChatWindow(Adw.ApplicationWindow):
         msg = Message(body, sender, timestamp=self._parse_history_ts(timestamp),
                       was_encrypted=was_encrypted,
                       encryption_namespace=encryption_namespace)
-        self._insert_bubble_by_timestamp(MessageWidget(msg))
+        entry, live = self._transcript.insert(msg)
+        if not live:
+            # Más viejo que la ventana viva: queda en el modelo y se pinta
+            # cuando el usuario suba hasta aquí.
+            return None
+        if deferred:
+            return entry
+        entry.widget = MessageWidget(msg)
+        self._insert_bubble_by_timestamp(entry.widget)
+        return entry
+
+    def _queue_history_bubbles(self, entries, place):
+        """Materializa `entries` (en ese orden) sin frenar el main loop.
+
+        El parseo de cada cuerpo (build_render_plan: markdown, fences,
+        tablas, validación del markup) corre en render_pool; un tick
+        callback instancia los widgets desde los planes en lotes de
+        _BUBBLE_FILL_BUDGET_MS por frame y los inserta con `place(widget)`.
+        Con las más nuevas primero, la primera pantalla aparece enseguida y
+        el resto se completa hacia arriba."""
+        for entry in entries:
+            entry.plan = None
+            self._bubble_fill_queue.append((entry, place))
+            self._submit_render_plan(entry)
+        if self._bubble_fill_queue and self._bubble_fill_tick_id is None:
+            self._bubble_fill_tick_id = self.add_tick_callback(self._on_bubble_fill_tick)
+
+    @staticmethod
+    def _submit_render_plan(entry):
+        def ready(_message, plan):
+            # Hilo del pool: sólo se deja el plan en la entrada (False si
+            # falló: el widget parsea por su cuenta). El tick lo recoge.
+            entry.plan = plan if plan is not None else False
+        render_pool.submit(build_render_plan, entry.message, ready)
+
+    def _build_entry_from_plan(self, entry):
+        plan = entry.plan
+        entry.plan = None
+        return MessageWidget(entry.message, render_plan=plan or None)
+
+    def _on_bubble_fill_tick(self, _widget, _frame_clock):
+        deadline = time.perf_counter() + self._BUBBLE_FILL_BUDGET_MS / 1000.0
+        built = 0
+        while self._bubble_fill_queue:
+            entry, place = self._bubble_fill_queue[0]
+            if entry.plan is None:
+                break  # todavía en el pool: en orden, se espera al siguiente frame
+            self._bubble_fill_queue.popleft()
+            if entry.widget is None:
+                try:
+                    entry.widget = self._build_entry_from_plan(entry)
+                    place(entry.widget)
+                    built += 1
+                except Exception as e:
+                    debug_print(f"Error al mostrar mensaje de historial: {e}")
+            if time.perf_counter() >= deadline:
+                break
+        if DEBUG and built:
+            debug_print(f"[transcript] fill built={built} "
+                        f"pending={len(self._bubble_fill_queue)} pool={render_pool.stats()}")
+        if self._bubble_fill_queue:
+            return GLib.SOURCE_CONTINUE
+        self._bubble_fill_tick_id = None
+        self._prefetch_older_plans()
+        self._release_offscreen_bubbles()
+        return GLib.SOURCE_REMOVE
+
+    def _cancel_bubble_fill(self):
+        """Olvida lo que quedaba por materializar (el transcript se vacía)."""
+        self._bubble_fill_queue.clear()
+        if self._bubble_fill_tick_id is not None:
+            self.remove_tick_callback(self._bubble_fill_tick_id)
+            self._bubble_fill_tick_id = None
+
+    def _prefetch_older_plans(self):
+        """Prepara en el pool los planes de la próxima página oculta, para
+        que _reveal_older_bubbles sólo tenga que instanciar."""
+        for entry in self._transcript.peek_older(self._TRANSCRIPT_PAGE_SIZE):
+            if entry.widget is None and entry.plan is None:
+                self._submit_render_plan(entry)
 
     def _has_recent_matching_bubble(self, body, sender, timestamp,
                                     window_seconds=60):
@@ -3314,16 +3502,17 @@ class LLMChatWindow(Adw.ApplicationWindow):
         if target_dt is None:
             return False
         normalized_body = Message.compact_blank_lines(body)
-        for child in list(self.messages_box):
-            message = getattr(child, 'message', None)
-            if message is None or message.sender != sender:
-                continue
-            if Message.compact_blank_lines(message.content) != normalized_body:
-                continue
-            child_dt = self._comparable_ts(message.timestamp)
-            if child_dt is None:
+        # El modelo está ordenado por timestamp: sólo se miran los mensajes
+        # de la ventana de tiempo, tengan o no widget vivo.
+        from datetime import timedelta
+        target_dt = self._comparable_ts(target_dt)
+        window = timedelta(seconds=window_seconds)
+        for entry in self._transcript.entries_between(
+                target_dt - window, target_dt + window):
+            message = entry.message
+            if message.sender != sender:
                 continue
-            if abs((target_dt - child_dt).total_seconds()) <= window_seconds:
+            if Message.compact_blank_lines(message.content) == normalized_body:
                 return True
         return False
 
@@ -3364,11 +3553,125 @@ class LLMChatWindow(Adw.ApplicationWindow):
         if (getattr(self, '_xmpp_backfill_remaining', 0) > 0
                 or not self._history_displayed):
             return
+        # Primero lo que ya está en memoria pero sin widget; sólo cuando no
+        # queda nada oculto se le pide más historial al backend.
+        if self._transcript.hidden_count:
+            self._reveal_older_bubbles()
+            return
+        if not self.is_messaging_backend:
+            self._load_older_llm_history()
+            return
         # El usuario subió a leer hacia atrás: el lote que llegue NO debe
         # saltar al fondo (ver _on_xmpp_history_complete).
         self._loading_older_history = True
         self.backend.load_more_history()
 
+    def _load_older_llm_history(self):
+        """Pide a logs.db la página anterior del historial LLM, fuera del
+        hilo de UI, y la antepone al transcript."""
+        cursor = self._llm_history_cursor
+        if cursor is None or self._llm_history_loading or not self.cid:
+            return
+        self._llm_history_loading = True
+        cid = self.cid
+        chat_history = self.chat_history
+
+        def fetch():
+            entries = []
+            try:
+                entries = chat_history.get_conversation_history_page(
+                    cid, before_datetime=cursor[0], before_id=cursor[1],
+                    limit=self._LLM_HISTORY_PAGE_SIZE)
+            except Exception as e:
+                debug_print(f"[history] Error leyendo página anterior: {e}")
+            finally:
+                chat_history.close_connection()
+            GLib.idle_add(self._on_older_llm_history_page, cid, entries)
+
+        threading.Thread(target=fetch, daemon=True).start()
+
+    def _on_older_llm_history_page(self, cid, entries):
+        self._llm_history_loading = False
+        # La ventana pudo cambiar de conversación mientras se leía.
+        if cid != self.cid or self._llm_history_cursor is None:
+            return GLib.SOURCE_REMOVE
+        self._remember_llm_history_cursor(entries)
+        added = self._transcript.prepend_older(self._history_entries_to_messages(entries))
+        if DEBUG:
+            debug_print(f"[history] página anterior: mensajes={added} "
+                        f"fin={self._llm_history_cursor is None}")
+        if added:
+            self._reveal_older_bubbles()
+        return GLib.SOURCE_REMOVE
+
+    def _remember_llm_history_cursor(self, entries):
+        """Guarda el cursor de la página más vieja leída, o None si fue la
+        última (página incompleta)."""
+        if len(entries) < self._LLM_HISTORY_PAGE_SIZE:
+            self._llm_history_cursor = None
+        else:
+            self._llm_history_cursor = (entries[0]['datetime_utc'], entries[0]['id'])
+
+    def _reveal_older_bubbles(self):
+        """Materializa la página anterior de mensajes ocultos del transcript."""
+        if self._bubble_fill_queue:
+            # La ventana viva todavía se está llenando hacia arriba: las
+            # ocultas irían encima de burbujas que aún no existen.
+            return
+        entries = self._transcript.reveal_older(self._TRANSCRIPT_PAGE_SIZE)
+        # De la más nueva a la más vieja: cada prepend queda encima de la
+        # anterior y el orden final es cronológico. Los planes suelen estar
+        # listos (_prefetch_older_plans); si no, el widget parsea solo.
+        for entry in reversed(entries):
+            if entry.widget is None:
+                entry.widget = self._build_entry_from_plan(entry)
+            self.messages_box.prepend(entry.widget)
+        if DEBUG:
+            debug_print(
+                f"[transcript] reveal count={len(entries)} "
+                f"hidden={self._transcript.hidden_count} "
+                f"live={self._transcript.live_count}")
+
+    def _release_offscreen_bubbles(self):
+        """Suelta los widgets de las burbujas más viejas si hay demasiadas.
+
+        Sólo mientras se sigue el fondo: quien lee más arriba está mirando
+        justamente esas burbujas. Se deja margen (una página) para no
+        ocultar/mostrar en cada mensaje nuevo."""
+        limit = self._TRANSCRIPT_LIVE_LIMIT
+        if self._bubble_fill_queue:
+            # Burbujas vivas sin widget todavía: ocultar ahora dejaría huecos.
+            return
+        if (not self._stick_to_bottom or
+                self._transcript.live_count <= limit + self._TRANSCRIPT_PAGE_SIZE):
+            return
+
+        def release(entry):
+            widget = entry.widget
+            # Sólo la primera burbuja de arriba, y nunca una que siga viva
+            # de verdad (streaming, botones pendientes, la respuesta en curso).
+            if (widget.get_parent() != self.messages_box
+                    or widget.get_prev_sibling() is not None
+                    or widget is self.current_message_widget
+                    or getattr(widget, '_streaming', False)
+                    or getattr(widget, '_quick_response_row', None) is not None):
+                return False
+            self.messages_box.remove(widget)
+            return True
+
+        released = self._transcript.hide_oldest(limit, release)
+        if DEBUG and released:
+            debug_print(
+                f"[transcript] release count={released} "
+                f"hidden={self._transcript.hidden_count} "
+                f"live={self._transcript.live_count}")
+
+    def _remove_message_widget(self, widget):
+        """Retira una burbuja del chat y del transcript."""
+        if widget.get_parent() == self.messages_box:
+            self.messages_box.remove(widget)
+        self._transcript.discard(widget)
+
     def _load_and_display_history(self, history_entries):
         """Método auxiliar para cargar y mostrar el historial después de que la UI esté lista."""
         try:
@@ -3468,12 +3771,12 @@ class LLMChatWindow(Adw.ApplicationWindow):
                 # prioriza que el bubble local se vea instantáneo.
                 self._schedule_messaging_send_after_frame(text)
             else:
-                # LLM: mantener estado busy durante generación.
-                self.set_enabled(False)
-                # LLM: crear ya la burbuja de respuesta que el stream irá
-                # rellenando vía 'response'.
-                self.current_message_widget = self.display_message("", sender="assistant")
-                self._on_llm_response(self.backend, "")
+                self._llm_turns_in_flight += 1
+                if self._llm_turns_in_flight == 1:
+                    self._begin_llm_turn()
+                # Si otro turno está generando, éste queda en la cola de
+                # generation_scheduler y su burbuja se crea cuando aquel
+                # termine (_on_llm_finished).
                 # LLM: enviar en idle de baja prioridad.
                 GLib.idle_add(
                     self._start_llm_task,
@@ -3481,6 +3784,28 @@ class LLMChatWindow(Adw.ApplicationWindow):
                     priority=GLib.PRIORITY_LOW,
                 )
 
+    def _begin_llm_turn(self):
+        # LLM: estado busy durante la generación. El input sigue activo para
+        # poder encolar el siguiente prompt.
+        self._set_busy(True)
+        # LLM: crear ya la burbuja de respuesta que el stream irá
+        # rellenando vía 'response'.
+        self.current_message_widget = self.display_message("", sender="assistant")
+        self._on_llm_response(self.backend, "")
+
+    def _on_queue_position(self, _backend, position):
+        if position < 0:
+            self.activity_label.set_label("")
+        elif position == 0:
+            self.activity_label.set_label(_("Waiting for a free slot…"))
+        else:
+            self.activity_label.set_label(
+                _("Waiting for a free slot ({} ahead)…").format(position))
+
+    def _on_active_changed(self, *_args):
+        if self.is_active() and self.backend is not None and not self.is_messaging_backend:
+            generation_scheduler.set_focused(self.backend)
+
     def _cancel_pending_messaging_send(self):
         if self._pending_messaging_send_timeout_id is not None:
             GLib.source_remove(self._pending_messaging_send_timeout_id)
@@ -3595,7 +3920,7 @@ class LLMChatWindow(Adw.ApplicationWindow):
                         self.messages_box)
             # Si es hijo, removerlo
             if is_child:
-                self.messages_box.remove(self.current_message_widget)
+                self._remove_message_widget(self.current_message_widget)
                 self.current_message_widget = None
         if message.startswith("Traceback"):
             message = message.split("\n")[-2]
@@ -3616,8 +3941,13 @@ class LLMChatWindow(Adw.ApplicationWindow):
     def _on_llm_finished(self, llm_client, success: bool):
         """Maneja la señal 'finished' de LLMClient."""
         self.set_enabled(True)
+        self._flush_stream_render()
         self.accumulated_response = ""
         self.input_text.grab_focus()
+        self._llm_turns_in_flight = max(0, self._llm_turns_in_flight - 1)
+        if self._llm_turns_in_flight and not self.is_messaging_backend:
+            # El siguiente turno encolado pasa a ser el que se muestra.
+            self._begin_llm_turn()
 
         # Red de seguridad: registrar la ventana por CID si _on_llm_response
         # no llegó a hacerlo (p.ej. sin chunks pero success=True). El caso
@@ -3638,11 +3968,11 @@ class LLMChatWindow(Adw.ApplicationWindow):
                             del app._window_by_cid[key]
                     app._window_by_cid[llm_key] = self
 
-        # Refrescar el sidebar de conversaciones: para el caso normal (CID
-        # nuevo) es aquí, no en _on_llm_response, donde la fila ya existe
-        # en la tabla conversations — LLMClient._process_stream la crea en
-        # su 'finally', que corre justo antes de emitir esta señal.
-        if success and self.model_sidebar is not None:
+    def _on_history_saved(self, _backend, _cid):
+        """Refresca el sidebar de conversaciones cuando el escritor de fondo
+        ya aplicó el turno (no en _on_llm_finished: el turno todavía está en
+        cola y el main loop no espera al disco, ver persistence_writer)."""
+        if self.model_sidebar is not None:
             self.model_sidebar.refresh()
 
     def _on_llm_response(self, llm_client, response):
@@ -3707,10 +4037,43 @@ class LLMChatWindow(Adw.ApplicationWindow):
                     app._window_by_cid[llm_key] = self
 
         self.accumulated_response += response
-        GLib.idle_add(self.current_message_widget.update_content,
-                      self.accumulated_response)
+        self._queue_stream_render()
         self._scroll_to_bottom_after_layout_if_following()
 
+    def _queue_stream_render(self):
+        """Pinta accumulated_response en la burbuja en el próximo frame.
+
+        Varios 'response' entre dos frames se pintan una sola vez: el reloj
+        de frames de GTK marca el ritmo, no la cantidad de chunks."""
+        widget = self.current_message_widget
+        if widget is None:
+            return
+        if self._stream_render_tick is not None:
+            pending_widget, tick_id = self._stream_render_tick
+            if pending_widget is widget:
+                return
+            pending_widget.remove_tick_callback(tick_id)
+            self._stream_render_tick = None
+
+        def on_tick(_widget, _clock):
+            self._stream_render_tick = None
+            if self.current_message_widget is widget:
+                widget.update_content(self.accumulated_response)
+            return GLib.SOURCE_REMOVE
+
+        self._stream_render_tick = (widget, widget.add_tick_callback(on_tick))
+
+    def _flush_stream_render(self):
+        """Pinta ya lo pendiente: el tick no corre si la ventana no está
+        mapeada, y al cerrar el turno accumulated_response se vacía."""
+        if self._stream_render_tick is None:
+            return
+        widget, tick_id = self._stream_render_tick
+        self._stream_render_tick = None
+        widget.remove_tick_callback(tick_id)
+        if self.current_message_widget is widget:
+            widget.update_content(self.accumulated_response)
+
     def _on_response_message(self, _backend, request_id, body, timestamp=''):
         """Mensaje discreto XMPP con identidad estable para correcciones."""
         ts = self._parse_history_ts(timestamp) if timestamp else None
@@ -3990,8 +4353,8 @@ class LLMChatWindow(Adw.ApplicationWindow):
                 # the command expires/fails it must disappear, leaving one
                 # toast instead of becoming another permanent chat bubble.
                 widget = self._message_widgets_by_id.get(request_id)
-                if widget is not None and widget.get_parent() == self.messages_box:
-                    self.messages_box.remove(widget)
+                if widget is not None:
+                    self._remove_message_widget(widget)
                 self._message_widgets_by_id.pop(request_id, None)
                 if widget is self.current_message_widget:
                     self.current_message_widget = None
@@ -5076,6 +5439,25 @@ class LLMChatWindow(Adw.ApplicationWindow):
         # Permitir el cierre de la ventana
         return False
 
+    def _finish_startup_benchmark(self):
+        """Espera al primer frame pintado y deja que la aplicación imprima el
+        informe por fases y salga (ver finish_startup_benchmark)."""
+        app = self.get_application()
+        frame_clock = self.get_frame_clock()
+        if frame_clock is None:
+            # Sin frame clock todavía (no realizada): 'window_shown' es lo último.
+            app.finish_startup_benchmark()
+            return
+        handler = {}
+
+        def on_after_paint(clock):
+            clock.disconnect(handler['id'])
+            startup_timing.mark('first_frame')
+            app.finish_startup_benchmark()
+
+        handler['id'] = frame_clock.connect('after-paint', on_after_paint)
+        self.queue_draw()
+
     def _on_window_show(self, window):
         """Set focus to the input text when the window is shown."""
         # Configurar recursos de forma segura cuando la ventana se muestra
@@ -5092,11 +5474,10 @@ class LLMChatWindow(Adw.ApplicationWindow):
         
         # Handle benchmark startup
         if self.benchmark_startup and self.start_time:
-            end_time = time.time()
-            elapsed_time = end_time - self.start_time
-            debug_print(f"Startup time: {elapsed_time:.4f} seconds")
-            # Use GLib.idle_add to exit after the current event loop iteration
-            GLib.idle_add(self.get_application().quit)
+            elapsed_time = time.time() - self.start_time
+            debug_print(f"Startup time (window shown): {elapsed_time:.4f} seconds")
+            startup_timing.mark('window_shown')
+            self._finish_startup_benchmark()
             return  # Don't grab focus if we are exiting
 
         # Verificación de integridad: si tenemos un CID pero después de un tiempo no se ha cargado 
@@ -5119,7 +5500,8 @@ class LLMChatWindow(Adw.ApplicationWindow):
                                 self.set_conversation_name(conversation['name'])
                                 debug_print(f"Título actualizado en carga de emergencia: {conversation['name']}")
                                 
-                            history_entries = self.chat_history.get_conversation_history(self.cid)
+                            history_entries = self.chat_history.get_conversation_history_page(
+                                self.cid, limit=self._LLM_HISTORY_PAGE_SIZE)
                             if history_entries:
                                 self._history_loaded = True
                                 self._load_and_display_history(history_entries)
@@ -5132,50 +5514,55 @@ class LLMChatWindow(Adw.ApplicationWindow):
         
         self.input_text.grab_focus()
 
+    def _history_entries_to_messages(self, history_entries):
+        """Convierte filas de logs.db (prompt + respuesta) en Messages."""
+        messages = []
+        for entry in history_entries:
+            # logs.db guarda datetime_utc naive en UTC: sin marcarlo, la
+            # burbuja mostraría la hora desplazada por la zona local.
+            timestamp = self._parse_history_ts(entry.get('datetime_utc'))
+            if timestamp is not None and timestamp.tzinfo is None:
+                from datetime import timezone
+                timestamp = timestamp.replace(tzinfo=timezone.utc).astimezone()
+            prompt = entry.get('prompt')
+            response = entry.get('response')
+            if prompt:
+                messages.append(Message(prompt, sender="user", timestamp=timestamp))
+            if response:
+                messages.append(Message(response, sender="assistant", timestamp=timestamp))
+        return messages
+
     def _display_conversation_history(self, history_entries):
-        """Muestra el historial de conversación en la UI."""
+        """Muestra la página más reciente del historial en la UI.
+
+        Los turnos van al transcript, pero sólo los más recientes se
+        materializan como MessageWidget; el resto aparece por páginas al
+        subir hasta el borde superior (ver _reveal_older_bubbles), y cuando
+        ya no queda nada oculto se lee de logs.db la página anterior
+        (ver _load_older_llm_history)."""
         # Limpiar contenedor de mensajes existentes
-        for child in self.messages_box:
+        for child in list(self.messages_box):
             self.messages_box.remove(child)
-            
+        self._cancel_bubble_fill()
+        self._transcript.clear()
+
         # Verificar que tengamos entradas válidas
         if not history_entries:
             debug_print("No hay entradas de historial para mostrar")
             return
-            
+
         debug_print(f"Mostrando {len(history_entries)} mensajes de historial")
-        debug_print(f"Detalle de las entradas: {history_entries}")
-        
-        # Mostrar cada mensaje en la UI
-        for entry in history_entries:
-            try:
-                debug_print(f"Procesando entrada: {entry}")
-                
-                # Verificar campos obligatorios en la entrada
-                prompt = entry.get('prompt')
-                response = entry.get('response')
-                
-                if prompt:
-                    debug_print(f"Creando mensaje de usuario con: {prompt[:50]}...")
-                    # Crear un objeto Message antes de pasarlo a MessageWidget
-                    msg = Message(prompt, sender="user")
-                    user_message = MessageWidget(msg)
-                    self.messages_box.append(user_message)
-                else:
-                    debug_print("Entrada sin prompt, saltando mensaje de usuario")
-                    
-                if response:
-                    debug_print(f"Creando mensaje de asistente con: {response[:50]}...")
-                    # Crear un objeto Message antes de pasarlo a MessageWidget
-                    msg = Message(response, sender="assistant")
-                    assistant_message = MessageWidget(msg)
-                    self.messages_box.append(assistant_message)
-                else:
-                    debug_print("Entrada sin response, saltando mensaje de asistente")
-            except Exception as e:
-                debug_print(f"Error al mostrar mensaje de historial: {e}")
-                debug_print(f"Excepción completa:", exc_info=True)
-        
+
+        self._remember_llm_history_cursor(history_entries)
+        messages = self._history_entries_to_messages(history_entries)
+
+        live = self._transcript.load(messages, self._TRANSCRIPT_LIVE_LIMIT)
+        # De la más nueva a la más vieja, cada una encima de la anterior.
+        self._queue_history_bubbles(reversed(live), self.messages_box.prepend)
+        debug_print(
+            f"[transcript] historial: vivos={self._transcript.live_count} "
+            f"ocultos={self._transcript.hidden_count}")
+
         # Scroll hasta el final cuando todos los mensajes estén en pantalla
         self._scroll_to_bottom_after_layout()
 
@@ -0,0 +1,126 @@
+"""Coalescencia de chunks de streaming entre el hilo del modelo y la UI.
+
+Antes, LLMClient._process_stream hacía un GLib.idle_add por token: con un
+modelo local rápido eso son miles de fuentes en el main loop por respuesta,
+y el throughput queda acotado por el coste de despachar cada una.
+ChunkCoalescer junta los chunks en un buffer protegido por lock y entrega
+el texto concatenado como mucho una vez por intervalo (≈ un frame), o antes
+si el buffer supera un umbral de tamaño.
+
+No depende de GLib: quien lo crea pasa `schedule(callback, delay)`, que debe
+correr `callback` en el hilo de la UI tras `delay` segundos (0 = cuanto
+antes). LLMClient lo implementa con GLib.timeout_add / GLib.idle_add.
+"""
+import threading
+import time
+from collections import deque
+
+
+class ChunkCoalescer:
+    """Buffer thread-safe de chunks con entrega agrupada.
+
+    push() se llama desde el hilo productor; la entrega (`deliver(text)`)
+    corre siempre en el hilo que ejecuta los callbacks de `schedule`. Nunca
+    hay más de un flush programado por intervalo, salvo el flush inmediato
+    que dispara el umbral de tamaño o flush_soon().
+    """
+
+    def __init__(self, deliver, schedule, interval=0.016, max_chars=2048,
+                 clock=time.monotonic):
+        self._deliver = deliver
+        self._schedule = schedule
+        self.interval = interval
+        self.max_chars = max_chars
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._pending_chars = 0
+        self._first_pending_at = None
+        self._timed_flush_scheduled = False
+        self._immediate_flush_scheduled = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.chunks_in = 0
+            self.flushes = 0
+            self.last_flush_latency = 0.0
+            self.max_flush_latency = 0.0
+            self._total_flush_latency = 0.0
+
+    def stats(self):
+        with self._lock:
+            flushes = self.flushes
+            return {
+                'chunks': self.chunks_in,
+                'flushes': flushes,
+                'merged_chunks': max(0, self.chunks_in - flushes),
+                'last_flush_latency_ms': self.last_flush_latency * 1000,
+                'max_flush_latency_ms': self.max_flush_latency * 1000,
+                'mean_flush_latency_ms': (
+                    self._total_flush_latency / flushes * 1000 if flushes else 0.0),
+            }
+
+    def push(self, chunk):
+        """Encola un chunk (hilo productor)."""
+        if not chunk:
+            return
+        schedule_timed = schedule_now = False
+        with self._lock:
+            if not self._pending:
+                self._first_pending_at = self._clock()
+            self._pending.append(chunk)
+            self._pending_chars += len(chunk)
+            self.chunks_in += 1
+            if (self._pending_chars >= self.max_chars
+                    and not self._immediate_flush_scheduled):
+                self._immediate_flush_scheduled = True
+                schedule_now = True
+            elif not self._timed_flush_scheduled and not self._immediate_flush_scheduled:
+                self._timed_flush_scheduled = True
+                schedule_timed = True
+        if schedule_now:
+            self._schedule(self._flush_immediate, 0)
+        elif schedule_timed:
+            self._schedule(self._flush_timed, self.interval)
+
+    def flush_soon(self):
+        """Programa la entrega inmediata de lo pendiente.
+
+        El productor la llama antes de encolar 'finished'/'error': así el
+        último texto llega a la UI antes que el cierre del turno, sin
+        esperar a que venza el intervalo."""
+        with self._lock:
+            if not self._pending or self._immediate_flush_scheduled:
+                return
+            self._immediate_flush_scheduled = True
+        self._schedule(self._flush_immediate, 0)
+
+    def _flush_timed(self):
+        with self._lock:
+            self._timed_flush_scheduled = False
+        self.flush()
+        return False
+
+    def _flush_immediate(self):
+        with self._lock:
+            self._immediate_flush_scheduled = False
+        self.flush()
+        return False
+
+    def flush(self):
+        """Entrega ya lo pendiente (hilo de la UI). Devuelve el texto entregado."""
+        with self._lock:
+            if not self._pending:
+                return ''
+            text = ''.join(self._pending)
+            self._pending.clear()
+            self._pending_chars = 0
+            latency = self._clock() - self._first_pending_at
+            self._first_pending_at = None
+            self.flushes += 1
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self._total_flush_latency += latency
+        self._deliver(text)
+        return text
@@ -0,0 +1,218 @@
+"""Presupuesto de contexto: tokens por turno y resumen de los turnos viejos.
+
+conversation_cache recorta el contexto a context_turns/context_tokens; lo
+que queda fuera simplemente no se enviaba. Aquí está lo que completa esa
+etapa antes de conversation.prompt:
+
+- estimate_tokens(): tiktoken (cl100k_base) si está instalado, si no ~4
+  caracteres por token. TOKEN_ESTIMATOR nombra el método usado;
+- ContextStore: context.db, junto a logs.db (que es de llm y no se le
+  agregan tablas, ver docs/data-model.md). Guarda la estimación de cada
+  turno por id de respuesta, para no volver a tokenizar el historial al
+  reabrir, y el resumen acumulado (rolling) de cada conversación;
+- build_summary_prompt(): el prompt con que, en segundo plano, el modelo
+  resume los turnos que quedaron fuera del presupuesto, partiendo del
+  resumen anterior. LLMClient lo antepone al system prompt.
+
+No depende de gi.
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from .debug_utils import debug_print
+
+CHARS_PER_TOKEN = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_estimates (
+    response_id TEXT NOT NULL,
+    estimator TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    PRIMARY KEY (response_id, estimator)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summaries (
+    conversation_id TEXT PRIMARY KEY,
+    through_id TEXT NOT NULL,
+    turns INTEGER NOT NULL,
+    summary TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    model TEXT,
+    datetime_utc TEXT NOT NULL
+);
+"""
+
+SUMMARY_SYSTEM = (
+    "You maintain a running summary of a chat between a user and an assistant. "
+    "Keep facts, decisions, names, numbers, code identifiers and open questions; "
+    "drop pleasantries. Answer with the updated summary only, in the language "
+    "of the conversation.")
+SUMMARY_CONTEXT_PREFIX = "Summary of the earlier part of this conversation:\n"
+# El resumen sólo se rehace cuando quedan fuera al menos tantos turnos nuevos.
+SUMMARY_MIN_NEW_TURNS = 2
+
+
+def _load_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        return None
+
+
+_encoding = _load_encoding()
+TOKEN_ESTIMATOR = ('tiktoken:cl100k_base' if _encoding is not None
+                   else f'chars/{CHARS_PER_TOKEN}')
+
+
+def estimate_tokens(text):
+    """Tokens aproximados de `text` (no es el tokenizador del proveedor)."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+class Summary:
+    """Resumen de los turnos de una conversación hasta `through_id`."""
+
+    __slots__ = ('conversation_id', 'through_id', 'turns', 'text', 'tokens', 'model')
+
+    def __init__(self, conversation_id, through_id, turns, text, tokens=None, model=None):
+        self.conversation_id = conversation_id
+        self.through_id = through_id
+        self.turns = turns
+        self.text = text
+        self.tokens = estimate_tokens(text) if tokens is None else tokens
+        self.model = model
+
+    def covers(self, response_id):
+        return response_id is not None and response_id <= self.through_id
+
+
+def build_summary_prompt(previous, turns):
+    """Prompt para resumir `turns` (CachedTurn, del más viejo al más nuevo)
+    sobre el resumen anterior `previous` (Summary o None)."""
+    parts = []
+    if previous is not None:
+        parts.append(f"Current summary:\n{previous.text.strip()}\n")
+    parts.append("New turns to fold into the summary:")
+    for turn in turns:
+        parts.append(f"User: {str(turn.prompt).strip()}\n"
+                     f"Assistant: {str(turn.response).strip()}")
+    return "\n\n".join(parts)
+
+
+def system_with_summary(system, summary):
+    """El system prompt con el resumen delante (o sin cambios)."""
+    if summary is None:
+        return system
+    block = SUMMARY_CONTEXT_PREFIX + summary.text.strip()
+    return f"{block}\n\n{system}" if system else block
+
+
+class ContextStore:
+    """context.db, con una conexión por hilo."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._thread_local = threading.local()
+
+    def get_connection(self):
+        if getattr(self._thread_local, 'conn', None) is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._thread_local.conn = conn
+        return self._thread_local.conn
+
+    def close_connection(self):
+        conn = getattr(self._thread_local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._thread_local.conn = None
+
+    # --- Tokens por turno ---
+
+    def token_counts(self, response_ids, estimator=None):
+        """{response_id: tokens} de los ids ya estimados con `estimator`."""
+        estimator = estimator or TOKEN_ESTIMATOR
+        ids = [rid for rid in response_ids if rid]
+        counts = {}
+        conn = self.get_connection()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT response_id, tokens FROM token_estimates "
+                f"WHERE estimator = ? AND response_id IN ({marks})",
+                [estimator] + chunk).fetchall()
+            counts.update((row['response_id'], row['tokens']) for row in rows)
+        return counts
+
+    def save_token_counts(self, counts, estimator=None):
+        if not counts:
+            return
+        estimator = estimator or TOKEN_ESTIMATOR
+        conn = self.get_connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO token_estimates (response_id, estimator, tokens) "
+                "VALUES (?, ?, ?)",
+                [(rid, estimator, tokens) for rid, tokens in counts.items() if rid])
+
+    # --- Resumen acumulado ---
+
+    def get_summary(self, conversation_id):
+        row = self.get_connection().execute(
+            "SELECT * FROM summaries WHERE conversation_id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        return Summary(row['conversation_id'], row['through_id'], row['turns'],
+                       row['summary'], row['tokens'], row['model'])
+
+    def save_summary(self, summary):
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (conversation_id, through_id, turns, "
+                "summary, tokens, model, datetime_utc) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (summary.conversation_id, summary.through_id, summary.turns, summary.text,
+                 summary.tokens, summary.model, datetime.now(timezone.utc).isoformat()))
+
+    def forget_conversation(self, conversation_id):
+        """Al borrar la conversación. Las estimaciones por id se quedan: son
+        pocas filas y un id de respuesta no se reutiliza."""
+        conn = self.get_connection()
+        with conn:
+            conn.execute("DELETE FROM summaries WHERE conversation_id = ?",
+                         (conversation_id,))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_context_store(user_dir=None):
+    """El ContextStore compartido del directorio de usuario de llm, o None
+    si no se puede abrir (el contexto funciona igual, sin caché en disco)."""
+    if user_dir is None:
+        from .platform_utils import ensure_user_dir_exists
+        user_dir = ensure_user_dir_exists()
+        if not user_dir:
+            return None
+    path = os.path.join(user_dir, "context.db")
+    with _stores_lock:
+        if path not in _stores:
+            store = ContextStore(path)
+            try:
+                store.get_connection()
+            except sqlite3.Error as e:
+                debug_print(f"[context] no se pudo abrir {path}: {e}")
+                store = None
+            _stores[path] = store
+        return _stores[path]
@@ -0,0 +1,264 @@
+"""Conversaciones de llm reconstruidas, cacheadas por (cid, model_id).
+
+LLMClient rehacía self.conversation.responses desde logs.db en cada cambio
+de modelo, al reabrir una conversación y al arrancar: leía todo el
+historial y creaba un llm.Prompt y dos llm.Response por turno. Aquí cada
+(cid, model_id) guarda sus turnos ya construidos y un cursor (datetime_utc,
+id) de la última fila leída, de modo que ponerse al día (sync) sólo lee y
+construye los turnos posteriores.
+
+Los turnos que genera la propia aplicación se añaden al terminar el
+stream (append_live) con su llm.Response real; cuando el escritor de fondo
+los guarda y un sync posterior lee esa fila, se reconoce por prompt y
+respuesta y sólo avanza el cursor, sin duplicar el turno.
+
+plan() arma el contexto del siguiente prompt: todos los turnos, o sólo
+los últimos `max_turns` y/o los que entren en `max_tokens` (ver
+context_budget.estimate_tokens; siempre al menos el último), más el
+resumen acumulado de los que quedaron fuera si lo hay. Con un
+ContextStore, la estimación de cada fila leída se guarda por id de
+respuesta y no se recalcula en el próximo arranque.
+
+El estado se comparte entre ventanas; cada LLMClient arma su propia
+llm.Conversation con plan(), así que nadie muta las listas de otro.
+No depende de gi ni de llm: cómo se construye un turno lo decide quien
+llama (build_turn).
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .context_budget import estimate_tokens
+from .debug_utils import debug_print
+
+DEFAULT_MAX_ENTRIES = 16
+
+
+def is_replayable(prompt, response):
+    """Un turno entra al contexto sólo con prompt y respuesta no vacíos."""
+    return bool(prompt and str(prompt).strip() and response and str(response).strip())
+
+
+class CachedTurn:
+    """Un turno del contexto: las llm.Response que lo representan, su texto
+    y su tamaño estimado. `response_id` es None hasta que la fila de
+    logs.db se lee en un sync (los turnos en vivo aún no la tienen)."""
+
+    __slots__ = ('responses', 'prompt', 'response', 'tokens', 'response_id')
+
+    def __init__(self, responses, prompt, response, response_id=None, tokens=None):
+        self.responses = tuple(responses)
+        self.prompt = prompt
+        self.response = response
+        if tokens is None:
+            tokens = estimate_tokens(prompt) + estimate_tokens(response)
+        self.tokens = tokens
+        self.response_id = response_id
+
+
+class ContextPlan:
+    """El contexto de un prompt: `responses` para conversation.responses,
+    los turnos enviados (`kept`), los que quedaron fuera (`dropped`) y el
+    resumen que los reemplaza (o None)."""
+
+    __slots__ = ('responses', 'kept', 'dropped', 'summary')
+
+    def __init__(self, kept, dropped, summary=None):
+        self.kept = kept
+        self.dropped = dropped
+        self.summary = summary
+        self.responses = [response for turn in kept for response in turn.responses]
+
+    @property
+    def tokens(self):
+        """Tokens estimados del historial enviado (turnos y resumen)."""
+        summary = self.summary.tokens if self.summary is not None else 0
+        return summary + sum(turn.tokens for turn in self.kept)
+
+    def unsummarized(self):
+        """Turnos fuera del contexto que el resumen aún no cubre."""
+        return [turn for turn in self.dropped if turn.response_id is not None
+                and (self.summary is None or not self.summary.covers(turn.response_id))]
+
+
+class ConversationState:
+    def __init__(self, cid, model_id):
+        self.cid = cid
+        self.model_id = model_id
+        self.turns = []
+        self.cursor = None      # (datetime_utc, id) de la última fila leída
+        self.synced = False
+        self._live_pending = 0  # turnos en vivo aún sin fila leída
+        self._lock = threading.Lock()
+
+    def sync(self, chat_history, build_turn, token_store=None):
+        """Lee de logs.db las filas posteriores al cursor y añade sus turnos.
+        Con `token_store` (ContextStore), las estimaciones de tokens salen de
+        ahí y las nuevas se guardan. Devuelve cuántos turnos construyó."""
+        after_datetime, after_id = self.cursor or (None, None)
+        entries = chat_history.get_conversation_history(
+            self.cid, after_datetime=after_datetime, after_id=after_id)
+        known, computed = {}, {}
+        if token_store is not None and entries:
+            try:
+                known = token_store.token_counts([entry.get('id') for entry in entries])
+            except sqlite3.Error as e:
+                debug_print(f"[context] no se pudieron leer las estimaciones: {e}")
+                token_store = None
+        added = self.extend(entries, build_turn, known, computed)
+        if token_store is not None and computed:
+            try:
+                token_store.save_token_counts(computed)
+            except sqlite3.Error as e:
+                debug_print(f"[context] no se pudieron guardar las estimaciones: {e}")
+        self.synced = True
+        return added
+
+    def extend(self, entries, build_turn, known_tokens=None, computed_tokens=None):
+        """Añade los turnos de `entries` (filas de logs.db en orden) que
+        sigan al cursor. `build_turn(prompt, response)` devuelve las
+        llm.Response del turno. `known_tokens` ({id: tokens}) evita
+        estimar; lo estimado se anota en `computed_tokens`."""
+        known_tokens = known_tokens or {}
+        if computed_tokens is None:
+            computed_tokens = {}
+        added = 0
+        with self._lock:
+            for entry in entries:
+                key = (entry.get('datetime_utc') or '', entry.get('id') or '')
+                if self.cursor is not None and key <= self.cursor:
+                    continue
+                self.cursor = key
+                prompt, response = entry.get('prompt'), entry.get('response')
+                if not is_replayable(prompt, response):
+                    continue
+                response_id = entry.get('id')
+                live = self._pending_live(prompt, response)
+                if live is not None:
+                    live.response_id = response_id
+                    self._live_pending -= 1
+                    computed_tokens[response_id] = live.tokens
+                    continue
+                turn = CachedTurn(build_turn(prompt, response), prompt, response,
+                                  response_id, known_tokens.get(response_id))
+                if response_id not in known_tokens:
+                    computed_tokens[response_id] = turn.tokens
+                self.turns.append(turn)
+                added += 1
+        return added
+
+    def _pending_live(self, prompt, response):
+        if not self._live_pending:
+            return None
+        for turn in reversed(self.turns):
+            if (turn.response_id is None and turn.prompt == prompt
+                    and turn.response.strip() == str(response).strip()):
+                return turn
+        return None
+
+    def append_live(self, responses, prompt, response):
+        """Un turno recién generado en esta sesión (aún sin fila leída)."""
+        if not is_replayable(prompt, response):
+            return None
+        turn = CachedTurn(responses, prompt, response)
+        with self._lock:
+            self.turns.append(turn)
+            self._live_pending += 1
+        return turn
+
+    def plan(self, max_turns=None, max_tokens=None, summary=None, reserve_tokens=0):
+        """ContextPlan con los últimos `max_turns` turnos que entren en
+        `max_tokens` estimados (0/None: sin tope), descontados el resumen y
+        `reserve_tokens` (el prompt nuevo). `summary` sólo se usa si quedan
+        turnos fuera."""
+        with self._lock:
+            turns = list(self.turns)
+        recent = turns[-max_turns:] if max_turns else turns
+        kept = self._fit(recent, max_tokens, reserve_tokens)
+        if summary is not None and len(kept) < len(turns) and max_tokens:
+            # El resumen también ocupa presupuesto.
+            kept = self._fit(kept, max_tokens, reserve_tokens + summary.tokens)
+        dropped = turns[:len(turns) - len(kept)]
+        return ContextPlan(kept, dropped, summary if dropped else None)
+
+    @staticmethod
+    def _fit(turns, max_tokens, reserved):
+        """Los últimos turnos que entran en max_tokens - reserved (al menos uno)."""
+        if not max_tokens:
+            return turns
+        budget = max_tokens - reserved
+        count = 0
+        for turn in reversed(turns):
+            budget -= turn.tokens
+            if budget < 0 and count:
+                break
+            count += 1
+        return turns[len(turns) - count:]
+
+    def window(self, max_turns=None, max_tokens=None):
+        """Lista nueva con las llm.Response del contexto recortado, del más
+        viejo al más nuevo (ver plan)."""
+        return self.plan(max_turns, max_tokens).responses
+
+    @property
+    def tokens(self):
+        with self._lock:
+            return sum(turn.tokens for turn in self.turns)
+
+
+class ConversationCache:
+    """LRU de ConversationState por (cid, model_id), thread-safe."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'rows_built': 0,
+                       'syncs': 0, 'sync_ms_total': 0.0}
+
+    def state(self, cid, model_id):
+        """El estado de (cid, model_id), creándolo vacío si no estaba."""
+        key = (cid, model_id)
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+                self._stats['hits'] += 1
+                return state
+            self._stats['misses'] += 1
+            state = self._states[key] = ConversationState(cid, model_id)
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+                self._stats['evictions'] += 1
+            return state
+
+    def restore(self, cid, model_id, chat_history, build_turn, token_store=None):
+        """El estado de (cid, model_id) puesto al día con logs.db."""
+        state = self.state(cid, model_id)
+        start = time.perf_counter()
+        added = state.sync(chat_history, build_turn, token_store)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            self._stats['syncs'] += 1
+            self._stats['rows_built'] += added
+            self._stats['sync_ms_total'] += elapsed_ms
+        debug_print(f"[context] cid={cid} model={model_id}: +{added} turnos "
+                    f"(total {len(state.turns)}) en {elapsed_ms:.1f} ms")
+        return state
+
+    def invalidate(self, cid=None):
+        """Olvida los estados de `cid` (todos si es None), p.ej. al borrar
+        la conversación."""
+        with self._lock:
+            for key in [k for k in self._states if cid is None or k[0] == cid]:
+                del self._states[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._states))
+        stats['sync_ms_total'] = round(stats['sync_ms_total'], 3)
+        return stats
+
+
+conversation_cache = ConversationCache()
@@ -1,4 +1,5 @@
 import sqlite3
+from collections.abc import Mapping
 from typing import List, Dict, Optional
 import subprocess
 import json
@@ -8,20 +9,154 @@ import gettext
 import os
 import urllib.request
 import urllib.error
-import threading
 import hashlib
 import logging
-import llm
-import sqlite_utils
-from llm.migrations import migrate
+import threading
+from contextlib import contextmanager
+
+from .history_database import get_history_database
+from .persistence_writer import persistence_writer
 
 _ = gettext.gettext
 
 def debug_print(*args, **kwargs):
     print(*args, **kwargs)
 
+
+# Columnas que necesita la UI para pintar un turno; el resto de `responses`
+# (prompt_json, response_json, options_json, tokens…) no se lee al paginar.
+HISTORY_PAGE_COLUMNS = ('id', 'model', 'prompt', 'response', 'conversation_id',
+                        'datetime_utc')
+_JSON_COLUMNS = frozenset(('prompt_json', 'response_json', 'options_json'))
+# response_json de un turno cuya generación se canceló a medias (el CLI de
+# llm guarda ahí el JSON del proveedor; lo nuestro no lo usa para otra cosa).
+TRUNCATED_RESPONSE_JSON = '{"truncated": true}'
+
+
+class HistoryEntry(Mapping):
+    """Fila de `responses` de sólo lectura que decodifica el JSON al acceder.
+
+    Antes cada fila se copiaba a un dict y se hacía json.loads de
+    prompt_json, response_json y options_json aunque nadie los mirara (la
+    ventana y LLMClient sólo leen prompt, response, model y datetime_utc).
+    Se comporta como el dict de siempre: entry['x'], entry.get('x'), dict(entry).
+    """
+
+    __slots__ = ('_row', '_decoded')
+
+    def __init__(self, row):
+        self._row = row
+        self._decoded = {}
+
+    def __getitem__(self, key):
+        if key in self._decoded:
+            return self._decoded[key]
+        try:
+            value = self._row[key]
+        except IndexError:
+            raise KeyError(key) from None
+        if key in _JSON_COLUMNS and value:
+            value = json.loads(value)
+            self._decoded[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(self._row.keys())
+
+    def __len__(self):
+        return len(self._row.keys())
+
+    def __repr__(self):
+        return f"HistoryEntry(id={self._row['id']!r})"
+
+
+class _PendingHistory:
+    """Escrituras de un logs.db encoladas en persistence_writer y sin aplicar.
+
+    Desde el main loop las lecturas no esperan al escritor: combinan lo que
+    hay en la BD con esto, así un turno recién encolado (o un título, o un
+    borrado) se ve enseguida. Cada escritura es una lista de operaciones,
+    en el orden en que se encolaron:
+    - ('turn', cid, fila de responses)
+    - ('insert', cid, fila de conversations): INSERT OR IGNORE
+    - ('update', cid, columnas de conversations)
+    - ('delete', cid, None)
+    y se retira en el on_done de su trabajo, haya salido bien o no."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._writes = {}
+        self._next = 0
+
+    def add(self, *ops):
+        with self._lock:
+            self._next += 1
+            self._writes[self._next] = ops
+            return self._next
+
+    def discard(self, token):
+        with self._lock:
+            self._writes.pop(token, None)
+
+    def conversation_ids(self):
+        with self._lock:
+            return {cid for ops in self._writes.values() for _k, cid, _v in ops}
+
+    def view(self, cid, row=None):
+        """(conversación, turnos en cola, borrada) de `cid` sobre `row`, su
+        fila en la BD. Con borrada=True lo que tenga la BD ya no cuenta."""
+        with self._lock:
+            ops = [op for writes in self._writes.values() for op in writes
+                   if op[1] == cid]
+        turns = []
+        deleted = False
+        for kind, _cid, value in ops:
+            if kind == 'turn':
+                turns.append(value)
+            elif kind == 'insert' and row is None:
+                row = dict(value)
+            elif kind == 'update' and row is not None:
+                row = {**row, **value}
+            elif kind == 'delete':
+                row, turns, deleted = None, [], True
+        return row, turns, deleted
+
+
+_pending_histories = {}
+_pending_histories_lock = threading.Lock()
+
+
+def _pending_history(db_path):
+    # Por archivo, como el HistoryDatabase: el sidebar y la ventana pueden
+    # tener cada uno su ChatHistory sobre el mismo logs.db.
+    with _pending_histories_lock:
+        if db_path not in _pending_histories:
+            _pending_histories[db_path] = _PendingHistory()
+        return _pending_histories[db_path]
+
+
+def _turn_key(entry):
+    return (entry['datetime_utc'], entry['id'])
+
+
+def _merge_turns(entries, pending):
+    """Filas de la BD más las encoladas, sin repetir (entre el commit y su
+    on_done un turno está en ambos lados), en orden cronológico."""
+    known = {entry['id'] for entry in entries}
+    entries = entries + [HistoryEntry(turn) for turn in pending if turn['id'] not in known]
+    entries.sort(key=_turn_key)
+    return entries
+
 class ChatHistory:
-    def __init__(self, db_path: Optional[str] = None):
+    def __init__(self, db_path: Optional[str] = None, search_index=None, database=None):
+        """`search_index` (search_index.SearchIndex) se mantiene al día con lo
+        que se escribe aquí; sin argumento, el logs.db del usuario usa el
+        índice compartido y una BD explícita no indexa nada.
+
+        Las conexiones son del HistoryDatabase del archivo (`database`, o el
+        compartido de get_history_database): varios ChatHistory sobre el
+        mismo logs.db comparten pool de lectura y escritora."""
+        default_db = db_path is None
         if db_path is None:
             # Usar ensure_user_dir_exists para asegurar el directorio
             from .platform_utils import ensure_user_dir_exists
@@ -32,110 +167,188 @@ class ChatHistory:
                 debug_print(f"[ChatHistory] CRITICAL: {error_msg}")
                 # Podríamos lanzar una excepción aquí para detener la inicialización.
                 raise RuntimeError(error_msg)
-            user_dir = ensure_user_dir_exists()
             db_path = os.path.join(user_dir, "logs.db")
         self.db_path = db_path
-        self._thread_local = threading.local()
+        self.database = database or get_history_database(db_path)
+        self._pending = _pending_history(db_path)
+        if search_index is None and default_db:
+            from .search_index import get_search_index
+            search_index = get_search_index(os.path.dirname(db_path))
+        self.search_index = search_index
+        if search_index is not None:
+            search_index.register_source('llm', db_path)
+
+    def _db_exists(self):
+        if not self.database.exists():
+            # La BD puede estar por crearla un turno todavía en cola.
+            persistence_writer.wait_for(self)
+        return self.database.exists()
 
     def _ensure_db_exists(self):
         """Asegura que la base de datos existe y está migrada, solo si es necesario."""
-        if not os.path.exists(self.db_path):
-            self._run_llm_migrations()
-
-    def _run_llm_migrations(self):
-        """Ensures the database schema is managed by llm's migrations."""
-        db_utils = None
-        try:
-            db_utils = sqlite_utils.Database(self.db_path)
-            # Ejecutar las migraciones de llm
-            migrate(db_utils)
-            logging.info(f"LLM migrations applied successfully to {self.db_path}")
-        except Exception as e:
-            logging.error(f"Error running LLM migrations on {self.db_path}: {e}", exc_info=True)
-        finally:
-            # Asegurarse de cerrar la conexión usada por sqlite_utils
-            if db_utils and hasattr(db_utils, 'conn') and db_utils.conn:
-                try:
-                    db_utils.conn.close()
-                except Exception as close_err:
-                    logging.error(f"Error closing sqlite_utils connection after migration: {close_err}", exc_info=True)
-        # Forzar flush a disco cerrando la conexión principal
-        self.close_connection()
+        self.database.ensure_schema()
+
+    @contextmanager
+    def _reader(self):
+        """Conexión de lectura del pool. Fuera del main loop, después de
+        aplicar las escrituras que sigan en cola en el escritor de fondo;
+        en el main loop no se espera y cada lectura suma lo encolado
+        (_PendingHistory)."""
+        persistence_writer.wait_for(self)
+        with self.database.reader() as conn:
+            yield conn
+
+    def writer(self):
+        """Contexto con la conexión de escritura compartida y su lock tomado.
+
+        También lo usa persistence_writer para aplicar los lotes en cola."""
+        return self.database.writer()
+
+    def _writer(self):
+        persistence_writer.wait_for(self)
+        return self.database.writer()
+
+    def _queue_write(self, write, *ops, on_done=None):
+        """Encola `write(conn)` detrás de lo pendiente si se llama desde el
+        main loop con escrituras en cola (ver persistence_writer.should_queue)
+        y deja `ops` a la vista de las lecturas hasta aplicarla. False si no
+        hacía falta: el llamador escribe directo."""
+        if not persistence_writer.should_queue(self):
+            return False
+        token = self._pending.add(*ops)
+
+        def written(result, error):
+            self._pending.discard(token)
+            if error is not None:
+                debug_print(f"[ChatHistory] escritura en cola falló: {error}")
+            elif on_done is not None:
+                on_done()
+
+        persistence_writer.submit(self, write, on_done=written)
+        return True
 
     def get_connection(self):
-        """Gets a sqlite3 connection for the current thread."""
-        if not hasattr(self._thread_local, "conn") or self._thread_local.conn is None:
-            try:
-                # Solo crear la BD si no existe cuando vamos a conectarnos
-                if not os.path.exists(self.db_path):
-                    self._run_llm_migrations()
-
-                self._thread_local.conn = sqlite3.connect(self.db_path)
-                self._thread_local.conn.row_factory = sqlite3.Row
-            except sqlite3.Error as e:
-                if "no such table" in str(e):
-                    logging.warning(f"Table not found error on connect, attempting migrations again: {e}")
-                    try:
-                        self._run_llm_migrations()
-                        # Reintentar la conexión después de la migración
-                        self._thread_local.conn = sqlite3.connect(self.db_path)
-                        self._thread_local.conn.row_factory = sqlite3.Row
-                    except Exception as migrate_err:
-                        logging.error(f"Failed to run migrations on 'no such table' error: {migrate_err}", exc_info=True)
-                        raise ConnectionError(_(f"Error al conectar a la base de datos después de fallo de migración: {e}")) from migrate_err
-                else:
-                    raise ConnectionError(_(f"Error al conectar a la base de datos: {e}")) from e
-        return self._thread_local.conn
+        """The shared write connection, without taking its lock.
 
-    def close_connection(self):
-        """Closes the connection for the current thread."""
-        if hasattr(self._thread_local, "conn") and self._thread_local.conn is not None:
-            self._thread_local.conn.close()
-            self._thread_local.conn = None
+        Kept for scripts and tests that drive ChatHistory from a single
+        thread; inside the app reads go through the pool and writes through
+        writer()."""
+        persistence_writer.wait_for(self)
+        return self.database.writer_connection()
 
-    def get_conversation_history(self, conversation_id: str) -> List[Dict]:
-        if not os.path.exists(self.db_path):
+    def close_connection(self):
+        """No-op: las conexiones son del HistoryDatabase compartido y vuelven
+        a su pool al terminar cada consulta. Se mantiene para los hilos que
+        la llamaban al terminar."""
+
+    def get_conversation_history(self, conversation_id: str,
+                                 after_datetime: Optional[str] = None,
+                                 after_id: Optional[str] = None) -> List[Dict]:
+        """Todos los turnos de la conversación, del más viejo al más nuevo.
+
+        Con cursor (datetime_utc e id de la última fila ya leída) devuelve
+        sólo los posteriores: así se pone al día la conversación cacheada
+        (ver conversation_cache.py) sin releer todo el historial.
+        Las columnas JSON se decodifican recién al accederlas (HistoryEntry).
+        Para pintar, preferir get_conversation_history_page."""
+        _row, pending, deleted = self._pending.view(conversation_id)
+        if after_datetime is not None:
+            cursor = (after_datetime, after_id or '')
+            pending = [turn for turn in pending if _turn_key(turn) > cursor]
+        if deleted or not self._db_exists():
+            return _merge_turns([], pending)
+        params = [conversation_id]
+        cursor_clause = ''
+        if after_datetime is not None:
+            cursor_clause = 'AND (r.datetime_utc > ? OR (r.datetime_utc = ? AND r.id > ?))'
+            params.extend((after_datetime, after_datetime, after_id or ''))
+        with self._reader() as conn:
+            rows = conn.execute(f"""
+                SELECT r.*, c.name as conversation_name
+                FROM responses r
+                JOIN conversations c ON r.conversation_id = c.id
+                WHERE r.conversation_id = ? {cursor_clause}
+                ORDER BY r.datetime_utc ASC, r.id ASC
+            """, params).fetchall()
+        return _merge_turns([HistoryEntry(row) for row in rows], pending)
+
+    def get_conversation_history_page(self, conversation_id: str,
+                                      before_datetime: Optional[str] = None,
+                                      before_id: Optional[str] = None,
+                                      limit: int = 50) -> List[Dict]:
+        """Una página de turnos anteriores a un cursor, en orden cronológico.
+
+        Paginación por clave (keyset) sobre (datetime_utc, id): sin cursor
+        devuelve los `limit` turnos más recientes; para la página anterior
+        se pasa el datetime_utc (y el id, para desempatar turnos con la misma
+        hora) de la primera fila de la página actual. Sólo se leen las
+        columnas de HISTORY_PAGE_COLUMNS. Una página con menos de `limit`
+        filas indica que no queda historial más viejo."""
+        if limit <= 0:
             return []
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT r.*, c.name as conversation_name
-            FROM responses r
-            JOIN conversations c ON r.conversation_id = c.id
-            WHERE r.conversation_id = ?
-            ORDER BY datetime_utc ASC
-        """, (conversation_id,))
-
-        history = []
-        for row in cursor.fetchall():
-            entry = dict(row)
-            if entry['prompt_json']:
-                entry['prompt_json'] = json.loads(entry['prompt_json'])
-            if entry['response_json']:
-                entry['response_json'] = json.loads(entry['response_json'])
-            if entry['options_json']:
-                entry['options_json'] = json.loads(entry['options_json'])
-            history.append(entry)
-        return history
+        _row, pending, deleted = self._pending.view(conversation_id)
+        if before_datetime is not None:
+            if before_id is None:
+                pending = [turn for turn in pending
+                           if turn['datetime_utc'] < before_datetime]
+            else:
+                cursor = (before_datetime, before_id)
+                pending = [turn for turn in pending if _turn_key(turn) < cursor]
+        if deleted or not self._db_exists():
+            return _merge_turns([], pending)[-limit:]
+        columns = ', '.join(HISTORY_PAGE_COLUMNS)
+        params = [conversation_id]
+        cursor_clause = ''
+        if before_datetime is not None:
+            if before_id is None:
+                cursor_clause = 'AND datetime_utc < ?'
+                params.append(before_datetime)
+            else:
+                cursor_clause = 'AND (datetime_utc < ? OR (datetime_utc = ? AND id < ?))'
+                params.extend((before_datetime, before_datetime, before_id))
+        params.append(limit)
+        try:
+            with self._reader() as conn:
+                rows = conn.execute(f"""
+                    SELECT {columns} FROM responses
+                    WHERE conversation_id = ? {cursor_clause}
+                    ORDER BY datetime_utc DESC, id DESC
+                    LIMIT ?
+                """, params).fetchall()
+        except sqlite3.OperationalError as e:
+            debug_print(f"[ChatHistory] Error leyendo página de historial: {e}")
+            return []
+        rows.reverse()
+        return _merge_turns([HistoryEntry(row) for row in rows], pending)[-limit:]
+
+    def has_conversation_history(self, conversation_id: str) -> bool:
+        """True si la conversación tiene al menos un turno guardado."""
+        _row, pending, deleted = self._pending.view(conversation_id)
+        if pending:
+            return True
+        if deleted or not self._db_exists():
+            return False
+        try:
+            with self._reader() as conn:
+                row = conn.execute(
+                    "SELECT 1 FROM responses WHERE conversation_id = ? LIMIT 1",
+                    (conversation_id,)).fetchone()
+        except sqlite3.OperationalError:
+            return False
+        return row is not None
 
     def get_last_conversation(self):
-        if not os.path.exists(self.db_path):
-            return None
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM conversations ORDER BY id DESC LIMIT 1")
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        conversations = self.get_conversations(1, 0)
+        return conversations[0] if conversations else None
 
     def get_conversation(self, conversation_id: str):
-        if not os.path.exists(self.db_path):
-            return None
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM conversations WHERE id = ?", (conversation_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        row = None
+        if self._db_exists():
+            with self._reader() as conn:
+                row = conn.execute(
+                    "SELECT * FROM conversations WHERE id = ?",
+                    (conversation_id,)).fetchone()
+        return self._pending.view(conversation_id, dict(row) if row else None)[0]
 
     def _sanitize_title(self, title: str) -> str:
         """Sanitizes the conversation title."""
@@ -146,156 +359,243 @@ class ChatHistory:
         """Sets the title (name) for a specific conversation."""
         sanitized_title = self._sanitize_title(title)
         query = "UPDATE conversations SET name = ? WHERE id = ?"  # Use 'name' column
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(query, (sanitized_title, conversation_id))
-            conn.commit()
-        finally:
-            cursor.close()
-            self.close_connection()
+
+        def write(conn):
+            conn.execute(query, (sanitized_title, conversation_id))
+
+        if self._queue_write(write, ('update', conversation_id, {'name': sanitized_title})):
+            return
+        with self._writer() as conn, conn:
+            write(conn)
 
     def delete_conversation(self, conversation_id: str):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "DELETE FROM conversations WHERE id = ?", (conversation_id,))
-        cursor.execute(
-            "DELETE FROM responses WHERE conversation_id = ?",
-            (conversation_id,))
-        conn.commit()
+        def write(conn):
+            conn.execute(
+                "DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            conn.execute(
+                "DELETE FROM responses WHERE conversation_id = ?",
+                (conversation_id,))
 
-    def get_conversations(self, limit: int, offset: int) -> List[Dict]:
-        if not os.path.exists(self.db_path):
-            return []
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("""
-                SELECT * FROM conversations
-                ORDER BY id DESC
-                LIMIT ? OFFSET ?
-            """, (limit, offset))
-        except sqlite3.OperationalError:
-            return []
+        def forget():
+            if self.search_index is not None:
+                self.search_index.forget_conversation('llm', conversation_id)
 
-        conversations = []
-        for row in cursor.fetchall():
-            conversations.append(dict(row))
+        if self._queue_write(write, ('delete', conversation_id, None), on_done=forget):
+            return
+        with self._writer() as conn, conn:
+            write(conn)
+        forget()
 
-        return conversations
+    def get_conversations(self, limit: int, offset: int) -> List[Dict]:
+        rows = []
+        if self._db_exists():
+            try:
+                with self._reader() as conn:
+                    rows = conn.execute("""
+                        SELECT * FROM conversations
+                        ORDER BY id DESC
+                        LIMIT ? OFFSET ?
+                    """, (limit, offset)).fetchall()
+            except sqlite3.OperationalError:
+                return []
+        conversations = [dict(row) for row in rows]
+        pending = self._pending.conversation_ids()
+        if not pending:
+            return conversations
+        # Lo encolado: cambia o quita filas de esta página y, en la primera,
+        # suma las conversaciones que todavía no están en la BD.
+        listed = {conversation['id'] for conversation in conversations}
+        conversations = [
+            view for view in (self._pending.view(conversation['id'], conversation)[0]
+                              if conversation['id'] in pending else conversation
+                              for conversation in conversations)
+            if view is not None]
+        if offset == 0:
+            for cid in pending - listed:
+                row = self._pending.view(cid)[0]
+                if row is not None and self._stored_conversation(cid) is None:
+                    conversations.append(row)
+            conversations.sort(key=lambda conversation: conversation['id'], reverse=True)
+        return conversations[:limit]
+
+    def _stored_conversation(self, conversation_id):
+        if not self._db_exists():
+            return None
+        with self._reader() as conn:
+            return conn.execute(
+                "SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
 
     def add_history_entry(
         self, conversation_id: str, prompt: str, response_text: str,
-        model_id: str, fragments: List[str] = None, system_fragments: List[str] = None
+        model_id: str, fragments: List[str] = None, system_fragments: List[str] = None,
+        conversation_name: Optional[str] = None, truncated: bool = False
     ):
-        # Asegurarse que la BD existe antes de escribir
-        self._ensure_db_exists()
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Guarda un turno completo en una sola transacción.
+
+        Con `conversation_name` también crea la fila de la conversación si no
+        existe (INSERT OR IGNORE), de modo que conversación, respuesta y
+        enlaces a fragmentos se escriben con un único commit. `truncated`
+        marca una respuesta parcial (generación cancelada) en response_json.
+        Síncrono: desde el hilo de streaming o la UI, usar queue_history_entry.
+        Desde el main loop con escrituras en cola, encola también (detrás de
+        ellas) y devuelve el id que tendrá el turno."""
+        if persistence_writer.should_queue(self):
+            return self.queue_history_entry(
+                conversation_id, prompt, response_text, model_id, fragments,
+                system_fragments, conversation_name, truncated)
+        # Resolver fragmentos puede leer archivos o la red: fuera de la
+        # transacción, para no retener el lock de escritura.
+        resolved = self._resolve_fragments(fragments, system_fragments)
         try:
-            response_id = str(ULID()).lower()
-
-            # Use datetime for UTC timestamp
-            timestamp_utc = datetime.now(timezone.utc).isoformat()
-
-            cursor.execute("""
-                INSERT INTO responses
-                (id, model, prompt, response, conversation_id, datetime_utc)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                response_id,
-                model_id,
-                prompt,
-                response_text,
-                conversation_id,
-                timestamp_utc
-            ))
-            conn.commit()
-            # Handle fragments
-            if fragments:
-                self._add_fragments(response_id, fragments, 'prompt_fragments')
-            if system_fragments:
-                self._add_fragments(response_id, system_fragments, 'system_fragments')
-
+            with self._writer() as conn, conn:
+                response_id = self._write_turn(conn, resolved, conversation_id, prompt,
+                                               response_text, model_id, conversation_name,
+                                               truncated)
         except sqlite3.Error as e:
             debug_print(_(f"Error adding entry to history: {e}"))
-            conn.rollback()
-        finally:
-            self.close_connection()
+            return None
+        self._update_search_index()
+        return response_id
+
+    def queue_history_entry(
+        self, conversation_id: str, prompt: str, response_text: str,
+        model_id: str, fragments: List[str] = None, system_fragments: List[str] = None,
+        conversation_name: Optional[str] = None, truncated: bool = False, on_done=None
+    ):
+        """Como add_history_entry, pero lo aplica el escritor de fondo.
+
+        Vuelve enseguida con el id del turno; `on_done(response_id, error)`
+        corre en el hilo escritor tras el commit (ver persistence_writer).
+        Hasta entonces el turno ya aparece en las lecturas de este logs.db
+        (_PendingHistory): su id y su hora se fijan aquí, no al aplicarlo."""
+        response_id = str(ULID()).lower()
+        timestamp_utc = datetime.now(timezone.utc).isoformat()
+        ops = [('turn', conversation_id, {
+            'id': response_id, 'model': model_id, 'prompt': prompt,
+            'response': response_text,
+            'response_json': TRUNCATED_RESPONSE_JSON if truncated else None,
+            'conversation_id': conversation_id, 'datetime_utc': timestamp_utc,
+            'conversation_name': conversation_name})]
+        if conversation_name is not None:
+            ops.insert(0, ('insert', conversation_id, {
+                'id': conversation_id, 'name': conversation_name, 'model': model_id}))
+        token = self._pending.add(*ops)
+
+        def written(response_id, error):
+            self._pending.discard(token)
+            if error is None:
+                self._update_search_index()
+            if on_done is not None:
+                on_done(response_id, error)
+
+        persistence_writer.submit(
+            self,
+            lambda conn, resolved: self._write_turn(
+                conn, resolved, conversation_id, prompt, response_text,
+                model_id, conversation_name, truncated,
+                response_id=response_id, timestamp_utc=timestamp_utc),
+            prepare=lambda: self._resolve_fragments(fragments, system_fragments),
+            on_done=written)
+        return response_id
+
+    def _update_search_index(self):
+        if self.search_index is not None:
+            self.search_index.schedule_sync()
+
+    def _resolve_fragments(self, fragments, system_fragments):
+        resolved = []
+        for table_name, specifiers in (('prompt_fragments', fragments),
+                                       ('system_fragments', system_fragments)):
+            for order, specifier in enumerate(specifiers or ()):
+                try:
+                    resolved.append((table_name, order, specifier,
+                                     self.resolve_fragment(specifier)))
+                except ValueError as e:
+                    debug_print(f"Error adding fragment '{specifier}': {e}")
+        return resolved
+
+    def _write_turn(self, conn, resolved, conversation_id, prompt, response_text,
+                    model_id, conversation_name, truncated=False,
+                    response_id=None, timestamp_utc=None):
+        """Inserta el turno en la transacción en curso. Devuelve el id."""
+        if conversation_name is not None:
+            self._insert_conversation(conn, conversation_id, conversation_name, model_id)
+        response_id = response_id or str(ULID()).lower()
+        # Use datetime for UTC timestamp
+        timestamp_utc = timestamp_utc or datetime.now(timezone.utc).isoformat()
+        conn.execute("""
+            INSERT INTO responses
+            (id, model, prompt, response, response_json, conversation_id, datetime_utc)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (
+            response_id,
+            model_id,
+            prompt,
+            response_text,
+            TRUNCATED_RESPONSE_JSON if truncated else None,
+            conversation_id,
+            timestamp_utc
+        ))
+        for table_name, order, specifier, content in resolved:
+            self._link_fragment(conn, response_id, table_name, order,
+                                content, specifier)
+        return response_id
 
     def create_conversation_if_not_exists(self, conversation_id, name: str, model: Optional[str] = None):
-        # Asegurarse que la BD existe antes de escribir
-        self._ensure_db_exists()
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        def write(conn):
+            self._insert_conversation(conn, conversation_id, name, model)
+
+        row = {'id': conversation_id, 'name': name, 'model': model}
+        if self._queue_write(write, ('insert', conversation_id, row)):
+            return
         try:
-            cursor.execute("""
-                INSERT OR IGNORE INTO conversations (id, name, model)
-                VALUES (?, ?, ?)
-            """, (conversation_id, name, model))
-            conn.commit()
+            with self._writer() as conn, conn:
+                write(conn)
         except sqlite3.Error as e:
             debug_print(_(f"Error creating conversation record: {e}"))
-            conn.rollback()
-        finally:
-            self.close_connection()
-
-    def _add_fragments(self, response_id: str, fragments: List[str], table_name: str):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        for order, fragment_specifier in enumerate(fragments):
-            try:
-                fragment_content = self.resolve_fragment(fragment_specifier)
-                # Obtener el ID entero del fragmento
-                fragment_id: int = self._get_or_create_fragment(fragment_content, source=fragment_specifier) # source podría ser mejorado
-                cursor.execute(f"""
-                    INSERT INTO {table_name} (response_id, fragment_id, "order")
-                    VALUES (?, ?, ?)
-                """, (response_id, fragment_id, order)) # Usar el ID entero
-            except ValueError as e:
-                debug_print(f"Error adding fragment '{fragment_specifier}': {e}")
-            except sqlite3.IntegrityError as e:
-                 # Manejar posibles errores de PK duplicado si la lógica de orden/ID es incorrecta
-                 debug_print(f"Integrity error adding fragment '{fragment_specifier}' for response {response_id}: {e}")
-            except sqlite3.Error as e:
-                 debug_print(f"Database error adding fragment '{fragment_specifier}': {e}")
-        conn.commit()
-        self.close_connection()
-
-    def _get_or_create_fragment(self, fragment_content: str, source: str = None) -> int:
-        conn = self.get_connection()
-        cursor = conn.cursor()
+
+    @staticmethod
+    def _insert_conversation(conn, conversation_id, name, model):
+        conn.execute("""
+            INSERT OR IGNORE INTO conversations (id, name, model)
+            VALUES (?, ?, ?)
+        """, (conversation_id, name, model))
+
+    def _link_fragment(self, conn, response_id, table_name, order, content, source):
+        """Enlaza un fragmento a la respuesta dentro de la transacción en curso."""
+        fragment_id = self._get_or_create_fragment(content, source=source, conn=conn)
+        try:
+            conn.execute(f"""
+                INSERT INTO {table_name} (response_id, fragment_id, "order")
+                VALUES (?, ?, ?)
+            """, (response_id, fragment_id, order))
+        except sqlite3.IntegrityError as e:
+            # Manejar posibles errores de PK duplicado si la lógica de orden/ID es incorrecta
+            debug_print(f"Integrity error adding fragment '{source}' "
+                        f"for response {response_id}: {e}")
+
+    def _get_or_create_fragment(self, fragment_content: str, source: str = None,
+                                conn=None) -> int:
+        """ID entero del fragmento con ese contenido, creándolo si hace falta.
+
+        Con `conn` se usa la transacción del llamador y no se hace commit."""
+        if conn is None:
+            with self._writer() as conn, conn:
+                return self._get_or_create_fragment(fragment_content, source, conn)
         content_hash = hashlib.sha256(fragment_content.encode('utf-8')).hexdigest()
-        cursor.execute("SELECT id FROM fragments WHERE hash = ?", (content_hash,))
-        row = cursor.fetchone()
+        row = conn.execute("SELECT id FROM fragments WHERE hash = ?",
+                           (content_hash,)).fetchone()
         if row:
-            fragment_id = row['id'] # Devuelve el ID entero existente
-        else:
-            # Usar datetime para el timestamp UTC como lo hace llm
-            timestamp_utc = datetime.now(timezone.utc).isoformat()
-            cursor.execute(
-                "INSERT INTO fragments (content, hash, source, datetime_utc) VALUES (?, ?, ?, ?)",
-                (fragment_content, content_hash, source, timestamp_utc)
-            )
-            conn.commit()
-            # Obtener el ID recién insertado
-            fragment_id = cursor.lastrowid
-            if fragment_id is None:
-                # Fallback por si lastrowid no funciona (raro en SQLite con PK entero)
-                cursor.execute("SELECT id FROM fragments WHERE hash = ?", (content_hash,))
-                row = cursor.fetchone()
-                if row:
-                    fragment_id = row['id']
-                else:
-                    # Esto no debería pasar si la inserción fue exitosa
-                    raise sqlite3.Error("Could not retrieve fragment ID after insertion.")
-        self.close_connection()
-        return fragment_id # Devuelve el nuevo ID entero
+            return row['id']  # Devuelve el ID entero existente
+        # Usar datetime para el timestamp UTC como lo hace llm
+        timestamp_utc = datetime.now(timezone.utc).isoformat()
+        cursor = conn.execute(
+            "INSERT INTO fragments (content, hash, source, datetime_utc) VALUES (?, ?, ?, ?)",
+            (fragment_content, content_hash, source, timestamp_utc)
+        )
+        return cursor.lastrowid
 
     def get_fragments_for_response(self, response_id: str, table_name: str) -> List[str]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
         query = f"""
             SELECT fragments.content
             FROM {table_name}
@@ -303,8 +603,12 @@ class ChatHistory:
             WHERE {table_name}.response_id = ?
             ORDER BY {table_name}."order"
         """
-        cursor.execute(query, (response_id,))
-        return [row['content'] for row in cursor.fetchall()]
+        with self._reader() as conn:
+            return [row['content'] for row in conn.execute(query, (response_id,))]
+
+    def _fetch_one(self, query, params):
+        with self._reader() as conn:
+            return conn.execute(query, params).fetchone()
 
     def resolve_fragment(self, specifier: str) -> str:
         """
@@ -324,25 +628,21 @@ class ChatHistory:
         if not specifier:
             raise ValueError("Empty fragment specifier")
 
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
         # 1. Check if it's a hash (64 hex chars)
         if len(specifier) == 64 and all(c in '0123456789abcdef' for c in specifier):
-            cursor.execute("SELECT content FROM fragments WHERE hash = ?", (specifier,))
-            hash_row = cursor.fetchone()
+            hash_row = self._fetch_one(
+                "SELECT content FROM fragments WHERE hash = ?", (specifier,))
             if hash_row:
                 return hash_row['content']
             # If not found by hash, continue (maybe it's an alias that looks like a hash)
 
         # 2. Check if it's an alias
-        cursor.execute("""
+        alias_row = self._fetch_one("""
             SELECT fragments.content
             FROM fragment_aliases
             JOIN fragments ON fragment_aliases.fragment_id = fragments.id
             WHERE fragment_aliases.alias = ?
         """, (specifier,))
-        alias_row = cursor.fetchone()
         if alias_row:
             return alias_row['content']
 
@@ -380,8 +680,8 @@ class ChatHistory:
             elif specifier.isdigit():
                 try:
                     fragment_id_int = int(specifier)
-                    cursor.execute("SELECT content FROM fragments WHERE id = ?", (fragment_id_int,))
-                    id_row = cursor.fetchone()
+                    id_row = self._fetch_one(
+                        "SELECT content FROM fragments WHERE id = ?", (fragment_id_int,))
                     if id_row:
                         return id_row['content']
                     # If not found by ID, fall through to treating as raw content
@@ -408,9 +708,14 @@ class ChatHistory:
         if not cid:
             logging.warning("No conversation ID provided to update model.")
             return
-        with self.get_connection() as conn:
+
+        def write(conn):
             conn.execute(
                 "UPDATE conversations SET model = ? WHERE id = ?",
                 (model_id, cid)
             )
-            conn.commit()
+
+        if self._queue_write(write, ('update', cid, {'model': model_id})):
+            return
+        with self._writer() as conn, conn:
+            write(conn)
@@ -0,0 +1,280 @@
+"""Planificador de generaciones compartido por todas las ventanas LLM.
+
+Cada LLMClient lanzaba un threading.Thread por prompt, sin límite global,
+y rechazaba un segundo envío mientras generaba. Con diez ventanas contra
+el mismo proveedor no había prioridad, límite ni reparto. Aquí hay un
+único pool de `workers` hilos para toda la aplicación:
+
+- cada turno es un ticket encolado con su dueño (el backend que lo pidió)
+  y su proveedor (needs_key del modelo; None para modelos locales);
+- un dueño tiene como mucho un turno en curso y los suyos salen en orden
+  (el contexto del segundo incluye la respuesta del primero), así que una
+  ventana puede encolar el siguiente prompt mientras el anterior fluye;
+- cada proveedor tiene un tope de turnos simultáneos (provider_limits; por
+  defecto DEFAULT_PROVIDER_LIMIT, y LOCAL_PROVIDER_LIMIT para los locales,
+  que comparten CPU/GPU);
+- entre los tickets que pueden correr, primero los del dueño enfocado
+  (set_focused, la ventana activa) y después por orden de llegada.
+
+Los callbacks del ticket (`on_position(n)` mientras espera, con n = turnos
+por delante; `on_start()` al arrancar) corren en el hilo que cambió la
+cola: para tocar la UI hay que volver con GLib.idle_add. stats() da
+profundidad de cola, ocupación por proveedor y tiempos de espera. Los
+hilos los pone worker_pool.WorkerPool. No depende de gi.
+"""
+import itertools
+import statistics
+import threading
+import time
+import weakref
+from collections import deque
+
+from .debug_utils import debug_print
+from .worker_pool import WorkerPool
+
+DEFAULT_WORKERS = 4
+DEFAULT_PROVIDER_LIMIT = 2
+LOCAL_PROVIDER_LIMIT = 1
+_WAIT_SAMPLES = 200
+
+
+def parse_provider_limits(spec):
+    """'openai=3,anthropic=2,local=1' -> {'openai': 3, 'anthropic': 2, None: 1}.
+    'local' (o vacío) es el proveedor de los modelos sin needs_key."""
+    limits = {}
+    for item in (spec or '').split(','):
+        name, sep, value = item.partition('=')
+        if not sep:
+            continue
+        try:
+            limits[name.strip() if name.strip() not in ('', 'local') else None] = int(value)
+        except ValueError:
+            debug_print(f"[scheduler] límite inválido: {item!r}")
+    return limits
+
+
+class GenerationTicket:
+    """Un turno encolado. state: queued → running → done, o cancelled."""
+
+    __slots__ = ('run', 'owner', 'provider', 'seq', 'on_position', 'on_start',
+                 'state', 'queued_at', 'started_at', 'position', '__weakref__')
+
+    def __init__(self, run, owner, provider, seq, on_position, on_start):
+        self.run = run
+        self.owner = owner
+        self.provider = provider
+        self.seq = seq
+        self.on_position = on_position
+        self.on_start = on_start
+        self.state = 'queued'
+        self.queued_at = time.perf_counter()
+        self.started_at = None
+        self.position = None
+
+    @property
+    def wait_ms(self):
+        end = self.started_at if self.started_at is not None else time.perf_counter()
+        return (end - self.queued_at) * 1000.0
+
+
+class GenerationScheduler:
+    def __init__(self, workers=DEFAULT_WORKERS, provider_limits=None):
+        self._cond = threading.Condition()
+        self._pool = WorkerPool(self._cond, 'generation', workers, take=self._take,
+                                run=self._start, pending=lambda: len(self._queue),
+                                runnable=self._runnable_count)
+        self._limits = dict(provider_limits or {})
+        self._queue = []             # tickets en espera, en orden de llegada
+        self._running = {}           # proveedor -> turnos en curso
+        self._owner_tickets = {}     # id(dueño) -> su ticket en curso
+        self._focused = None         # weakref al dueño enfocado
+        self._seq = itertools.count()
+        self._waits = deque(maxlen=_WAIT_SAMPLES)
+        self._stats = {'submitted': 0, 'completed': 0, 'cancelled': 0,
+                       'errors': 0, 'focus_boosts': 0, 'max_queue': 0}
+
+    # --- Configuración ---
+
+    def configure(self, workers=None, provider_limits=None):
+        """Cambia el tamaño del pool o los topes por proveedor (p.ej. desde la
+        config de la aplicación al arrancar)."""
+        with self._cond:
+            if provider_limits:
+                self._limits.update(provider_limits)
+            self._cond.notify_all()
+        if workers:
+            self._pool.resize(workers)
+        else:
+            self._pool.wake()
+
+    def limit_for(self, provider):
+        if provider in self._limits:
+            return max(1, int(self._limits[provider]))
+        return LOCAL_PROVIDER_LIMIT if provider is None else DEFAULT_PROVIDER_LIMIT
+
+    def set_focused(self, owner):
+        """El dueño de la ventana activa: sus turnos pasan primero."""
+        with self._cond:
+            self._focused = weakref.ref(owner) if owner is not None else None
+            changed = self._positions_changed()
+        self._notify_positions(changed)
+
+    # --- Cola ---
+
+    def submit(self, run, owner, provider=None, on_position=None, on_start=None):
+        """Encola `run()` (corre en un hilo del pool). Devuelve el ticket."""
+        with self._cond:
+            ticket = GenerationTicket(run, owner, provider, next(self._seq),
+                                      on_position, on_start)
+            self._queue.append(ticket)
+            self._stats['submitted'] += 1
+            self._stats['max_queue'] = max(self._stats['max_queue'], len(self._queue))
+            changed = self._positions_changed()
+            self._cond.notify_all()
+        self._pool.wake()
+        self._notify_positions(changed)
+        return ticket
+
+    def cancel(self, ticket):
+        """Saca de la cola un ticket que aún no arrancó. False si ya corre o
+        terminó: entonces lo corta quien lo ejecuta (LLMClient.cancel)."""
+        with self._cond:
+            if ticket.state != 'queued':
+                return False
+            self._queue.remove(ticket)
+            ticket.state = 'cancelled'
+            self._stats['cancelled'] += 1
+            changed = self._positions_changed()
+        self._notify_positions(changed)
+        return True
+
+    def release_owner(self, ticket):
+        """Deja pasar el siguiente turno del dueño sin esperar a que termine
+        `ticket` (cancelado pero con su hilo aún bloqueado en el proveedor).
+        El cupo del proveedor sigue ocupado hasta que el hilo vuelva."""
+        with self._cond:
+            self._release_owner_locked(ticket)
+            self._cond.notify_all()
+        self._pool.wake()
+
+    def _release_owner_locked(self, ticket):
+        if self._owner_tickets.get(id(ticket.owner)) is ticket:
+            del self._owner_tickets[id(ticket.owner)]
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def _is_focused(self, ticket):
+        focused = self._focused() if self._focused is not None else None
+        return focused is not None and ticket.owner is focused
+
+    def _ordered(self):
+        """La cola en orden de prioridad: enfocado primero, luego llegada."""
+        return sorted(self._queue, key=lambda t: (not self._is_focused(t), t.seq))
+
+    def _runnable(self, ticket, owners_seen):
+        if id(ticket.owner) in self._owner_tickets or id(ticket.owner) in owners_seen:
+            return False
+        return self._running.get(ticket.provider, 0) < self.limit_for(ticket.provider)
+
+    def _next_ticket(self):
+        owners_seen = set()   # un dueño sale en orden: sólo su primer ticket
+        for ticket in self._ordered():
+            if self._runnable(ticket, owners_seen):
+                return ticket
+            owners_seen.add(id(ticket.owner))
+        return None
+
+    def _runnable_count(self):
+        """Cuántos tickets podrían arrancar ya, contando los cupos que irían
+        ocupando."""
+        owners_seen, running, count = set(), dict(self._running), 0
+        for ticket in self._ordered():
+            if (id(ticket.owner) not in self._owner_tickets
+                    and id(ticket.owner) not in owners_seen
+                    and running.get(ticket.provider, 0) < self.limit_for(ticket.provider)):
+                running[ticket.provider] = running.get(ticket.provider, 0) + 1
+                count += 1
+            owners_seen.add(id(ticket.owner))
+        return count
+
+    def _positions_changed(self):
+        """(ticket, posición) de los tickets cuya posición cambió."""
+        changed = []
+        for position, ticket in enumerate(self._ordered()):
+            if ticket.position != position:
+                ticket.position = position
+                changed.append((ticket, position))
+        return changed
+
+    @staticmethod
+    def _notify_positions(changed):
+        for ticket, position in changed:
+            if ticket.on_position is not None:
+                try:
+                    ticket.on_position(position)
+                except Exception as e:
+                    debug_print(f"[scheduler] on_position falló: {e}")
+
+    # --- Pool ---
+
+    def _take(self):
+        """Saca el siguiente ticket (con la Condition tomada, desde el pool)."""
+        ticket = self._next_ticket()
+        if ticket is None:
+            return None
+        self._queue.remove(ticket)
+        if self._is_focused(ticket) and any(t.seq < ticket.seq for t in self._queue):
+            self._stats['focus_boosts'] += 1
+        ticket.state = 'running'
+        ticket.started_at = time.perf_counter()
+        self._waits.append(ticket.wait_ms)
+        self._running[ticket.provider] = self._running.get(ticket.provider, 0) + 1
+        self._owner_tickets[id(ticket.owner)] = ticket
+        return ticket, self._positions_changed()
+
+    def _start(self, job):
+        ticket, changed = job
+        self._notify_positions(changed)
+        self._run(ticket)
+
+    def _run(self, ticket):
+        error = False
+        try:
+            if ticket.on_start is not None:
+                ticket.on_start()
+            ticket.run()
+        except Exception as e:
+            error = True
+            debug_print(f"[scheduler] el turno falló: {e}")
+        finally:
+            with self._cond:
+                ticket.state = 'done'
+                self._running[ticket.provider] -= 1
+                self._release_owner_locked(ticket)
+                self._stats['completed'] += 1
+                self._stats['errors'] += error
+                self._cond.notify_all()
+
+    # --- Métricas ---
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            waits = sorted(self._waits)
+            providers = {}
+            for provider in set(self._running) | {t.provider for t in self._queue}:
+                providers[provider or 'local'] = {
+                    'running': self._running.get(provider, 0),
+                    'queued': sum(1 for t in self._queue if t.provider == provider),
+                    'limit': self.limit_for(provider)}
+            stats.update(workers=self._pool.size, threads=self._pool.thread_count(),
+                         queued=len(self._queue),
+                         running=sum(self._running.values()), providers=providers)
+        stats['wait_p50_ms'] = round(statistics.median(waits), 3) if waits else None
+        stats['wait_max_ms'] = round(waits[-1], 3) if waits else None
+        return stats
+
+
+generation_scheduler = GenerationScheduler()
@@ -0,0 +1,262 @@
+"""Servicio de base de datos de logs.db compartido por toda la aplicación.
+
+Cada ventana construía su propio ChatHistory, con sus conexiones por hilo
+(threading.local), su os.path.exists y, en un logs.db nuevo, sus propias
+migraciones de llm. Con una docena de ventanas restauradas eran una
+docena de juegos de conexiones al mismo archivo peleando por el lock de
+escritura. Aquí hay uno por archivo (get_history_database):
+
+- un pool pequeño de conexiones de lectura (PRAGMA query_only), que se
+  abren a demanda hasta `readers` y se prestan con reader();
+- una única conexión de escritura, serializada con un lock (writer()):
+  las escrituras del proceso ya no compiten entre sí en SQLite, sólo
+  esperan su turno en Python, donde se puede medir;
+- la existencia del archivo y las migraciones de llm, resueltas una vez.
+
+Las conexiones no están atadas a un hilo (check_same_thread=False): el
+pool o el lock garantizan que sólo un hilo use cada una a la vez.
+
+stats() reporta la utilización del pool (en uso, pico, tiempo ocupado) y
+el tiempo esperado por una lectora libre o por el lock de escritura.
+No depende de gi.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from . import startup_timing
+from .debug_utils import debug_print
+
+DEFAULT_READERS = 4
+
+
+class HistoryDatabase:
+    # Se aplican a cada conexión al abrirla. WAL deja leer mientras se escribe
+    # (la UI lee historial mientras el hilo de streaming guarda) y, con
+    # synchronous=NORMAL, el commit no espera un fsync; journal_mode es
+    # persistente en el archivo y el CLI de llm lo usa igual de bien.
+    _PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-8192",  # KiB: ~8 MB de páginas por conexión
+        "PRAGMA mmap_size=67108864",
+    )
+
+    def __init__(self, db_path, readers=DEFAULT_READERS):
+        self.db_path = db_path
+        self.size = max(1, readers)
+        self._cond = threading.Condition()
+        self._idle = []          # lectoras abiertas y libres
+        self._open_readers = 0   # abiertas en total (libres + prestadas)
+        self._in_use = 0
+        self._writer_lock = threading.RLock()
+        self._writer_conn = None
+        self._writer_depth = 0   # reentradas del dueño actual del lock
+        self._schema_lock = threading.Lock()
+        self._exists = False
+        self._created = time.perf_counter()
+        self._stats = {'reader_checkouts': 0, 'reader_waits': 0, 'reader_wait_ms': 0.0,
+                       'reader_wait_max_ms': 0.0, 'reader_busy_ms': 0.0,
+                       'readers_peak': 0, 'writer_acquisitions': 0, 'writer_waits': 0,
+                       'writer_wait_ms': 0.0, 'writer_wait_max_ms': 0.0,
+                       'writer_busy_ms': 0.0, 'migrations': 0}
+
+    # --- Archivo y esquema ---
+
+    def exists(self):
+        """True si logs.db ya existe; una vez visto no se vuelve a hacer stat.
+
+        Mientras otro hilo lo crea (ensure_schema) el archivo ya está pero
+        sus tablas no: cuenta como ausente hasta que termine."""
+        if not self._exists:
+            found = os.path.exists(self.db_path)
+            self._exists = found and not self._schema_lock.locked()
+        return self._exists
+
+    def ensure_schema(self):
+        """Crea y migra logs.db con las migraciones de llm si no existe.
+
+        Sólo la primera llamada que lo encuentra ausente migra; las demás
+        (otras ventanas, otros hilos) esperan a que termine."""
+        if self.exists():
+            return
+        with self._schema_lock:
+            if self.exists():
+                return
+            self._run_llm_migrations()
+            self._exists = True
+
+    def _run_llm_migrations(self):
+        """Ensures the database schema is managed by llm's migrations."""
+        db_utils = None
+        try:
+            with startup_timing.phase('history_migrations'):
+                # Sólo al crear/migrar logs.db: importar llm (y sqlite_utils)
+                # al cargar el módulo retrasaba el primer frame.
+                import sqlite_utils
+                from llm.migrations import migrate
+                db_utils = sqlite_utils.Database(self.db_path)
+                migrate(db_utils)
+            self._stats['migrations'] += 1
+            logging.info(f"LLM migrations applied successfully to {self.db_path}")
+        except Exception as e:
+            logging.error(f"Error running LLM migrations on {self.db_path}: {e}",
+                          exc_info=True)
+        finally:
+            # Asegurarse de cerrar la conexión usada por sqlite_utils
+            if db_utils is not None and getattr(db_utils, 'conn', None):
+                try:
+                    db_utils.conn.close()
+                except Exception as close_err:
+                    logging.error(f"Error closing sqlite_utils connection after "
+                                  f"migration: {close_err}", exc_info=True)
+
+    def _open(self, read_only):
+        self.ensure_schema()
+        with startup_timing.phase('history_connect'):
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            pragmas = self._PRAGMAS + (("PRAGMA query_only=1",) if read_only else ())
+            for pragma in pragmas:
+                try:
+                    conn.execute(pragma)
+                except sqlite3.Error as e:
+                    # p.ej. WAL no disponible en ese sistema de archivos: se
+                    # sigue con el modo que tenga la BD.
+                    debug_print(f"[HistoryDatabase] {pragma} falló: {e}")
+        return conn
+
+    # --- Lectoras ---
+
+    @contextmanager
+    def reader(self):
+        """Presta una conexión de lectura del pool; espera si están todas en uso."""
+        start = time.perf_counter()
+        waited = False
+        with self._cond:
+            while not self._idle and self._open_readers >= self.size:
+                waited = True
+                self._cond.wait()
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open_readers += 1  # se reserva el hueco antes de abrir
+            self._in_use += 1
+            wait_ms = (time.perf_counter() - start) * 1000.0
+            self._stats['reader_checkouts'] += 1
+            self._stats['readers_peak'] = max(self._stats['readers_peak'], self._in_use)
+            if waited:
+                self._stats['reader_waits'] += 1
+                self._stats['reader_wait_ms'] += wait_ms
+                self._stats['reader_wait_max_ms'] = max(
+                    self._stats['reader_wait_max_ms'], wait_ms)
+        if conn is None:
+            try:
+                conn = self._open(read_only=True)
+            except BaseException:
+                with self._cond:
+                    self._open_readers -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+        held = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._cond:
+                self._in_use -= 1
+                self._stats['reader_busy_ms'] += (time.perf_counter() - held) * 1000.0
+                self._idle.append(conn)
+                self._cond.notify()
+
+    # --- Escritura ---
+
+    @contextmanager
+    def writer(self):
+        """La conexión de escritura, con el lock tomado mientras dure el bloque.
+
+        Reentrante: un método que escribe puede llamar a otro que también
+        escribe desde el mismo hilo. Quien la recibe hace commit (p.ej.
+        `with conn:`); lo que quede sin confirmar al salir se descarta."""
+        start = time.perf_counter()
+        waited = not self._writer_lock.acquire(blocking=False)
+        if waited:
+            self._writer_lock.acquire()
+        wait_ms = (time.perf_counter() - start) * 1000.0
+        held = time.perf_counter()
+        self._writer_depth += 1
+        try:
+            if self._writer_depth == 1:
+                self._stats['writer_acquisitions'] += 1
+                if waited:
+                    self._stats['writer_waits'] += 1
+                    self._stats['writer_wait_ms'] += wait_ms
+                    self._stats['writer_wait_max_ms'] = max(
+                        self._stats['writer_wait_max_ms'], wait_ms)
+            yield self.writer_connection()
+        finally:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                conn = self._writer_conn
+                if conn is not None and conn.in_transaction:
+                    conn.rollback()
+                self._stats['writer_busy_ms'] += (time.perf_counter() - held) * 1000.0
+            self._writer_lock.release()
+
+    def writer_connection(self):
+        """La conexión de escritura sin tomar el lock (la abre si hace falta).
+
+        Para quien ya está dentro de writer() o para scripts y tests de un
+        solo hilo; en la aplicación, escribir siempre con writer()."""
+        if self._writer_conn is None:
+            with self._writer_lock:
+                if self._writer_conn is None:
+                    self._writer_conn = self._open(read_only=False)
+        return self._writer_conn
+
+    # --- Ciclo de vida y métricas ---
+
+    def close(self):
+        """Cierra las lectoras libres y la escritora; la siguiente operación
+        vuelve a abrir lo que necesite."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open_readers -= len(idle)
+        for conn in idle:
+            conn.close()
+        with self._writer_lock:
+            if self._writer_conn is not None:
+                self._writer_conn.close()
+                self._writer_conn = None
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(readers=self.size, readers_open=self._open_readers,
+                         readers_in_use=self._in_use)
+        uptime_ms = (time.perf_counter() - self._created) * 1000.0
+        # Fracción del tiempo de vida en que las lectoras estuvieron prestadas.
+        stats['reader_utilization'] = round(
+            stats['reader_busy_ms'] / (uptime_ms * self.size), 4) if uptime_ms else 0.0
+        for key, value in stats.items():
+            if isinstance(value, float) and key != 'reader_utilization':
+                stats[key] = round(value, 3)
+        return stats
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_history_database(db_path, readers=DEFAULT_READERS):
+    """El HistoryDatabase compartido de `db_path` (uno por archivo y proceso)."""
+    key = os.path.realpath(db_path)
+    with _databases_lock:
+        database = _databases.get(key)
+        if database is None:
+            database = _databases[key] = HistoryDatabase(db_path, readers)
+        return database
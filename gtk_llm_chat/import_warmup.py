@@ -0,0 +1,80 @@
+"""Precalentamiento en segundo plano de los imports pesados.
+
+Para que GTK/Adw y la primera ventana (el roster incluido) aparezcan
+antes, llm y sus plugins, markdown_it, GStreamer, nbxmpp y la pila OMEMO
+ya no se importan al cargar los módulos de la ventana: cada uno entra en
+su primer uso. Para que ese primer uso no sea una pausa visible, una vez
+pintada la ventana este hilo los importa por adelantado:
+
+- markdown: pango_markdown (markdown_it), lo primero que necesita pintar
+  el historial;
+- omemo: xmpp_omemo y sus bibliotecas, si la cuenta tiene OMEMO;
+- llm: import llm, carga de plugins (serializada con model_catalog) y el
+  catálogo de modelos.
+
+nbxmpp no tiene tarea propia: la sesión XMPP lo importa en el idle que la
+arranca, justo después del primer frame (y la tarea de OMEMO lo arrastra).
+GStreamer tampoco: Gst.init desde otro hilo no es seguro y sólo hace falta
+al reproducir o grabar.
+
+Cada tarea queda registrada como fase 'warm_<nombre>' de startup_timing.
+Un fallo (p. ej. OMEMO no instalado) sólo se anota: el import real lo
+volverá a intentar y reportará el error donde corresponde. No depende de gi.
+"""
+import importlib
+import threading
+import time
+
+from . import startup_timing
+from .debug_utils import debug_print
+
+
+def _import(module):
+    return lambda: importlib.import_module(module, __package__)
+
+
+def _warm_llm():
+    import llm  # noqa: F401
+    from .model_catalog import get_model_catalog, load_plugins
+    load_plugins()
+    get_model_catalog().models()
+
+
+def default_tasks(omemo=False):
+    tasks = [('markdown', _import('.pango_markdown'))]
+    if omemo:
+        tasks.append(('omemo', _import('.xmpp_omemo')))
+    tasks.append(('llm', _warm_llm))
+    return tasks
+
+
+class ImportWarmup:
+    def __init__(self, tasks):
+        self.tasks = list(tasks)
+        self.results = {}  # nombre -> {'ms': float, 'error': str | None}
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='import-warmup',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        for name, task in self.tasks:
+            start = time.perf_counter()
+            error = None
+            try:
+                with startup_timing.phase(f'warm_{name}'):
+                    task()
+            except Exception as e:
+                error = str(e)
+                debug_print(f"[warmup] {name}: {e}")
+            self.results[name] = {'ms': (time.perf_counter() - start) * 1000.0,
+                                  'error': error}
+        debug_print("[warmup] " + ", ".join(
+            f"{name} {r['ms']:.0f} ms" for name, r in self.results.items()))
@@ -4,23 +4,45 @@ import os
 import re
 import signal
 import sys
-import unittest
 from typing import Optional
-from unittest.mock import patch, MagicMock
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 from gi.repository import GObject, GLib
 import llm
 import threading
+import time
+from collections import deque
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from . import startup_timing
+from .chunk_coalescer import ChunkCoalescer
+from .context_budget import (SUMMARY_MIN_NEW_TURNS, SUMMARY_SYSTEM, Summary,
+                             build_summary_prompt, estimate_tokens, get_context_store,
+                             system_with_summary)
+from .conversation_cache import conversation_cache
 from .db_operations import ChatHistory
+from .generation_scheduler import generation_scheduler
 from .debug_utils import debug_print
+from .model_catalog import get_model_catalog, load_plugins
+from .model_warmup import model_warmup, prefetch_enabled
+from .turn_metrics import TurnMetrics, get_metrics_log
 
 from .chat_application import _
-from .chat_backend import ChatBackend
+from .chat_backend import ChatBackend, DEFAULT_CONVERSATION_NAME
+from .chat_preferences import get_preferences, keeps_answer
+
+class _Turn:
+    """Un prompt enviado: su evento de cancelación, sus métricas y su
+    ticket en generation_scheduler."""
+
+    __slots__ = ('prompt', 'cancelled', 'metrics', 'ticket')
+
+    def __init__(self, prompt, metrics):
+        self.prompt = prompt
+        self.cancelled = threading.Event()
+        self.metrics = metrics
+        self.ticket = None
 
-DEFAULT_CONVERSATION_NAME = lambda: _("New Conversation")
 
 class LLMClient(ChatBackend):
     # Señales heredadas de ChatBackend: response, error, finished,
@@ -32,88 +54,227 @@ class LLMClient(ChatBackend):
         self.model = None
         self.conversation = None
         self._is_generating_flag = False
-        self._stream_thread = None
+        # Turnos en curso o en cola, en orden; sólo se tocan en el main loop.
+        # Cada uno lleva su evento de cancelación: el hilo de un turno
+        # cancelado puede seguir vivo cuando arranca el siguiente.
+        self._turns = deque()
+        self._cancel_lock = threading.Lock()
+        # Turnos ya construidos de la conversación actual (conversation_cache).
+        self._context = None
+        self._context_store = None
+        # Resumen acumulado por cid (context.db) y los que se están generando.
+        self._summaries = {}
+        self._summarizing = set()
+        self._summary_lock = threading.Lock()
+        # Dueño en generation_scheduler de los resúmenes: no esperan al turno
+        # en curso de esta ventana, pero sí al cupo del proveedor.
+        self._summary_owner = object()
         self._init_error = None
-        self.chat_history = chat_history or ChatHistory(fragments_path=fragments_path)
+        # Carga y cambio de modelo (en el hilo de UI o, con model_prefetch,
+        # en _prefetch_thread) no se pisan. El cambio lo toma sólo para
+        # asignar lo que armó; send_message no lo espera si la carga va en
+        # segundo plano (el hilo del turno sí, ver _wait_for_model).
+        self._load_lock = threading.RLock()
+        self._prefetch_thread = None
+        self._pending_model_id = None
+        self.last_turn_metrics = None
+        self.chat_history = chat_history or ChatHistory()
+        # Los tokens no se emiten uno a uno: se agrupan y se entregan como
+        # mucho una vez por frame (ver chunk_coalescer.py).
+        self._coalescer = ChunkCoalescer(
+            self._emit_coalesced_response, self._schedule_on_main_loop,
+            interval=self.config.get('stream_flush_interval_ms', 16) / 1000,
+            max_chars=self.config.get('stream_flush_max_chars', 2048))
+
+    @staticmethod
+    def _schedule_on_main_loop(callback, delay):
+        if delay > 0:
+            GLib.timeout_add(max(1, int(delay * 1000)), callback)
+        else:
+            GLib.idle_add(callback)
+
+    def _emit_coalesced_response(self, text):
+        self.emit('response', text)
+
+    def get_stream_stats(self):
+        """Contadores de coalescencia del último turno: chunks recibidos,
+        entregas al main loop, chunks fusionados y latencia de flush."""
+        return self._coalescer.stats()
 
     def _ensure_model_loaded(self):
         """Ensures the model is loaded, loading it if necessary."""
-        if self.model is None and self._init_error is None:
-            debug_print("LLMClient: Ensuring model is loaded (was deferred).")
-            self._load_model_internal() # Load default or configured model
+        with self._load_lock:
+            if self.model is None and self._init_error is None:
+                debug_print("LLMClient: Ensuring model is loaded (was deferred).")
+                self._load_model_internal() # Load default or configured model
+
+    def _wait_for_model(self):
+        """Hilo del turno: espera la carga o el cambio de modelo en segundo
+        plano que siga en curso. True si hay modelo para generar."""
+        thread = self._prefetch_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._ensure_model_loaded()
+        return self.model is not None and not self._init_error
 
-    def send_message(self, prompt: str):
-        self._ensure_model_loaded() # Ensure model is loaded before sending
-        if self._is_generating_flag:
-            GLib.idle_add(self.emit, 'error', "Ya se está generando una respuesta.")
-            # 'error' sin 'finished' rompe el contrato del backend: la
-            # ventana se rehabilita en _on_llm_error, pero otros oyentes
-            # (p.ej. estado busy) esperan el cierre del turno.
-            GLib.idle_add(self.emit, 'finished', False)
+    def prepare(self):
+        """Carga ahora el modelo y el historial de la conversación, en vez de
+        al primer uso. Para hilos de fondo (restauración de sesión): lo que
+        emite llega al main loop por GLib.idle_add."""
+        self._ensure_model_loaded()
+        if prefetch_enabled(self.config) and self.model is not None:
+            model_warmup.warm(self.model)
+
+    def prefetch(self):
+        """Con model_prefetch, prepare() en un hilo de fondo (ver
+        model_warmup.py); mientras tanto get_model_id/get_conversation_id
+        responden con la config en vez de bloquear."""
+        if not prefetch_enabled(self.config) or self._loading_in_background():
             return
+        self._start_background(self.prepare)
 
-        if self._init_error or not self.model:
-            GLib.idle_add(self.emit, 'error',
-                          f"Error al inicializar el modelo: {self._init_error or 'Modelo no disponible'}")
-            GLib.idle_add(self.emit, 'finished', False)
-            return
+    def _start_background(self, target, *args):
+        self._prefetch_thread = threading.Thread(
+            target=target, args=args, name='model-prefetch', daemon=True)
+        self._prefetch_thread.start()
+
+    def _loading_in_background(self):
+        thread = self._prefetch_thread
+        return (thread is not None and thread.is_alive()
+                and thread is not threading.current_thread())
+
+    def send_message(self, prompt: str):
+        """Encola el turno en generation_scheduler. Con otro turno de esta
+        conversación en curso, el nuevo espera detrás y sale cuando aquel
+        emita 'finished'. Con el modelo cargándose o cambiando en segundo
+        plano (model_prefetch) no espera: el turno entra a la cola y su
+        hilo espera al modelo (_wait_for_model)."""
+        if self._loading_in_background():
+            model_id = self.get_model_id()
+            entry = get_model_catalog().get(model_id)
+            provider = getattr(entry, 'needs_key', None)
+        else:
+            self._ensure_model_loaded() # Ensure model is loaded before sending
+            if self._init_error or not self.model:
+                GLib.idle_add(self.emit, 'error',
+                              "Error al inicializar el modelo: "
+                              f"{self._init_error or 'Modelo no disponible'}")
+                GLib.idle_add(self.emit, 'finished', False)
+                return
+            model_id = self.model.model_id
+            provider = getattr(self.model, 'needs_key', None)
 
+        turn = _Turn(prompt, TurnMetrics(model_id, self.config.get('cid')))
+        self._turns.append(turn)
         self._is_generating_flag = True
 
-        self._stream_thread = threading.Thread(target=self._process_stream, args=(prompt,), daemon=True)
-        self._stream_thread.start()
+        def started():
+            turn.metrics.started()
+            GLib.idle_add(self._on_turn_position, turn, -1)
+
+        turn.ticket = generation_scheduler.submit(
+            lambda: self._process_stream(turn), owner=self,
+            provider=provider,
+            on_position=lambda position: GLib.idle_add(self._on_turn_position,
+                                                       turn, position),
+            on_start=started)
+
+    def _on_turn_position(self, turn, position):
+        # Sólo interesa la espera del turno que la ventana está mostrando; los
+        # que esperan detrás de él en esta misma conversación, no.
+        if position >= 0 and turn.ticket.state != 'queued':
+            return False  # ya arrancó: el aviso llegó tarde
+        if self._turns and self._turns[0] is turn and not turn.cancelled.is_set():
+            self.emit('queue-position', position)
+        return False
+
+    def _end_turn(self, turn):
+        if turn in self._turns:
+            self._turns.remove(turn)
+        self._is_generating_flag = bool(self._turns)
+        return False
 
     def set_model(self, model_id):
-        """Establece el modelo actual y actualiza el proveedor."""
+        """Establece el modelo actual y actualiza el proveedor.
+
+        Con model_prefetch, valida el id en el catálogo y hace el cambio
+        (modelo, Conversation, historial) en un hilo; 'ready' llega después."""
         debug_print(f"LLMClient: Request to set model to: {model_id}, current cid: {self.config.get('cid')}")
+        # El selector del sidebar lo pide dos veces por cada clic (fila y
+        # señal model-selected): la segunda no rehace nada.
+        if model_id == self._pending_model_id or (
+                self.model is not None and self.model.model_id == model_id
+                and self.conversation is not None):
+            return True
         # Mantener el modelo actual en la config
         self.config['model'] = model_id
 
         # Guardar cid antiguo
         old_cid = self.config.get('cid')
 
-        # Si hay una conversación previa, actualizar el modelo en la BD antes de recargar
-        if old_cid:
-            self.chat_history.update_conversation_model(old_cid, model_id)
-            debug_print(f"LLMClient: Modelo en BD actualizado para cid={old_cid} -> {model_id}")
-
-        # Reiniciar referencias previas para evitar estados residuales
-        self.model = None
-        self.conversation = None
-
-        # Buscar el modelo en la lista de modelos disponibles
-        all_models = llm.get_models()
-        self.model = next((model for model in all_models if getattr(model, 'model_id', None) == model_id), None)
-        if not self.model:
+        if not prefetch_enabled(self.config):
+            return self._switch_model(model_id, old_cid)
+        if get_model_catalog().get(model_id) is None:
             debug_print(f"LLMClient: No se pudo encontrar el modelo con ID: {model_id}")
             return False
+        self._pending_model_id = model_id
+        self._start_background(self._switch_model, model_id, old_cid, True)
+        return True
 
-        # Actualizar el proveedor basado en el atributo needs_key del modelo
-        self.provider = getattr(self.model, 'needs_key', None) or "Local/Other"
-        debug_print(f"LLMClient: Proveedor actualizado a: {self.provider}")
-
-        # Crear una nueva conversación para el modelo
-        debug_print(f"LLMClient: Creando nueva instancia de conversación para el modelo {self.model.model_id}")
-        self.conversation = self.model.conversation()
-
-        # Recargar historial si había cid previo
-        if old_cid:
-            debug_print(f"LLMClient: Recargando historial para cid={old_cid} tras cambio de modelo.")
-            history_entries = self.chat_history.get_conversation_history(old_cid)
-            self.load_history(history_entries)
-            debug_print(f"LLMClient: Historial recargado ({len(history_entries)} entradas) para cid={old_cid} tras cambio de modelo.")
-            # Restaurar el cid en config
-            self.config['cid'] = old_cid
-        else:
-            # Nuevo cid para conversación sin historial previo
-            new_cid = self.conversation.id
-            self.config['cid'] = new_cid
-            debug_print(f"LLMClient: Nuevo cid asignado: {new_cid}")
-            # Crear conversación en BD
-            self.chat_history.create_conversation_if_not_exists(new_cid, DEFAULT_CONVERSATION_NAME(), model_id)
+    def _switch_model(self, model_id, old_cid, in_background=False):
+        """Cambia de modelo. Modelo, Conversation e historial se arman en
+        locales, sin el lock: mientras tanto los turnos siguen viendo el
+        modelo anterior entero. Se asignan de una vez bajo _load_lock y el
+        precalentamiento va después, fuera del lock, como en prepare()."""
+        emit = (lambda *args: GLib.idle_add(self.emit, *args)) if in_background else self.emit
+        try:
+            # Buscar el modelo en el catálogo compartido (sin recorrer los plugins)
+            try:
+                model = get_model_catalog().get_model(model_id)
+            except llm.UnknownModelError:
+                model = None
+            if not model:
+                debug_print(f"LLMClient: No se pudo encontrar el modelo con ID: {model_id}")
+                if in_background:
+                    emit('error', f"Modelo desconocido: {model_id}")
+                return False
+
+            debug_print(f"LLMClient: Creando nueva instancia de conversación "
+                        f"para el modelo {model.model_id}")
+            conversation = model.conversation()
+            context = None
+            if old_cid:
+                # Actualizar el modelo en la BD y recargar el historial (sólo
+                # lo que falte en la caché); el cid se conserva.
+                self.chat_history.update_conversation_model(old_cid, model_id)
+                debug_print(f"LLMClient: Modelo en BD actualizado para cid={old_cid} "
+                            f"-> {model_id}; recargando historial.")
+                context = conversation_cache.restore(
+                    old_cid, model.model_id, self.chat_history,
+                    lambda prompt, answer: self._history_turn(prompt, answer, model,
+                                                              conversation),
+                    self._get_context_store())
+                self._fit_conversation(conversation, context)
+                cid = old_cid
+            else:
+                # Nuevo cid para conversación sin historial previo
+                cid = conversation.id
+                debug_print(f"LLMClient: Nuevo cid asignado: {cid}")
+                self.chat_history.create_conversation_if_not_exists(
+                    cid, DEFAULT_CONVERSATION_NAME(), model_id)
+
+            with self._load_lock:
+                self.model, self.conversation, self._context = model, conversation, context
+                self.provider = getattr(model, 'needs_key', None) or "Local/Other"
+                self.config['cid'] = cid
+        finally:
+            if self._pending_model_id == model_id:
+                self._pending_model_id = None
 
+        if in_background:
+            model_warmup.warm(model)
         # Emitir la señal ready para que la UI se actualice
-        self.emit('ready', model_id)
+        emit('ready', model_id)
         debug_print(f"LLMClient: Modelo {model_id} cargado y conversación reinicializada.")
         return True
 
@@ -123,28 +284,28 @@ class LLMClient(ChatBackend):
         try:
             # Asegurar que los plugins estén cargados, pero sin forzar recarga
             try:
-                from llm.plugins import load_plugins, pm
                 if not hasattr(llm.plugins, '_loaded') or not llm.plugins._loaded:
-                    # Solo cargar si no están ya cargados
-                    load_plugins()
+                    # Solo cargar si no están ya cargados (serializado con el
+                    # precalentamiento en segundo plano, ver model_catalog)
+                    with startup_timing.phase('load_plugins'):
+                        load_plugins()
                     debug_print("LLMClient: Plugins cargados correctamente en _load_model_internal")
                 else:
                     debug_print("LLMClient: Plugins ya estaban cargados, omitiendo carga en _load_model_internal")
             except Exception as e:
                 debug_print(f"LLMClient: Error verificando/cargando plugins en _load_model_internal: {e}")
             
-            # Determine the model_id to load
-            if model_id is None:
-                # Use config or default if no specific model_id is provided (initial load)
-                model_id = self.config.get('model') or llm.get_default_model()
+            with startup_timing.phase('model_resolve'):
+                # Determine the model_id to load
+                if model_id is None:
+                    # Use config or default if no specific model_id is provided (initial load)
+                    model_id = self.config.get('model') or llm.get_default_model()
 
-            debug_print(f"LLMClient: Attempting to load model: {model_id} (in _load_model_internal)")
-            
-            # Cargar directamente el modelo solicitado
-            debug_print(f"LLMClient: Intentando cargar modelo directamente: {model_id}")
-            
-            # Cargar el modelo
-            new_model = llm.get_model(model_id)
+                debug_print(f"LLMClient: Attempting to load model: {model_id} "
+                            "(in _load_model_internal)")
+
+                # Cargar el modelo
+                new_model = get_model_catalog().get_model(model_id)
             self.model = new_model  # Assign the new model
             debug_print(f"LLMClient: Using model {self.model.model_id}")
             
@@ -159,12 +320,7 @@ class LLMClient(ChatBackend):
             # If model setup was successful and a cid exists (especially for initial load with a persisted session)
             if current_cid and conversation_recreated_or_model_changed:
                 debug_print(f"LLMClient: Attempting to reload history for cid '{current_cid}' during model initialization.")
-                history_entries = self.chat_history.get_conversation_history(current_cid) # Corrected method name
-                if history_entries:
-                    self.load_history(history_entries)
-                    debug_print(f"LLMClient: Successfully reloaded {len(history_entries)} entries for cid '{current_cid}' (initial load).")
-                else:
-                    debug_print(f"LLMClient: No history entries found for cid '{current_cid}' to reload (initial load).")
+                self._restore_history(current_cid)
             elif not current_cid and conversation_recreated_or_model_changed:
                  debug_print("LLMClient: New conversation created, no prior cid to reload history from.")
 
@@ -182,44 +338,29 @@ class LLMClient(ChatBackend):
             import traceback
             traceback.print_exc()
 
-    def _process_stream(self, prompt: str):
+    def _process_stream(self, turn):
+        """Genera un turno. Corre en un hilo de generation_scheduler."""
+        prompt, cancelled, metrics = turn.prompt, turn.cancelled, turn.metrics
         success = False
         full_response = ""
+        response = None
         chat_history = self.chat_history
         try:
+            if cancelled.is_set():
+                return  # cancelado entre salir de la cola y arrancar
+            if not self._wait_for_model():
+                GLib.idle_add(self.emit, 'error',
+                              "Error al inicializar el modelo: "
+                              f"{self._init_error or 'Modelo no disponible'}")
+                return
             debug_print(f"LLMClient: Sending prompt: '{prompt[:50]}' (len={len(prompt)})")
 
-            # Depurar el contenido de self.conversation.responses antes de enviar el prompt
-            debug_print("LLMClient: Current conversation history before sending prompt:")
-            
-            # ENFOQUE MÁS ESTRICTO: Reconstruir las conversaciones por turnos
-            # Solo mantener prompts válidos de usuario y respuestas válidas de asistente
-            filtered_responses = []
-            is_user_turn = True  # Alternamos entre turno de usuario y asistente
-            
-            for response in self.conversation.responses:
-                if is_user_turn:
-                    # Si es turno de usuario, verificar que tenga prompt válido
-                    if response.prompt and response.prompt.prompt and response.prompt.prompt.strip():
-                        filtered_responses.append(response)
-                        is_user_turn = False  # Siguiente sería turno del asistente
-                else:
-                    # Si es turno del asistente, verificar que tenga chunks válidos
-                    if hasattr(response, '_chunks') and response._chunks and any(chunk.strip() for chunk in response._chunks):
-                        filtered_responses.append(response)
-                        is_user_turn = True  # Siguiente sería turno del usuario
-                    else:
-                        # Si el asistente tiene chunks vacíos, descartamos y volvemos a turno de usuario
-                        # También eliminamos el prompt del usuario anterior para mantener la alternancia
-                        if filtered_responses:
-                            filtered_responses.pop()  # Quitar el último prompt de usuario
-                        is_user_turn = True  # Volver a turno de usuario
-            
-            # Revisar si el último elemento es un turno de usuario sin respuesta
-            if filtered_responses and is_user_turn == False:
-                # Último elemento es un prompt de usuario sin respuesta, lo eliminamos
-                filtered_responses.pop()
-            
+            # El contexto sale ya construido de conversation_cache: sólo se
+            # recorta al presupuesto, sin recorrer cada turno.
+            plan = self._plan_context(prompt) if self._context is not None else None
+            if plan is not None:
+                self.conversation.responses = plan.responses
+
             if prompt is None or str(prompt).strip() == "":
                 debug_print("LLMClient: ERROR: prompt vacío o None detectado en _process_stream. Abortando.")
                 GLib.idle_add(self.emit, 'error', "No se puede enviar un prompt vacío al modelo.")
@@ -228,6 +369,15 @@ class LLMClient(ChatBackend):
             prompt_args = {}
             if self.config.get('system'):
                 prompt_args['system'] = self.config['system']
+            if plan is not None and plan.summary is not None:
+                prompt_args['system'] = system_with_summary(prompt_args.get('system'),
+                                                            plan.summary)
+            metrics.context(
+                (plan.tokens if plan is not None else 0) + estimate_tokens(prompt)
+                + estimate_tokens(prompt_args.get('system')),
+                len(plan.kept) if plan is not None else 0,
+                len(plan.dropped) if plan is not None else 0,
+                plan.summary.turns if plan is not None and plan.summary is not None else 0)
             if self.config.get('temperature'):
                 try:
                     temp_val = float(self.config['temperature'])
@@ -262,6 +412,7 @@ class LLMClient(ChatBackend):
                     prompt,
                     **prompt_args
                 )
+                metrics.prompt_sent()
             except Exception as e:
                 # Mensaje de error simplificado
                 debug_print(f"LLMClient: Error en conversation.prompt: {e}")
@@ -269,55 +420,88 @@ class LLMClient(ChatBackend):
                 return
 
             debug_print(_("LLMClient: Starting stream processing..."))
-            for chunk in response:
-                if not self._is_generating_flag:
-                    debug_print(_("LLMClient: Stream processing cancelled externally."))
-                    break
-                if chunk:
-                    full_response += chunk
-                    GLib.idle_add(self.emit, 'response', chunk)
-            success = True
-            debug_print(_("LLMClient: Stream finished normally."))
+            self._coalescer.reset_stats()
+            stream = iter(response)
+            for chunk in stream:
+                # Con el lock: un chunk que llega mientras cancel() corre no
+                # se entrega después de su 'finished'.
+                with self._cancel_lock:
+                    if cancelled.is_set():
+                        break
+                    if chunk:
+                        metrics.chunk(chunk)
+                        if metrics.chunks == 1:
+                            model_warmup.record_ttft(metrics.model_id, metrics.ttft_ms)
+                        full_response += chunk
+                        self._coalescer.push(chunk)
+            if cancelled.is_set():
+                debug_print(_("LLMClient: Stream processing cancelled externally."))
+                self._close_stream(stream)
+            else:
+                success = True
+                debug_print(_("LLMClient: Stream finished normally."))
+                self._remember_turn(prompt, full_response, response)
 
         except Exception as e:
             debug_print(_(f"LLMClient: Error during streaming: {e}"))
             import traceback
             debug_print(traceback.format_exc())
-            GLib.idle_add(self.emit, 'error', f"Error durante el streaming: {str(e)}")
+            self._coalescer.flush_soon()
+            if not cancelled.is_set():
+                GLib.idle_add(self.emit, 'error', f"Error durante el streaming: {str(e)}")
         finally:
             try:
                 debug_print(_(f"LLMClient: Cleaning up stream task (success={success})."))
-                self._is_generating_flag = False
-                self._stream_thread = None
-                # Solo guardar en el historial si fue exitoso Y HUBO RESPUESTA DEL ASISTENTE
-                if success and full_response and full_response.strip():
+                GLib.idle_add(self._end_turn, turn)
+                truncated = cancelled.is_set()
+                keep_partial = get_preferences().resolve(self.config,
+                                                         'keep_partial_on_cancel')
+                if truncated and not keep_partial:
+                    debug_print("LLMClient: Turno cancelado; "
+                                "la respuesta parcial se descarta.")
+                # Solo guardar en el historial si fue exitoso (o cancelado y se
+                # conservan los parciales) Y HUBO RESPUESTA DEL ASISTENTE
+                elif keeps_answer(full_response, success, truncated, keep_partial):
                     cid = self.config.get('cid')
                     model_id = self.get_model_id()
 
                     # Fuente de verdad: self.conversation.id, no config['cid'] (que
                     # chat_window.py puede haber fijado ya en memoria al recibir el
                     # primer chunk, antes de que la conversación exista en la BD).
-                    # create_conversation_if_not_exists es idempotente (INSERT OR
-                    # IGNORE), así que es seguro llamarla siempre que haya conversación.
+                    # Crear la conversación es idempotente (INSERT OR IGNORE), así que
+                    # es seguro pedirlo siempre que haya conversación; add_history_entry
+                    # lo hace en la misma transacción que el turno.
+                    conversation_name = None
                     if self.conversation and self.conversation.id:
                         cid = self.conversation.id
                         if not self.config.get('cid'):
                             self.config['cid'] = cid
                             debug_print(f"LLMClient: New conversation detected, cid set to: {cid}")
-                        self.chat_history.create_conversation_if_not_exists(cid, DEFAULT_CONVERSATION_NAME(), model_id)
+                        conversation_name = DEFAULT_CONVERSATION_NAME()
 
                     if cid and model_id: 
                         try:
-                            self.chat_history.add_history_entry( 
+                            # Lo escribe el escritor de fondo: 'finished' no
+                            # espera al disco.
+                            metrics.awaiting_persist = True
+                            queued_at = time.perf_counter()
+                            self.chat_history.queue_history_entry(
                                 cid,
                                 prompt,
                                 full_response, 
                                 model_id,
                                 fragments=self.config.get('fragments'),
-                                system_fragments=self.config.get('system_fragments')
+                                system_fragments=self.config.get('system_fragments'),
+                                conversation_name=conversation_name,
+                                truncated=truncated,
+                                on_done=lambda _id, error, cid=cid: GLib.idle_add(
+                                    self._on_turn_persisted, metrics, cid, error,
+                                    time.perf_counter() - queued_at)
                             )
-                            debug_print(f"LLMClient: History entry added for cid={cid} with assistant response.")
+                            debug_print(f"LLMClient: History entry queued for cid={cid} "
+                                        "with assistant response.")
                         except Exception as e:
+                            metrics.awaiting_persist = False
                             debug_print(_(f"Error al guardar en historial: {e}"))
                     else:
                         debug_print("LLMClient: Not saving history because cid or model_id is missing.")
@@ -328,13 +512,110 @@ class LLMClient(ChatBackend):
             finally:
                 # self.chat_history.close_connection() # No cerrar aquí si es un atributo de instancia
                 pass 
-            GLib.idle_add(self.emit, 'finished', success)
+            # Lo que quede en el buffer sale antes que 'finished' (ambos son
+            # idles y GLib los despacha en orden).
+            self._coalescer.flush_soon()
+            debug_print(f"LLMClient: stream stats {self._coalescer.stats()}")
+            # Detrás del último flush: las estadísticas de entrega ya lo incluyen.
+            GLib.idle_add(self._finish_metrics, metrics, success,
+                          getattr(response, 'output_tokens', None))
+            if not cancelled.is_set():
+                # Cancelado, 'finished' ya lo emitió cancel().
+                GLib.idle_add(self.emit, 'finished', success)
+
+    @staticmethod
+    def _close_stream(stream):
+        """Cierra el generador del stream: el GeneratorExit llega al execute()
+        del plugin, cuyos `with` cierran la respuesta HTTP en curso en vez de
+        seguir leyendo (y pagando) tokens que ya nadie va a ver."""
+        close = getattr(stream, 'close', None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            debug_print(f"LLMClient: Error cerrando el stream cancelado: {e}")
+
+    # --- Métricas por turno (ver turn_metrics.py) ---
+    # Los tres pasos corren en el main loop: el cierre del stream y la
+    # confirmación del escritor pueden llegar en cualquier orden.
+
+    def _finish_metrics(self, metrics, success, output_tokens):
+        if metrics.finished_at is None:
+            metrics.finish(success, output_tokens, self._coalescer.stats())
+        self._publish_metrics(metrics)
+        return False
+
+    def _on_turn_persisted(self, metrics, cid, error, seconds):
+        if error is None:
+            self.emit('history-saved', cid)
+        return self._on_metrics_persisted(metrics, None if error else seconds)
+
+    def _on_metrics_persisted(self, metrics, seconds):
+        metrics.awaiting_persist = False
+        if seconds is not None:
+            metrics.persisted(seconds)
+        self._publish_metrics(metrics)
+        return False
+
+    def _publish_metrics(self, metrics):
+        if metrics.finished_at is None or metrics.awaiting_persist or metrics.published:
+            return
+        metrics.published = True
+        # Conversación nueva: el cid aparece con el primer turno.
+        metrics.conversation_id = metrics.conversation_id or self.config.get('cid')
+        data = metrics.as_dict()
+        self.last_turn_metrics = data
+        debug_print(f"LLMClient: turn metrics {data}")
+        log = get_metrics_log(self.config)
+        if log is not None:
+            threading.Thread(target=log.write, args=(data,), name='turn-metrics',
+                             daemon=True).start()
+        self.emit('turn-metrics', data)
+
+    def get_ttft_stats(self):
+        """Tiempo al primer token del modelo actual (ver
+        ModelWarmup.ttft_stats), o None si aún no hubo turnos."""
+        return model_warmup.ttft_stats(self.get_model_id())
 
     def cancel(self):
-        """No-op cancel (el stream no se cancela)."""
-        pass
+        """Cancela el turno en curso y los que esperan detrás. Vuelve enseguida
+        y emite 'finished' (False) por cada uno, sin esperar al proveedor: el
+        hilo de streaming deja de entregar chunks, cierra el stream en cuanto
+        recibe el siguiente (o termina la espera) y guarda la respuesta
+        parcial marcada como truncada, o la descarta con
+        keep_partial_on_cancel=False. Los encolados salen de la cola."""
+        turns = [turn for turn in self._turns if not turn.cancelled.is_set()]
+        if not turns:
+            return
+        with self._cancel_lock:
+            for turn in turns:
+                turn.cancelled.set()
+            # Lo ya recibido llega a la UI antes que 'finished'.
+            self._coalescer.flush_soon()
+        for turn in turns:
+            metrics = turn.metrics
+            metrics.cancelled = True
+            if metrics.started_at is not None:
+                metrics.finish(False, None, self._coalescer.stats())
+            if generation_scheduler.cancel(turn.ticket):
+                # Nunca arrancó: no hay hilo que lo cierre.
+                if metrics.finished_at is None:
+                    metrics.finish(False)
+                self._publish_metrics(metrics)
+            else:
+                # El hilo puede quedar bloqueado hasta el próximo chunk: el
+                # siguiente turno de esta conversación no lo espera.
+                generation_scheduler.release_owner(turn.ticket)
+            GLib.idle_add(self.emit, 'finished', False)
+        self._turns.clear()
+        self._is_generating_flag = False
+        debug_print(f"LLMClient: {len(turns)} turno(s) cancelado(s).")
 
     def get_model_id(self):
+        if self._loading_in_background():
+            return (self._pending_model_id or self.config.get('model')
+                    or llm.get_default_model())
         self._ensure_model_loaded()
         return self.model.model_id if self.model else llm.get_default_model()
 
@@ -343,6 +624,8 @@ class LLMClient(ChatBackend):
         return self.get_model_id()
 
     def get_conversation_id(self):
+        if self._loading_in_background():
+            return self.config.get('cid')
         self._ensure_model_loaded()
         return self.conversation.id if self.conversation else None
 
@@ -374,7 +657,7 @@ class LLMClient(ChatBackend):
         # Si el modelo actual no corresponde, cargarlo
         if not self.model or self.model.model_id != model_id:
             try:
-                self.model = llm.get_model(model_id)
+                self.model = get_model_catalog().get_model(model_id)
                 debug_print(f"LLMClient: load_history - Modelo cargado: {model_id}")
             except Exception as e:
                 debug_print(f"LLMClient: Error cargando modelo '{model_id}' para historial: {e}")
@@ -385,30 +668,144 @@ class LLMClient(ChatBackend):
             self.conversation = self.model.conversation()
             debug_print(f"LLMClient: load_history - Conversación creada para modelo: {self.model.model_id}")
 
-        # Limpiar respuestas previas
-        self.conversation.responses = []
+        # Los turnos ya cacheados para (cid, modelo) no se vuelven a construir
+        cid = self.config.get('cid') or self.conversation.id
+        context = conversation_cache.state(cid, self.model.model_id)
+        added = context.extend(history_entries, self._history_turn)
+        self._attach_context(context)
+        debug_print(f"LLMClient: Historial cargado. {added} turnos nuevos, "
+                    f"{len(context.turns)} en total.")
+
+    def _history_turn(self, user_prompt, assistant_response, model=None,
+                      conversation=None):
+        """Las llm.Response con que se repone un turno guardado en logs.db
+        (del modelo y la Conversation actuales, o de los que se pasen)."""
+        model = model or self.model
+        conversation = conversation or self.conversation
+        prompt_obj = llm.Prompt(user_prompt, model)
+        resp_user = llm.Response(prompt_obj, model, stream=False,
+                                 conversation=conversation)
+        resp_user._prompt_json = {'prompt': user_prompt}
+        resp_user._done = True
+        resp_user._chunks = []
+
+        resp_assistant = llm.Response(prompt_obj, model, stream=False,
+                                      conversation=conversation)
+        resp_assistant._done = True
+        resp_assistant._chunks = [str(assistant_response).strip()]
+        return (resp_user, resp_assistant)
+
+    def _restore_history(self, cid):
+        """Pone la conversación de `cid` al día desde conversation_cache: sólo
+        se leen y construyen los turnos que la caché aún no tiene."""
+        context = conversation_cache.restore(cid, self.model.model_id,
+                                             self.chat_history, self._history_turn,
+                                             self._get_context_store())
+        self._attach_context(context)
+
+    def _get_context_store(self):
+        """El context.db junto al logs.db de esta conversación (o None)."""
+        if self._context_store is None:
+            db_path = getattr(self.chat_history, 'db_path', None)
+            if db_path:
+                self._context_store = get_context_store(os.path.dirname(db_path)) or False
+        return self._context_store or None
+
+    def _attach_context(self, context):
+        self._context = context
+        self._fit_conversation(self.conversation, context)
+
+    def _fit_conversation(self, conversation, context):
+        # Los turnos nuevos se guardan con conversation.id: debe ser el cid
+        # restaurado, no el id al azar de la Conversation recién creada.
+        conversation.id = context.cid
+        conversation.responses = context.window(*self._context_limits())
+
+    def _plan_context(self, prompt):
+        """El contexto del próximo prompt dentro del presupuesto, con el
+        resumen de los turnos que quedan fuera si context_summary está
+        activo (y, si el resumen se quedó atrás, lo rehace en segundo plano)."""
+        context = self._context
+        max_turns, max_tokens = self._context_limits()
+        summarize = bool(self.config.get('context_summary'))
+        summary = self._load_summary(context.cid) if summarize else None
+        reserve = estimate_tokens(prompt) + estimate_tokens(self.config.get('system'))
+        plan = context.plan(max_turns, max_tokens, summary, reserve)
+        debug_print(f"LLMClient: Contexto de {len(plan.kept)} turnos (~{plan.tokens} tokens), "
+                    f"{len(plan.dropped)} fuera, resumen: {plan.summary is not None}")
+        if summarize and len(plan.unsummarized()) >= SUMMARY_MIN_NEW_TURNS:
+            self._schedule_summary(context.cid, plan)
+        return plan
+
+    def _load_summary(self, cid):
+        if cid not in self._summaries:
+            store = self._get_context_store()
+            try:
+                self._summaries[cid] = store.get_summary(cid) if store else None
+            except Exception as e:
+                debug_print(f"LLMClient: No se pudo leer el resumen de {cid}: {e}")
+                self._summaries[cid] = None
+        return self._summaries[cid]
+
+    def _schedule_summary(self, cid, plan):
+        """Resume en segundo plano los turnos fuera del contexto que el
+        resumen acumulado aún no cubre. Uno por conversación a la vez."""
+        with self._summary_lock:
+            if cid in self._summarizing:
+                return
+            self._summarizing.add(cid)
+        turns = plan.unsummarized()
+        previous = plan.summary
+        model = self.model
+        summary_model_id = self.config.get('summary_model')
 
-        # Cargar pares válidos de prompt/respuesta
-        for entry in history_entries:
-            user_prompt = entry.get('prompt')
-            assistant_response = entry.get('response')
-            if not (user_prompt and str(user_prompt).strip() and assistant_response and str(assistant_response).strip()):
-                continue
+        def run():
+            try:
+                summary_model = get_model_catalog().get_model(summary_model_id) \
+                    if summary_model_id else model
+                text = summary_model.prompt(build_summary_prompt(previous, turns),
+                                            system=SUMMARY_SYSTEM, stream=False).text().strip()
+                if not text:
+                    return
+                summary = Summary(cid, turns[-1].response_id,
+                                  (previous.turns if previous else 0) + len(turns),
+                                  text, model=summary_model.model_id)
+                store = self._get_context_store()
+                if store:
+                    store.save_summary(summary)
+                GLib.idle_add(self._on_summary_ready, summary)
+                debug_print(f"LLMClient: Resumen de {summary.turns} turnos de {cid} "
+                            f"(~{summary.tokens} tokens)")
+            except Exception as e:
+                debug_print(f"LLMClient: No se pudo resumir {cid}: {e}")
+            finally:
+                with self._summary_lock:
+                    self._summarizing.discard(cid)
 
-            # Crear prompt y respuestas
-            prompt_obj = llm.Prompt(user_prompt, self.model)
-            resp_user = llm.Response(prompt_obj, self.model, stream=False, conversation=self.conversation)
-            resp_user._prompt_json = {'prompt': user_prompt}
-            resp_user._done = True
-            resp_user._chunks = []
-            self.conversation.responses.append(resp_user)
+        generation_scheduler.submit(run, owner=self._summary_owner,
+                                    provider=getattr(model, 'needs_key', None))
 
-            resp_assistant = llm.Response(prompt_obj, self.model, stream=False, conversation=self.conversation)
-            resp_assistant._done = True
-            resp_assistant._chunks = [str(assistant_response).strip()]
-            self.conversation.responses.append(resp_assistant)
+    def _on_summary_ready(self, summary):
+        self._summaries[summary.conversation_id] = summary
+        return False
 
-        debug_print(f"LLMClient: Historial cargado. Total de respuestas: {len(self.conversation.responses)}")
+    def _context_limits(self):
+        """(context_turns, context_tokens) de la config; None sin tope."""
+        limits = []
+        for key in ('context_turns', 'context_tokens'):
+            try:
+                limits.append(int(self.config.get(key) or 0) or None)
+            except (TypeError, ValueError):
+                limits.append(None)
+        return tuple(limits)
+
+    def _remember_turn(self, prompt, full_response, response):
+        """Añade el turno recién generado al contexto cacheado."""
+        cid = self.conversation.id
+        context = self._context
+        if context is None or context.cid != cid or context.model_id != self.model.model_id:
+            context = self._context = conversation_cache.state(cid, self.model.model_id)
+        context.append_live((response,), prompt, full_response)
 
     def set_conversation(self, conversation_id: str):
         """
@@ -438,16 +835,15 @@ class LLMClient(ChatBackend):
                 debug_print(f"LLMClient: Failed to set model {model_id} for conversation {conversation_id}")
                 # Continue anyway, will try to use default or current model
         
-        # Load the conversation history
-        history_entries = self.chat_history.get_conversation_history(conversation_id)
-        if history_entries:
-            self.load_history(history_entries)
-            debug_print(f"LLMClient: Loaded {len(history_entries)} entries for conversation {conversation_id}")
-            return True
-        else:
-            debug_print(f"LLMClient: No history found for conversation {conversation_id}")
-            # We still consider this a success even if there's no history
+        # Load the conversation history (the background model switch, if
+        # any, restores it itself)
+        if self._loading_in_background():
             return True
+        self._ensure_model_loaded()
+        if self.model is None or self.conversation is None:
+            return False
+        self._restore_history(conversation_id)
+        return True
 
     def get_provider_for_model(self, model_id):
         """Obtiene el proveedor asociado a un modelo dado su ID."""
@@ -455,17 +851,13 @@ class LLMClient(ChatBackend):
             debug_print("get_provider_for_model: model_id es None")
             return "Unknown Provider"
 
-        # Obtener todos los modelos disponibles
+        # Búsqueda O(1) en el catálogo compartido
         try:
-            all_models = llm.get_models()
-
-            # Buscar el modelo por ID y devolver su proveedor
-            for model in all_models:
-                if getattr(model, 'model_id', None) == model_id:
-                    provider = getattr(model, 'needs_key', None) or "Local/Other"
-                    debug_print(f"Proveedor encontrado: {provider} para modelo {model_id}")
-                    self.provider = provider
-                    return provider
+            entry = get_model_catalog().get(model_id)
+            if entry is not None:
+                provider = entry.needs_key or "Local/Other"
+                self.provider = provider
+                return provider
         except Exception as e:
             debug_print(f"Error al obtener modelos: {e}")
 
@@ -473,15 +865,9 @@ class LLMClient(ChatBackend):
         return "Unknown Provider"  # Si no se encuentra el modelo
         
     def get_all_models(self):
-        """Obtiene todos los modelos disponibles. Utilizado para compartir estado entre componentes."""
+        """Obtiene todos los modelos disponibles (entradas del catálogo compartido)."""
         try:
-            from llm.plugins import load_plugins
-            # Asegurar que los plugins estén cargados, pero sin forzar recarga
-            if not hasattr(llm.plugins, '_loaded') or not llm.plugins._loaded:
-                load_plugins()
-                debug_print("LLMClient: Plugins cargados en get_all_models")
-            
-            return llm.get_models()
+            return get_model_catalog().models()
         except Exception as e:
             debug_print(f"LLMClient: Error obteniendo modelos: {e}")
             return []
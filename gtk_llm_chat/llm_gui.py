@@ -46,12 +46,71 @@ def register_commands(cli):
     @click.option(
             "--benchmark-startup",
         is_flag=True,
-        help="Mide el tiempo hasta que la ventana se muestra y sale.",
+        help=("Mide cada fase del arranque hasta el primer frame, "
+              "imprime el informe JSON y sale."),
     )
-    def run_gui(cid, system, model, continue_last, template, param, option, fragment, benchmark_startup):
+    @click.option(
+        "--prefetch",
+        is_flag=True,
+        help="Precalienta el modelo al elegirlo o al abrir una conversación.",
+    )
+    @click.option(
+        "--metrics-log",
+        type=str,
+        metavar='FILE',
+        help="Añade las métricas de cada turno (TTFT, tok/s...) como líneas JSON a FILE.",
+    )
+    @click.option(
+        "--show-metrics",
+        is_flag=True,
+        help="Muestra TTFT y tok/s del último turno junto al modelo.",
+    )
+    @click.option(
+        "--max-generations",
+        type=int,
+        metavar='N',
+        help="Generaciones simultáneas en toda la aplicación (por defecto 4).",
+    )
+    @click.option(
+        "--provider-limits",
+        type=str,
+        metavar='SPEC',
+        help='Generaciones simultáneas por proveedor, p.ej. "openai=3,local=1".',
+    )
+    @click.option(
+        "--context-turns",
+        type=int,
+        metavar='N',
+        help="Envía al modelo sólo los últimos N turnos de la conversación.",
+    )
+    @click.option(
+        "--context-tokens",
+        type=int,
+        metavar='N',
+        help="Envía al modelo sólo los últimos turnos que entren en ~N tokens.",
+    )
+    @click.option(
+        "--context-summary",
+        is_flag=True,
+        help="Resume en segundo plano los turnos que quedan fuera del contexto.",
+    )
+    @click.option(
+        "--summary-model",
+        type=str,
+        metavar='MODEL',
+        help="Modelo para los resúmenes del contexto (por defecto, el de la conversación).",
+    )
+    def run_gui(cid, system, model, continue_last, template, param, option, fragment,
+                benchmark_startup, prefetch, metrics_log, show_metrics, max_generations,
+                provider_limits, context_turns, context_tokens, context_summary,
+                summary_model):
         """Runs a GUI for the chatbot"""
         # Record start time if benchmarking
         start_time = time.time() if benchmark_startup else None
+        from . import startup_timing
+        if benchmark_startup:
+            startup_timing.enable(start_time)
+            startup_timing.time_core_imports()
 
         # Creamos la configuración en un diccionario
         config = {
@@ -64,10 +123,20 @@ def register_commands(cli):
             'options': option,
             'fragments': fragment,
             'benchmark_startup': benchmark_startup,
+            'model_prefetch': prefetch,
+            'metrics_log': metrics_log,
+            'show_turn_metrics': show_metrics,
+            'generation_workers': max_generations,
+            'provider_limits': provider_limits,
+            'context_turns': context_turns,
+            'context_tokens': context_tokens,
+            'context_summary': context_summary,
+            'summary_model': summary_model,
             'start_time': start_time,
         }
 
-        from .chat_application import LLMChatApplication
+        with startup_timing.phase('import_app'):
+            from .chat_application import LLMChatApplication
         app = LLMChatApplication(config)
 
         # Transformar la configuración en argumentos de línea de comandos
@@ -18,12 +18,14 @@ import time
 try:
     # Si se ejecuta como módulo del paquete
     from .debug_utils import debug_print
+    from . import startup_timing
     # Postponer import de chat_application hasta que sea necesario
 except ImportError:
     # Si se ejecuta como script directo, añadir el directorio actual al path
     import os
     sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
     from debug_utils import debug_print
+    import startup_timing
     # Postponer import de chat_application hasta que sea necesario
 
 # Aplicar patch de compatibilidad NumPy/Python 3.13 lo antes posible
@@ -137,6 +139,8 @@ apply_numpy_python313_compatibility_patch()
 # Benchmark
 benchmark_startup = '--benchmark-startup' in sys.argv
 start_time = time.time() if benchmark_startup else None
+if benchmark_startup:
+    startup_timing.enable(start_time)
 
 def parse_args(argv):
     """Parsea los argumentos de la línea de comandos"""
@@ -149,7 +153,32 @@ def parse_args(argv):
     parser.add_argument('-p', '--param', nargs=2, action='append', metavar=('KEY', 'VALUE'), help='Parámetros para el template')
     parser.add_argument('-o', '--option', nargs=2, action='append', metavar=('KEY', 'VALUE'), help='Opciones para el modelo')
     parser.add_argument('-f', '--fragment', action='append', metavar='FRAGMENT', help='Fragmento (alias, URL, hash o ruta de archivo) para agregar al prompt')
-    parser.add_argument('--benchmark-startup', action='store_true', help='Mide el tiempo hasta que la ventana se muestra y sale.')
+    parser.add_argument('--benchmark-startup', action='store_true',
+                        help='Mide cada fase del arranque hasta el primer frame, '
+                             'imprime el informe JSON y sale.')
+    parser.add_argument('--prefetch', action='store_true',
+                        help='Precalienta el modelo al elegirlo o al abrir una conversación.')
+    parser.add_argument('--metrics-log', type=str, metavar='FILE',
+                        help='Añade las métricas de cada turno (TTFT, tok/s...) '
+                             'como líneas JSON a FILE.')
+    parser.add_argument('--show-metrics', action='store_true',
+                        help='Muestra TTFT y tok/s del último turno junto al modelo.')
+    parser.add_argument('--max-generations', type=int, metavar='N',
+                        help='Generaciones simultáneas en toda la aplicación (por defecto 4).')
+    parser.add_argument('--provider-limits', type=str, metavar='SPEC',
+                        help='Generaciones simultáneas por proveedor, '
+                             'p.ej. "openai=3,local=1".')
+    parser.add_argument('--context-turns', type=int, metavar='N',
+                        help='Envía al modelo sólo los últimos N turnos de la conversación.')
+    parser.add_argument('--context-tokens', type=int, metavar='N',
+                        help='Envía al modelo sólo los últimos turnos '
+                             'que entren en ~N tokens.')
+    parser.add_argument('--context-summary', action='store_true',
+                        help='Resume en segundo plano los turnos que quedan '
+                             'fuera del contexto.')
+    parser.add_argument('--summary-model', type=str, metavar='MODEL',
+                        help='Modelo para los resúmenes del contexto '
+                             '(por defecto, el de la conversación).')
     args = parser.parse_args(argv[1:])
     config = {
         'cid': args.cid,
@@ -161,6 +190,15 @@ def parse_args(argv):
         'options': args.option,
         'fragments': args.fragment,
         'benchmark_startup': args.benchmark_startup,
+        'model_prefetch': args.prefetch,
+        'metrics_log': args.metrics_log,
+        'show_turn_metrics': args.show_metrics,
+        'generation_workers': args.max_generations,
+        'provider_limits': args.provider_limits,
+        'context_turns': args.context_turns,
+        'context_tokens': args.context_tokens,
+        'context_summary': args.context_summary,
+        'summary_model': args.summary_model,
         'start_time': start_time,
     }
     return config
@@ -176,11 +214,14 @@ def main(argv=None):
     # Lanzar la aplicación principal
     # Importamos chat_application aquí para evitar cargar GTK4 innecesariamente
     # si en el futuro este módulo se usa para otra cosa antes de este punto.
-    try:
-        from .chat_application import LLMChatApplication
-    except ImportError:
-        # Fallback para script directo
-        from chat_application import LLMChatApplication
+    if config.get('benchmark_startup'):
+        startup_timing.time_core_imports()
+    with startup_timing.phase('import_app'):
+        try:
+            from .chat_application import LLMChatApplication
+        except ImportError:
+            # Fallback para script directo
+            from chat_application import LLMChatApplication
     
     chat_app = LLMChatApplication(config)
     cmd_args = []
@@ -0,0 +1,339 @@
+"""Catálogo persistente de modelos de llm, compartido por toda la app.
+
+llm.get_models() y llm.get_model() recorren todos los plugins y les piden
+instanciar su lista de modelos. ModelSelectionManager lo hacía varias veces
+por selector (con una caché de 5 s), y LLMClient.set_model,
+get_provider_for_model y WelcomeWindow repetían el recorrido completo en
+cada cambio de modelo. Aquí se guarda el resultado una vez, en
+`gtk_llm_chat_models.json` del directorio de usuario de llm:
+
+    {model_id, name, provider, needs_key, aliases, capabilities, plugin_info}
+
+más los plugins que registran modelos. Las búsquedas por id, alias o
+proveedor son diccionarios en memoria.
+
+El catálogo se invalida solo cuando puede haber cambiado: la huella incluye
+la versión de llm, los plugins instalados (entry points 'llm' con su
+versión), LLM_LOAD_PLUGINS y el mtime/tamaño de keys.json, aliases.json y
+extra-openai-models.yaml (hay plugins que listan modelos distintos según
+las llaves). invalidate() fuerza la reconstrucción (p. ej. tras guardar una
+llave).
+
+Los objetos Model reales (para conversar) se siguen pidiendo a llm, pero
+una sola vez por proceso e invalidación: get_model() los memoriza por id y
+alias en lugar de recorrer los plugins en cada llamada.
+
+llm se importa sólo al reconstruir o al pedir un objeto Model: leer el
+catálogo vigente desde disco no lo necesita, así que los selectores pueden
+listar modelos antes de que llm esté cargado. No depende de gi.
+"""
+import importlib.metadata
+import json
+import os
+import sys
+import threading
+import time
+
+from .debug_utils import debug_print
+
+# Subirlo si cambia el formato del archivo: los catálogos viejos se rehacen.
+CATALOG_VERSION = 1
+CATALOG_FILE = "gtk_llm_chat_models.json"
+# Archivos del directorio de usuario que cambian qué modelos hay o cómo se llaman.
+_WATCHED_FILES = ("keys.json", "aliases.json", "extra-openai-models.yaml")
+# Las búsquedas revisan la huella de esos archivos como mucho una vez por
+# intervalo: un stat por búsqueda sería barato, pero no O(1).
+_CHECK_INTERVAL = 1.0
+
+# llm.plugins.load_plugins() marca _loaded antes de terminar de cargar: un
+# segundo hilo que llame mientras tanto vería plugins a medias. Todo lo de la
+# app que carga plugins pasa por load_plugins() de este módulo.
+_plugins_lock = threading.Lock()
+
+
+def load_plugins():
+    """llm.plugins.load_plugins(), serializado entre hilos."""
+    import llm.plugins
+    with _plugins_lock:
+        llm.plugins.load_plugins()
+
+
+def normalize_provider(needs_key):
+    """Clave de proveedor como la agrupa la UI (None = local/otros)."""
+    return needs_key.lower().strip() if needs_key else None
+
+
+class CatalogModel:
+    """Entrada del catálogo. Expone los atributos que la UI leía de los
+    objetos Model (model_id, name, needs_key, aliases, plugin_info), así que
+    puede ocupar su lugar en las listas de los selectores."""
+
+    __slots__ = ('model_id', 'name', 'provider', 'needs_key', 'aliases',
+                 'capabilities', 'plugin_info')
+
+    def __init__(self, model_id, name=None, needs_key=None, aliases=(),
+                 capabilities=None, plugin_info=None):
+        self.model_id = model_id
+        self.name = name or model_id
+        self.needs_key = needs_key
+        self.provider = normalize_provider(needs_key)
+        self.aliases = list(aliases)
+        self.capabilities = dict(capabilities or {})
+        self.plugin_info = plugin_info
+
+    def to_dict(self):
+        return {'model_id': self.model_id, 'name': self.name,
+                'needs_key': self.needs_key, 'aliases': self.aliases,
+                'capabilities': self.capabilities, 'plugin_info': self.plugin_info}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['model_id'], data.get('name'), data.get('needs_key'),
+                   data.get('aliases') or (), data.get('capabilities'),
+                   data.get('plugin_info'))
+
+    def __repr__(self):
+        return f"CatalogModel({self.model_id!r}, provider={self.provider!r})"
+
+
+def _capabilities(model, async_model):
+    return {
+        'can_stream': bool(getattr(model, 'can_stream', False)),
+        'supports_schema': bool(getattr(model, 'supports_schema', False)),
+        'supports_tools': bool(getattr(model, 'supports_tools', False)),
+        'attachment_types': sorted(getattr(model, 'attachment_types', None) or ()),
+        'async': async_model is not None,
+    }
+
+
+def _plugin_infos():
+    """Paquete raíz de cada plugin de terceros -> {'name', 'version'}."""
+    import llm.plugins
+    pm = llm.plugins.pm
+    distinfo = dict(pm.list_plugin_distinfo())
+    infos = {}
+    for plugin in pm.get_plugins():
+        module = getattr(plugin, '__name__', '')
+        if not module or module.startswith('llm.'):
+            continue  # llm.default_plugins: se muestran por proveedor
+        dist = distinfo.get(plugin)
+        name = getattr(dist, 'project_name', None) or getattr(dist, 'name', None)
+        infos[module.split('.')[0]] = {'name': name or module,
+                                       'version': getattr(dist, 'version', None)}
+    return infos
+
+
+def _plugins_fingerprint():
+    """Versión de llm y plugins instalados; no carga ningún plugin."""
+    try:
+        llm_version = importlib.metadata.version('llm')
+    except importlib.metadata.PackageNotFoundError:
+        llm_version = None
+    plugins = []
+    try:
+        for ep in importlib.metadata.entry_points(group='llm'):
+            dist = getattr(ep, 'dist', None)
+            plugins.append([ep.name, ep.value, getattr(dist, 'name', None),
+                            getattr(dist, 'version', None)])
+    except Exception as e:
+        debug_print(f"[model-catalog] no se pudieron leer los entry points: {e}")
+    frozen = None
+    if getattr(sys, 'frozen', False):
+        # En los binarios de PyInstaller los plugins van dentro del ejecutable.
+        try:
+            frozen = os.stat(sys.executable).st_mtime_ns
+        except OSError:
+            pass
+    return {'catalog': CATALOG_VERSION, 'llm': llm_version, 'plugins': sorted(plugins),
+            'load_plugins': os.environ.get('LLM_LOAD_PLUGINS'), 'frozen': frozen}
+
+
+class ModelCatalog:
+    def __init__(self, user_dir):
+        self.user_dir = str(user_dir)
+        self.path = os.path.join(self.user_dir, CATALOG_FILE)
+        self._lock = threading.RLock()
+        self._models = None      # model_id -> CatalogModel
+        self._by_name = {}       # model_id y alias -> CatalogModel
+        self._by_provider = {}   # proveedor normalizado -> [CatalogModel]
+        self._plugins = []
+        self._objects = None     # model_id y alias -> objeto Model de llm
+        self._plugins_fp = None
+        self._files_fp = None
+        self._checked_at = 0.0
+        self._stats = {'loads': 0, 'builds': 0, 'lookups': 0}
+
+    # -- huella -------------------------------------------------------------
+
+    def _watched_fingerprint(self):
+        state = {}
+        for name in _WATCHED_FILES:
+            try:
+                st = os.stat(os.path.join(self.user_dir, name))
+                state[name] = [st.st_mtime_ns, st.st_size]
+            except OSError:
+                state[name] = None
+        return state
+
+    def _fingerprint(self):
+        if self._plugins_fp is None:
+            self._plugins_fp = _plugins_fingerprint()
+        return dict(self._plugins_fp, files=self._watched_fingerprint())
+
+    # -- carga --------------------------------------------------------------
+
+    def _ensure(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._models is not None and now - self._checked_at < _CHECK_INTERVAL:
+                return
+            self._checked_at = now
+            files = self._watched_fingerprint()
+            if self._models is not None and files == self._files_fp:
+                return
+            fingerprint = self._fingerprint()
+            if not self._load(fingerprint):
+                self._build(fingerprint)
+
+    def _load(self, fingerprint):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('fingerprint') != fingerprint:
+            debug_print("[model-catalog] catálogo en disco desactualizado")
+            return False
+        self._install([CatalogModel.from_dict(m) for m in data.get('models', [])],
+                      data.get('plugins', []), fingerprint)
+        self._objects = None
+        self._stats['loads'] += 1
+        return True
+
+    def _build(self, fingerprint):
+        """Recorre los plugins una vez: arma el catálogo, lo persiste y de
+        paso memoriza los objetos Model."""
+        import llm
+        start = time.perf_counter()
+        load_plugins()
+        plugin_infos = _plugin_infos()
+        models, objects = [], {}
+        for entry in llm.get_models_with_aliases():
+            model = entry.model
+            top = type(model).__module__.split('.')[0]
+            models.append(CatalogModel(
+                model.model_id, getattr(model, 'name', None) or str(model),
+                getattr(model, 'needs_key', None), entry.aliases,
+                _capabilities(model, entry.async_model), plugin_infos.get(top)))
+            for name in [model.model_id] + list(entry.aliases):
+                objects.setdefault(name, model)
+        plugins = [{'name': p['name'], 'version': p.get('version')}
+                   for p in llm.get_plugins() if 'register_models' in p['hooks']]
+        self._install(models, plugins, fingerprint)
+        self._objects = objects
+        self._stats['builds'] += 1
+        self._write(fingerprint)
+        debug_print(f"[model-catalog] {len(models)} modelos catalogados en "
+                    f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def _install(self, models, plugins, fingerprint):
+        self._models = {m.model_id: m for m in models}
+        self._by_name = {}
+        self._by_provider = {}
+        for model in models:
+            for name in [model.model_id] + model.aliases:
+                self._by_name.setdefault(name, model)
+            self._by_provider.setdefault(model.provider, []).append(model)
+        self._plugins = plugins
+        self._files_fp = fingerprint['files']
+
+    def _write(self, fingerprint):
+        data = {'fingerprint': fingerprint, 'plugins': self._plugins,
+                'models': [m.to_dict() for m in self._models.values()]}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            debug_print(f"[model-catalog] no se pudo guardar {self.path}: {e}")
+
+    def invalidate(self):
+        """Descarta el catálogo y los objetos memorizados; la próxima búsqueda
+        lo reconstruye."""
+        with self._lock:
+            self._models = None
+            self._objects = None
+            self._checked_at = 0.0
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    # -- búsquedas ----------------------------------------------------------
+
+    def models(self):
+        """Todas las entradas, en el orden en que las registran los plugins."""
+        self._ensure()
+        return list(self._models.values())
+
+    def get(self, name):
+        """Entrada por model_id o alias, o None."""
+        self._ensure()
+        self._stats['lookups'] += 1
+        return self._by_name.get(name)
+
+    def needs_key_for(self, name):
+        entry = self.get(name)
+        return entry.needs_key if entry else None
+
+    def models_for_provider(self, provider):
+        self._ensure()
+        return list(self._by_provider.get(provider, ()))
+
+    def providers(self):
+        self._ensure()
+        return list(self._by_provider)
+
+    def plugins(self):
+        """Plugins instalados que registran modelos: [{'name', 'version'}]."""
+        self._ensure()
+        return list(self._plugins)
+
+    def get_model(self, name=None):
+        """Objeto Model de llm por id o alias (el predeterminado si None).
+        Lanza llm.UnknownModelError como llm.get_model."""
+        import llm
+        name = name or llm.get_default_model()
+        self._ensure()
+        with self._lock:
+            if self._objects is None:
+                load_plugins()
+                self._objects = {}
+                for entry in llm.get_models_with_aliases():
+                    for alias in [entry.model.model_id] + list(entry.aliases):
+                        self._objects.setdefault(alias, entry.model)
+            model = self._objects.get(name)
+        if model is None:
+            raise llm.UnknownModelError("Unknown model: " + name)
+        return model
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, models=len(self._models or ()))
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_model_catalog(user_dir=None):
+    """Catálogo compartido del directorio de usuario de llm."""
+    if user_dir is None:
+        from .platform_utils import llm_user_dir
+        user_dir = llm_user_dir()
+    user_dir = str(user_dir)
+    with _catalogs_lock:
+        if user_dir not in _catalogs:
+            _catalogs[user_dir] = ModelCatalog(user_dir)
+        return _catalogs[user_dir]
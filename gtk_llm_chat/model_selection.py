@@ -2,7 +2,6 @@ import gi
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 from gi.repository import Gtk, Adw, GObject, GLib
-import llm
 from collections import defaultdict
 import os
 import pathlib
@@ -10,6 +9,7 @@ import json
 
 from .chat_application import _
 from .debug_utils import debug_print
+from .model_catalog import get_model_catalog
 
 class ModelSelectionManager(GObject.Object):
     """
@@ -33,75 +33,26 @@ class ModelSelectionManager(GObject.Object):
         self._models_loaded = False
         self._keys_cache = None
         self._provider_key_map = {}  # Normaliza provider_key -> provider_key original
-        
-        # Índices para optimizar búsquedas - se construyen una sola vez
-        self._model_id_to_provider = {}  # model_id -> provider_key
-        self._model_id_to_object = {}    # model_id -> model_object
-        self._all_models_cache = None    # Cache de llm.get_models()
-        self._cache_timestamp = 0       # Timestamp del último cache
-        
+
+        # Catálogo persistente compartido: búsquedas por id/proveedor sin
+        # recorrer los plugins (ver model_catalog.py).
+        self.catalog = get_model_catalog()
+
         # Separación entre información estática y dinámica
         self._static_providers_loaded = False  # Solo se carga una vez
         self._dynamic_models_cache = None     # Cache de modelos dinámicos
 
-    def _build_model_indices(self):
-        """Construye índices para búsquedas rápidas de modelos."""
-        import time
-        current_time = time.time()
-        
-        # Solo reconstruir si han pasado más de 5 segundos desde el último cache
-        if self._all_models_cache is not None and (current_time - self._cache_timestamp) < 5:
-            return
-        
-        debug_print("ModelSelection: Construyendo índices de modelos...")
-        self._model_id_to_provider.clear()
-        self._model_id_to_object.clear()
-        
-        # Cache de llm.get_models() para no llamarlo múltiples veces
-        try:
-            self._all_models_cache = list(llm.get_models())
-            self._cache_timestamp = current_time
-            debug_print(f"ModelSelection: Cached {len(self._all_models_cache)} modelos de llm.get_models()")
-        except Exception as e:
-            debug_print(f"Error obteniendo modelos: {e}")
-            self._all_models_cache = []
-        
-        # Construir índices desde models_by_provider
-        for provider_key, models in self.models_by_provider.items():
-            for model_obj in models:
-                model_id = getattr(model_obj, 'model_id', None)
-                if model_id:
-                    self._model_id_to_provider[model_id] = provider_key
-                    self._model_id_to_object[model_id] = model_obj
-        
-        # Agregar modelos del cache que no estén en los índices
-        for model_obj in self._all_models_cache:
-            model_id = getattr(model_obj, 'model_id', None)
-            if model_id and model_id not in self._model_id_to_object:
-                self._model_id_to_object[model_id] = model_obj
-                # Intentar determinar el proveedor
-                provider = getattr(model_obj, 'needs_key', None) or 'local/other'
-                if provider not in self._model_id_to_provider.get(model_id, []):
-                    self._model_id_to_provider[model_id] = provider
-        
-        debug_print(f"ModelSelection: Índices construidos - {len(self._model_id_to_object)} modelos indexados")
-
     def get_model_by_id(self, model_id):
-        """Obtiene un objeto modelo por su ID de manera eficiente."""
-        self._build_model_indices()
-        return self._model_id_to_object.get(model_id)
+        """Obtiene la entrada del catálogo para un model_id (o alias)."""
+        return self.catalog.get(model_id)
     
     def get_provider_for_model_id(self, model_id):
         """Obtiene el proveedor para un model_id de manera eficiente."""
-        self._build_model_indices()
-        return self._model_id_to_provider.get(model_id)
+        entry = self.catalog.get(model_id)
+        return entry.provider if entry else None
 
     def invalidate_model_cache(self):
         """Invalida el cache de modelos forzando una reconstrucción."""
-        self._all_models_cache = None
-        self._cache_timestamp = 0
-        self._model_id_to_provider.clear()
-        self._model_id_to_object.clear()
         # Solo invalida modelos dinámicos, no los datos estáticos de plugins
         self._dynamic_models_cache = None
 
@@ -131,11 +82,7 @@ class ModelSelectionManager(GObject.Object):
     def get_provider_needs_key(self, provider_key):
         """Busca el valor de needs_key real para un provider_key dado usando cache cuando es posible."""
         # Usar cache dinámico si está disponible
-        if self._dynamic_models_cache:
-            all_models = self._dynamic_models_cache
-        else:
-            all_models = llm.get_models()
-        
+        all_models = self._dynamic_models_cache or self.catalog.models()
         for model in all_models:
             if getattr(model, 'needs_key', None) == provider_key:
                 return getattr(model, 'needs_key', None)
@@ -146,15 +93,9 @@ class ModelSelectionManager(GObject.Object):
         if hasattr(self, '_provider_to_needs_key') and self._provider_to_needs_key:
             return self._provider_to_needs_key
         
-        # Fallback a llm.get_models() si no hay cache
+        # Fallback al catálogo si no hay cache
         needs_key_map = {}
-        if self._dynamic_models_cache:
-            # Usar cache si está disponible
-            all_models = self._dynamic_models_cache
-        else:
-            # Solo llamar llm.get_models() si es absolutamente necesario
-            all_models = llm.get_models()
-        
+        all_models = self._dynamic_models_cache or self.catalog.models()
         for model in all_models:
             nk = getattr(model, 'needs_key', None)
             if nk:
@@ -191,21 +132,10 @@ class ModelSelectionManager(GObject.Object):
         if self._static_providers_loaded:
             return
         
-        from llm.plugins import pm, load_plugins
-        
         try:
-            # Asegurar que los plugins están cargados
-            import llm.plugins
-            if not hasattr(llm.plugins, '_loaded') or not llm.plugins._loaded:
-                load_plugins()
-                debug_print("ModelSelection: Plugins cargados correctamente")
-            else:
-                debug_print("ModelSelection: Plugins ya estaban cargados")
-            
-            # Obtener todos los plugins con modelos
-            all_plugins = llm.get_plugins()
-            plugins_with_models = [plugin for plugin in all_plugins if 'register_models' in plugin['hooks']]
-            providers_set = {plugin['name']: plugin for plugin in plugins_with_models}
+            # Plugins con modelos, desde el catálogo (sin cargar plugins si
+            # el catálogo en disco sigue vigente)
+            providers_set = {plugin['name']: plugin for plugin in self.catalog.plugins()}
             debug_print(f"Plugins con modelos encontrados: {list(providers_set.keys())}")
 
             # Procesar plugins para crear la estructura base de proveedores
@@ -242,7 +172,7 @@ class ModelSelectionManager(GObject.Object):
 
     def _load_dynamic_models(self):
         """
-        Carga modelos dinámicos usando llm.get_models().
+        Carga modelos dinámicos desde el catálogo de modelos.
         Este método se puede llamar cuando cambian las API keys.
         """
         try:
@@ -250,9 +180,9 @@ class ModelSelectionManager(GObject.Object):
             for provider_key in self.models_by_provider:
                 self.models_by_provider[provider_key] = []
             
-            # Obtener modelos actuales
-            all_models = llm.get_models()
-            debug_print(f"Total de modelos obtenidos de llm.get_models(): {len(all_models)}")
+            # Obtener modelos actuales (entradas del catálogo)
+            all_models = self.catalog.models()
+            debug_print(f"Total de modelos en el catálogo: {len(all_models)}")
             
             # Agrupar modelos por needs_key
             for model in all_models:
@@ -389,6 +319,8 @@ class ModelSelectionManager(GObject.Object):
 
             debug_print(f"API Key set for {real_key} in {keys_path}")
             self.invalidate_keys_cache()
+            # Hay plugins que listan otros modelos según las llaves.
+            self.catalog.invalidate()
             self.emit('api-key-changed', provider_key)
             return True
         except Exception as e:
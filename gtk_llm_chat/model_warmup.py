@@ -0,0 +1,139 @@
+"""Precalentamiento de modelos (opcional) y tiempo al primer token por modelo.
+
+El primer prompt después de elegir un modelo pagaba, en el hilo de UI,
+la resolución del modelo, la Conversation nueva y la recarga del
+historial (LLMClient.set_model / _load_model_internal), y después el
+arranque en frío del proveedor. Con model_prefetch activo (--prefetch o
+GTK_LLM_CHAT_PREFETCH=1) LLMClient hace ese trabajo en un hilo al elegir
+modelo o al abrir una conversación conocida, y llama a warm():
+
+- si el modelo expone un gancho de carga (WARM_HOOKS; p.ej. plugins de
+  modelos locales que cargan pesos), se llama una vez por proceso;
+- si tiene un host remoto (api_base/base_url, o el de OpenAI), se
+  resuelve su DNS. llm crea el cliente HTTP en cada petición, así que no
+  hay una conexión persistente que dejar abierta: lo que sí sobrevive es
+  la caché del resolver.
+
+record_ttft() anota el tiempo al primer token de cada turno y
+ttft_stats() lo resume por modelo, separando los turnos de un modelo ya
+precalentado de los que no. No depende de gi.
+"""
+import os
+import socket
+import statistics
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from .debug_utils import debug_print
+
+# Métodos que, si el modelo los tiene, lo dejan listo para generar.
+WARM_HOOKS = ('warm_up', 'warm', 'preload', 'load_model')
+_TTFT_SAMPLES = 100
+
+
+def prefetch_enabled(config=None):
+    """True si el usuario pidió precalentar (config o variable de entorno)."""
+    if config and config.get('model_prefetch'):
+        return True
+    return os.environ.get('GTK_LLM_CHAT_PREFETCH', '') not in ('', '0')
+
+
+def _provider_host(model):
+    for attr in ('api_base', 'base_url'):
+        value = getattr(model, attr, None)
+        if isinstance(value, str) and value:
+            return urlparse(value).hostname
+    if getattr(model, 'needs_key', None) == 'openai':
+        return 'api.openai.com'
+    return None
+
+
+def _summary(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {'count': len(samples), 'last_ms': round(samples[-1], 3),
+            'p50_ms': round(statistics.median(ordered), 3),
+            'min_ms': round(ordered[0], 3), 'max_ms': round(ordered[-1], 3)}
+
+
+class ModelWarmup:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._warmed = {}   # model_id -> resultado de warm()
+        self._ttft = {}     # model_id -> {'prefetched': deque, 'cold': deque, 'first_ms'}
+
+    def is_warm(self, model_id):
+        with self._lock:
+            return model_id in self._warmed
+
+    def warm(self, model):
+        """Gancho de carga y DNS del proveedor, una vez por modelo. Bloquea:
+        llamarlo desde un hilo de fondo."""
+        model_id = getattr(model, 'model_id', None)
+        with self._lock:
+            if model_id in self._warmed:
+                return self._warmed[model_id]
+        result = {'hook': None, 'hook_ms': None, 'host': None, 'dns_ms': None,
+                  'error': None}
+        for name in WARM_HOOKS:
+            hook = getattr(model, name, None)
+            if callable(hook):
+                start = time.perf_counter()
+                try:
+                    hook()
+                except Exception as e:
+                    result['error'] = f"{name}: {e}"
+                result['hook'] = name
+                result['hook_ms'] = round((time.perf_counter() - start) * 1000.0, 3)
+                break
+        host = _provider_host(model)
+        if host:
+            start = time.perf_counter()
+            try:
+                socket.getaddrinfo(host, 443, type=socket.SOCK_STREAM)
+            except OSError as e:
+                result['error'] = result['error'] or f"dns: {e}"
+            result['host'] = host
+            result['dns_ms'] = round((time.perf_counter() - start) * 1000.0, 3)
+        with self._lock:
+            self._warmed[model_id] = result
+        debug_print(f"[warmup] modelo {model_id}: {result}")
+        return result
+
+    def warm_in_background(self, model_id):
+        """Resuelve `model_id` en el catálogo y lo precalienta en un hilo."""
+        def run():
+            from .model_catalog import get_model_catalog
+            try:
+                self.warm(get_model_catalog().get_model(model_id))
+            except Exception as e:
+                debug_print(f"[warmup] modelo {model_id}: {e}")
+
+        threading.Thread(target=run, name='model-warmup', daemon=True).start()
+
+    def record_ttft(self, model_id, ms):
+        """Tiempo al primer token de un turno de `model_id`."""
+        prefetched = self.is_warm(model_id)
+        with self._lock:
+            entry = self._ttft.setdefault(model_id, {
+                'prefetched': deque(maxlen=_TTFT_SAMPLES),
+                'cold': deque(maxlen=_TTFT_SAMPLES), 'first_ms': ms})
+            entry['prefetched' if prefetched else 'cold'].append(ms)
+
+    def ttft_stats(self, model_id=None):
+        """{model_id: {'first_ms', 'prefetched', 'cold'}} (o el de un modelo);
+        'prefetched' y 'cold' resumen count/last/p50/min/max o son None."""
+        with self._lock:
+            stats = {mid: {'first_ms': round(entry['first_ms'], 3),
+                           'prefetched': _summary(list(entry['prefetched'])),
+                           'cold': _summary(list(entry['cold']))}
+                     for mid, entry in self._ttft.items()}
+        if model_id is not None:
+            return stats.get(model_id)
+        return stats
+
+
+model_warmup = ModelWarmup()
@@ -0,0 +1,135 @@
+"""Cola de descifrados OMEMO: en orden por (peer, device), en paralelo entre ellos.
+
+XmppSession._on_message lanzaba un threading.Thread por stanza cifrada,
+que se bloqueaba en OMEMOEngine.decrypt_msg, y el motor los serializaba
+todos detrás de un único asyncio.Lock. En un catch-up de MAM con cientos
+de mensajes de muchos contactos eran cientos de hilos descifrando de a uno.
+Aquí hay un pool de `workers` hilos por sesión:
+
+- cada stanza es un trabajo con clave (bare JID del remitente, sid del
+  dispositivo emisor): la clave es un Double Ratchet, así que sus trabajos
+  corren de a uno y en orden de llegada, y on_done también sale en ese
+  orden (quien lo use para volver al hilo principal mantiene el orden);
+- claves distintas corren a la vez, repartidas por turnos: un contacto con
+  cientos de mensajes pendientes no retrasa a los demás;
+- stats() da profundidad de cola, en curso, y tiempos de espera y de
+  descifrado (p50/máx).
+
+`on_done(result, wait_ms, run_ms)` corre en el hilo del pool; para tocar
+la UI hay que volver con GLib.idle_add. Los hilos los pone
+worker_pool.WorkerPool. No depende de gi.
+"""
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .debug_utils import debug_print
+from .worker_pool import WorkerPool
+
+DEFAULT_WORKERS = 4
+_SAMPLES = 200
+
+
+class _DecryptJob:
+    __slots__ = ('key', 'run', 'on_done', 'queued_at')
+
+    def __init__(self, key, run, on_done):
+        self.key = key
+        self.run = run
+        self.on_done = on_done
+        self.queued_at = time.perf_counter()
+
+
+class DecryptScheduler:
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self._cond = threading.Condition()
+        self._pool = WorkerPool(self._cond, 'omemo-decrypt', workers, take=self._take,
+                                run=self._run, pending=lambda: self._queued,
+                                runnable=self._runnable_count)
+        self._queues = OrderedDict()   # clave -> deque de trabajos, por turnos
+        self._active = set()           # claves con un trabajo en curso
+        self._queued = 0
+        self._waits = deque(maxlen=_SAMPLES)
+        self._runs = deque(maxlen=_SAMPLES)
+        self._stats = {'submitted': 0, 'completed': 0, 'errors': 0, 'max_queue': 0}
+
+    def submit(self, peer, device, run, on_done=None):
+        """Encola `run()` para la clave (peer, device). Devuelve cuántos
+        trabajos esperan (incluido éste)."""
+        key = (peer, device)
+        with self._cond:
+            self._queues.setdefault(key, deque()).append(_DecryptJob(key, run, on_done))
+            self._queued += 1
+            self._stats['submitted'] += 1
+            self._stats['max_queue'] = max(self._stats['max_queue'], self._queued)
+            depth = self._queued
+            self._cond.notify_all()
+        self._pool.wake()
+        return depth
+
+    def queue_depth(self):
+        with self._cond:
+            return self._queued
+
+    def _next_job(self):
+        for key in self._queues:
+            if key in self._active:
+                continue
+            jobs = self._queues.pop(key)
+            job = jobs.popleft()
+            if jobs:
+                self._queues[key] = jobs   # al final: turno de la siguiente clave
+            return job
+        return None
+
+    def _runnable_count(self):
+        return sum(1 for key in self._queues if key not in self._active)
+
+    def _take(self):
+        """Saca el siguiente trabajo (con la Condition tomada, desde el pool)."""
+        job = self._next_job()
+        if job is not None:
+            self._queued -= 1
+            self._active.add(job.key)
+        return job
+
+    def _run(self, job):
+        started = time.perf_counter()
+        wait_ms = (started - job.queued_at) * 1000.0
+        error = False
+        result = None
+        try:
+            result = job.run()
+        except Exception as e:
+            error = True
+            debug_print(f"[omemo-decrypt] el descifrado de {job.key[0]} falló: {e}")
+        run_ms = (time.perf_counter() - started) * 1000.0
+        try:
+            # Antes de liberar la clave: el siguiente de la misma clave no
+            # puede adelantar su on_done.
+            if job.on_done is not None:
+                job.on_done(result, wait_ms, run_ms)
+        except Exception as e:
+            debug_print(f"[omemo-decrypt] on_done falló: {e}")
+        finally:
+            with self._cond:
+                self._active.discard(job.key)
+                self._waits.append(wait_ms)
+                self._runs.append(run_ms)
+                self._stats['completed'] += 1
+                self._stats['errors'] += error
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats, workers=self._pool.size,
+                         threads=self._pool.thread_count(),
+                         queued=self._queued, running=len(self._active),
+                         peers=len(self._queues))
+            waits = sorted(self._waits)
+            runs = sorted(self._runs)
+        stats['wait_p50_ms'] = round(statistics.median(waits), 3) if waits else None
+        stats['decrypt_p50_ms'] = round(statistics.median(runs), 3) if runs else None
+        stats['decrypt_max_ms'] = round(runs[-1], 3) if runs else None
+        return stats
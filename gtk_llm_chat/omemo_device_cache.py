@@ -0,0 +1,76 @@
+"""Qué device lists OMEMO están al día, para no refrescarlas en cada envío.
+
+OMEMOEngine.encrypt_msg_async esperaba, antes de cada mensaje, tres
+refresh_device_list por PubSub (OMEMO 2 y legacy del destinatario, legacy
+propia), cada uno con hasta 8 s de timeout: cada envío pagaba esos viajes
+y la burbuja seguía en 'pending' en servidores lentos. Las listas ya
+quedan guardadas por python-omemo en el almacén de claves; aquí sólo se
+anota cuándo se refrescó cada (namespace, bare_jid):
+
+- is_fresh() es cierto durante `ttl` segundos desde el último refresco;
+- invalidate() la marca vieja: lo llama XmppSession al recibir por PEP
+  una device list nueva (XEP-0163, con +notify en las caps) y, para todas,
+  al reconectar (los eventos de mientras no llegan);
+- el cifrado que falla con listas de la caché se reintenta una vez
+  forzando el refresco (un dispositivo retirado sin aviso).
+
+No depende de gi ni de python-omemo.
+"""
+import threading
+import time
+
+DEFAULT_TTL = 300.0
+
+
+class DeviceListCache:
+    """Momento del último refresco por (namespace, bare_jid), thread-safe:
+    lo leen el hilo asyncio de OMEMO y lo invalida el hilo principal."""
+
+    def __init__(self, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._refreshed = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'refreshes': 0, 'forced': 0, 'invalidations': 0}
+
+    def is_fresh(self, namespace, bare_jid):
+        """Cierto si la lista se refrescó hace menos de `ttl` (cuenta un hit)."""
+        with self._lock:
+            refreshed = self._refreshed.get((namespace, bare_jid))
+            fresh = refreshed is not None and self._clock() - refreshed < self.ttl
+            if fresh:
+                self._stats['hits'] += 1
+            return fresh
+
+    def mark_refreshed(self, namespace, bare_jid, forced=False):
+        with self._lock:
+            self._refreshed[(namespace, bare_jid)] = self._clock()
+            self._stats['refreshes'] += 1
+            self._stats['forced'] += forced
+
+    def invalidate(self, bare_jid=None, namespace=None):
+        """Olvida las listas de `bare_jid` (todas si es None), sólo las de
+        `namespace` si se indica. Devuelve cuántas olvidó."""
+        with self._lock:
+            keys = [key for key in self._refreshed
+                    if (bare_jid is None or key[1] == bare_jid)
+                    and (namespace is None or key[0] == namespace)]
+            for key in keys:
+                del self._refreshed[key]
+            self._stats['invalidations'] += len(keys)
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._refreshed))
+
+
+def format_encrypt_timings(recipient, timings):
+    """Los tiempos de OMEMOEngine.encrypt_msg_async para los logs [delivery]."""
+    return (f"recipient={recipient} "
+            f"total_ms={timings.get('total_ms', 0.0):.1f} "
+            f"refresh_ms={timings.get('refresh_ms', 0.0):.1f} "
+            f"encrypt_ms={timings.get('encrypt_ms', 0.0):.1f} "
+            f"lists_refreshed={timings.get('lists_refreshed', 0)} "
+            f"lists_cached={timings.get('lists_cached', 0)} "
+            f"retried={int(bool(timings.get('retried')))}")
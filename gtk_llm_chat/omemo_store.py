@@ -0,0 +1,246 @@
+"""Almacén de claves OMEMO en SQLite, con escrituras agrupadas por operación.
+
+JSONStorage (antes en xmpp_omemo) volcaba el diccionario entero de claves con
+json.dump(indent=2), fsync y os.replace en cada store(): un paso del
+ratchet o un refresco de device list, que hacen varios store() por
+dispositivo destinatario, reescribían un archivo que crece con cada sesión
+y cada prekey. Aquí cada clave es una fila de `kv` (valor JSON compacto) y:
+
+- batch() agrupa las escrituras de una operación (cifrar, descifrar,
+  inicializar): dentro, store()/delete() van al buffer de esa operación
+  (un KeyBatch, que load() ya ve), y al salir de su bloque más externo se
+  confirma en una sola transacción. El buffer se busca por contextvars:
+  cada tarea asyncio tiene el suyo, así dos operaciones que se intercalan
+  en el loop de OMEMO no retrasan ni mezclan sus commits. Fuera de
+  batch() cada escritura es su propia transacción;
+- al abrir, si existe el JSON de JSONStorage y la base está vacía, se
+  importa entero en una transacción y el JSON queda como
+  `<archivo>.migrated` (no se borra: es la única copia de las claves
+  antiguas si algo sale mal);
+- stats() cuenta transacciones, filas y bytes escritos, para comparar con
+  la reescritura completa del JSON (benchmarks/omemo_storage.py).
+
+El modo es WAL con synchronous=FULL: cada commit queda en disco como antes
+hacía el fsync del JSON, pero sólo con lo que cambió. No depende de gi ni
+de python-omemo; el adaptador Storage está en xmpp_omemo.SQLiteStorage.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .debug_utils import debug_print
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_DELETED = object()
+# El KeyBatch de la operación en curso (ver SQLiteKeyStore.batch).
+_current_batch = ContextVar('omemo_key_batch', default=None)
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def load_json_keys(path):
+    """El diccionario de claves de un archivo de JSONStorage ({} si no hay)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_json_keys(path, data):
+    """Lo que hacía JSONStorage.save_to_file en cada store(): reescribir el
+    archivo entero con fsync. Devuelve los bytes escritos. Se conserva para
+    el benchmark de comparación."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+        written = f.tell()
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+    return written
+
+
+class KeyBatch:
+    """Escrituras pendientes de una operación y, una vez confirmadas, lo que
+    costó su transacción."""
+
+    def __init__(self, store):
+        self.store = store
+        self.changes = {}        # key -> JSON o _DELETED
+        self.rows_written = 0
+        self.rows_deleted = 0
+        self.bytes_written = 0
+        self.commit_ms = 0.0
+
+
+class SQLiteKeyStore:
+    """Claves OMEMO de una cuenta en un archivo SQLite."""
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Lo usan el hilo del worker asyncio de OMEMO y quien crea el motor.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+        try:
+            os.chmod(db_path, 0o600)
+        except OSError:
+            pass
+        self._lock = threading.RLock()
+        self._stats = {'transactions': 0, 'rows_written': 0, 'rows_deleted': 0,
+                       'bytes_written': 0, 'commit_ms_total': 0.0, 'batches': 0,
+                       'migrated_keys': 0}
+        if legacy_json_path:
+            self._migrate_json(legacy_json_path)
+
+    # --- Migración ---
+
+    def _migrate_json(self, path):
+        if not os.path.exists(path):
+            return
+        with self._lock:
+            has_rows = self._conn.execute("SELECT 1 FROM kv LIMIT 1").fetchone()
+            if has_rows:
+                debug_print(f"[omemo-storage] {path} ignorado: {self.db_path} ya tiene claves")
+                return
+            try:
+                data = load_json_keys(path)
+            except (OSError, ValueError) as e:
+                debug_print(f"[omemo-storage] no se pudo leer {path} para migrar: {e}")
+                return
+            self._commit({key: _encode(value) for key, value in data.items()})
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('migrated_from', ?)",
+                (os.path.basename(path),))
+            self._stats['migrated_keys'] = len(data)
+        os.replace(path, f"{path}.migrated")
+        debug_print(f"[omemo-storage] migradas {len(data)} claves de {path} a {self.db_path}")
+
+    # --- Claves ---
+
+    def _batch(self):
+        """El KeyBatch de la operación en curso sobre este almacén, o None."""
+        batch = _current_batch.get()
+        return batch if batch is not None and batch.store is self else None
+
+    def load(self, key):
+        """(True, valor) o (False, None). Dentro de batch() ve lo que la
+        misma operación todavía no confirmó; lo de otras operaciones, no."""
+        batch = self._batch()
+        with self._lock:
+            pending = batch.changes.get(key) if batch is not None else None
+            if pending is _DELETED:
+                return False, None
+            if pending is not None:
+                return True, json.loads(pending)
+            row = self._conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def store(self, key, value):
+        self._write(key, _encode(value))
+
+    def delete(self, key):
+        self._write(key, _DELETED)
+
+    def _write(self, key, value):
+        batch = self._batch()
+        with self._lock:
+            if batch is not None:
+                batch.changes[key] = value
+            else:
+                self._commit({key: value})
+
+    def keys(self):
+        batch = self._batch()
+        with self._lock:
+            keys = {row[0] for row in self._conn.execute("SELECT key FROM kv")}
+            for key, value in (batch.changes.items() if batch is not None else ()):
+                if value is _DELETED:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+        return keys
+
+    @contextmanager
+    def batch(self):
+        """Agrupa en una transacción las escrituras de la operación en curso
+        y devuelve su KeyBatch. Anidable: dentro de la misma operación,
+        confirma el más externo. Si el bloque falla, lo escrito dentro se
+        confirma igual (python-omemo ya actualizó su caché en memoria con
+        esos valores; descartarlos dejaría disco y memoria distintos)."""
+        batch = self._batch()
+        if batch is not None:
+            yield batch
+            return
+        batch = KeyBatch(self)
+        token = _current_batch.set(batch)
+        try:
+            yield batch
+        finally:
+            _current_batch.reset(token)
+            if batch.changes:
+                with self._lock:
+                    self._stats['batches'] += 1
+                    self._commit(batch.changes, batch)
+
+    def _commit(self, changes, batch=None):
+        start = time.perf_counter()
+        upserts = [(key, value) for key, value in changes.items() if value is not _DELETED]
+        deletes = [(key,) for key, value in changes.items() if value is _DELETED]
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", upserts)
+            if deletes:
+                self._conn.executemany("DELETE FROM kv WHERE key = ?", deletes)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        written = sum(len(k) + len(v) for k, v in upserts)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        self._stats['transactions'] += 1
+        self._stats['rows_written'] += len(upserts)
+        self._stats['rows_deleted'] += len(deletes)
+        self._stats['bytes_written'] += written
+        self._stats['commit_ms_total'] += elapsed_ms
+        if batch is not None:
+            batch.rows_written = len(upserts)
+            batch.rows_deleted = len(deletes)
+            batch.bytes_written = written
+            batch.commit_ms = elapsed_ms
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['commit_ms_total'] = round(stats['commit_ms_total'], 3)
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
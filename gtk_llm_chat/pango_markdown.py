@@ -10,12 +10,18 @@ viewport). Un Gtk.Label con markup mide síncrono y exacto.
 Cubre el mismo subconjunto de markdown que MarkdownView: negrita, cursiva,
 tachado, código inline y en bloque, headings, listas (anidadas y ordenadas),
 blockquote, hr y las etiquetas <think>/<thinking>.
+
+markdown_to_pango, has_table y split_table_blocks guardan su resultado en
+render_cache (por hash del texto): volver a pintar un cuerpo ya visto no
+lo vuelve a parsear.
 """
 import re
 
 from gi.repository import GLib
 from markdown_it import MarkdownIt
 
+from .render_cache import cached
+
 _md = MarkdownIt().enable(['strikethrough', 'table'])
 
 _HEADING_PT = {'1': 24, '2': 20, '3': 16, '4': 12, '5': 10, '6': 10}
@@ -138,8 +144,12 @@ def _render_fragment(text):
     return ''.join(out)
 
 
-def markdown_to_pango(text):
+def markdown_to_pango(text, cache=True):
     """Convierte markdown a Pango markup listo para Gtk.Label.set_markup."""
+    return cached('pango', text or '', _markdown_to_pango, cache)
+
+
+def _markdown_to_pango(text):
     parts = []
     for fragment, is_thinking in _split_thinking(text or ''):
         if is_thinking:
@@ -193,7 +203,11 @@ def extract_tables(text):
     return tables
 
 
-def has_table(text):
+def has_table(text, cache=True):
+    return cached('has_table', text or '', _has_table, cache)
+
+
+def _has_table(text):
     tokens = _md.parse(text)
     for token in tokens:
         if token.type == 'table_open':
@@ -205,8 +219,14 @@ _TABLE_DELIMITER_RE = re.compile(
     r'^\s*\|?\s*:?-+:?\s*(?:\|\s*:?-+:?\s*)+\|?\s*$')
 
 
-def split_table_blocks(text):
-    """Return prose and parsed tables without dropping surrounding content."""
+def split_table_blocks(text, cache=True):
+    """Return prose and parsed tables without dropping surrounding content.
+
+    The result may come from render_cache and is shared: do not mutate it."""
+    return cached('table_blocks', str(text or ''), _split_table_blocks, cache)
+
+
+def _split_table_blocks(text):
     lines = str(text or '').splitlines(keepends=True)
     result = []
     prose_start = 0
@@ -0,0 +1,261 @@
+"""Escritor de historial en segundo plano, compartido por ChatHistory y XmppHistory.
+
+Las escrituras al terminar un turno LLM (LLMClient._process_stream) y las
+de cada mensaje XMPP corrían en el hilo que las pedía — el de streaming
+antes de emitir 'finished', o directamente el main loop de GTK. Aquí se
+encolan y un único hilo las aplica: los trabajos que llegan juntos para la
+misma base se agrupan en una sola transacción (un commit, un fsync), cada
+uno dentro de su SAVEPOINT para que el fallo de uno no arrastre al resto.
+
+Un trabajo es `write(conn)`, con la conexión de escritura del `target`:
+la que presta su writer() (ChatHistory: la escritora única del
+HistoryDatabase, con su lock tomado durante el lote) o, si no tiene, la
+de get_connection() del hilo escritor (XmppHistory).
+Opcionalmente:
+- `prepare()` corre antes de abrir la transacción (resolver fragmentos
+  puede leer archivos o la red) y su resultado llega como
+  `write(conn, prepared)`.
+- `on_done(result, error)` se llama en el hilo escritor después del
+  commit; para tocar la UI hay que volver con GLib.idle_add.
+- `batch=False` para trabajos que hacen commit por su cuenta (p.ej. los
+  que reutilizan métodos públicos de XmppHistory): corren solos.
+
+Desde el main loop nunca se espera al escritor: wait_for vuelve enseguida
+ahí, y cada historial combina sus lecturas con lo que tiene en cola
+(ChatHistory y XmppHistory guardan esas filas en memoria hasta su on_done).
+Una escritura directa desde el main loop con trabajos en cola se encola
+también (should_queue), para no adelantarse a ellos. Los demás hilos sí
+esperan (wait_for) y leen lo recién escrito; flush() es para el cierre.
+
+`persistence_writer` es el de los historiales. search_index tiene otra
+instancia, con su propio hilo: indexar (la primera vez, todo el historial)
+no se pone delante de las escrituras de logs.db y xmpp_history.db.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+from .debug_utils import debug_print
+
+
+class _Job:
+    __slots__ = ('target', 'write', 'prepare', 'on_done', 'batch')
+
+    def __init__(self, target, write, prepare, on_done, batch):
+        self.target = target
+        self.write = write
+        self.prepare = prepare
+        self.on_done = on_done
+        self.batch = batch
+
+
+class PersistenceWriter:
+    def __init__(self, max_batch=128, name='history-writer'):
+        self.max_batch = max_batch
+        self.name = name
+        self._cond = threading.Condition()
+        self._jobs = deque()
+        # Trabajos encolados o en curso, por archivo (ver _key).
+        self._pending = {}
+        self._inflight = 0
+        self._thread = None
+        self._stats = {'jobs': 0, 'batches': 0, 'errors': 0,
+                       'max_batch': 0, 'last_commit_ms': 0.0}
+
+    def submit(self, target, write, prepare=None, on_done=None, batch=True):
+        """Encola un trabajo de escritura. No bloquea."""
+        job = _Job(target, write, prepare, on_done, batch)
+        with self._cond:
+            self._jobs.append(job)
+            key = self._key(target)
+            self._pending[key] = self._pending.get(key, 0) + 1
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    @staticmethod
+    def _key(target):
+        # Por archivo y no por instancia: el sidebar y la ventana pueden tener
+        # cada uno su ChatHistory sobre el mismo logs.db.
+        return getattr(target, 'db_path', None) or id(target)
+
+    def is_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+    @staticmethod
+    def is_main_thread():
+        return threading.current_thread() is threading.main_thread()
+
+    def should_queue(self, target):
+        """True desde el main loop con escrituras de `target` en cola: una
+        escritura directa se adelantaría a ellas, así que va detrás."""
+        return self.is_main_thread() and self.has_pending(target)
+
+    def has_pending(self, target=None):
+        with self._cond:
+            if target is None:
+                return bool(self._jobs) or self._inflight > 0
+            return self._pending.get(self._key(target), 0) > 0
+
+    def wait_for(self, target, timeout=None):
+        """Espera a que se apliquen las escrituras pendientes de `target`.
+
+        Para hilos de trabajo. No-op desde el propio hilo escritor
+        (callbacks on_done), donde esperar sería un deadlock, y desde el
+        main loop, que no se bloquea por el disco: devuelve False si quedan
+        escrituras sin aplicar."""
+        if self.is_writer_thread():
+            return True
+        if self.is_main_thread():
+            return not self.has_pending(target)
+        key = self._key(target)
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._pending.get(key, 0) == 0, timeout)
+
+    def flush(self, timeout=None):
+        """Espera a que la cola quede vacía y aplicada. True si lo logró.
+
+        Pensado para el cierre de la aplicación: el hilo es daemon y lo
+        que quede en cola al salir se perdería."""
+        if self.is_writer_thread():
+            return False
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._jobs and self._inflight == 0, timeout)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queued'] = len(self._jobs)
+        return stats
+
+    def _take_batch(self):
+        """Primer trabajo de la cola más los siguientes agrupables con él."""
+        first = self._jobs.popleft()
+        batch = [first]
+        if first.batch:
+            while (self._jobs and len(batch) < self.max_batch
+                   and self._jobs[0].batch
+                   and self._jobs[0].target is first.target):
+                batch.append(self._jobs.popleft())
+        self._inflight = len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._jobs)
+                batch = self._take_batch()
+            results = self._apply(batch)
+            with self._cond:
+                for job in batch:
+                    key = self._key(job.target)
+                    remaining = self._pending.get(key, 1) - 1
+                    if remaining:
+                        self._pending[key] = remaining
+                    else:
+                        self._pending.pop(key, None)
+                self._inflight = 0
+                self._cond.notify_all()
+            for job, (result, error) in zip(batch, results):
+                if job.on_done is None:
+                    continue
+                try:
+                    job.on_done(result, error)
+                except Exception as e:
+                    debug_print(f"[writer] on_done falló: {e}")
+
+    def _apply(self, batch):
+        """Aplica un lote; devuelve [(resultado, error)] en el mismo orden."""
+        prepared = []
+        for job in batch:
+            try:
+                prepared.append(job.prepare() if job.prepare is not None else None)
+            except Exception as e:
+                debug_print(f"[writer] prepare falló: {e}")
+                prepared.append(e)
+
+        start = time.perf_counter()
+        target = batch[0].target
+        try:
+            if hasattr(target, 'writer'):
+                lease = target.writer()
+            else:
+                lease = nullcontext(target.get_connection())
+            with lease as conn:
+                results = self._apply_to(conn, batch, prepared)
+        except Exception as e:
+            debug_print(f"[writer] sin conexión: {e}")
+            with self._cond:
+                self._stats['errors'] += len(batch)
+            return [(None, e)] * len(batch)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self._cond:
+            self._stats['jobs'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['errors'] += sum(1 for _r, error in results if error is not None)
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+            self._stats['last_commit_ms'] = elapsed_ms
+        return results
+
+    def _apply_to(self, conn, batch, prepared):
+        results = []
+        if not batch[0].batch:
+            job = batch[0]
+            try:
+                if isinstance(prepared[0], Exception):
+                    raise prepared[0]
+                results.append((self._call(job, conn, prepared[0]), None))
+                conn.commit()
+            except Exception as e:
+                debug_print(f"[writer] trabajo falló: {e}")
+                self._rollback(conn)
+                results.append((None, e))
+        else:
+            try:
+                if conn.in_transaction:
+                    conn.commit()
+                conn.execute("BEGIN")
+                for job, value in zip(batch, prepared):
+                    if isinstance(value, Exception):
+                        results.append((None, value))
+                        continue
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        result = self._call(job, conn, value)
+                    except Exception as e:
+                        debug_print(f"[writer] trabajo falló: {e}")
+                        conn.execute("ROLLBACK TO job")
+                        results.append((None, e))
+                    else:
+                        results.append((result, None))
+                    conn.execute("RELEASE job")
+                conn.commit()
+            except Exception as e:
+                # Falló el lote entero (BEGIN/COMMIT: disco lleno, BD
+                # bloqueada más allá del timeout…).
+                debug_print(f"[writer] lote falló: {e}")
+                self._rollback(conn)
+                results = [(None, e)] * len(batch)
+        return results
+
+    @staticmethod
+    def _call(job, conn, prepared):
+        if job.prepare is not None:
+            return job.write(conn, prepared)
+        return job.write(conn)
+
+    @staticmethod
+    def _rollback(conn):
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+
+
+persistence_writer = PersistenceWriter()
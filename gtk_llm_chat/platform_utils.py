@@ -3,7 +3,7 @@ platform_utils.py - utilidades multiplataforma para gtk-llm-chat
 """
 import sys
 import os
-import llm # Importar llm para usar llm.user_dir()
+import pathlib
 import sqlite3
 import glob
 import traceback
@@ -38,17 +38,39 @@ def is_frozen():
     return getattr(sys, 'frozen', False)
 
 
+def llm_user_dir():
+    """El mismo directorio que llm.user_dir(), sin importar llm.
+
+    Importar llm cuesta cientos de ms (modelos, embeddings, httpx,
+    sqlite_utils) y casi todo el arranque sólo necesita la ruta. Si llm ya
+    está cargado se le delega; si no, se resuelve como él: LLM_USER_PATH o
+    click.get_app_dir("io.datasette.llm").
+    """
+    llm = sys.modules.get('llm')
+    if llm is not None and hasattr(llm, 'user_dir'):
+        return llm.user_dir()
+    llm_user_path = os.environ.get("LLM_USER_PATH")
+    if llm_user_path:
+        path = pathlib.Path(llm_user_path)
+    else:
+        import click
+        path = pathlib.Path(click.get_app_dir("io.datasette.llm"))
+    path.mkdir(exist_ok=True, parents=True)
+    return path
+
+
 def ensure_user_dir_exists():
     """
     Asegura que el directorio de configuración/datos del usuario exista y lo devuelve.
-    Delega a llm.user_dir() que maneja LLM_USER_PATH, XDG y directorios específicos de plataforma.
+    Resuelve como llm.user_dir() (ver llm_user_dir): LLM_USER_PATH, XDG y
+    directorios específicos de plataforma.
     """
     try:
         # llm.user_dir() usa LLM_USER_PATH si está seteado.
         # En Flatpak, el manifiesto setea LLM_USER_PATH a $HOME/.config/io.datasette.llm (del sandbox)
         # que es un montaje de ~/.config/io.datasette.llm (del host).
         # En otros sistemas, usa XDG_CONFIG_HOME o defaults de plataforma.
-        user_dir = llm.user_dir()
+        user_dir = llm_user_dir()
         
         # El path devuelto por llm.user_dir() ya está expandido y es absoluto.
         debug_print(f"[platform_utils] llm.user_dir() resolvió a: {user_dir}")
@@ -0,0 +1,114 @@
+"""Caché LRU del renderizado de markdown, por hash de contenido.
+
+Construir una burbuja parsea su cuerpo con MarkdownIt (markdown_to_pango,
+has_table, split_table_blocks) y lo trocea por fences (_split_code_fences).
+Recargar el historial, el backfill tras un catch-up MAM, restaurar ventanas
+o los fallbacks de _set_label_content vuelven a renderizar exactamente los
+mismos cuerpos. Aquí se guarda el resultado terminado, con clave
+(tipo, RENDERER_VERSION, hash del texto), acotado por un presupuesto de
+memoria estimada: al pasarse se descartan los menos usados.
+
+Los valores cacheados se comparten entre llamadas: quien los recibe no
+debe mutarlos. No depende de gi.
+"""
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+# Subirlo cuando cambie la salida de cualquiera de los renderizadores
+# cacheados: las entradas de la versión anterior dejan de coincidir.
+RENDERER_VERSION = 1
+
+_DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+def content_key(kind, text):
+    digest = hashlib.blake2b((text or '').encode('utf-8', 'surrogatepass'),
+                             digest_size=16).digest()
+    return (kind, RENDERER_VERSION, digest)
+
+
+def estimate_size(value):
+    """Bytes aproximados de un resultado (str, números, y listas/tuplas/
+    dicts de ellos), contando lo compartido una sola vez por aparición."""
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class RenderCache:
+    """LRU thread-safe con presupuesto de memoria y estadísticas."""
+
+    def __init__(self, max_bytes=_DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_or_compute(self, kind, text, compute):
+        """Resultado de `compute(text)`, desde la caché si ya se calculó para
+        el mismo contenido."""
+        key = content_key(kind, text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+        # Fuera del lock: renderizar puede tardar y otro hilo no debe esperar.
+        value = compute(text)
+        self._store(key, value)
+        return value
+
+    def _store(self, key, value):
+        size = estimate_size(value) + sys.getsizeof(key[2])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _key, (_value, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+render_cache = RenderCache()
+
+
+def cached(kind, text, compute, cache=True):
+    """Atajo sobre la caché global; `cache=False` calcula sin guardar (la
+    cola de una respuesta en streaming cambia en cada chunk y sólo
+    desplazaría entradas útiles)."""
+    if not cache:
+        return compute(text)
+    return render_cache.get_or_compute(kind, text, compute)
@@ -0,0 +1,72 @@
+"""Pool de hilos para preparar burbujas fuera del hilo de GTK.
+
+Al abrir una ventana, _display_conversation_history y el backfill XMPP
+construían cientos de MessageWidget seguidos en el main loop, y cada uno
+parseaba su markdown (markdown_to_pango, _autolink, Pango.parse_markup)
+antes de devolver el control: la ventana quedaba congelada. Ahora el
+parseo (widgets.build_render_plan) corre aquí y la ventana sólo instancia
+widgets desde el plan, en lotes que caben en un frame.
+
+El pool no sabe de GTK: `deliver` es la forma de volver al hilo principal
+(GLib.idle_add en la app) y se inyecta, como en search_index.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .debug_utils import debug_print
+
+# Con el GIL, más hilos no parsean más rápido: sólo compiten con el main
+# loop. Dos bastan para que un mensaje enorme no retrase a los demás.
+_DEFAULT_WORKERS = 2
+
+
+class RenderPool:
+    def __init__(self, workers=_DEFAULT_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'completed': 0, 'errors': 0,
+                       'queued': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+
+    def submit(self, build, item, on_ready, deliver=None):
+        """Corre `build(item)` en el pool y llama `on_ready(item, result)`
+        (result es None si build falló), a través de `deliver` si se da."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='render-plan')
+            self._stats['submitted'] += 1
+            self._stats['queued'] += 1
+            executor = self._executor
+        executor.submit(self._run, build, item, on_ready, deliver)
+
+    def _run(self, build, item, on_ready, deliver):
+        start = time.perf_counter()
+        try:
+            result = build(item)
+            error = False
+        except Exception as e:
+            debug_print(f"[render-pool] no se pudo preparar: {e}")
+            result, error = None, True
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            self._stats['queued'] -= 1
+            self._stats['completed'] += 1
+            self._stats['errors'] += error
+            self._stats['total_ms'] += elapsed_ms
+            self._stats['max_ms'] = max(self._stats['max_ms'], elapsed_ms)
+        if deliver is not None:
+            deliver(on_ready, item, result)
+        else:
+            on_ready(item, result)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        completed = stats['completed']
+        stats['avg_ms'] = stats['total_ms'] / completed if completed else 0.0
+        return stats
+
+
+render_pool = RenderPool()
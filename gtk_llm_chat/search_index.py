@@ -0,0 +1,443 @@
+"""Índice de búsqueda de texto completo (FTS5) sobre conversaciones LLM y XMPP.
+
+Un solo índice para las dos fuentes:
+- 'llm': responses.prompt + responses.response de logs.db (una entrada por
+  turno; también lo que escribe el CLI de llm).
+- 'xmpp': messages.body de xmpp_history.db (una entrada por mensaje).
+
+Vive en su propio archivo, search_index.db, junto a los otros dos: logs.db
+es de llm y no se le agregan tablas. El índice se pone al día por cursor
+(el rowid más alto ya indexado de cada fuente), así que sincronizar es
+incremental y no depende de quién escribió la fila. Lo que se reescribe o
+borra en el lugar (correcciones XEP-0308, duplicados MAM, conversaciones
+borradas) se avisa con mark_dirty()/forget_conversation().
+
+Los documentos se numeran en orden de indexado, que tras la primera
+sincronización es el de llegada: "los N más recientes que coinciden" es un
+recorrido del índice en orden inverso que FTS5 corta en cuanto tiene N.
+La búsqueda toma esa ventana y la ordena por relevancia (un BM25 calculado
+sobre la ventana) en Python. bm25()/snippet() de SQLite recorren la lista
+completa de cada término para sus estadísticas, y con palabras comunes en
+1M de mensajes eso son cientos de ms; la ventana acota el costo al tamaño
+de la respuesta.
+"""
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+from .debug_utils import debug_print
+from .persistence_writer import PersistenceWriter
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(
+    body,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3 4'
+);
+CREATE TABLE IF NOT EXISTS docs_meta (
+    rowid INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    source_rowid INTEGER NOT NULL,
+    conversation TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    timestamp TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_docs_meta_source ON docs_meta(source, source_rowid);
+CREATE INDEX IF NOT EXISTS idx_docs_meta_conversation ON docs_meta(source, conversation);
+CREATE TABLE IF NOT EXISTS sync_state (
+    source TEXT PRIMARY KEY,
+    last_rowid INTEGER NOT NULL
+);
+"""
+
+# Marcas de resaltado en los snippets: caracteres de control que no aparecen
+# en texto de chat, para que la UI pueda escapar el texto y luego cambiarlas
+# por markup (ver snippet_to_markup).
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_SYNC_CHUNK = 5000
+# Coincidencias más recientes que se ordenan por relevancia.
+_RANK_WINDOW = 200
+_SNIPPET_TOKENS = 12
+# Parámetros de BM25.
+_K1 = 1.2
+_B = 0.75
+
+# Hilo y conexiones propios del índice, aparte de persistence_writer: la
+# primera sincronización recorre todo el historial y no debe quedar delante
+# de las escrituras de los historiales.
+index_writer = PersistenceWriter(name='search-index')
+
+
+def build_match_query(text):
+    """Texto libre -> expresión MATCH de FTS5.
+
+    Cada palabra va entre comillas (la sintaxis de FTS5 no se expone al
+    usuario) y todas deben aparecer; la última se busca como prefijo, para
+    que la búsqueda responda mientras se escribe. None si no hay palabras."""
+    tokens = _TOKEN_RE.findall(text or '')
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _fold(text):
+    """Como el tokenizer: minúsculas y sin diacríticos ("Café" -> "cafe")."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _term_matcher(text):
+    """Función token -> índice del término de la consulta que coincide (o None),
+    con la misma semántica que build_match_query (el último es prefijo)."""
+    terms = [_fold(token) for token in _TOKEN_RE.findall(text or '')]
+    exact = {term: i for i, term in enumerate(terms[:-1])}
+    prefix = terms[-1] if terms else None
+
+    def match(token):
+        folded = _fold(token)
+        if prefix is not None and folded.startswith(prefix):
+            return len(terms) - 1
+        return exact.get(folded)
+    return match, len(terms)
+
+
+def rank_and_snippet(text, rows, limit):
+    """Ordena `rows` [(rowid, body)] por relevancia para `text` y devuelve
+    [(rowid, snippet, score)] de los `limit` mejores.
+
+    BM25 con el mismo peso para cada término (dentro de la ventana todos los
+    documentos contienen todos los términos, así que el IDF no distingue);
+    a igual puntaje gana el más reciente. El snippet es el tramo de
+    _SNIPPET_TOKENS palabras con más coincidencias, marcadas con
+    SNIPPET_START/SNIPPET_END."""
+    match, term_count = _term_matcher(text)
+    if not rows or not term_count:
+        return []
+    analysed = []
+    for rowid, body in rows:
+        body = body or ''
+        tokens = list(_TOKEN_RE.finditer(body))
+        hits = [match(token.group()) for token in tokens]
+        analysed.append((rowid, body, tokens, hits))
+    avg_len = sum(len(tokens) for _r, _b, tokens, _h in analysed) / len(analysed) or 1.0
+
+    scored = []
+    for rowid, body, tokens, hits in analysed:
+        norm = _K1 * (1 - _B + _B * len(tokens) / avg_len)
+        score = 0.0
+        for term in range(term_count):
+            tf = hits.count(term)
+            score += tf * (_K1 + 1) / (tf + norm)
+        scored.append((score, rowid, body, tokens, hits))
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [(rowid, _snippet(body, tokens, hits), -score)
+            for score, rowid, body, tokens, hits in scored[:limit]]
+
+
+def _snippet(body, tokens, hits):
+    if not tokens:
+        return body
+    width = min(_SNIPPET_TOKENS, len(tokens))
+    flags = [hit is not None for hit in hits]
+    best_start, best = 0, sum(flags[:width])
+    window = best
+    for start in range(1, len(tokens) - width + 1):
+        window += flags[start + width - 1] - flags[start - 1]
+        if window > best:
+            best_start, best = start, window
+    end = best_start + width
+    parts = ['…' if best_start > 0 else body[:tokens[0].start()]]
+    cursor = tokens[best_start].start()
+    for token, flag in zip(tokens[best_start:end], flags[best_start:end]):
+        parts.append(body[cursor:token.start()])
+        if flag:
+            parts.append(f"{SNIPPET_START}{token.group()}{SNIPPET_END}")
+        else:
+            parts.append(token.group())
+        cursor = token.end()
+    parts.append('…' if end < len(tokens) else body[cursor:])
+    return ''.join(parts)
+
+
+def snippet_to_markup(snippet, escape):
+    """Snippet con marcas -> markup Pango. `escape` es GLib.markup_escape_text
+    (se inyecta para que este módulo no dependa de gi)."""
+    return (escape(snippet or '')
+            .replace(SNIPPET_START, '<b>')
+            .replace(SNIPPET_END, '</b>'))
+
+
+class SearchIndex:
+    """Índice FTS5 propio de la app, con una conexión por hilo."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._thread_local = threading.local()
+        self._lock = threading.Lock()
+        # Una sincronización a la vez: dos leerían el mismo cursor e
+        # indexarían dos veces las mismas filas.
+        self._sync_lock = threading.Lock()
+        # source -> ruta de la BD de origen (logs.db / xmpp_history.db).
+        self._sources = {}
+        # source -> rowids de origen a reindexar o borrar.
+        self._dirty = {}
+        self._sync_scheduled = False
+
+    def get_connection(self):
+        if getattr(self._thread_local, 'conn', None) is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._thread_local.conn = conn
+        return self._thread_local.conn
+
+    def close_connection(self):
+        conn = getattr(self._thread_local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._thread_local.conn = None
+
+    # --- Mantenimiento ---
+
+    def register_source(self, source, path):
+        with self._lock:
+            self._sources[source] = path
+
+    def mark_dirty(self, source, rowids):
+        """Filas de origen reescritas o borradas en el lugar."""
+        rowids = [int(r) for r in rowids if r is not None]
+        if not rowids:
+            return
+        with self._lock:
+            self._dirty.setdefault(source, set()).update(rowids)
+
+    def schedule_sync(self):
+        """Pide una sincronización en el hilo del índice (una sola a la vez;
+        la que ya está en cola recoge todo lo pendiente)."""
+        with self._lock:
+            if self._sync_scheduled:
+                return
+            self._sync_scheduled = True
+        index_writer.submit(self, lambda _conn: self.sync(), batch=False)
+
+    def flush(self, timeout=None):
+        """Espera a que el hilo del índice aplique lo que tiene en cola."""
+        return index_writer.flush(timeout)
+
+    def sync(self):
+        """Indexa lo nuevo de cada fuente registrada. Devuelve cuántos
+        documentos se agregaron o reemplazaron."""
+        with self._sync_lock:
+            return self._sync()
+
+    def _sync(self):
+        with self._lock:
+            self._sync_scheduled = False
+            sources = dict(self._sources)
+            dirty, self._dirty = self._dirty, {}
+        conn = self.get_connection()
+        changed = 0
+        for source, path in sources.items():
+            if not os.path.exists(path):
+                continue
+            try:
+                source_conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            except sqlite3.Error as e:
+                debug_print(f"[search] no se pudo abrir {path}: {e}")
+                continue
+            source_conn.row_factory = sqlite3.Row
+            try:
+                changed += self._reindex_dirty(conn, source_conn, source,
+                                               dirty.get(source, ()))
+                changed += self._sync_new_rows(conn, source_conn, source)
+            except sqlite3.Error as e:
+                debug_print(f"[search] sincronización de {source} falló: {e}")
+                conn.rollback()
+            finally:
+                source_conn.close()
+        return changed
+
+    @staticmethod
+    def _select_rows(source_conn, source, where, params, limit=-1):
+        if source == 'llm':
+            return source_conn.execute(
+                "SELECT rowid, conversation_id AS conversation, id AS ref, "
+                "datetime_utc AS timestamp, "
+                "COALESCE(prompt, '') || char(10) || COALESCE(response, '') AS body "
+                f"FROM responses WHERE {where} ORDER BY rowid LIMIT ?",
+                (*params, limit)).fetchall()
+        return source_conn.execute(
+            "SELECT id AS rowid, bare_jid AS conversation, id AS ref, timestamp, body "
+            f"FROM messages WHERE {where} ORDER BY id LIMIT ?",
+            (*params, limit)).fetchall()
+
+    @staticmethod
+    def _last_rowid(conn, source):
+        row = conn.execute("SELECT last_rowid FROM sync_state WHERE source = ?",
+                           (source,)).fetchone()
+        return row['last_rowid'] if row else 0
+
+    def _store(self, conn, source, rows, replace=False):
+        for row in rows:
+            meta = (row['conversation'] or '', str(row['ref']), row['timestamp'])
+            existing = self._doc_rowid(conn, source, row['rowid']) if replace else None
+            if existing is None:
+                rowid = conn.execute(
+                    "INSERT INTO docs_meta "
+                    "(source, source_rowid, conversation, ref, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?)", (source, row['rowid'], *meta)).lastrowid
+            else:
+                rowid = existing
+                conn.execute("DELETE FROM docs WHERE rowid = ?", (rowid,))
+                conn.execute("UPDATE docs_meta SET conversation = ?, ref = ?, timestamp = ? "
+                             "WHERE rowid = ?", (*meta, rowid))
+            conn.execute("INSERT INTO docs (rowid, body) VALUES (?, ?)",
+                         (rowid, row['body'] or ''))
+        return len(rows)
+
+    @staticmethod
+    def _doc_rowid(conn, source, source_rowid):
+        row = conn.execute(
+            "SELECT rowid FROM docs_meta WHERE source = ? AND source_rowid = ?",
+            (source, source_rowid)).fetchone()
+        return row[0] if row else None
+
+    def _sync_new_rows(self, conn, source_conn, source):
+        last_rowid = self._last_rowid(conn, source)
+        column = 'rowid' if source == 'llm' else 'id'
+        total = 0
+        while True:
+            rows = self._select_rows(source_conn, source, f"{column} > ?",
+                                     (last_rowid,), limit=_SYNC_CHUNK)
+            if not rows:
+                break
+            with conn:
+                total += self._store(conn, source, rows)
+                last_rowid = rows[-1]['rowid']
+                conn.execute("INSERT OR REPLACE INTO sync_state (source, last_rowid) "
+                             "VALUES (?, ?)", (source, last_rowid))
+        return total
+
+    def _reindex_dirty(self, conn, source_conn, source, rowids):
+        # Las filas más nuevas que el cursor entran igual con la pasada de
+        # filas nuevas.
+        last_rowid = self._last_rowid(conn, source)
+        rowids = sorted(r for r in rowids if r <= last_rowid)
+        if not rowids:
+            return 0
+        column = 'rowid' if source == 'llm' else 'id'
+        total = 0
+        for start in range(0, len(rowids), 500):
+            chunk = rowids[start:start + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            rows = self._select_rows(source_conn, source,
+                                     f"{column} IN ({placeholders})", chunk)
+            present = {row['rowid'] for row in rows}
+            with conn:
+                for missing in set(chunk) - present:
+                    rowid = self._doc_rowid(conn, source, missing)
+                    if rowid is not None:
+                        self._delete_doc(conn, rowid)
+                total += self._store(conn, source, rows, replace=True)
+        return total
+
+    @staticmethod
+    def _delete_doc(conn, rowid):
+        conn.execute("DELETE FROM docs WHERE rowid = ?", (rowid,))
+        conn.execute("DELETE FROM docs_meta WHERE rowid = ?", (rowid,))
+
+    def forget_conversation(self, source, conversation):
+        """Borra del índice todos los documentos de una conversación."""
+        def job(conn):
+            rowids = [row[0] for row in conn.execute(
+                "SELECT rowid FROM docs_meta WHERE source = ? AND conversation = ?",
+                (source, conversation))]
+            for rowid in rowids:
+                self._delete_doc(conn, rowid)
+            return len(rowids)
+        index_writer.submit(self, job)
+
+    def rebuild(self):
+        """Vacía el índice y lo rehace desde cero (p.ej. tras un VACUUM de
+        logs.db, que puede renumerar rowids)."""
+        conn = self.get_connection()
+        with conn:
+            conn.execute("DELETE FROM docs")
+            conn.execute("DELETE FROM docs_meta")
+            conn.execute("DELETE FROM sync_state")
+        return self.sync()
+
+    # --- Consulta ---
+
+    def search(self, text, limit=20, source=None, conversation=None):
+        """Documentos que contienen todas las palabras de `text`: entre las
+        _RANK_WINDOW coincidencias más recientes, los `limit` más relevantes.
+        Cada resultado es un dict con source, conversation, ref, timestamp,
+        snippet (con SNIPPET_START/END) y rank (menor es mejor)."""
+        match = build_match_query(text)
+        if match is None:
+            return []
+        filters = ''
+        params = [match]
+        if source is not None:
+            filters += ' AND m.source = ?'
+            params.append(source)
+        if conversation is not None:
+            filters += ' AND m.conversation = ?'
+            params.append(conversation)
+        params.append(_RANK_WINDOW)
+        conn = self.get_connection()
+        try:
+            rows = conn.execute(f"""
+                SELECT docs.rowid, docs.body, m.source, m.conversation, m.ref, m.timestamp
+                FROM docs JOIN docs_meta AS m ON m.rowid = docs.rowid
+                WHERE docs MATCH ?{filters}
+                ORDER BY docs.rowid DESC
+                LIMIT ?
+            """, params).fetchall()
+        except sqlite3.OperationalError as e:
+            debug_print(f"[search] consulta '{match}' falló: {e}")
+            return []
+        by_rowid = {row['rowid']: row for row in rows}
+        results = []
+        for rowid, snippet, rank in rank_and_snippet(
+                text, [(row['rowid'], row['body']) for row in rows], limit):
+            row = by_rowid[rowid]
+            results.append({'source': row['source'], 'conversation': row['conversation'],
+                            'ref': row['ref'], 'timestamp': row['timestamp'],
+                            'snippet': snippet, 'rank': rank})
+        return results
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(user_dir=None):
+    """Índice compartido del directorio de usuario de llm, o None si este
+    SQLite no trae FTS5 (la búsqueda simplemente no aparece)."""
+    if user_dir is None:
+        from .platform_utils import ensure_user_dir_exists
+        user_dir = ensure_user_dir_exists()
+        if not user_dir:
+            return None
+    path = os.path.join(user_dir, "search_index.db")
+    with _indexes_lock:
+        if path not in _indexes:
+            index = SearchIndex(path)
+            try:
+                index.get_connection()
+            except sqlite3.OperationalError as e:
+                debug_print(f"[search] FTS5 no disponible: {e}")
+                index = None
+            _indexes[path] = index
+        return _indexes[path]
@@ -0,0 +1,131 @@
+"""Restauración de la sesión de ventanas como un pipeline.
+
+_restore_session_state reabría cada ventana guardada en serie en el hilo
+de UI: backend, LLMChatWindow e historial de una antes de empezar la
+siguiente, así que con muchas conversaciones la primera ventana tardaba
+lo mismo que antes y la última mucho más. Ahora:
+
+1. se leen todos los descriptores y se ordenan: la ventana que tenía el
+   foco primero, después el resto en el orden guardado (el de
+   Gtk.Application.get_windows, del foco más reciente al más viejo);
+2. `prepare(descriptor)` corre en un pool de hilos para todos a la vez
+   (en LLM: construir el backend, cargar modelo e historial y leer la
+   primera página que pintará la ventana);
+3. en el hilo de UI, `materialize(descriptor, prepared)` crea las
+   ventanas de a una por frame, en orden: la siguiente espera a que la
+   anterior se pinte (`after_frame`), así que la primera aparece en
+   cuanto está lista y las demás no congelan la que ya se ve.
+
+Si `prepare` falla, `materialize` recibe None y la ventana se abre por el
+camino normal. `post(callback)` lleva los resultados al hilo de UI
+(GLib.idle_add en la aplicación). No depende de gi.
+
+Quedan registradas en startup_timing las marcas 'first_window_restored'
+y 'all_windows_restored' (ver benchmarks/startup.py --restore).
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import startup_timing
+from .debug_utils import debug_print
+
+DEFAULT_WORKERS = 4
+
+
+def order_descriptors(descriptors):
+    """La ventana enfocada al salir primero; el resto en el orden guardado."""
+    focused = [d for d in descriptors if d.get('focused')]
+    return focused[:1] + [d for d in descriptors if d not in focused[:1]]
+
+
+class RestorePipeline:
+    def __init__(self, descriptors, prepare, materialize, post, after_frame,
+                 on_done=None, workers=DEFAULT_WORKERS):
+        self.descriptors = order_descriptors(list(descriptors))
+        self._prepare = prepare
+        self._materialize = materialize
+        self._post = post
+        self._after_frame = after_frame
+        self._on_done = on_done
+        self._workers = max(1, workers)
+        self._prepared = {}   # índice -> resultado de prepare (None si falló)
+        self._next = 0
+        self._waiting_frame = False
+        self._start = None
+        self.windows = []
+        self.done = False
+        self.stats = {'descriptors': len(self.descriptors), 'windows': 0,
+                      'prepare_errors': 0, 'prepare_ms': 0.0,
+                      'first_window_ms': None, 'all_windows_ms': None}
+
+    def start(self):
+        self._start = time.perf_counter()
+        if not self.descriptors:
+            self._finish()
+            return self
+        executor = ThreadPoolExecutor(max_workers=min(self._workers, len(self.descriptors)),
+                                      thread_name_prefix='session-restore')
+        for index, descriptor in enumerate(self.descriptors):
+            executor.submit(self._run_prepare, index, descriptor)
+        executor.shutdown(wait=False)
+        return self
+
+    def _elapsed_ms(self):
+        return (time.perf_counter() - self._start) * 1000.0
+
+    def _run_prepare(self, index, descriptor):
+        start = time.perf_counter()
+        try:
+            prepared, error = self._prepare(descriptor), None
+        except Exception as e:
+            prepared, error = None, e
+            debug_print(f"[restore] preparando {descriptor}: {e}")
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        self._post(lambda: self._on_prepared(index, prepared, error, elapsed_ms))
+
+    def _on_prepared(self, index, prepared, error, elapsed_ms):
+        self._prepared[index] = prepared
+        self.stats['prepare_ms'] += elapsed_ms
+        if error is not None:
+            self.stats['prepare_errors'] += 1
+        self._pump()
+        return False
+
+    def _pump(self):
+        """Materializa la siguiente ventana si ya está preparada y la anterior
+        ya se pintó. Las que no dan ventana no esperan frame."""
+        while (not self._waiting_frame and not self.done
+               and self._next in self._prepared):
+            index = self._next
+            self._next += 1
+            descriptor = self.descriptors[index]
+            try:
+                window = self._materialize(descriptor, self._prepared.pop(index))
+            except Exception as e:
+                debug_print(f"[restore] Error restaurando ventana {descriptor}: {e}")
+                window = None
+            if window is not None:
+                self.windows.append(window)
+                self.stats['windows'] += 1
+                self._waiting_frame = True
+                self._after_frame(window, self._on_frame)
+        if not self._waiting_frame and self._next >= len(self.descriptors):
+            self._finish()
+
+    def _on_frame(self):
+        self._waiting_frame = False
+        if self.stats['first_window_ms'] is None:
+            self.stats['first_window_ms'] = round(self._elapsed_ms(), 3)
+            startup_timing.mark('first_window_restored')
+        self._pump()
+
+    def _finish(self):
+        if self.done:
+            return
+        self.done = True
+        self.stats['all_windows_ms'] = round(self._elapsed_ms(), 3)
+        self.stats['prepare_ms'] = round(self.stats['prepare_ms'], 3)
+        startup_timing.mark('all_windows_restored')
+        debug_print(f"[restore] {self.stats}")
+        if self._on_done is not None:
+            self._on_done(self)
@@ -0,0 +1,181 @@
+"""Cronómetro por fases del arranque, para --benchmark-startup.
+
+Antes --benchmark-startup medía un único número (de start_time a que la
+ventana se mostraba). Aquí cada fase relevante del arranque anota cuánto
+tardó: imports (gi, Adw, llm), load_plugins, StyleManager.load_styles,
+ResourceManager.setup_icon_theme, la conexión y migraciones de ChatHistory,
+la resolución del modelo en LLMClient._load_model_internal y el primer
+frame pintado. Al terminar, la ventana imprime el informe como una línea
+JSON (ver REPORT_PREFIX) que benchmarks/startup.py recoge y agrega.
+
+Desactivado (el caso normal) todo es un no-op: phase() devuelve un
+contexto vacío y mark() no hace nada. No depende de gi.
+"""
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Prefijo de la línea de stdout con el informe: el resto de la salida
+# (DEBUG, avisos de GTK) se ignora al parsear.
+REPORT_PREFIX = 'STARTUP_BENCHMARK '
+
+_lock = threading.Lock()
+_state = {'enabled': False, 'origin': None}
+_phases = {}   # nombre -> [ms acumulados, veces, inicio de la primera (ms)]
+_marks = {}    # nombre -> ms desde el origen
+
+
+def enable(start_time=None):
+    """Activa el registro. `start_time` (time.time() del arranque, el que ya
+    guardan main.py y llm_gui.py) fija el origen; si no, es ahora."""
+    offset = time.time() - start_time if start_time else 0.0
+    with _lock:
+        _state['enabled'] = True
+        _state['origin'] = time.perf_counter() - offset
+
+
+def is_enabled():
+    return _state['enabled']
+
+
+def _now_ms():
+    return (time.perf_counter() - _state['origin']) * 1000.0
+
+
+def phase(name):
+    """Contexto que suma su duración a la fase `name`."""
+    if not _state['enabled']:
+        return nullcontext()
+    return _timed(name)
+
+
+@contextmanager
+def _timed(name):
+    start = _now_ms()
+    try:
+        yield
+    finally:
+        elapsed = _now_ms() - start
+        with _lock:
+            entry = _phases.setdefault(name, [0.0, 0, start])
+            entry[0] += elapsed
+            entry[1] += 1
+
+
+def mark(name):
+    """Instante (ms desde el origen) en que ocurrió `name`; sólo el primero."""
+    if not _state['enabled']:
+        return
+    with _lock:
+        _marks.setdefault(name, _now_ms())
+
+
+def time_core_imports():
+    """Importa gi (Gtk) y Adw cada uno en su fase, antes de que lo haga
+    chat_application: importados después ya estarían en sys.modules y su
+    coste quedaría escondido en 'import_app'. llm no: se importa tarde (ver
+    import_warmup.py) y su fase 'import_llm' la mide quien lo necesita."""
+    with phase('import_gi'):
+        import gi
+        gi.require_versions({'Gtk': '4.0', 'Adw': '1'})
+        from gi.repository import Gtk  # noqa: F401
+    with phase('import_adw'):
+        from gi.repository import Adw  # noqa: F401
+
+
+def report():
+    with _lock:
+        phases = {name: {'ms': round(ms, 3), 'count': count, 'start_ms': round(start, 3)}
+                  for name, (ms, count, start) in _phases.items()}
+        marks = {name: round(ms, 3) for name, ms in _marks.items()}
+    return {'phases': phases, 'marks': marks,
+            'total_ms': round(_now_ms(), 3) if _state['enabled'] else None}
+
+
+def emit(stream=None):
+    """Escribe el informe como una línea REPORT_PREFIX + JSON."""
+    stream = stream or sys.stdout
+    stream.write(REPORT_PREFIX + json.dumps(report(), sort_keys=True) + '\n')
+    stream.flush()
+
+
+def parse_report(output):
+    """El informe de la salida de un arranque (la última línea con
+    REPORT_PREFIX), o None si el proceso no llegó a emitirlo."""
+    found = None
+    for line in output.splitlines():
+        if line.startswith(REPORT_PREFIX):
+            found = json.loads(line[len(REPORT_PREFIX):])
+    return found
+
+
+# Subsistema al que se atribuye cada import de `python -X importtime`: el
+# primer prefijo que coincide, recorriendo desde el propio módulo hacia
+# quien lo importó. Lo que no cae en ninguno es 'other' (stdlib, etc.).
+SUBSYSTEMS = (
+    ('gstreamer', ('gi.repository.Gst',)),
+    ('gtk', ('gi',)),
+    ('llm-plugins', ('llm_',)),
+    ('llm', ('llm', 'sqlite_utils', 'openai', 'pydantic', 'httpx')),
+    ('markdown', ('markdown_it',)),
+    ('nbxmpp', ('nbxmpp',)),
+    ('omemo', ('omemo', 'oldmemo', 'twomemo', 'x3dh', 'doubleratchet', 'xeddsa')),
+    ('app', ('gtk_llm_chat',)),
+)
+
+
+def _subsystem_of(module):
+    for name, prefixes in SUBSYSTEMS:
+        for prefix in prefixes:
+            if module == prefix or module.startswith(prefix if prefix.endswith('_')
+                                                     else prefix + '.'):
+                return name
+    return None
+
+
+def importtime_report(stderr):
+    """Agrega la salida de `python -X importtime` por subsistema.
+
+    Cada línea trae el tiempo propio del módulo y su profundidad; los hijos
+    se imprimen antes que el padre. Un módulo sin subsistema propio hereda
+    el de quien lo importó (lo que importa llm cuenta para llm), así que
+    el tiempo propio de cada línea se suma una sola vez.
+    """
+    nodes = []  # subárboles que esperan a su padre: (profundidad, módulo, µs, hijos)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # cabecera "self [us] | cumulative | imported package"
+        raw = parts[2].rstrip()
+        name = raw.strip()
+        depth = (len(raw) - len(raw.lstrip()) - 1) // 2
+        children = []
+        while nodes and nodes[-1][0] > depth:
+            children.append(nodes.pop())
+        nodes.append((depth, name, int(parts[0]), children[::-1]))
+
+    subsystems = {}
+    stack = [(node, None) for node in nodes]
+    while stack:
+        (_depth, name, self_us, children), inherited = stack.pop()
+        subsystem = _subsystem_of(name) or inherited
+        entry = subsystems.setdefault(subsystem or 'other', {'self_ms': 0.0, 'modules': 0})
+        entry['self_ms'] += self_us / 1000.0
+        entry['modules'] += 1
+        stack.extend((child, subsystem) for child in children)
+    for entry in subsystems.values():
+        entry['self_ms'] = round(entry['self_ms'], 3)
+    return {'subsystems': subsystems,
+            'total_ms': round(sum(e['self_ms'] for e in subsystems.values()), 3)}
+
+
+def reset():
+    with _lock:
+        _state['enabled'] = False
+        _state['origin'] = None
+        _phases.clear()
+        _marks.clear()
@@ -0,0 +1,90 @@
+"""Frontera entre bloques cerrados y el bloque abierto de un texto en streaming.
+
+MessageWidget.update_content recibe en cada chunk la respuesta acumulada
+completa. Re-renderizarla entera (split de fences, markdown_to_pango,
+Pango.parse_markup) cuesta O(n) por chunk y O(n²) por respuesta. Los bloques
+que ya terminaron — un párrafo seguido de otro, un fence con su ``` de
+cierre, una tabla tras la que vino una línea en blanco — no pueden cambiar
+con el texto que todavía no llegó, así que se congelan y sólo se rehace la
+cola abierta.
+
+La frontera es conservadora a propósito: sólo se corta donde renderizar las
+dos mitades por separado da lo mismo que renderizar el todo. Ante la duda
+(listas que pueden continuar, blockquotes, bloques <think> abiertos) la
+frontera retrocede y ese texto sigue en la cola.
+
+Sin dependencias de GTK para poder probarlo headless.
+"""
+import re
+
+# Mismo patrón que usa widgets._split_code_fences: la frontera tiene que
+# respetar exactamente los fences que luego se montan como bloque de código.
+CODE_FENCE_RE = re.compile(r'```([^\n`]*)\n?([\s\S]*?)```')
+
+_THINK_OPEN_RE = re.compile(r'<think(?:ing)?>')
+_THINK_SPAN_RE = re.compile(r'<think(?:ing)?>.*?</think(?:ing)?>', re.DOTALL)
+
+# Una o más líneas en blanco entre dos bloques.
+_BLANK_RUN_RE = re.compile(r'\n[ \t]*\n(?:[ \t]*\n)*')
+
+# Inicio de bloque que puede continuar al anterior aunque haya una línea en
+# blanco entre medio: ítems de lista (una lista "loose" se numera y se
+# agrupa como un todo) y blockquotes.
+_CONTINUATION_RE = re.compile(r'(?:[-*+]|\d{1,9}[.)])(?:[ \t]|$)|>')
+
+
+def stable_prefix_length(text):
+    """Longitud del prefijo de `text` formado sólo por bloques cerrados.
+
+    `text[:n]` se puede renderizar una vez y reutilizar mientras el texto
+    siga creciendo por el final; `text[n:]` es la cola abierta. Devuelve 0
+    si todavía no hay ningún bloque cerrado.
+    """
+    text = text or ''
+    limit = len(text)
+
+    fences = list(CODE_FENCE_RE.finditer(text))
+    tail_start = fences[-1].end() if fences else 0
+    open_fence = text.find('```', tail_start)
+    if open_fence != -1:
+        limit = open_fence
+
+    # Un <think> sin cerrar se renderiza distinto si se parte en dos.
+    forbidden = [(m.start(), m.end()) for m in _THINK_SPAN_RE.finditer(text)]
+    last_closed = forbidden[-1][1] if forbidden else 0
+    open_think = _THINK_OPEN_RE.search(text, last_closed)
+    if open_think is not None:
+        limit = min(limit, open_think.start())
+
+    def inside_forbidden(pos):
+        return any(start < pos < end for start, end in forbidden)
+
+    best = 0
+    pos = 0
+    regions = []
+    for match in fences:
+        if match.end() > limit:
+            break
+        regions.append((pos, match.start()))
+        if not inside_forbidden(match.end()):
+            best = match.end()
+        pos = match.end()
+    regions.append((pos, limit))
+
+    for start, end in regions:
+        for blank in _BLANK_RUN_RE.finditer(text, start, end):
+            cut = blank.end()
+            # El bloque siguiente tiene que haber empezado: hasta entonces
+            # no sabemos si la línea en blanco separa bloques o no.
+            if cut >= len(text):
+                continue
+            # Línea indentada: continuación del bloque anterior (párrafo de
+            # un ítem de lista, código indentado).
+            if text[cut] in ' \t':
+                continue
+            if _CONTINUATION_RE.match(text, cut):
+                continue
+            if inside_forbidden(cut):
+                continue
+            best = max(best, cut)
+    return best
@@ -0,0 +1,146 @@
+"""Modelo cronológico del transcript de una ventana, con materialización parcial.
+
+Antes cada mensaje de la conversación era un MessageWidget vivo dentro de
+messages_box: una conversación de miles de turnos creaba miles de labels,
+TextViews de código y grids de tablas al abrirse. TranscriptModel guarda
+todos los Message en orden cronológico y sólo una ventana contigua de los
+más recientes tiene widget ("vivos"); los anteriores quedan ocultos y se
+materializan por páginas cuando el usuario sube hasta el borde superior.
+
+El modelo no sabe de GTK: cada entrada lleva un `widget` opaco que la
+ventana crea y destruye, y un `plan` igual de opaco (el render plan que
+se prepara fuera del hilo de GTK antes de crear el widget). Las claves de
+orden las da `sort_key(message)` (en la ventana, el timestamp normalizado
+de _comparable_ts).
+"""
+from bisect import bisect_left, bisect_right
+
+
+class TranscriptEntry:
+    __slots__ = ('message', 'key', 'widget', 'plan')
+
+    def __init__(self, message, key, widget=None):
+        self.message = message
+        self.key = key
+        self.widget = widget
+        self.plan = None
+
+
+class TranscriptModel:
+    """Mensajes ordenados por timestamp; los de índice >= live_start están vivos."""
+
+    def __init__(self, sort_key):
+        self._sort_key = sort_key
+        self._keys = []
+        self._entries = []
+        self.live_start = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    @property
+    def hidden_count(self):
+        """Mensajes más viejos que la ventana viva, sin widget."""
+        return self.live_start
+
+    @property
+    def live_count(self):
+        return len(self._entries) - self.live_start
+
+    def clear(self):
+        self._keys = []
+        self._entries = []
+        self.live_start = 0
+
+    def load(self, messages, keep):
+        """Reemplaza el contenido y devuelve las entradas a materializar.
+
+        Sólo las `keep` más recientes quedan vivas; el resto se materializa
+        bajo demanda con reveal_older()."""
+        entries = [TranscriptEntry(m, self._sort_key(m)) for m in messages]
+        # sort es estable: a igual timestamp se respeta el orden de llegada
+        # (el prompt antes que su respuesta).
+        entries.sort(key=lambda entry: entry.key)
+        self._entries = entries
+        self._keys = [entry.key for entry in entries]
+        self.live_start = max(0, len(entries) - keep)
+        return entries[self.live_start:]
+
+    def prepend_older(self, messages):
+        """Antepone una página de mensajes más viejos que todo lo cargado.
+
+        Entran ocultos, como si siempre hubieran estado: la ventana los
+        materializa con reveal_older(). Pensado para páginas keyset del
+        historial, cuyas claves no superan la del mensaje más viejo."""
+        entries = [TranscriptEntry(m, self._sort_key(m)) for m in messages]
+        entries.sort(key=lambda entry: entry.key)
+        self._entries[:0] = entries
+        self._keys[:0] = [entry.key for entry in entries]
+        self.live_start += len(entries)
+        return len(entries)
+
+    def insert(self, message, widget=None):
+        """Inserta en su sitio cronológico. Devuelve (entrada, viva).
+
+        Un mensaje más viejo que toda la ventana viva, habiendo mensajes
+        ocultos, también queda oculto: materializarlo dejaría un hueco entre
+        él y el resto de lo pintado."""
+        key = self._sort_key(message)
+        index = bisect_right(self._keys, key)
+        entry = TranscriptEntry(message, key, widget)
+        self._keys.insert(index, key)
+        self._entries.insert(index, entry)
+        if index < self.live_start:
+            self.live_start += 1
+            return entry, False
+        return entry, True
+
+    def discard(self, widget):
+        """Olvida la entrada del widget (retirado del chat). True si estaba."""
+        for index in range(len(self._entries) - 1, -1, -1):
+            if self._entries[index].widget is widget:
+                del self._entries[index]
+                del self._keys[index]
+                if index < self.live_start:
+                    self.live_start -= 1
+                return True
+        return False
+
+    def peek_older(self, count):
+        """Las `count` entradas ocultas más cercanas a la ventana viva, sin
+        cambiar nada (para preparar la próxima página de reveal_older)."""
+        return self._entries[max(0, self.live_start - count):self.live_start]
+
+    def reveal_older(self, count):
+        """Pasa a vivas hasta `count` entradas ocultas, de la más vieja a la
+        más nueva. La ventana les crea widget y las antepone."""
+        start = max(0, self.live_start - count)
+        revealed = self._entries[start:self.live_start]
+        self.live_start = start
+        return revealed
+
+    def hide_oldest(self, keep, release):
+        """Oculta las entradas vivas más viejas hasta dejar `keep`.
+
+        `release(entry)` retira el widget de la vista y devuelve False si no
+        puede (burbuja en streaming, con botones pendientes…): ahí se corta,
+        para que lo vivo siga siendo un tramo contiguo. Devuelve cuántas se
+        ocultaron."""
+        hidden = 0
+        while len(self._entries) - self.live_start > keep:
+            entry = self._entries[self.live_start]
+            if entry.widget is not None and not release(entry):
+                break
+            entry.widget = None
+            self.live_start += 1
+            hidden += 1
+        return hidden
+
+    def entries_between(self, low, high):
+        """Entradas (vivas u ocultas) con low <= clave <= high."""
+        start = bisect_left(self._keys, low)
+        end = bisect_right(self._keys, high)
+        return self._entries[start:end]
@@ -0,0 +1,216 @@
+"""Métricas de rendimiento por turno de un backend de generación.
+
+LLMClient no tenía más telemetría que los debug_print de _process_stream.
+Cada turno lleva ahora un TurnMetrics que anota, con un único reloj:
+
+- queue_ms: de send_message a que arranca el hilo de streaming;
+- prompt_ms: armado del prompt (fragmentos, conversation.prompt);
+- prompt_tokens_est: tamaño estimado de lo enviado (historial en contexto,
+  resumen, system y prompt; ver context_budget.py), con context_turns
+  enviados, dropped_turns fuera del presupuesto y summarized_turns
+  cubiertos por el resumen;
+- ttft_ms: de send_message al primer chunk (lo que el usuario espera);
+- inter_token_*: percentiles del intervalo entre chunks consecutivos;
+- tokens_per_s: tokens de salida (los que informe el modelo o, si no,
+  los chunks) entre el primer chunk y el último;
+- flush_*: latencia de entrega a la UI (ver chunk_coalescer.py);
+- persist_ms: de que se encola el turno a que el escritor de fondo lo
+  confirma en logs.db (None si no se guardó).
+
+Un turno cancelado se cierra en el momento de cancel() (total_ms mide
+hasta ahí) y queda con cancelled=True.
+
+as_dict() es lo que viaja en la señal 'turn-metrics' de ChatBackend y lo
+que MetricsLog escribe, una línea JSON por turno, con la versión de la
+aplicación para comparar modelos y builds. No depende de gi.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+
+def _percentile(ordered, fraction):
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000.0, 3)
+
+
+def app_version():
+    try:
+        from importlib.metadata import version
+        return version('gtk-llm-chat')
+    except Exception:
+        return None
+
+
+class TurnMetrics:
+    """Cronometraje de un turno. Se crea en send_message, lo alimenta el
+    hilo de streaming y lo cierran finish() y persisted(), que pueden
+    llegar en cualquier orden."""
+
+    def __init__(self, model_id=None, conversation_id=None, clock=time.perf_counter):
+        self._clock = clock
+        self.model_id = model_id
+        self.conversation_id = conversation_id
+        self.queued_at = clock()
+        self.started_at = None
+        self.prompt_at = None
+        self.first_chunk_at = None
+        self.last_chunk_at = None
+        self.finished_at = None
+        self.chunks = 0
+        self.chars = 0
+        self._gaps = []
+        self.output_tokens = None
+        self.success = None
+        self.cancelled = False
+        self.flush = {}
+        self.prompt_tokens = None
+        self.context_turns = None
+        self.dropped_turns = None
+        self.summarized_turns = None
+        self.persist_ms = None
+        self.awaiting_persist = False   # el turno está en la cola del escritor
+        self.published = False
+        self.timestamp = datetime.now(timezone.utc).isoformat()
+
+    def started(self):
+        self.started_at = self._clock()
+
+    def prompt_sent(self):
+        self.prompt_at = self._clock()
+
+    def context(self, prompt_tokens, turns, dropped=0, summarized=0):
+        """Tamaño estimado del prompt y cuántos turnos previos lleva."""
+        self.prompt_tokens = prompt_tokens
+        self.context_turns = turns
+        self.dropped_turns = dropped
+        self.summarized_turns = summarized
+
+    def chunk(self, text):
+        now = self._clock()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = now
+        else:
+            self._gaps.append(now - self.last_chunk_at)
+        self.last_chunk_at = now
+        self.chunks += 1
+        self.chars += len(text)
+
+    def finish(self, success, output_tokens=None, flush_stats=None):
+        self.finished_at = self._clock()
+        self.success = bool(success)
+        self.output_tokens = output_tokens
+        self.flush = dict(flush_stats or {})
+
+    def persisted(self, seconds):
+        self.persist_ms = _ms(seconds)
+
+    @property
+    def ttft_ms(self):
+        if self.first_chunk_at is None:
+            return None
+        return _ms(self.first_chunk_at - self.queued_at)
+
+    def tokens_per_s(self):
+        tokens = self.output_tokens if self.output_tokens else self.chunks
+        if not tokens or self.first_chunk_at is None:
+            return None
+        span = (self.last_chunk_at or self.first_chunk_at) - self.first_chunk_at
+        if span <= 0:
+            return None
+        return round(tokens / span, 2)
+
+    def as_dict(self):
+        gaps = sorted(self._gaps)
+        return {
+            'timestamp': self.timestamp,
+            'version': app_version(),
+            'model': self.model_id,
+            'cid': self.conversation_id,
+            'success': self.success,
+            'cancelled': self.cancelled,
+            'queue_ms': _ms(self.started_at - self.queued_at
+                            if self.started_at is not None else None),
+            'prompt_ms': _ms(self.prompt_at - self.started_at
+                             if None not in (self.prompt_at, self.started_at) else None),
+            'ttft_ms': self.ttft_ms,
+            'prompt_tokens_est': self.prompt_tokens,
+            'context_turns': self.context_turns,
+            'dropped_turns': self.dropped_turns,
+            'summarized_turns': self.summarized_turns,
+            'inter_token_p50_ms': _ms(_percentile(gaps, 0.5)),
+            'inter_token_p90_ms': _ms(_percentile(gaps, 0.9)),
+            'inter_token_p99_ms': _ms(_percentile(gaps, 0.99)),
+            'inter_token_max_ms': _ms(gaps[-1] if gaps else None),
+            'chunks': self.chunks,
+            'chars': self.chars,
+            'output_tokens': self.output_tokens,
+            'tokens_per_s': self.tokens_per_s(),
+            'total_ms': _ms(self.finished_at - self.queued_at
+                            if self.finished_at is not None else None),
+            'flushes': self.flush.get('flushes'),
+            'flush_mean_ms': round(self.flush['mean_flush_latency_ms'], 3)
+            if 'mean_flush_latency_ms' in self.flush else None,
+            'flush_max_ms': round(self.flush['max_flush_latency_ms'], 3)
+            if 'max_flush_latency_ms' in self.flush else None,
+            'persist_ms': self.persist_ms,
+        }
+
+
+def format_summary(metrics):
+    """Texto corto para la cabecera de la ventana: TTFT y tok/s."""
+    parts = []
+    if metrics.get('ttft_ms') is not None:
+        parts.append(f"{metrics['ttft_ms'] / 1000.0:.2f} s")
+    if metrics.get('tokens_per_s') is not None:
+        parts.append(f"{metrics['tokens_per_s']:.0f} tok/s")
+    return " · ".join(parts)
+
+
+class MetricsLog:
+    """Añade cada turno como una línea JSON a `path` (metrics_log en la
+    config, --metrics-log o GTK_LLM_CHAT_METRICS_LOG)."""
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+
+    def write(self, metrics):
+        line = json.dumps(metrics, sort_keys=True, ensure_ascii=False)
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def get_metrics_log(config=None):
+    """El MetricsLog compartido de la ruta configurada, o None si no hay."""
+    path = (config or {}).get('metrics_log') or os.environ.get('GTK_LLM_CHAT_METRICS_LOG')
+    if not path:
+        return None
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None:
+            log = _logs[path] = MetricsLog(path)
+        return log
+
+
+def load_metrics(path):
+    """Lee un archivo JSON lines de métricas (para comparar builds)."""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -425,14 +425,10 @@ class WelcomeWindow(Adw.ApplicationWindow):
         if llm_client and hasattr(llm_client, 'get_provider_for_model'):
             provider_key = llm_client.get_provider_for_model(model_id)
         else:
-            # Fallback: buscar en los modelos cargados
+            # Fallback: buscar en el catálogo de modelos
             try:
-                import llm
-                all_models = llm.get_models()
-                for m in all_models:
-                    if getattr(m, 'model_id', None) == model_id:
-                        provider_key = getattr(m, 'needs_key', None)
-                        break
+                from .model_catalog import get_model_catalog
+                provider_key = get_model_catalog().needs_key_for(model_id)
             except Exception:
                 provider_key = None
         # Consultar el estado de la API key
@@ -575,28 +571,22 @@ class WelcomeWindow(Adw.ApplicationWindow):
             # Obtener el provider_key del modelo usando el manager
             if hasattr(self.model_selector, 'manager') and self.model_selector.manager:
                 manager = self.model_selector.manager
-                # Buscar el modelo en todos los proveedores
-                for prov_key, models in manager.models_by_provider.items():
-                    for model in models:
-                        if getattr(model, 'model_id', None) == modelid:
-                            provider_key = manager._provider_to_needs_key.get(prov_key)
-                            debug_print(f"Debug: Encontrado modelo {modelid} en proveedor {prov_key}, needs_key: {provider_key}")
-                            break
-                    if provider_key is not None:
-                        break
+                # Búsqueda directa en el catálogo del manager
+                entry = manager.get_model_by_id(modelid)
+                if entry is not None:
+                    provider_key = manager._provider_to_needs_key.get(entry.provider)
+                    debug_print(f"Debug: Encontrado modelo {modelid} en proveedor "
+                                f"{entry.provider}, needs_key: {provider_key}")
             
             # Si no se encontró, intentar obtener directamente del modelo
             if provider_key is None:
                 try:
-                    import llm
-                    all_models = llm.get_models()
-                    for m in all_models:
-                        if getattr(m, 'model_id', None) == modelid:
-                            provider_key = getattr(m, 'needs_key', None)
-                            debug_print(f"Debug: Encontrado modelo {modelid} directamente, needs_key: {provider_key}")
-                            break
+                    from .model_catalog import get_model_catalog
+                    provider_key = get_model_catalog().needs_key_for(modelid)
+                    debug_print(f"Debug: Modelo {modelid} en el catálogo, "
+                                f"needs_key: {provider_key}")
                 except Exception as e:
-                    debug_print(f"Error buscando modelo en llm.get_models(): {e}")
+                    debug_print(f"Error buscando modelo en el catálogo: {e}")
                     provider_key = None
             
             # Consultar el estado de la API key si es necesario
@@ -5,6 +5,7 @@ from gi.repository import Gtk, Adw, GObject, GLib
 
 from .chat_application import _
 from .model_selection import ModelSelectionManager
+from .model_warmup import model_warmup, prefetch_enabled
 from .debug_utils import debug_print
 from .resource_manager import resource_manager
 
@@ -62,26 +63,25 @@ class WideModelSelector(Gtk.Box):
         Cambia el sidebar al proveedor correspondiente y selecciona el modelo en la lista.
         Además, emite las señales necesarias para que el contenedor actualice el UI.
         """
-        for provider_key in self.manager.models_by_provider:
-            models = self.manager.get_models_for_provider(provider_key)
-            for model in models:
-                if getattr(model, 'model_id', None) == modelid:
-                    # Normalizar None a un nombre válido para el stack
-                    stack_key = provider_key if provider_key is not None else "local"
-                    self.content_stack.set_visible_child_name(stack_key)
-                    page_ui = self._provider_pages_cache.get(provider_key)
-                    if page_ui:
-                        model_list = page_ui["model_list"]
-                        for row in model_list:
-                            if getattr(row, 'model_id', None) == modelid:
-                                GLib.idle_add(model_list.select_row, row)
-                                break
-                    self._update_model_info_panel(provider_key, modelid)
-                    # Emitir señal para que el contenedor actualice el headerbar
-                    self.emit('model-selected', modelid)
-                    self._update_and_emit_api_key_status(provider_key)
-                    return True
-        return False
+        entry = self.manager.get_model_by_id(modelid)
+        if entry is None or entry.provider not in self.manager.models_by_provider:
+            return False
+        provider_key = entry.provider
+        # Normalizar None a un nombre válido para el stack
+        stack_key = provider_key if provider_key is not None else "local"
+        self.content_stack.set_visible_child_name(stack_key)
+        page_ui = self._provider_pages_cache.get(provider_key)
+        if page_ui:
+            model_list = page_ui["model_list"]
+            for row in model_list:
+                if getattr(row, 'model_id', None) == modelid:
+                    GLib.idle_add(model_list.select_row, row)
+                    break
+        self._update_model_info_panel(provider_key, modelid)
+        # Emitir señal para que el contenedor actualice el headerbar
+        self.emit('model-selected', modelid)
+        self._update_and_emit_api_key_status(provider_key)
+        return True
 
     def _add_no_selection_page(self):
         """Añade la página inicial de 'Sin Selección'."""
@@ -278,6 +278,8 @@ class WideModelSelector(Gtk.Box):
         model_id = getattr(row, 'model_id', None)
         if model_id:
             self.manager.config['model'] = model_id
+            if prefetch_enabled(self.manager.config):
+                model_warmup.warm_in_background(model_id)
             self.manager.emit('model-selected', model_id) 
             self.emit('model-selected', model_id)
             debug_print(f"WideModelSelector: Model '{model_id}' for provider '{provider_key}' selected.")
@@ -432,12 +434,7 @@ class WideModelSelector(Gtk.Box):
         main_vbox.append(avatar)
         
         # Obtener información del modelo
-        models = self.manager.get_models_for_provider(provider_key)
-        model_obj = None
-        for model in models:
-            if getattr(model, 'model_id', None) == model_id:
-                model_obj = model
-                break
+        model_obj = self.manager.get_model_by_id(model_id)
         
         if not model_obj:
             error_row = Adw.ActionRow()
@@ -8,12 +8,13 @@ gi.require_version('Gtk', '4.0')
 gi.require_version('Gdk', '4.0')
 gi.require_version('GdkPixbuf', '2.0')
 gi.require_version('Adw', '1')
-gi.require_version('Gst', '1.0')
-from gi.repository import Adw, Gdk, GLib, Gst, Gtk, Pango
+from gi.repository import Adw, Gdk, GLib, Gtk, Pango
 from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from .resource_manager import resource_manager
+from .render_cache import cached
+from .stream_blocks import CODE_FENCE_RE, stable_prefix_length
 
 DEBUG = os.environ.get('DEBUG') or False
 
@@ -117,11 +118,12 @@ def _remove_attachment_label(content):
                   flags=re.IGNORECASE).strip()
 
 
-CODE_FENCE_RE = re.compile(r'```([^\n`]*)\n?([\s\S]*?)```')
+def _split_code_fences(content, cache=True):
+    """Devuelve fragmentos ('text'|'code', language, content) preservando orden."""
+    return cached('code_fences', content or '', _split_code_fences_uncached, cache)
 
 
-def _split_code_fences(content):
-    """Devuelve fragmentos ('text'|'code', language, content) preservando orden."""
+def _split_code_fences_uncached(content):
     parts = []
     pos = 0
     for match in CODE_FENCE_RE.finditer(content or ''):
@@ -373,6 +375,105 @@ def _autolink(markup):
     return ''.join(out)
 
 
+def _label_markup(content, use_markdown, cache=True):
+    """Markup validado para el label de `content`, o None si hay que pintarlo
+    como texto plano. El markup generado es balanceado por construcción, pero
+    ante cualquier sorpresa se degrada a texto plano en vez de a un label
+    vacío (set_markup inválido no pinta nada).
+
+    No toca widgets: corre igual en los hilos de render_pool."""
+    if use_markdown:
+        from .pango_markdown import markdown_to_pango
+        markup = _autolink(markdown_to_pango(content, cache))
+        try:
+            Pango.parse_markup(markup, -1, '\x00')
+            return markup
+        except GLib.Error:
+            debug_print("[widget] markup inválido; fallback a texto plano")
+    # Texto plano: aun así autoenlazar las URLs (los adjuntos llegan como
+    # una URL suelta). Se escapa primero para que el markup sea válido.
+    markup = _autolink(GLib.markup_escape_text(content or ''))
+    try:
+        Pango.parse_markup(markup, -1, '\x00')
+        return markup
+    except GLib.Error:
+        debug_print("[widget] autolink inválido; texto plano tal cual")
+    return None
+
+
+def _content_segments(content, use_markdown, cache=True):
+    """Tramo de contenido -> segmentos listos para instanciar:
+    ('code', código, lenguaje), ('table', modelo, None) y
+    ('text', texto, markup o None)."""
+    segments = []
+    if not (content or '').strip():
+        return segments
+    from .pango_markdown import has_table, split_table_blocks
+    for kind, language, value in _split_code_fences(content, cache):
+        if kind == 'code':
+            segments.append(('code', value, language))
+        elif (value or '').strip():
+            if has_table(value, cache):
+                for block_kind, block_value in split_table_blocks(value, cache):
+                    if block_kind == 'table':
+                        segments.append(('table', block_value, None))
+                    elif block_value:
+                        segments.append(('text', block_value, _label_markup(
+                            block_value, use_markdown, cache)))
+            else:
+                segments.append(('text', value, _label_markup(value, use_markdown, cache)))
+    return segments
+
+
+def _bubble_content(message):
+    """Texto que muestra la burbuja de `message`, y sus adjuntos:
+    (content, image_url, audio_url, visible_content)."""
+    content = message.content
+    if message.sender == "user" and content.startswith("user:"):
+        content = content[5:].strip()
+    image_url = _first_image_url(content)
+    audio_url = _first_audio_url(content) if not image_url else None
+    visible_content = _content_without_attachment_url(content, image_url or audio_url)
+    return content, image_url, audio_url, visible_content
+
+
+class RenderPlan:
+    """Todo lo que MessageWidget necesita parsear para pintar un mensaje,
+    calculado fuera del hilo de GTK (ver build_render_plan)."""
+    __slots__ = ('source', 'use_markdown', 'image_url', 'audio_url',
+                 'visible_content', 'frozen_source', 'frozen', 'tail')
+
+    def __init__(self, source, use_markdown, image_url, audio_url,
+                 visible_content, frozen_source, frozen, tail):
+        self.source = source
+        self.use_markdown = use_markdown
+        self.image_url = image_url
+        self.audio_url = audio_url
+        self.visible_content = visible_content
+        self.frozen_source = frozen_source
+        self.frozen = frozen
+        self.tail = tail
+
+    def matches(self, message, use_markdown):
+        return self.source == message.content and self.use_markdown == use_markdown
+
+
+def build_render_plan(message, use_markdown=True):
+    """Parsea el cuerpo de `message` sin crear widgets: markdown, fences,
+    tablas y validación del markup. Seguro desde cualquier hilo; el hilo de
+    GTK sólo instancia los widgets (MessageWidget(..., render_plan=plan)).
+
+    Parte el contenido igual que _render_streamed_content (bloques cerrados
+    y cola), para que un update_content posterior siga siendo incremental."""
+    _content, image_url, audio_url, visible = _bubble_content(message)
+    stable = stable_prefix_length(visible) if visible.strip() else 0
+    return RenderPlan(
+        message.content, use_markdown, image_url, audio_url, visible,
+        visible[:stable],
+        _content_segments(visible[:stable], use_markdown),
+        _content_segments(visible[stable:], use_markdown))
+
+
 class Message:
     """
     Representa un mensaje
@@ -428,7 +529,9 @@ class MessageWidget(Gtk.Box):
     """Widget para mostrar un mensaje individual"""
 
     def __init__(self, message, use_markdown=True, avatar_path=None,
-                 avatar_anchor=False, on_retry=None):
+                 avatar_anchor=False, on_retry=None, render_plan=None):
+        """`render_plan` (build_render_plan, hecho en otro hilo) ahorra el
+        parseo; si no corresponde a este mensaje se ignora."""
         super().__init__(orientation=Gtk.Orientation.VERTICAL, spacing=3)
         self.message = message
         self.use_markdown = use_markdown
@@ -472,10 +575,8 @@ class MessageWidget(Gtk.Box):
             margin_box.append(message_box)
             margin_box.append(Gtk.Box(hexpand=True))  # Espaciador derecho
 
-        # Quitar el prefijo "user:" si existe
-        content = message.content
-        if is_user and content.startswith("user:"):
-            content = content[5:].strip()
+        if render_plan is not None and not render_plan.matches(message, use_markdown):
+            render_plan = None
 
         # Texto normal sigue en Gtk.Label/Pango por estabilidad de layout; los
         # fences se montan como widgets separados para copiar sólo el bloque.
@@ -488,8 +589,13 @@ class MessageWidget(Gtk.Box):
         self._attachment_data = None
         self._attachment_url = None
         self._audio_widget = None
-        image_url = _first_image_url(content)
-        audio_url = _first_audio_url(content) if not image_url else None
+        # Quitar el prefijo "user:" si existe; separar los adjuntos.
+        if render_plan is not None:
+            image_url = render_plan.image_url
+            audio_url = render_plan.audio_url
+            visible_content = render_plan.visible_content
+        else:
+            _content, image_url, audio_url, visible_content = _bubble_content(message)
         if image_url:
             self._ensure_attachment_preview(message_box, image_url)
         elif audio_url:
@@ -497,8 +603,6 @@ class MessageWidget(Gtk.Box):
                 audio_url, duration=0.0)
             self._audio_widget.add_css_class('audio-bubble')
             message_box.prepend(self._audio_widget)
-        visible_content = _content_without_attachment_url(
-            content, image_url or audio_url)
 
         self.content_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
         self.content_box.set_hexpand(True)
@@ -508,7 +612,14 @@ class MessageWidget(Gtk.Box):
         self.content_scroll.set_propagate_natural_height(True)
         self.content_scroll.set_child(self.content_box)
         self._content_scroll_tick_id = None
-        self._set_message_content(visible_content)
+        # Render incremental (ver _render_streamed_content): fuente ya
+        # congelada y widgets de la cola abierta.
+        self._frozen_source = ''
+        self._tail_widgets = []
+        if render_plan is not None:
+            self._apply_render_plan(render_plan)
+        else:
+            self._set_message_content(visible_content)
         message_box.append(self.content_scroll)
 
         # Estado de progreso/entrega en una cabecera de altura estable. Se
@@ -628,7 +739,7 @@ class MessageWidget(Gtk.Box):
         for child in list(self.content_box):
             self.content_box.remove(child)
 
-    def _build_text_label(self, content):
+    def _build_text_label(self, content, markup):
         label = Gtk.Label()
         label.set_wrap(True)
         label.set_wrap_mode(Pango.WrapMode.WORD_CHAR)
@@ -639,39 +750,22 @@ class MessageWidget(Gtk.Box):
         if re.match(r'^\s*(?:🔧|🛠|Tool(?:\s|:)|Using tool|Herramienta:)',
                     str(content or ''), re.IGNORECASE):
             label.add_css_class('tool-activity-line')
-        self._set_label_content(label, content)
+        self._set_label_content(label, content, markup)
         return label
 
-    def _set_label_content(self, label, content):
-        """Pinta `content` en `label` — markdown como Pango markup, o texto
-        plano. El markup generado es balanceado por construcción, pero ante
-        cualquier sorpresa se degrada a texto plano en vez de a un label
-        vacío (set_markup inválido no pinta nada)."""
+    @staticmethod
+    def _set_label_content(label, content, markup):
+        """Pinta `content` en `label` con el markup ya validado de
+        _label_markup, o como texto plano si es None."""
         if not (content or '').strip():
             label.set_text('')
             label.set_visible(False)
             return
         label.set_visible(True)
-        if self.use_markdown:
-            from .pango_markdown import markdown_to_pango
-            markup = _autolink(markdown_to_pango(content))
-            try:
-                Pango.parse_markup(markup, -1, '\x00')
-                label.set_markup(markup)
-                return
-            except GLib.Error:
-                debug_print("[widget] markup inválido; fallback a texto plano")
-        # Texto plano: aun así autoenlazar las URLs (los adjuntos llegan como
-        # una URL suelta). Se escapa primero para que el markup sea válido.
-        escaped = GLib.markup_escape_text(content or '')
-        markup = _autolink(escaped)
-        try:
-            Pango.parse_markup(markup, -1, '\x00')
+        if markup is not None:
             label.set_markup(markup)
-            return
-        except GLib.Error:
-            debug_print("[widget] autolink inválido; texto plano tal cual")
-        label.set_text(content)
+        else:
+            label.set_text(content)
 
     def _build_code_block(self, code, language):
         card = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=0)
@@ -790,8 +884,7 @@ class MessageWidget(Gtk.Box):
         card.append(scrolled)
         return card
 
-    def _set_message_content(self, content):
-        self._clear_content_box()
+    def _apply_content_scroll_policy(self, content):
         is_tool_output = bool(re.search(
             r'(?i)^\s*(?:⚠️?|✅|❌)?\s*(?:🔧|🛠️?|Tool(?:\s|:)|Using tool|'
             r'Herramienta:|Exec failed:|Ejecutando\b|Consultando\b|Recibido\b)',
@@ -804,24 +897,69 @@ class MessageWidget(Gtk.Box):
             self.content_scroll.set_max_content_height(-1)
             self.content_scroll.set_policy(
                 Gtk.PolicyType.NEVER, Gtk.PolicyType.NEVER)
+
+    def _build_content_widgets(self, content, cache=True):
+        """Widgets (texto, código, tablas) de un tramo de contenido.
+
+        `cache=False` no guarda los parseos en render_cache (la cola abierta
+        de un streaming cambia en cada chunk)."""
+        return self._widgets_from_segments(
+            _content_segments(content, self.use_markdown, cache))
+
+    def _widgets_from_segments(self, segments):
+        widgets = []
+        for kind, value, extra in segments:
+            if kind == 'code':
+                widgets.append(self._build_code_block(value, extra))
+            elif kind == 'table':
+                widgets.append(self._build_table_widget(value))
+            else:
+                widgets.append(self._build_text_label(value, extra))
+        return widgets
+
+    def _apply_render_plan(self, plan):
+        """Como _set_message_content, pero con el parseo ya hecho."""
+        self._clear_content_box()
+        self._apply_content_scroll_policy(plan.visible_content)
+        for widget in self._widgets_from_segments(plan.frozen):
+            self.content_box.append(widget)
+        self._frozen_source = plan.frozen_source
+        self._tail_widgets = self._widgets_from_segments(plan.tail)
+        for widget in self._tail_widgets:
+            self.content_box.append(widget)
+
+    def _set_message_content(self, content):
+        self._clear_content_box()
+        self._frozen_source = ''
+        self._tail_widgets = []
+        self._apply_content_scroll_policy(content)
         if not (content or '').strip():
             return
-        parts = _split_code_fences(content)
-        from .pango_markdown import has_table, split_table_blocks
-        for kind, language, value in parts:
-            if kind == 'code':
-                self.content_box.append(self._build_code_block(value, language))
-            elif (value or '').strip():
-                if has_table(value):
-                    for block_kind, block_value in split_table_blocks(value):
-                        if block_kind == 'table':
-                            self.content_box.append(
-                                self._build_table_widget(block_value))
-                        elif block_value:
-                            self.content_box.append(
-                                self._build_text_label(block_value))
-                else:
-                    self.content_box.append(self._build_text_label(value))
+        self._render_streamed_content(content)
+
+    def _render_streamed_content(self, content):
+        """Renderiza `content` reutilizando los bloques ya congelados.
+
+        Todo lo anterior a stable_prefix_length() son bloques cerrados
+        (párrafos, fences, tablas) que el texto por llegar ya no puede
+        cambiar: se montan una sola vez. Sólo la cola abierta se rehace en
+        cada chunk, así que el coste por chunk deja de crecer con la
+        longitud de la respuesta."""
+        for widget in self._tail_widgets:
+            self.content_box.remove(widget)
+        self._tail_widgets = []
+        stable = stable_prefix_length(content)
+        frozen_len = len(self._frozen_source)
+        if stable > frozen_len:
+            for widget in self._build_content_widgets(content[frozen_len:stable]):
+                self.content_box.append(widget)
+            self._frozen_source = content[:stable]
+        else:
+            stable = frozen_len
+        self._tail_widgets = self._build_content_widgets(
+            content[stable:], cache=not self._streaming)
+        for widget in self._tail_widgets:
+            self.content_box.append(widget)
 
     def update_content(self, new_content):
         """Actualiza el contenido del mensaje"""
@@ -838,7 +976,14 @@ class MessageWidget(Gtk.Box):
             self._ensure_attachment_preview(self.message_box, image_url)
         visible_content = _content_without_attachment_url(
             self.message.content, image_url)
-        self._set_message_content(visible_content)
+        # Streaming: el texto sólo crece por el final, así que los bloques
+        # congelados siguen valiendo. Una corrección XEP-0308 o un adjunto
+        # que reescribe el texto invalida el prefijo: render completo.
+        if self._frozen_source and visible_content.startswith(self._frozen_source):
+            self._apply_content_scroll_policy(visible_content)
+            self._render_streamed_content(visible_content)
+        else:
+            self._set_message_content(visible_content)
         if follow_output:
             GLib.idle_add(self._animate_content_scroll_to_bottom)
         # Cambiar el label ya invalida el layout del widget; no hace falta
@@ -996,6 +1141,7 @@ class AudioMessageWidget(Gtk.Box):
     def _on_seek(self, scale, _scroll, value):
         self._player._position = value
         if self._player._pipeline:
+            from gi.repository import Gst
             self._player._pipeline.seek_simple(
                 Gst.Format.TIME, Gst.SeekFlags.FLUSH,
                 int(value * Gst.SECOND))
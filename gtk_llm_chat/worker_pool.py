@@ -0,0 +1,81 @@
+"""Hilos de trabajo para los planificadores con cola propia.
+
+generation_scheduler y omemo_decrypt_scheduler guardan su cola bajo su
+propia threading.Condition y deciden qué trabajo sale (cupos por
+proveedor, orden por ratchet); este pool sólo pone y quita hilos:
+
+- `take()` corre con la Condition tomada y saca el siguiente trabajo, o
+  devuelve None si nada puede arrancar ahora;
+- `pending()` cuenta los trabajos en cola, puedan arrancar o no: mientras
+  haya alguno, un hilo sin trabajo espera en la Condition (el planificador
+  hace notify_all al liberar cupo) en vez de terminar;
+- `runnable()` cuenta los que podrían arrancar ya: wake() arranca hilos
+  hasta que haya uno libre por cada uno, sin pasar de `size`. Los hilos
+  ocupados no cuentan como libres.
+
+`run(job)` corre fuera de la Condition. Sin trabajo en cola los hilos
+terminan y wake() los recrea. No depende de gi.
+"""
+import threading
+
+
+class WorkerPool:
+    def __init__(self, cond, name, size, take, run, pending, runnable):
+        self._cond = cond
+        self._name = name
+        self._size = max(1, size)
+        self._take = take
+        self._run = run
+        self._pending = pending
+        self._runnable = runnable
+        self._threads = []
+        self._idle = 0   # hilos vivos sin trabajo (esperando o por arrancar)
+
+    @property
+    def size(self):
+        return self._size
+
+    def resize(self, size):
+        """Cambia el tope; los hilos que sobran terminan al quedar libres."""
+        with self._cond:
+            self._size = max(1, int(size))
+            self._cond.notify_all()
+        self.wake()
+
+    def thread_count(self):
+        with self._cond:
+            return len(self._threads)
+
+    def wake(self):
+        """Arranca los hilos que falten para lo que ya puede correr."""
+        with self._cond:
+            missing = min(self._size - len(self._threads), self._runnable() - self._idle)
+            for _ in range(max(0, missing)):
+                thread = threading.Thread(target=self._work, name=self._name, daemon=True)
+                self._threads.append(thread)
+                self._idle += 1
+                thread.start()
+
+    def _work(self):
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                job = None
+                while job is None:
+                    if len(self._threads) > self._size:
+                        break
+                    job = self._take()
+                    if job is None:
+                        if not self._pending():
+                            break
+                        self._cond.wait()
+                if job is None:
+                    self._threads.remove(me)
+                    self._idle -= 1
+                    return
+                self._idle -= 1
+            try:
+                self._run(job)
+            finally:
+                with self._cond:
+                    self._idle += 1
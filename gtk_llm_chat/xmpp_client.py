@@ -33,7 +33,10 @@ from nbxmpp.structs import DiscoIdentity, StanzaHandler
 from .chat_backend import ChatBackend
 from .chat_application import _
 from .debug_utils import debug_print
-from .xmpp_history import XmppHistory
+from .omemo_decrypt_scheduler import DecryptScheduler
+from .omemo_device_cache import format_encrypt_timings
+from .xmpp_history import XmppHistory, fold_mam_corrections
+from . import xmpp_presence
 
 STATE_DISCONNECTED = 'disconnected'
 STATE_CONNECTING = 'connecting'
@@ -90,6 +93,14 @@ AVATAR_DATA_NODE = 'urn:xmpp:avatar:data'
 VCARD_AVATAR_UPDATE_NS = 'vcard-temp:x:update'
 VCARD_TEMP_NS = 'vcard-temp'
 
+# Nodos PEP de las device lists OMEMO -> namespace del backend (los mismos
+# de XmppOMEMOSessionManager._get_device_list_node; xmpp_omemo se importa
+# sólo si OMEMO está habilitado).
+DEVICE_LIST_NODES = {
+    'eu.siacs.conversations.axolotl.devicelist': 'eu.siacs.conversations.axolotl',
+    'urn:xmpp:omemo:2:devices': 'urn:xmpp:omemo:2',
+}
+
 
 def parse_telemetry(item):
     """Extrae la telemetría del <telemetry/> publicado en el nodo PEP.
@@ -208,10 +219,10 @@ class XmppSession(GObject.Object):
         'omemo-status-changed': (GObject.SignalFlags.RUN_LAST, None, (bool,)),
     }
 
-    PRESENCE_ONLINE = 'online'
-    PRESENCE_BUSY = 'busy'
-    PRESENCE_AWAY = 'away'
-    PRESENCE_OFFLINE = 'offline'
+    PRESENCE_ONLINE = xmpp_presence.PRESENCE_ONLINE
+    PRESENCE_BUSY = xmpp_presence.PRESENCE_BUSY
+    PRESENCE_AWAY = xmpp_presence.PRESENCE_AWAY
+    PRESENCE_OFFLINE = xmpp_presence.PRESENCE_OFFLINE
 
     def __init__(self, jid: str, password: str, resource: str = RESOURCE,
                  auto_reconnect: bool = True):
@@ -221,6 +232,8 @@ class XmppSession(GObject.Object):
         self._omemo_decrypting = set()
         self._omemo_decrypted = set()
         self._omemo_decrypt_failed = set()
+        # Pool de descifrado: en orden por (remitente, dispositivo).
+        self._omemo_decrypts = DecryptScheduler()
         self._jid = JID.from_string(jid)
         self._password = password
         self._resource = f"{resource}-{_device_resource_suffix()}"
@@ -341,9 +354,12 @@ class XmppSession(GObject.Object):
             f'{AVATAR_METADATA_NODE}+notify',
         ]
         if is_omemo_enabled():
-            features.append(LEGACY_NS)
+            # Con +notify de las device lists, un contacto que agrega o
+            # retira un dispositivo nos lo avisa por PEP (_on_pep_event), y
+            # el envío no tiene que volver a pedir la lista cada vez.
+            features.extend([LEGACY_NS, f'{LEGACY_NS}.devicelist+notify'])
             if twomemo_available:
-                features.append(TWOMEMO_NS)
+                features.extend([TWOMEMO_NS, f'{TWOMEMO_NS}:devices+notify'])
 
         client.get_module('EntityCaps').set_caps(
             [DiscoIdentity(category='client', type='pc', name='gtk-llm-chat')],
@@ -462,13 +478,21 @@ class XmppSession(GObject.Object):
 
         nbxmpp sólo rellena `data` para los namespaces que conoce (avatar, tune,
         …); el nuestro es propio, así que el payload viene crudo en `item` y lo
-        parseamos nosotros."""
+        parseamos nosotros. También llegan aquí las device lists OMEMO (de
+        contactos y propias), que sólo invalidan la caché del motor."""
         if not properties.is_pubsub_event:
             return
         event = properties.pubsub_event
         if event.node == AVATAR_METADATA_NODE:
             self._on_avatar_metadata(stanza, event)
             return
+        if event.node in DEVICE_LIST_NODES:
+            if self.omemo_engine is not None:
+                sender = stanza.getFrom()
+                bare_jid = str(sender.bare) if sender is not None else self.bare_jid
+                self.omemo_engine.invalidate_device_list(
+                    bare_jid, DEVICE_LIST_NODES[event.node])
+            return
         if event.node not in (TELEMETRY_NODE, LEGACY_TELEMETRY_NODE) or event.item is None:
             return
         telemetry = parse_telemetry(event.item)
@@ -497,6 +521,10 @@ class XmppSession(GObject.Object):
         self.connect_to_server()
 
     def _on_connected(self, _client, _signal_name):
+        # Los eventos PEP de device lists de mientras estuvimos fuera no
+        # llegan: la próxima vez se vuelven a pedir.
+        if self.omemo_engine is not None:
+            self.omemo_engine.invalidate_device_list()
         # Orden RFC 6121: roster primero, luego presence inicial, y solo
         # entonces anunciar 'connected'. Si se envía un mensaje antes del
         # presence, el servidor nos considera offline y lo encola.
@@ -877,8 +905,10 @@ class XmppSession(GObject.Object):
     def _ensure_history(self):
         if self.history is None:
             from .platform_utils import ensure_user_dir_exists
+            from .search_index import get_search_index
             user_dir = ensure_user_dir_exists()
-            self.history = XmppHistory(os.path.join(user_dir, "xmpp_history.db"))
+            self.history = XmppHistory(os.path.join(user_dir, "xmpp_history.db"),
+                                       search_index=get_search_index(user_dir))
 
     # --- Mensajes ---
 
@@ -1072,42 +1102,53 @@ class XmppSession(GObject.Object):
                     return
                 self._omemo_decrypting.add(stanza_key)
 
-                def decrypt_in_background():
-                    try:
-                        body = self.omemo_engine.decrypt_msg(sender_bare, encrypted_node)
-                    except Exception as exc:
-                        body = None
-                        debug_print(f"OMEMO: error en hilo de descifrado para {sender_bare}: {exc}")
-
-                    def resume_message():
-                        self._omemo_decrypting.discard(stanza_key)
-                        from .xmpp_omemo import OMEMO_NOT_FOR_US
-                        if body is OMEMO_NOT_FOR_US:
-                            # A bare-JID message may be delivered to every
-                            # connected resource even when its OMEMO key only
-                            # targets another device (for example Gajim).  It
-                            # is not a corrupt message and must not create a
-                            # failure bubble in this resource.
-                            return GLib.SOURCE_REMOVE
-                        if body is None:
-                            debug_print(f"OMEMO: fallo de desencriptación para el mensaje de {sender_bare}")
-                            properties.body = fallback_body
-                            self._omemo_decrypt_failed.add(stanza_key)
-                        else:
-                            properties.body = body
-                            stanza_id = _stanza.getAttr('id')
-                            if stanza_id:
-                                self.emit('encryption-state', stanza_id,
-                                          encrypted_node.getNamespace() or '')
-                        self._omemo_decrypted.add(stanza_key)
-                        self._on_message(_client, _stanza, properties)
-                        self._omemo_decrypted.discard(stanza_key)
-                        self._omemo_decrypt_failed.discard(stanza_key)
+                from .xmpp_omemo import sender_device_id
+                sender_device = sender_device_id(encrypted_node)
+
+                def decrypt():
+                    return self.omemo_engine.decrypt_msg(sender_bare, encrypted_node)
+
+                def resume_message(body):
+                    self._omemo_decrypting.discard(stanza_key)
+                    from .xmpp_omemo import OMEMO_NOT_FOR_US
+                    if body is OMEMO_NOT_FOR_US:
+                        # A bare-JID message may be delivered to every
+                        # connected resource even when its OMEMO key only
+                        # targets another device (for example Gajim).  It
+                        # is not a corrupt message and must not create a
+                        # failure bubble in this resource.
                         return GLib.SOURCE_REMOVE
+                    if body is None:
+                        debug_print(f"OMEMO: fallo de desencriptación para el mensaje "
+                                    f"de {sender_bare}")
+                        properties.body = fallback_body
+                        self._omemo_decrypt_failed.add(stanza_key)
+                    else:
+                        properties.body = body
+                        stanza_id = _stanza.getAttr('id')
+                        if stanza_id:
+                            self.emit('encryption-state', stanza_id,
+                                      encrypted_node.getNamespace() or '')
+                    self._omemo_decrypted.add(stanza_key)
+                    self._on_message(_client, _stanza, properties)
+                    self._omemo_decrypted.discard(stanza_key)
+                    self._omemo_decrypt_failed.discard(stanza_key)
+                    return GLib.SOURCE_REMOVE
 
-                    GLib.idle_add(resume_message)
-
-                threading.Thread(target=decrypt_in_background, daemon=True).start()
+                def on_decrypted(body, wait_ms, decrypt_ms):
+                    debug_print(
+                        f"[omemo-decrypt] from={sender_bare} device={sender_device} "
+                        f"wait_ms={wait_ms:.1f} decrypt_ms={decrypt_ms:.1f} "
+                        f"queued={self._omemo_decrypts.queue_depth()}")
+                    # Desde el pool, en orden por (remitente, dispositivo):
+                    # idle_add conserva ese orden en el hilo principal.
+                    GLib.idle_add(resume_message, body)
+
+                depth = self._omemo_decrypts.submit(
+                    sender_bare, sender_device, decrypt, on_decrypted)
+                if depth > 1:
+                    debug_print(f"[omemo-decrypt] queued from={sender_bare} "
+                                f"device={sender_device} depth={depth}")
                 return
 
             decrypt_failed = stanza_key in self._omemo_decrypt_failed
@@ -1427,8 +1468,12 @@ class XmppSession(GObject.Object):
             msg.addChild(node=chatstate)
 
             if self.omemo_engine is not None and is_omemo_enabled():
+                timings = {}
                 try:
-                    encrypted_node, _ = self.omemo_engine.encrypt_msg_async(to_bare_jid, text)
+                    encrypted_node, _ = self.omemo_engine.encrypt_msg_async(
+                        to_bare_jid, text, timings=timings)
+                    debug_print(f"[delivery] id={stanza_id} phase=encrypt-timing "
+                                f"{format_encrypt_timings(to_bare_jid, timings)}")
                     if encrypted_node is not None:
                         nodes = encrypted_node if isinstance(encrypted_node, list) else [encrypted_node]
                         if len(nodes) != 1:
@@ -1785,6 +1830,7 @@ class XmppSession(GObject.Object):
     def shutdown(self):
         self._cancel_reconnect_timer()
         self._conversations.clear()
+        debug_print(f"[omemo-decrypt] stats {self._omemo_decrypts.stats()}")
         self.disconnect_from_server()
 
 
@@ -1870,7 +1916,7 @@ class XmppConversation(ChatBackend):
                 ts = datetime.now(timezone.utc).isoformat()
                 history = self.session.history
                 if history is not None:
-                    history.record_message(
+                    history.queue_message(
                         self.bare_jid, body, 'in', ts,
                         request_id=replace_id)
                 self._track_incoming_id(replace_id)
@@ -1890,7 +1936,7 @@ class XmppConversation(ChatBackend):
         encryption_namespace = self._pending_encryption.pop(request_id, None) if request_id else None
         has_pending = bool(quick_responses) or bool(commands)
         if history is not None:
-            history.record_message(
+            history.queue_message(
                 self.bare_jid, body, 'in', ts,
                 quick_responses=quick_responses, commands=commands,
                 request_id=request_id, was_encrypted=encryption_namespace is not None,
@@ -1990,7 +2036,7 @@ class XmppConversation(ChatBackend):
         if history is not None:
             if history.has_recent_outgoing(self.bare_jid, body):
                 return
-            history.record_message(
+            history.queue_message(
                 self.bare_jid, body, 'out', ts, request_id=request_id)
         self.emit('own-message', body, encryption_ns or '')
 
@@ -2047,7 +2093,7 @@ class XmppConversation(ChatBackend):
         # se hubiera enviado de verdad.
         history = self.session.history
         if history is not None:
-            history.record_message(self.bare_jid, prompt, 'out', ts)
+            history.queue_message(self.bare_jid, prompt, 'out', ts)
         self.emit('finished', True)
 
     def _emit_delivery_failed(self, body):
@@ -2074,7 +2120,7 @@ class XmppConversation(ChatBackend):
             history = self.session.history
             if history is not None:
                 # `detail` es el get_uri devuelto por el slot.
-                history.record_message(self.bare_jid, detail, 'out', ts)
+                history.queue_message(self.bare_jid, detail, 'out', ts)
             # La ventana no pudo pintar la burbuja al pulsar "adjuntar": la URL
             # no existía hasta ahora. Sin esto el adjunto se enviaba de verdad
             # pero no aparecía en el chat hasta recargar.
@@ -2106,7 +2152,7 @@ class XmppConversation(ChatBackend):
             return
         history = self.session.history
         if history is not None:
-            history.record_message(self.bare_jid, value, 'out', ts)
+            history.queue_message(self.bare_jid, value, 'out', ts)
         self.emit('finished', True)
 
     # send_command (legacy: solo action='execute', leía un <note> e ignoraba
@@ -2264,39 +2310,67 @@ class XmppConversation(ChatBackend):
              que los edits siguientes del mismo turno colapsen sobre ella.
         """
         history = self.session.history
-        output = []
-        position_by_request = {}
-        for item in messages:
-            body, direction, timestamp, mam_id = item[:4]
-            quick_responses = item[4] if len(item) > 4 else []
-            commands = item[5] if len(item) > 5 else []
-            request_id = item[6] if len(item) > 6 else None
-            replace_id = item[7] if len(item) > 7 else None
-            if replace_id and direction == 'in':
-                position = position_by_request.get(replace_id)
-                if position is not None:
-                    previous = output[position]
-                    output[position] = (
-                        body, previous[1], previous[2], previous[3],
-                        quick_responses, commands, previous[6])
-                    continue
-                if (history is not None
-                        and history.update_by_request_id(
-                            self.bare_jid, replace_id, body)):
-                    continue
-                request_id = replace_id
-            if request_id and direction == 'in':
-                position_by_request[request_id] = len(output)
-            output.append(
-                (body, direction, timestamp, mam_id,
-                 quick_responses, commands, request_id))
-        return output
-
-    def _record_and_emit(self, messages):
-        """Persiste en caché y emite a la UI cada mensaje de una página MAM."""
+        if history is None:
+            return fold_mam_corrections(messages, lambda _replace_id, _body: False)
+        return fold_mam_corrections(
+            messages,
+            lambda replace_id, body: history.update_by_request_id(
+                self.bare_jid, replace_id, body))
+
+    def _record_and_emit(self, messages, then=None):
+        """Persiste en caché y emite a la UI cada mensaje de una página MAM.
+
+        La reconciliación con la caché (plegado de correcciones, attach por
+        request_id/body, inserción) corre en el escritor de historial, fuera
+        del main loop; las emisiones vuelven después, en el mismo orden, y
+        al final se llama a `then()`."""
         history = self.session.history
-        for item in self._collapse_mam_corrections(messages):
-            body, direction, timestamp, mam_id = item[:4]
+        if history is None:
+            decisions = [(item, True)
+                         for item in self._collapse_mam_corrections(messages)]
+            self._emit_mam_page(decisions, then)
+            return
+
+        def on_done(decisions, error):
+            if error is not None:
+                debug_print(f"XmppConversation: reconciliación MAM falló: {error}")
+                # La página no se pierde: se emite entera, como sin caché.
+                try:
+                    collapsed = self._collapse_mam_corrections(messages)
+                except Exception as e:
+                    debug_print(f"XmppConversation: plegado MAM sin caché: {e}")
+                    collapsed = fold_mam_corrections(
+                        messages, lambda _replace_id, _body: False)
+                decisions = [(item, True) for item in collapsed]
+            GLib.idle_add(self._emit_mam_page, decisions, then)
+
+        history.submit_job(lambda _conn: self._reconcile_mam_page(messages),
+                           on_done=on_done)
+
+    def _reconcile_mam_page(self, messages):
+        """Cruza una página MAM con la caché (hilo escritor).
+
+        Devuelve [(item, inserted)] para lo que hay que emitir; inserted es
+        False si la fila ya existía. Los mensajes que se fusionaron con una
+        fila local (por request_id o body) vuelven con inserted=None y no se
+        emiten. Toda la página es una transacción (ingest_mam_page)."""
+        history = self.session.history
+        started = time.perf_counter()
+        decisions = history.ingest_mam_page(self.bare_jid, messages)
+        debug_print(
+            f"[mam] jid={self.bare_jid} page={len(messages)} "
+            f"new={sum(1 for _item, inserted in decisions if inserted)} "
+            f"merged={sum(1 for _item, inserted in decisions if inserted is None)} "
+            f"ms={(time.perf_counter() - started) * 1000.0:.1f}")
+        return decisions
+
+    def _emit_mam_page(self, decisions, then=None):
+        """Main loop: registra ids y emite lo que decidió _reconcile_mam_page.
+
+        inserted=None marca un mensaje fusionado con una fila local: sólo
+        cuenta para el seguimiento de ids, no se emite."""
+        for item, inserted in decisions:
+            body, direction, timestamp = item[:3]
             quick_responses = item[4] if len(item) > 4 else []
             commands = item[5] if len(item) > 5 else []
             # El id de stanza propio de este mensaje (si trae quick_responses/
@@ -2307,23 +2381,8 @@ class XmppConversation(ChatBackend):
             has_pending = bool(quick_responses) or bool(commands)
             if request_id and direction == 'in':
                 self._track_incoming_id(request_id)
-            if history is not None:
-                # Primero por request_id: un seed cuyo body ya reescribieron
-                # las correcciones en vivo jamás casa por body.
-                if request_id and history.attach_mam_to_request_id(
-                        self.bare_jid, request_id, timestamp, mam_id):
-                    continue
-                if history.attach_mam_to_recent_message(
-                        self.bare_jid, body, direction, timestamp, mam_id,
-                        quick_responses=quick_responses, commands=commands,
-                        request_id=request_id):
-                    continue
-            inserted = True
-            if history is not None:
-                inserted = history.record_message(
-                    self.bare_jid, body, direction, timestamp, mam_id,
-                    quick_responses=quick_responses, commands=commands,
-                    request_id=request_id)
+            if inserted is None:
+                continue
             if has_pending and request_id and direction == 'in':
                 self._track_pending_request(request_id, quick_responses)
             if inserted:
@@ -2336,6 +2395,9 @@ class XmppConversation(ChatBackend):
                 self.emit(
                     'history-actions', body, timestamp, quick_responses,
                     commands, request_id)
+        if then is not None:
+            then()
+        return GLib.SOURCE_REMOVE
 
     def _on_mam_catchup_page(self, messages, complete, rsm_last):
         """Página del catch-up hacia adelante (start=). Emite lo recibido y,
@@ -2344,22 +2406,25 @@ class XmppConversation(ChatBackend):
         history-complete, para que la UI trate todo como un lote de
         backfill."""
         self._pending_mam_queryid = None
-        self._record_and_emit(messages)
-        # Paginar hacia adelante mientras haya más y sepamos desde dónde.
-        if not complete and rsm_last and self.session.is_connected:
-            self._pending_mam_queryid = self.session.query_mam(
-                self.bare_jid, start=self._mam_catchup_start,
-                after=rsm_last, callback=self._on_mam_catchup_page)
-            if self._pending_mam_queryid is not None:
-                return
-        self.emit('history-complete', False)
+
+        def after_page():
+            # Paginar hacia adelante mientras haya más y sepamos desde dónde.
+            if not complete and rsm_last and self.session.is_connected:
+                self._pending_mam_queryid = self.session.query_mam(
+                    self.bare_jid, start=self._mam_catchup_start,
+                    after=rsm_last, callback=self._on_mam_catchup_page)
+                if self._pending_mam_queryid is not None:
+                    return
+            self.emit('history-complete', False)
+
+        self._record_and_emit(messages, then=after_page)
 
     def _on_mam_page(self, messages, complete, rsm_last=None):
         self._pending_mam_queryid = None
-        self._record_and_emit(messages)
         if messages:
             self._history_shown_from = messages[0][2]
-        self.emit('history-complete', not complete)
+        self._record_and_emit(
+            messages, then=lambda: self.emit('history-complete', not complete))
 
     def shutdown(self):
         # La sesión es compartida (la cierra quien la posee), pero sí hay
@@ -5,6 +5,8 @@ import json
 from typing import Dict, Optional
 from datetime import datetime, timezone
 
+from .persistence_writer import persistence_writer
+
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS messages (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -29,6 +31,70 @@ CREATE INDEX IF NOT EXISTS idx_messages_jid_ts ON messages(bare_jid, timestamp);
 CREATE INDEX IF NOT EXISTS idx_messages_jid_request ON messages(bare_jid, request_id);
 """
 
+# Estado de las acciones pendientes, para no recorrer el historial: un índice
+# parcial sobre las filas con quick_responses/commands (las que revisa
+# cleanup_expired_action_metadata) y pending_approvals, los ids de los
+# mensajes entrantes cuyas acciones son una aprobación aún sin resolver. La
+# mantienen, en la misma transacción, los métodos que cambian esas columnas
+# (_sync_pending_approval); _resolve_prior_approvals sólo la consulta.
+PENDING_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_messages_actionable ON messages(bare_jid)
+    WHERE quick_responses IS NOT NULL OR commands IS NOT NULL;
+CREATE TABLE IF NOT EXISTS pending_approvals (
+    message_id INTEGER PRIMARY KEY,
+    bare_jid TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pending_approvals_jid ON pending_approvals(bare_jid);
+"""
+
+# Filas que ingest_mam_page cruza por body y ventana de tiempo, como
+# attach_mam_to_recent_message.
+MAM_ATTACH_CANDIDATES = 10
+MAM_ATTACH_WINDOW_SECONDS = 120
+_IN_CHUNK = 400
+
+
+def _page_field(item, index, default=None):
+    return item[index] if len(item) > index else default
+
+
+def fold_mam_corrections(messages, apply_to_known):
+    """Pliega las correcciones XEP-0308 de una página MAM.
+
+    `messages` son tuplas (body, direction, timestamp, mam_id,
+    quick_responses, commands, request_id, replace_id). Cada corrección
+    entrante se aplica sobre un mensaje previo de la misma página (se
+    reescribe su body y sus acciones), o sobre una fila ya conocida si
+    `apply_to_known(replace_id, body)` devuelve True, o si no se ancla
+    como mensaje nuevo con request_id=<replace_id>. Devuelve las tuplas
+    de 7 campos que quedan (sin replace_id).
+    """
+    output = []
+    position_by_request = {}
+    for item in messages:
+        body, direction, timestamp, mam_id = item[:4]
+        quick_responses = _page_field(item, 4, [])
+        commands = _page_field(item, 5, [])
+        request_id = _page_field(item, 6)
+        replace_id = _page_field(item, 7)
+        if replace_id and direction == 'in':
+            position = position_by_request.get(replace_id)
+            if position is not None:
+                previous = output[position]
+                output[position] = (
+                    body, previous[1], previous[2], previous[3],
+                    quick_responses, commands, previous[6])
+                continue
+            if apply_to_known(replace_id, body):
+                continue
+            request_id = replace_id
+        if request_id and direction == 'in':
+            position_by_request[request_id] = len(output)
+        output.append(
+            (body, direction, timestamp, mam_id,
+             quick_responses, commands, request_id))
+    return output
+
 
 class XmppHistory:
     """Local cache for XMPP messages, per contact (bare JID).
@@ -39,10 +105,19 @@ class XmppHistory:
     shared base class with ChatHistory.
     """
 
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, search_index=None):
         self.db_path = db_path
         self._thread_local = threading.local()
         self._cleanup_done = False
+        # Rows handed to queue_message and not yet applied by the writer:
+        # reads from the main loop no longer wait for it, so they add these.
+        self._queued = {}
+        self._queued_lock = threading.Lock()
+        self._queued_next = 0
+        # Optional search_index.SearchIndex kept in sync with this DB.
+        self.search_index = search_index
+        if search_index is not None:
+            search_index.register_source('xmpp', db_path)
 
     def _ensure_db(self):
         if not os.path.exists(self.db_path):
@@ -52,6 +127,10 @@ class XmppHistory:
             conn.close()
 
     def get_connection(self):
+        # Read-your-writes: off the main loop, apply anything still queued
+        # for this DB first. The main loop does not wait; its reads add the
+        # queued rows (_with_queued) and its writes go behind them (_defer).
+        persistence_writer.wait_for(self)
         if not hasattr(self._thread_local, "conn") or self._thread_local.conn is None:
             self._ensure_db()
             self._thread_local.conn = sqlite3.connect(self.db_path)
@@ -103,7 +182,52 @@ class XmppHistory:
             conn.execute("ALTER TABLE messages ADD COLUMN was_encrypted INTEGER NOT NULL DEFAULT 0")
         if "encryption_namespace" not in columns:
             conn.execute("ALTER TABLE messages ADD COLUMN encryption_namespace TEXT")
+        has_pending = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pending_approvals'"
+        ).fetchone()
         conn.commit()
+        conn.executescript(PENDING_SCHEMA)
+        if not has_pending:
+            self._rebuild_pending_approvals(conn)
+            conn.commit()
+
+    def _rebuild_pending_approvals(self, conn):
+        """Llena pending_approvals desde las filas con acciones (una vez, al
+        crear la tabla en una caché existente)."""
+        conn.execute("DELETE FROM pending_approvals")
+        rows = conn.execute(
+            "SELECT id, bare_jid, body, direction, quick_responses, commands FROM messages "
+            "WHERE quick_responses IS NOT NULL OR commands IS NOT NULL"
+        ).fetchall()
+        conn.executemany(
+            "INSERT INTO pending_approvals (message_id, bare_jid) VALUES (?, ?)",
+            [(row["id"], row["bare_jid"]) for row in rows
+             if self._is_pending_approval(row["direction"], row["body"],
+                                          row["quick_responses"], row["commands"])])
+
+    @classmethod
+    def _is_pending_approval(cls, direction, body, quick_json, commands_json) -> bool:
+        """Lo que _resolve_prior_approvals considera una aprobación pendiente."""
+        if direction != "in" or (quick_json is None and commands_json is None):
+            return False
+        actions = cls._decode_metadata(quick_json) + cls._decode_metadata(commands_json)
+        return (cls._actions_look_like_approval(actions)
+                or (bool(actions) and cls._body_looks_like_approval(body)))
+
+    def _sync_pending_approval(self, conn, message_id, bare_jid, direction, body,
+                               quick_json, commands_json):
+        """Refleja en pending_approvals las acciones que quedaron en la fila."""
+        if self._is_pending_approval(direction, body, quick_json, commands_json):
+            conn.execute(
+                "INSERT OR IGNORE INTO pending_approvals (message_id, bare_jid) VALUES (?, ?)",
+                (message_id, bare_jid))
+        else:
+            conn.execute("DELETE FROM pending_approvals WHERE message_id = ?", (message_id,))
+
+    @staticmethod
+    def _forget_pending_approvals(conn, message_ids):
+        conn.executemany("DELETE FROM pending_approvals WHERE message_id = ?",
+                         [(message_id,) for message_id in message_ids])
 
     def record_message(self, bare_jid: str, body: str, direction: str,
                        timestamp: str, mam_id: Optional[str] = None,
@@ -117,6 +241,105 @@ class XmppHistory:
                        was_encrypted: bool = False,
                        encryption_namespace: Optional[str] = None):
         conn = self.get_connection()
+        inserted = self._write_message(
+            conn, bare_jid, body, direction, timestamp, mam_id,
+            quick_responses, commands, request_id, attachment_url,
+            attachment_mime_type, attachment_duration, attachment_local_path,
+            attachment_state, was_encrypted, encryption_namespace)
+        conn.commit()
+        self._update_search_index()
+        return inserted
+
+    def queue_message(self, bare_jid: str, body: str, direction: str,
+                      timestamp: str, on_done=None, **kwargs):
+        """Like record_message, but applied by the background writer.
+
+        Returns immediately; concurrent messages share one transaction.
+        `on_done(inserted, error)` runs on the writer thread. Until then the
+        message already shows up in get_recent and friends."""
+        item = {
+            'bare_jid': bare_jid, 'body': body, 'direction': direction,
+            'timestamp': timestamp, 'mam_id': kwargs.get('mam_id'),
+            'request_id': kwargs.get('request_id'),
+            'was_encrypted': int(bool(kwargs.get('was_encrypted'))),
+            'encryption_namespace': kwargs.get('encryption_namespace'),
+        }
+        for key in ('quick_responses', 'commands'):
+            item[key] = self._decode_metadata(self._encode_metadata(kwargs.get(key)))
+        for key in ('url', 'mime_type', 'duration', 'local_path', 'state'):
+            item[f'attachment_{key}'] = kwargs.get(f'attachment_{key}')
+        with self._queued_lock:
+            self._queued_next += 1
+            token = self._queued_next
+            self._queued[token] = item
+
+        def written(inserted, error):
+            with self._queued_lock:
+                self._queued.pop(token, None)
+            if inserted:
+                self._update_search_index()
+            if on_done is not None:
+                on_done(inserted, error)
+
+        persistence_writer.submit(
+            self,
+            lambda conn: self._write_message(
+                conn, bare_jid, body, direction, timestamp, **kwargs),
+            on_done=written)
+
+    def submit_job(self, job, on_done=None):
+        """Run `job(conn)` on the background writer, on its own.
+
+        For multi-step work that reuses the committing methods of this
+        class (e.g. reconciling a MAM page)."""
+        def done(result, error):
+            self._update_search_index()
+            if on_done is not None:
+                on_done(result, error)
+
+        persistence_writer.submit(self, job, on_done=done, batch=False)
+
+    def _defer(self, method, *args, **kwargs):
+        """From the main loop with writes still queued, run `method` on the
+        writer behind them instead of ahead of them (see
+        persistence_writer.should_queue). True if it was queued."""
+        if not persistence_writer.should_queue(self):
+            return False
+        self.submit_job(lambda _conn: method(*args, **kwargs))
+        return True
+
+    def _queued_rows(self, bare_jid):
+        with self._queued_lock:
+            return [item for item in self._queued.values()
+                    if bare_jid is None or item['bare_jid'] == bare_jid]
+
+    def _with_queued(self, rows, bare_jid, limit=None, keep=None):
+        """`rows` (oldest first) plus the queued rows of `bare_jid` that pass
+        `keep`, without repeating those the writer already committed."""
+        queued = [item for item in self._queued_rows(bare_jid)
+                  if keep is None or keep(item)]
+        if not queued:
+            return rows
+        seen = {(row['timestamp'], row['direction'], row['body']) for row in rows}
+        rows = rows + [item for item in queued
+                       if (item['timestamp'], item['direction'], item['body']) not in seen]
+        rows.sort(key=lambda row: row['timestamp'])
+        return rows[-limit:] if limit else rows
+
+    def _update_search_index(self, dirty_ids=()):
+        """Index new rows; `dirty_ids` were rewritten or deleted in place."""
+        if self.search_index is None:
+            return
+        self.search_index.mark_dirty('xmpp', dirty_ids)
+        self.search_index.schedule_sync()
+
+    def _write_message(self, conn, bare_jid, body, direction, timestamp,
+                       mam_id=None, quick_responses=None, commands=None,
+                       request_id=None, attachment_url=None,
+                       attachment_mime_type=None, attachment_duration=None,
+                       attachment_local_path=None, attachment_state=None,
+                       was_encrypted=False, encryption_namespace=None) -> bool:
+        """Insert (or merge by mam_id) one message; the caller commits."""
         quick_json = self._encode_metadata(quick_responses)
         commands_json = self._encode_metadata(commands)
         if direction == "in":
@@ -124,7 +347,8 @@ class XmppHistory:
                 conn, bare_jid, body, quick_responses, commands)
         if mam_id:
             existing = conn.execute(
-                "SELECT id FROM messages WHERE bare_jid = ? AND mam_id = ?",
+                "SELECT id, body, direction, quick_responses, commands FROM messages "
+                "WHERE bare_jid = ? AND mam_id = ?",
                 (bare_jid, mam_id),
             ).fetchone()
             if existing is not None:
@@ -135,7 +359,11 @@ class XmppHistory:
                     "request_id = COALESCE(?, request_id) WHERE id = ?",
                     (quick_json, commands_json, request_id, existing["id"]),
                 )
-                conn.commit()
+                if quick_json is not None or commands_json is not None:
+                    self._sync_pending_approval(
+                        conn, existing["id"], bare_jid, existing["direction"],
+                        existing["body"], quick_json or existing["quick_responses"],
+                        commands_json or existing["commands"])
                 return False
         cursor = conn.execute(
             "INSERT OR IGNORE INTO messages "
@@ -147,9 +375,44 @@ class XmppHistory:
              attachment_url, attachment_mime_type, attachment_duration, attachment_local_path, attachment_state,
              int(bool(was_encrypted)), encryption_namespace),
         )
-        conn.commit()
+        if cursor.rowcount > 0 and self._is_pending_approval(
+                direction, body, quick_json, commands_json):
+            conn.execute(
+                "INSERT OR IGNORE INTO pending_approvals (message_id, bare_jid) VALUES (?, ?)",
+                (cursor.lastrowid, bare_jid))
         return cursor.rowcount > 0
 
+    def ingest_mam_page(self, bare_jid: str, messages):
+        """Reconcilia una página MAM entera con la caché, en una transacción.
+
+        Hace lo mismo que, por mensaje, fold_mam_corrections con
+        update_by_request_id, attach_mam_to_request_id,
+        attach_mam_to_recent_message y record_message (y su
+        _resolve_prior_approvals). Pero lee de una vez las filas de la
+        página: por mam_id, por request_id, las sin mam_id con el mismo body
+        y las aprobaciones pendientes (pending_approvals). Decide en memoria y escribe con un
+        executemany de UPDATE, otro de INSERT y un solo commit.
+
+        Devuelve [(item, inserted)] con los items plegados (tuplas de 7
+        campos) en orden. inserted es True si es nuevo, False si su mam_id ya
+        estaba y None si se fusionó con una fila local.
+        """
+        page = _MamPage(self, bare_jid)
+        conn = self.get_connection()
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            page.load(conn, messages)
+            folded = fold_mam_corrections(messages, page.apply_correction)
+            decisions = [(item, page.ingest(item)) for item in folded]
+            page.write(conn)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        self._update_search_index(page.dirty_ids)
+        return decisions
+
     def _resolve_prior_approvals(self, conn, bare_jid: str, body: str,
                                  quick_responses=None, commands=None,
                                  exclude_id=None) -> int:
@@ -164,66 +427,55 @@ class XmppHistory:
         current_is_approval = (self._actions_look_like_approval(current_actions)
                                or (bool(current_actions)
                                    and self._body_looks_like_approval(body)))
-        rows = conn.execute(
-            "SELECT id, body, quick_responses, commands FROM messages "
-            "WHERE bare_jid = ? AND direction = 'in' "
-            "AND (quick_responses IS NOT NULL OR commands IS NOT NULL)",
-            (bare_jid,),
-        ).fetchall()
-        stale_ids = []
-        for row in rows:
-            if exclude_id is not None and row["id"] == exclude_id:
-                continue
-            actions = (self._decode_metadata(row["quick_responses"])
-                       + self._decode_metadata(row["commands"]))
-            if (self._actions_look_like_approval(actions)
-                    or (bool(actions)
-                        and self._body_looks_like_approval(row["body"]))):
-                stale_ids.append(row["id"])
         # A later approval and a later ordinary response both resolve all
         # earlier approvals. Empty protocol/status stanzas never reach here.
-        if not stale_ids or (not current_is_approval and not str(body or "").strip()):
+        if not current_is_approval and not str(body or "").strip():
+            return 0
+        stale_ids = [
+            row["message_id"] for row in conn.execute(
+                "SELECT message_id FROM pending_approvals WHERE bare_jid = ?",
+                (bare_jid,))
+            if row["message_id"] != exclude_id
+        ]
+        if not stale_ids:
             return 0
-        placeholders = ",".join("?" for _ in stale_ids)
+        return self._clear_actions(conn, stale_ids)
+
+    def _clear_actions(self, conn, message_ids) -> int:
+        """Quita quick_responses/commands de esas filas (ya resueltas)."""
+        placeholders = ",".join("?" for _ in message_ids)
         cursor = conn.execute(
             f"UPDATE messages SET quick_responses = NULL, commands = NULL "
             f"WHERE id IN ({placeholders})",
-            stale_ids,
+            message_ids,
         )
+        self._forget_pending_approvals(conn, message_ids)
         return cursor.rowcount
 
     def cleanup_superseded_approval_metadata(self) -> int:
-        """Reconcile cached/MAM cards with later messages in each chat."""
+        """Reconcile cached/MAM cards with later messages in each chat.
+
+        A pending approval is superseded by any later non-empty inbound
+        message of the same chat. Only the pending_approvals rows are
+        checked, each against idx_messages_jid_ts."""
         conn = self._thread_local.conn
         rows = conn.execute(
-            "SELECT id, bare_jid, body, direction, quick_responses, commands "
-            "FROM messages ORDER BY bare_jid, timestamp, id"
+            # CROSS JOIN fija el orden: pending_approvals afuera, no un scan de messages.
+            "SELECT a.id FROM pending_approvals AS p "
+            "CROSS JOIN messages AS a ON a.id = p.message_id "
+            "WHERE trim(a.body, char(32, 9, 10, 13)) != '' "
+            "AND EXISTS (SELECT 1 FROM messages AS later "
+            "WHERE later.bare_jid = a.bare_jid AND later.direction = 'in' "
+            "AND (later.timestamp > a.timestamp "
+            "OR (later.timestamp = a.timestamp AND later.id > a.id)) "
+            "AND trim(later.body, char(32, 9, 10, 13)) != '')"
         ).fetchall()
-        pending_by_jid = {}
-        stale_ids = []
-        for row in rows:
-            if row["direction"] != "in" or not str(row["body"] or "").strip():
-                continue
-            actions = (self._decode_metadata(row["quick_responses"])
-                       + self._decode_metadata(row["commands"]))
-            is_approval = (self._actions_look_like_approval(actions)
-                           or (bool(actions)
-                               and self._body_looks_like_approval(row["body"])))
-            previous = pending_by_jid.pop(row["bare_jid"], None)
-            if previous is not None:
-                stale_ids.append(previous)
-            if is_approval:
-                pending_by_jid[row["bare_jid"]] = row["id"]
+        stale_ids = [row["id"] for row in rows]
         if not stale_ids:
             return 0
-        placeholders = ",".join("?" for _ in stale_ids)
-        cursor = conn.execute(
-            f"UPDATE messages SET quick_responses = NULL, commands = NULL "
-            f"WHERE id IN ({placeholders})",
-            stale_ids,
-        )
+        changed = self._clear_actions(conn, stale_ids)
         conn.commit()
-        return cursor.rowcount
+        return changed
 
     def get_recent(self, bare_jid: str, limit: int = 50, verified_only: bool = False):
         conn = self.get_connection()
@@ -237,7 +489,9 @@ class XmppHistory:
             ") ORDER BY timestamp ASC",
             (bare_jid, limit),
         )
-        return [self._decode_row(row) for row in cursor.fetchall()]
+        return self._with_queued(
+            [self._decode_row(row) for row in cursor.fetchall()], bare_jid, limit,
+            keep=(lambda item: item['mam_id'] is not None) if verified_only else None)
 
     def get_before(self, bare_jid: str, before_timestamp: str, limit: int = 50):
         conn = self.get_connection()
@@ -251,7 +505,9 @@ class XmppHistory:
             ") ORDER BY timestamp ASC",
             (bare_jid, before_timestamp, limit),
         )
-        return [self._decode_row(row) for row in cursor.fetchall()]
+        return self._with_queued(
+            [self._decode_row(row) for row in cursor.fetchall()], bare_jid, limit,
+            keep=lambda item: item['timestamp'] < before_timestamp)
 
     def get_latest_timestamp(self, bare_jid: str) -> Optional[str]:
         conn = self.get_connection()
@@ -260,7 +516,10 @@ class XmppHistory:
             "ORDER BY timestamp DESC LIMIT 1",
             (bare_jid,),
         ).fetchone()
-        return row["timestamp"] if row else None
+        timestamps = [item['timestamp'] for item in self._queued_rows(bare_jid)]
+        if row:
+            timestamps.append(row["timestamp"])
+        return max(timestamps, default=None)
 
     def get_latest_timestamps(self) -> Dict[str, str]:
         """Última actividad de cada conversación, en una sola consulta.
@@ -273,7 +532,11 @@ class XmppHistory:
         rows = conn.execute(
             "SELECT bare_jid, MAX(timestamp) AS ts FROM messages GROUP BY bare_jid",
         ).fetchall()
-        return {row["bare_jid"]: row["ts"] for row in rows if row["ts"]}
+        latest = {row["bare_jid"]: row["ts"] for row in rows if row["ts"]}
+        for item in self._queued_rows(None):
+            if item['timestamp'] > latest.get(item['bare_jid'], ''):
+                latest[item['bare_jid']] = item['timestamp']
+        return latest
 
     def get_latest_mam_id(self, bare_jid: str) -> Optional[str]:
         """Ancla RSM (`after=`) para el catch-up de MAM: pedir sólo lo
@@ -300,14 +563,17 @@ class XmppHistory:
             return False
         conn = self.get_connection()
         rows = conn.execute(
-            "SELECT timestamp FROM messages WHERE bare_jid = ? "
+            "SELECT timestamp, direction, body FROM messages WHERE bare_jid = ? "
             "AND direction = 'out' AND body = ? "
             "ORDER BY timestamp DESC LIMIT 1",
             (bare_jid, text),
         ).fetchall()
+        rows = self._with_queued(
+            [dict(row) for row in rows], bare_jid,
+            keep=lambda item: item['direction'] == 'out' and item['body'] == text)
         if not rows:
             return False
-        recorded = self._parse_timestamp(rows[0]["timestamp"])
+        recorded = self._parse_timestamp(rows[-1]["timestamp"])
         if recorded is None:
             return True
         from datetime import datetime, timezone
@@ -322,10 +588,13 @@ class XmppHistory:
         placeholders = ",".join("?" for _ in values)
         conn = self.get_connection()
         rows = conn.execute(
-            "SELECT body, timestamp FROM messages "
+            "SELECT body, direction, timestamp FROM messages "
             f"WHERE bare_jid = ? AND direction = 'out' AND body IN ({placeholders})",
             (bare_jid, *values),
         ).fetchall()
+        rows = self._with_queued(
+            [dict(row) for row in rows], bare_jid,
+            keep=lambda item: item['direction'] == 'out' and item['body'] in values)
         for row in rows:
             candidate = self._parse_timestamp(row["timestamp"])
             if candidate is not None and candidate > target:
@@ -335,14 +604,24 @@ class XmppHistory:
     def update_by_request_id(self, bare_jid: str, request_id: str, body: str) -> bool:
         """Corrige el body de la pregunta original identificada por
         request_id y limpia quick_responses/commands (ya resuelta — que
-        _restore_history_actions no vuelva a mostrar la card al reabrir)."""
+        _restore_history_actions no vuelva a mostrar la card al reabrir).
+        Encolada detrás de otras escrituras (_defer) devuelve None."""
+        if self._defer(self.update_by_request_id, bare_jid, request_id, body):
+            return None
         conn = self.get_connection()
         cursor = conn.execute(
             "UPDATE messages SET body = ?, quick_responses = NULL, commands = NULL "
             "WHERE bare_jid = ? AND request_id = ?",
             (body, bare_jid, request_id),
         )
+        if cursor.rowcount > 0:
+            self._forget_request_approvals(conn, bare_jid, request_id)
         conn.commit()
+        if cursor.rowcount > 0 and self.search_index is not None:
+            ids = [row["id"] for row in conn.execute(
+                "SELECT id FROM messages WHERE bare_jid = ? AND request_id = ?",
+                (bare_jid, request_id))]
+            self._update_search_index(ids)
         return cursor.rowcount > 0
 
     def mark_resolved_by_request_id(self, bare_jid: str, request_id: str) -> bool:
@@ -350,16 +629,27 @@ class XmppHistory:
         una señal secundaria (carbon de la propia respuesta) resuelve la
         pregunta antes de que llegue la corrección XEP-0308 con el texto
         final; a diferencia de update_by_request_id, aquí no hay texto de
-        corrección que escribir."""
+        corrección que escribir. Encolada (_defer) devuelve None."""
+        if self._defer(self.mark_resolved_by_request_id, bare_jid, request_id):
+            return None
         conn = self.get_connection()
         cursor = conn.execute(
             "UPDATE messages SET quick_responses = NULL, commands = NULL "
             "WHERE bare_jid = ? AND request_id = ?",
             (bare_jid, request_id),
         )
+        if cursor.rowcount > 0:
+            self._forget_request_approvals(conn, bare_jid, request_id)
         conn.commit()
         return cursor.rowcount > 0
 
+    @staticmethod
+    def _forget_request_approvals(conn, bare_jid, request_id):
+        conn.execute(
+            "DELETE FROM pending_approvals WHERE message_id IN ("
+            "SELECT id FROM messages WHERE bare_jid = ? AND request_id = ?)",
+            (bare_jid, request_id))
+
     def cleanup_expired_action_metadata(self) -> int:
         """Elimina metadata de acciones que ya no pueden resolverse.
 
@@ -368,9 +658,10 @@ class XmppHistory:
         quick_responses/commands asociadas a ellos.
         """
         conn = self._thread_local.conn
+        # Recorre idx_messages_actionable: sólo las filas con acciones.
         rows = conn.execute(
-            "SELECT id, body, timestamp, quick_responses, commands FROM messages "
-            "WHERE quick_responses IS NOT NULL OR commands IS NOT NULL"
+            "SELECT id, bare_jid, body, direction, timestamp, quick_responses, commands "
+            "FROM messages WHERE quick_responses IS NOT NULL OR commands IS NOT NULL"
         ).fetchall()
         changed = 0
         for row in rows:
@@ -392,6 +683,8 @@ class XmppHistory:
                 "UPDATE messages SET quick_responses = ?, commands = ? WHERE id = ?",
                 (quick_json, commands_json, row["id"]),
             )
+            self._sync_pending_approval(conn, row["id"], row["bare_jid"], row["direction"],
+                                        row["body"], quick_json, commands_json)
             changed += 1
         if changed:
             conn.commit()
@@ -528,7 +821,7 @@ class XmppHistory:
         commands_json = self._encode_metadata(commands)
         conn = self.get_connection()
         cursor = conn.execute(
-            "SELECT id, timestamp FROM messages "
+            "SELECT id, timestamp, quick_responses, commands FROM messages "
             "WHERE bare_jid = ? AND direction = ? AND body = ? AND mam_id IS NULL "
             "ORDER BY timestamp DESC LIMIT 10",
             (bare_jid, direction, body),
@@ -538,7 +831,7 @@ class XmppHistory:
         # CERCANO en el tiempo, no el más reciente — con mensajes idénticos
         # repetidos ("ok" dos veces), quedarse con el más nuevo asignaba el
         # mam_id a la fila equivocada y dejaba la otra como sombra.
-        best_id = None
+        best = None
         best_delta = None
         for row in cursor.fetchall():
             candidate = self._parse_timestamp(row["timestamp"])
@@ -549,9 +842,10 @@ class XmppHistory:
                 continue
             if best_delta is None or delta < best_delta:
                 best_delta = delta
-                best_id = row["id"]
-        if best_id is None:
+                best = row
+        if best is None:
             return False
+        best_id = best["id"]
         try:
             if direction == "in":
                 self._resolve_prior_approvals(
@@ -565,6 +859,11 @@ class XmppHistory:
                 (timestamp, mam_id, quick_json, commands_json,
                  request_id, best_id),
             )
+            if quick_json is not None or commands_json is not None:
+                self._sync_pending_approval(
+                    conn, best_id, bare_jid, direction, body,
+                    quick_json or best["quick_responses"],
+                    commands_json or best["commands"])
             conn.commit()
         except sqlite3.IntegrityError:
             pass
@@ -615,7 +914,9 @@ class XmppHistory:
             "DELETE FROM messages WHERE id = ?",
             [(message_id,) for message_id in set(delete_ids)],
         )
+        self._forget_pending_approvals(conn, set(delete_ids))
         conn.commit()
+        self._update_search_index(delete_ids)
 
     @staticmethod
     def _parse_timestamp(value):
@@ -650,6 +951,9 @@ class XmppHistory:
     def update_attachment_state(self, bare_jid: str, body: str,
                                 direction: str, attachment_state: str,
                                 attachment_url: Optional[str] = None):
+        if self._defer(self.update_attachment_state, bare_jid, body, direction,
+                       attachment_state, attachment_url):
+            return
         conn = self.get_connection()
         conn.execute(
             "UPDATE messages SET attachment_state = ?"
@@ -668,9 +972,12 @@ class XmppHistory:
 
     def mark_encrypted(self, bare_jid: str, request_id: str,
                        namespace: Optional[str] = None) -> bool:
-        """Attach verified OMEMO metadata to a live or MAM-correlated row."""
+        """Attach verified OMEMO metadata to a live or MAM-correlated row.
+        Returns None when queued behind pending writes (_defer)."""
         if not request_id:
             return False
+        if self._defer(self.mark_encrypted, bare_jid, request_id, namespace):
+            return None
         conn = self.get_connection()
         cur = conn.execute(
             "UPDATE messages SET was_encrypted = 1, encryption_namespace = COALESCE(?, encryption_namespace) "
@@ -690,3 +997,241 @@ class XmppHistory:
             (bare_jid,),
         )
         return [dict(row) for row in cursor.fetchall()]
+
+
+class _MamRow:
+    """Estado en memoria de una fila de `messages` durante ingest_mam_page.
+    `id` es None para las filas nuevas de la página."""
+
+    __slots__ = ('id', 'body', 'direction', 'timestamp', 'mam_id', 'request_id',
+                 'quick_responses', 'commands', 'changed')
+
+    def __init__(self, id, body, direction, timestamp, mam_id, request_id,
+                 quick_responses, commands):
+        self.id = id
+        self.body = body
+        self.direction = direction
+        self.timestamp = timestamp
+        self.mam_id = mam_id
+        self.request_id = request_id
+        self.quick_responses = quick_responses
+        self.commands = commands
+        self.changed = False
+
+
+class _MamPage:
+    """Una página MAM reconciliada en memoria (ver ingest_mam_page)."""
+
+    def __init__(self, history, bare_jid):
+        self.history = history
+        self.bare_jid = bare_jid
+        self.rows = {}            # id -> _MamRow, filas existentes leídas
+        self.new_rows = []        # _MamRow a insertar, en orden
+        self.by_mam = {}          # mam_id -> _MamRow
+        self.by_request = {}      # request_id -> [_MamRow]
+        self.by_body = {}         # (direction, body) -> [_MamRow] sin mam_id
+        self.approvals = []       # _MamRow con acciones de aprobación pendientes
+        self.dirty_ids = []       # filas existentes cuyo body cambió
+
+    # --- Lectura ---
+
+    def load(self, conn, messages):
+        mam_ids = {item[3] for item in messages if item[3]}
+        request_ids = {_page_field(item, 6) for item in messages}
+        request_ids |= {_page_field(item, 7) for item in messages}
+        request_ids.discard(None)
+        bodies = {item[0] for item in messages if item[0] is not None}
+        columns = ("SELECT id, body, direction, timestamp, mam_id, request_id, "
+                   "quick_responses, commands FROM messages WHERE bare_jid = ? ")
+        self._select(conn, columns + "AND mam_id IN ({})", mam_ids)
+        self._select(conn, columns + "AND request_id IN ({})", request_ids)
+        self._select(conn, columns + "AND mam_id IS NULL AND body IN ({})", bodies)
+        for row in conn.execute(
+                columns + "AND id IN (SELECT message_id FROM pending_approvals "
+                "WHERE bare_jid = ?)", (self.bare_jid, self.bare_jid)):
+            self._add(row)
+
+    def _select(self, conn, sql, values):
+        values = list(values)
+        for start in range(0, len(values), _IN_CHUNK):
+            chunk = values[start:start + _IN_CHUNK]
+            marks = ",".join("?" for _ in chunk)
+            for row in conn.execute(sql.format(marks), [self.bare_jid] + chunk):
+                self._add(row)
+
+    def _add(self, row):
+        if row["id"] in self.rows:
+            return
+        item = _MamRow(row["id"], row["body"], row["direction"], row["timestamp"],
+                       row["mam_id"], row["request_id"], row["quick_responses"],
+                       row["commands"])
+        self.rows[item.id] = item
+        self._index(item)
+
+    def _index(self, row):
+        if row.mam_id:
+            self.by_mam[row.mam_id] = row
+        else:
+            self.by_body.setdefault((row.direction, row.body), []).append(row)
+        if row.request_id:
+            self.by_request.setdefault(row.request_id, []).append(row)
+        if self._is_approval(row):
+            self.approvals.append(row)
+
+    @staticmethod
+    def _is_approval(row):
+        return XmppHistory._is_pending_approval(
+            row.direction, row.body, row.quick_responses, row.commands)
+
+    # --- Decisiones ---
+
+    def apply_correction(self, request_id, body):
+        """update_by_request_id sobre las filas ya conocidas."""
+        rows = self.by_request.get(request_id)
+        if not rows:
+            return False
+        for row in rows:
+            if row.body != body and row.id is not None:
+                self.dirty_ids.append(row.id)
+            row.body = body
+            self._set_actions(row, None, None)
+        return True
+
+    def _set_actions(self, row, quick_json, commands_json):
+        row.quick_responses = quick_json
+        row.commands = commands_json
+        row.changed = True
+        if row in self.approvals and not self._is_approval(row):
+            self.approvals.remove(row)
+        elif row not in self.approvals and self._is_approval(row):
+            self.approvals.append(row)
+
+    def _resolve_prior_approvals(self, body, quick_responses, commands, exclude=None):
+        current_actions = list(quick_responses or []) + list(commands or [])
+        current_is_approval = (
+            XmppHistory._actions_look_like_approval(current_actions)
+            or (bool(current_actions) and XmppHistory._body_looks_like_approval(body)))
+        stale = [row for row in self.approvals if row is not exclude]
+        if not stale or (not current_is_approval and not str(body or "").strip()):
+            return
+        for row in stale:
+            self._set_actions(row, None, None)
+
+    def _set_mam(self, row, mam_id, timestamp):
+        candidates = self.by_body.get((row.direction, row.body))
+        if candidates and row in candidates:
+            candidates.remove(row)
+        row.mam_id = mam_id
+        row.timestamp = timestamp
+        row.changed = True
+        self.by_mam[mam_id] = row
+
+    def ingest(self, item):
+        body, direction, timestamp, mam_id = item[:4]
+        quick_responses = _page_field(item, 4, [])
+        commands = _page_field(item, 5, [])
+        request_id = _page_field(item, 6)
+        if request_id and self._attach_by_request(request_id, timestamp, mam_id):
+            return None
+        if self._attach_by_body(body, direction, timestamp, mam_id,
+                                quick_responses, commands, request_id):
+            return None
+        return self._record(body, direction, timestamp, mam_id,
+                            quick_responses, commands, request_id)
+
+    def _attach_by_request(self, request_id, timestamp, mam_id):
+        if not mam_id:
+            return False
+        targets = [row for row in self.by_request.get(request_id, ())
+                   if row.direction == "in" and not row.mam_id]
+        # Dos filas con el mismo mam_id, o un mam_id ya usado: el UPDATE
+        # de attach_mam_to_request_id fallaría por UNIQUE(bare_jid, mam_id).
+        if len(targets) != 1 or mam_id in self.by_mam:
+            return False
+        self._set_mam(targets[0], mam_id, timestamp)
+        return True
+
+    def _attach_by_body(self, body, direction, timestamp, mam_id,
+                        quick_responses, commands, request_id):
+        target = XmppHistory._parse_timestamp(timestamp)
+        if target is None or not mam_id:
+            return False
+        # Los más recientes primero, como el ORDER BY timestamp DESC LIMIT.
+        candidates = sorted((row for row in self.by_body.get((direction, body), ())
+                             if not row.mam_id),
+                            key=lambda row: row.timestamp, reverse=True)
+        candidates = candidates[:MAM_ATTACH_CANDIDATES]
+        best = None
+        best_delta = None
+        for row in candidates:
+            candidate = XmppHistory._parse_timestamp(row.timestamp)
+            if candidate is None:
+                continue
+            delta = abs((target - candidate).total_seconds())
+            if delta > MAM_ATTACH_WINDOW_SECONDS:
+                continue
+            if best_delta is None or delta < best_delta:
+                best_delta = delta
+                best = row
+        if best is None:
+            return False
+        if direction == "in":
+            self._resolve_prior_approvals(body, quick_responses, commands, exclude=best)
+        if mam_id in self.by_mam:
+            return True
+        self._set_mam(best, mam_id, timestamp)
+        self._merge_metadata(best, quick_responses, commands, request_id)
+        return True
+
+    def _merge_metadata(self, row, quick_responses, commands, request_id):
+        """El COALESCE de quick_responses/commands/request_id."""
+        quick_json = XmppHistory._encode_metadata(quick_responses)
+        commands_json = XmppHistory._encode_metadata(commands)
+        self._set_actions(row, quick_json or row.quick_responses,
+                          commands_json or row.commands)
+        if request_id and request_id != row.request_id:
+            if row.request_id:
+                self.by_request[row.request_id].remove(row)
+            row.request_id = request_id
+            self.by_request.setdefault(request_id, []).append(row)
+
+    def _record(self, body, direction, timestamp, mam_id,
+                quick_responses, commands, request_id):
+        if direction == "in":
+            self._resolve_prior_approvals(body, quick_responses, commands)
+        if mam_id and mam_id in self.by_mam:
+            self._merge_metadata(self.by_mam[mam_id], quick_responses, commands, request_id)
+            return False
+        row = _MamRow(None, body, direction, timestamp, mam_id, request_id,
+                      XmppHistory._encode_metadata(quick_responses),
+                      XmppHistory._encode_metadata(commands))
+        self.new_rows.append(row)
+        self._index(row)
+        return True
+
+    # --- Escritura ---
+
+    def write(self, conn):
+        changed = [row for row in self.rows.values() if row.changed]
+        if changed:
+            conn.executemany(
+                "UPDATE messages SET body = ?, timestamp = ?, mam_id = ?, request_id = ?, "
+                "quick_responses = ?, commands = ? WHERE id = ?",
+                [(row.body, row.timestamp, row.mam_id, row.request_id,
+                  row.quick_responses, row.commands, row.id) for row in changed])
+        for row in self.new_rows:
+            # Uno a uno (misma transacción): las aprobaciones necesitan su id.
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO messages "
+                "(bare_jid, body, direction, timestamp, mam_id, quick_responses, commands, "
+                "request_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.bare_jid, row.body, row.direction, row.timestamp, row.mam_id,
+                 row.quick_responses, row.commands, row.request_id))
+            if cursor.rowcount > 0:
+                row.id = cursor.lastrowid
+        pending_ids = {row.id for row in self.approvals if row.id is not None}
+        XmppHistory._forget_pending_approvals(
+            conn, [row.id for row in changed if row.id not in pending_ids])
+        conn.executemany(
+            "INSERT OR IGNORE INTO pending_approvals (message_id, bare_jid) VALUES (?, ?)",
+            [(message_id, self.bare_jid) for message_id in pending_ids])
@@ -1,18 +1,20 @@
 """
 xmpp_omemo.py - Integración OMEMO (XEP-0384) para XmppSession.
 
-Implementa el almacenamiento basado en archivos JSON y la sincronización PubSub
-con nbxmpp para OMEMO (tanto legacy eu.siacs.conversations.axolotl como urn:xmpp:omemo:2).
+Implementa el almacenamiento de claves (SQLite, ver omemo_store.py) y la
+sincronización PubSub con nbxmpp para OMEMO (tanto legacy
+eu.siacs.conversations.axolotl como urn:xmpp:omemo:2).
 """
 import os
-import json
 import socket
 import asyncio
 import faulthandler
 import sys
 import traceback
 import threading
+import time
 import html
+from contextlib import contextmanager
 from xml.etree import ElementTree as ET
 
 from gi.repository import GLib
@@ -22,6 +24,8 @@ from nbxmpp.namespaces import Namespace
 from nbxmpp.protocol import Message
 
 from .debug_utils import debug_print
+from .omemo_device_cache import DeviceListCache
+from .omemo_store import SQLiteKeyStore
 from .platform_utils import ensure_user_dir_exists
 
 # python-omemo imports
@@ -127,6 +131,12 @@ def _strip_non_schema_device_attributes(element: ET.Element) -> ET.Element:
     return element
 
 
+def sender_device_id(encrypted_node) -> str | None:
+    """El sid (dispositivo emisor) del <header> de un <encrypted>, legacy o 2."""
+    header_node = encrypted_node.getTag('header')
+    return header_node.getAttr('sid') if header_node is not None else None
+
+
 def _unwrap_sce_payload(payload: str) -> str:
     """Return user-visible bodies from an OMEMO 2 SCE envelope.
 
@@ -160,61 +170,28 @@ def _unwrap_sce_payload(payload: str) -> str:
 
 # --- Storage Provider ---
 
-class JSONStorage(Storage):
-    """Almacenamiento persistente en JSON para claves e información OMEMO."""
+class SQLiteStorage(Storage):
+    """Storage de python-omemo sobre SQLiteKeyStore: una fila por clave y,
+    dentro de batch(), una sola transacción por operación. Reemplaza a
+    JSONStorage, cuyo archivo se migra al abrir."""
 
-    def __init__(self, filepath: str):
+    def __init__(self, db_path: str, legacy_json_path: str = None):
         super().__init__()
-        self.filepath = filepath
-        self.data = {}
-        self.load_from_file()
-
-    def load_from_file(self):
-        if os.path.exists(self.filepath):
-            try:
-                with open(self.filepath, 'r', encoding='utf-8') as f:
-                    self.data = json.load(f)
-                debug_print(f"OMEMO JSONStorage: cargado {len(self.data)} entradas de {self.filepath}")
-            except Exception as e:
-                debug_print(f"OMEMO JSONStorage: error al cargar {self.filepath}: {e}")
-                self.data = {}
-        else:
-            self.data = {}
+        self.filepath = db_path
+        self.key_store = SQLiteKeyStore(db_path, legacy_json_path)
 
-    def save_to_file(self):
-        tmp_path = f"{self.filepath}.tmp"
-        try:
-            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
-            with open(tmp_path, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2)
-                f.flush()
-                os.fsync(f.fileno())
-            os.chmod(tmp_path, 0o600)
-            os.replace(tmp_path, self.filepath)
-            os.chmod(self.filepath, 0o600)
-        except Exception as e:
-            debug_print(f"OMEMO JSONStorage: error al guardar {self.filepath}: {e}")
-            try:
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
-            except OSError:
-                pass
+    def batch(self):
+        return self.key_store.batch()
 
     async def _load(self, key: str) -> Maybe[JSONType]:
-        print(f"[omemo-storage] load key={key}", flush=True)
-        if key in self.data:
-            return Just(self.data[key])
-        return Nothing()
+        found, value = self.key_store.load(key)
+        return Just(value) if found else Nothing()
 
     async def _store(self, key: str, value: JSONType) -> None:
-        print(f"[omemo-storage] store key={key}", flush=True)
-        self.data[key] = value
-        self.save_to_file()
+        self.key_store.store(key, value)
 
     async def _delete(self, key: str) -> None:
-        if key in self.data:
-            del self.data[key]
-            self.save_to_file()
+        self.key_store.delete(key)
 
 
 # --- Thread-Safe nbxmpp Task bridging ---
@@ -491,6 +468,58 @@ class XmppOMEMOSessionManager(SessionManager):
 
 # --- Background Asyncio Loop for OMEMO ---
 
+async def _batched(batch, coro):
+    """Ejecuta `coro` dentro del context manager `batch` (un storage batch)."""
+    with batch:
+        return await coro
+
+
+class _AsyncBatch:
+    """Un storage batch usable en `async with` (junto a otros locks)."""
+
+    def __init__(self, batch):
+        self._batch = batch
+
+    async def __aenter__(self):
+        return self._batch.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        return self._batch.__exit__(*exc_info)
+
+
+class _RatchetLock:
+    """`async with` sobre el asyncio.Lock de un ratchet en `locks`.
+
+    locks guarda (lock, usuarios); la entrada se borra cuando el último sale,
+    así el dict no crece con cada (peer, device) visto en la sesión. Todo
+    corre en el loop de OMEMOAsyncWorker: no hace falta otro lock.
+    """
+
+    def __init__(self, locks, ratchet):
+        self._locks = locks
+        self._ratchet = ratchet
+
+    async def __aenter__(self):
+        lock, users = self._locks.get(self._ratchet) or (asyncio.Lock(), 0)
+        self._locks[self._ratchet] = (lock, users + 1)
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._leave()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self._locks[self._ratchet][0].release()
+        self._leave()
+
+    def _leave(self):
+        lock, users = self._locks[self._ratchet]
+        if users > 1:
+            self._locks[self._ratchet] = (lock, users - 1)
+        else:
+            del self._locks[self._ratchet]
+
+
 class OMEMOAsyncWorker:
     """Hilo de ejecución en segundo plano con un event loop de asyncio."""
 
@@ -526,15 +555,39 @@ class OMEMOEngine:
         self.worker = OMEMOAsyncWorker()
         self.manager = None
         self.own_device_id = None
-        self._decrypt_async_lock = None
+        # (bare JID, sid) -> (asyncio.Lock, usuarios): un ratchet descifra
+        # de a uno. Ver _RatchetLock.
+        self._decrypt_locks = {}
+        # Device lists refrescadas hace poco: el envío no vuelve a pedirlas.
+        self.device_lists = DeviceListCache()
 
         # Ruta del archivo de persistencia
         user_dir = ensure_user_dir_exists()
         omemo_dir = os.path.join(user_dir, 'omemo')
         os.makedirs(omemo_dir, exist_ok=True)
         safe_jid = jid_str.lower().replace('/', '_')
-        self.storage_path = os.path.join(omemo_dir, f"{safe_jid}.json")
-        self.storage = JSONStorage(self.storage_path)
+        self.storage_path = os.path.join(omemo_dir, f"{safe_jid}.sqlite3")
+        # El JSON de versiones anteriores se importa la primera vez.
+        self.storage = SQLiteStorage(self.storage_path,
+                                     os.path.join(omemo_dir, f"{safe_jid}.json"))
+
+    @contextmanager
+    def _storage_batch(self, operation: str, peer: str):
+        """Una transacción de claves por operación, con lo que escribió ella
+        (no otras que se intercalen en el loop: ver omemo_store.KeyBatch)."""
+        start = time.perf_counter()
+        batch = None
+        try:
+            with self.storage.batch() as batch:
+                yield
+        finally:
+            if batch is not None:
+                debug_print(
+                    f"[omemo-storage] {operation} peer={peer} "
+                    f"rows={batch.rows_written} deleted={batch.rows_deleted} "
+                    f"bytes={batch.bytes_written} commit_ms={batch.commit_ms:.2f} "
+                    f"total_ms={(time.perf_counter() - start) * 1000.0:.2f}"
+                )
 
     def initialize(self, label: str):
         """Inicializa las claves OMEMO en segundo plano."""
@@ -606,6 +659,7 @@ class OMEMOEngine:
                         await manager.refresh_device_list(
                             backend.namespace, self.jid_str
                         )
+                    self.device_lists.mark_refreshed(backend.namespace, self.jid_str)
                     debug_print(
                         f"[omemo-init] republished bundle/device "
                         f"namespace={backend.namespace} device={own_device_id}"
@@ -640,7 +694,8 @@ class OMEMOEngine:
             stack_timer = threading.Timer(3, dump_omemo_stack)
             stack_timer.daemon = True
             stack_timer.start()
-            self.manager = self.worker.run_coroutine(_init_coro(), timeout=60)
+            self.manager = self.worker.run_coroutine(_batched(
+                self._storage_batch('init', self.jid_str), _init_coro()), timeout=60)
             stack_timer.cancel()
             faulthandler.cancel_dump_traceback_later()
             debug_print(f"[omemo-init] ready jid={self.jid_str} label={label}")
@@ -651,7 +706,21 @@ class OMEMOEngine:
             debug_print(f"[omemo-init] failed jid={self.jid_str} error={e!r}")
             debug_print(traceback.format_exc())
 
-    def encrypt_msg_async(self, to_bare_jid: str, text: str):
+    async def _refresh_device_list(self, namespace: str, bare_jid: str,
+                                   force: bool, timings: dict) -> None:
+        """refresh_device_list sólo si la lista no está al día (o `force`)."""
+        if not force and self.device_lists.is_fresh(namespace, bare_jid):
+            timings['lists_cached'] += 1
+            return
+        start = time.perf_counter()
+        await asyncio.wait_for(
+            self.manager.refresh_device_list(namespace, bare_jid), timeout=8,
+        )
+        self.device_lists.mark_refreshed(namespace, bare_jid, forced=force)
+        timings['lists_refreshed'] += 1
+        timings['refresh_ms'] += (time.perf_counter() - start) * 1000.0
+
+    def encrypt_msg_async(self, to_bare_jid: str, text: str, timings: dict = None):
         """Encripta para el destinatario usando la API OMEMO 2.1.
 
         ``SessionManager.encrypt`` recibe destinatarios inmutables y un mapa de
@@ -659,98 +728,98 @@ class OMEMOEngine:
         junto con errores no críticos. Se conserva compatibilidad con los
         llamadores antiguos devolviendo un Node cuando hay un solo backend y
         una lista de Nodes cuando hay varios.
+
+        Las device lists se refrescan sólo si no están al día (ver
+        omemo_device_cache); si el cifrado falla habiendo usado alguna de la
+        caché, se reintenta una vez refrescándolas todas. Si se pasa
+        `timings` (dict), se rellena con refresh_ms, encrypt_ms, total_ms,
+        lists_refreshed, lists_cached y retried.
         """
+        if timings is None:
+            timings = {}
+        timings.update(refresh_ms=0.0, encrypt_ms=0.0, total_ms=0.0,
+                       lists_refreshed=0, lists_cached=0, retried=False)
         if self.manager is None:
             return None, text
 
         print(f"[omemo-encrypt] start target={to_bare_jid} len={len(text)}", flush=True)
 
-        async def _encrypt_coro():
+        async def _encrypt_attempt(force):
             recipients = frozenset({to_bare_jid})
-            try:
-                if twomemo_available:
-                    # Los clientes OMEMO 2 pueden anunciar también el
-                    # namespace legacy sin publicar su bundle. Evitar que la
-                    # biblioteca intente descargar ese bundle durante la
-                    # resolución inicial de identidad.
-                    # Refresh unconditionally.  A cached v2 device can be
-                    # retired and replaced (for example during an identity
-                    # migration), so merely finding one local entry is not
-                    # proof that the online list is current.
-                    debug_print(f"OMEMO: refrescando device list OMEMO 2 de {to_bare_jid}")
-                    await asyncio.wait_for(
-                        self.manager.refresh_device_list(TWOMEMO_NS, to_bare_jid),
-                        timeout=8,
-                    )
-                    ids = (await self.storage.load_list(
-                        f"/devices/{to_bare_jid}/list", int
+            if twomemo_available:
+                # Los clientes OMEMO 2 pueden anunciar también el
+                # namespace legacy sin publicar su bundle. Evitar que la
+                # biblioteca intente descargar ese bundle durante la
+                # resolución inicial de identidad.
+                # A cached v2 device can be retired and replaced (for
+                # example during an identity migration): the device-list
+                # cache is invalidated by PEP notifications, expires after
+                # its TTL, and a failed encryption retries with `force`.
+                debug_print(f"OMEMO: device list OMEMO 2 de {to_bare_jid} force={force}")
+                await self._refresh_device_list(TWOMEMO_NS, to_bare_jid, force, timings)
+                ids = (await self.storage.load_list(
+                    f"/devices/{to_bare_jid}/list", int
+                )).maybe([])
+
+                for device_id in ids:
+                    key = f"/devices/{to_bare_jid}/{device_id}"
+                    namespaces = (await self.storage.load_list(
+                        f"{key}/namespaces", str
                     )).maybe([])
-
-                    for device_id in ids:
-                        key = f"/devices/{to_bare_jid}/{device_id}"
-                        namespaces = (await self.storage.load_list(
-                            f"{key}/namespaces", str
-                        )).maybe([])
-                        active = (await self.storage.load_dict(
-                            f"{key}/active", bool
-                        )).maybe({})
-                        if TWOMEMO_NS in namespaces:
-                            await self.storage.store(
-                                f"{key}/namespaces", [TWOMEMO_NS]
-                            )
-                            await self.storage.store(
-                                f"{key}/active", {TWOMEMO_NS: bool(active.get(TWOMEMO_NS, True))}
-                            )
-                    # Load the recipient's genuine legacy devices after the
-                    # v2 cleanup, and our own legacy devices for Carbon sync.
-                    # A mixed account must use the common legacy backend;
-                    # otherwise Gajim/Dino receive a v2 carbon without key
-                    # material and display a decryption failure.
-                    await asyncio.wait_for(
-                        self.manager.refresh_device_list(
-                            LEGACY_NS, to_bare_jid
-                        ), timeout=8,
-                    )
-                    await asyncio.wait_for(
-                        self.manager.refresh_device_list(
-                            LEGACY_NS, self.jid_str
-                        ), timeout=8,
-                    )
-                plaintext_bytes = text.encode('utf-8')
-                if twomemo_available:
-                    own_ids = (await self.storage.load_list(
-                        f"/devices/{self.jid_str}/list", int
+                    active = (await self.storage.load_dict(
+                        f"{key}/active", bool
+                    )).maybe({})
+                    if TWOMEMO_NS in namespaces:
+                        await self.storage.store(
+                            f"{key}/namespaces", [TWOMEMO_NS]
+                        )
+                        await self.storage.store(
+                            f"{key}/active", {TWOMEMO_NS: bool(active.get(TWOMEMO_NS, True))}
+                        )
+                # Load the recipient's genuine legacy devices after the
+                # v2 cleanup, and our own legacy devices for Carbon sync.
+                # A mixed account must use the common legacy backend;
+                # otherwise Gajim/Dino receive a v2 carbon without key
+                # material and display a decryption failure.
+                await self._refresh_device_list(LEGACY_NS, to_bare_jid, force, timings)
+                await self._refresh_device_list(LEGACY_NS, self.jid_str, force, timings)
+            plaintext_bytes = text.encode('utf-8')
+            if twomemo_available:
+                own_ids = (await self.storage.load_list(
+                    f"/devices/{self.jid_str}/list", int
+                )).maybe([])
+                has_legacy_only_own_device = False
+                for device_id in own_ids:
+                    if device_id == self.own_device_id:
+                        continue
+                    key = f"/devices/{self.jid_str}/{device_id}"
+                    namespaces = (await self.storage.load_list(
+                        f"{key}/namespaces", str
                     )).maybe([])
-                    has_legacy_only_own_device = False
-                    for device_id in own_ids:
-                        if device_id == self.own_device_id:
-                            continue
-                        key = f"/devices/{self.jid_str}/{device_id}"
-                        namespaces = (await self.storage.load_list(
-                            f"{key}/namespaces", str
-                        )).maybe([])
-                        active = (await self.storage.load_dict(
-                            f"{key}/active", bool
-                        )).maybe({})
-                        if (LEGACY_NS in namespaces
-                                and bool(active.get(LEGACY_NS, True))
-                                and not (TWOMEMO_NS in namespaces
-                                         and bool(active.get(TWOMEMO_NS, False)))):
-                            has_legacy_only_own_device = True
-                            break
-                    selected_namespace = (
-                        LEGACY_NS if has_legacy_only_own_device
-                        else TWOMEMO_NS
-                    )
-                    debug_print(
-                        f"[omemo-encrypt] selected namespace={selected_namespace} "
-                        f"legacy-own-device={has_legacy_only_own_device}"
-                    )
-                    plaintext = {selected_namespace: plaintext_bytes}
-                    priority = [selected_namespace]
-                else:
-                    plaintext = {LEGACY_NS: plaintext_bytes}
-                    priority = [LEGACY_NS]
+                    active = (await self.storage.load_dict(
+                        f"{key}/active", bool
+                    )).maybe({})
+                    if (LEGACY_NS in namespaces
+                            and bool(active.get(LEGACY_NS, True))
+                            and not (TWOMEMO_NS in namespaces
+                                     and bool(active.get(TWOMEMO_NS, False)))):
+                        has_legacy_only_own_device = True
+                        break
+                selected_namespace = (
+                    LEGACY_NS if has_legacy_only_own_device
+                    else TWOMEMO_NS
+                )
+                debug_print(
+                    f"[omemo-encrypt] selected namespace={selected_namespace} "
+                    f"legacy-own-device={has_legacy_only_own_device}"
+                )
+                plaintext = {selected_namespace: plaintext_bytes}
+                priority = [selected_namespace]
+            else:
+                plaintext = {LEGACY_NS: plaintext_bytes}
+                priority = [LEGACY_NS]
+            start = time.perf_counter()
+            try:
                 encrypted_messages, errors = await asyncio.wait_for(
                     self.manager.encrypt(
                         recipients,
@@ -758,10 +827,32 @@ class OMEMOEngine:
                         backend_priority_order=priority,
                     ), timeout=20
                 )
-                if errors:
-                    debug_print(f"OMEMO: errores no críticos al cifrar para {to_bare_jid}: {errors}")
-                if not encrypted_messages:
-                    raise NoEligibleDevices(f"no encrypted messages for {to_bare_jid}")
+            finally:
+                timings['encrypt_ms'] += (time.perf_counter() - start) * 1000.0
+            if errors:
+                debug_print(f"OMEMO: errores no críticos al cifrar para {to_bare_jid}: "
+                            f"{errors}")
+            if not encrypted_messages:
+                raise NoEligibleDevices(f"no encrypted messages for {to_bare_jid}")
+            return encrypted_messages
+
+        async def _encrypt_coro():
+            try:
+                try:
+                    encrypted_messages = await _encrypt_attempt(force=False)
+                except asyncio.TimeoutError:
+                    raise
+                except Exception as e:
+                    if not timings['lists_cached']:
+                        raise
+                    # Con listas de la caché: quizá un dispositivo cambió
+                    # sin que llegara el evento PEP. Una vez, refrescando.
+                    debug_print(
+                        f"OMEMO: cifrado con device lists en caché falló para "
+                        f"{to_bare_jid} ({e!r}); reintento refrescándolas"
+                    )
+                    timings['retried'] = True
+                    encrypted_messages = await _encrypt_attempt(force=True)
             except NoEligibleDevices as e:
                 debug_print(f"OMEMO: no hay dispositivos OMEMO elegibles para {to_bare_jid}: {e}")
                 return None, text
@@ -785,12 +876,25 @@ class OMEMOEngine:
             print(f"[omemo-encrypt] done target={to_bare_jid} nodes={len(nodes)}", flush=True)
             return (nodes[0] if len(nodes) == 1 else nodes), text
 
+        start = time.perf_counter()
         try:
-            return self.worker.run_coroutine(_encrypt_coro(), timeout=25)
+            return self.worker.run_coroutine(_batched(
+                self._storage_batch('encrypt', to_bare_jid), _encrypt_coro()), timeout=25)
         except Exception as e:
             debug_print(f"OMEMO: Error encriptando mensaje: {e}")
             print(f"[omemo-encrypt] failed target={to_bare_jid} error={e!r}", flush=True)
             return None, text
+        finally:
+            timings['total_ms'] = (time.perf_counter() - start) * 1000.0
+
+    def invalidate_device_list(self, bare_jid: str = None, namespace: str = None):
+        """Marca vieja la device list de `bare_jid` (todas si es None): el
+        próximo envío la vuelve a pedir."""
+        dropped = self.device_lists.invalidate(bare_jid, namespace)
+        debug_print(
+            f"[omemo-devices] invalidate jid={bare_jid or '*'} "
+            f"namespace={namespace or '*'} dropped={dropped}"
+        )
 
     def decrypt_msg(self, from_bare_jid: str, encrypted_node: Node) -> str | None | object:
         """Desencripta un nodo encriptado entrante."""
@@ -822,14 +926,17 @@ class OMEMOEngine:
             flush=True,
         )
 
+        ratchet = (from_bare_jid, sender_device_id(encrypted_node))
+
         async def _decrypt_coro():
             # Streaming can deliver the seed, first token and final update in
             # rapid succession.  SessionManager mutates a Double Ratchet, so
-            # those decryptions must run strictly in arrival order rather
-            # than concurrently on the shared asyncio loop.
-            if self._decrypt_async_lock is None:
-                self._decrypt_async_lock = asyncio.Lock()
-            async with self._decrypt_async_lock:
+            # decryptions for one (peer, device) must run strictly in arrival
+            # order; XmppSession's DecryptScheduler already queues them that
+            # way, and this lock keeps the guarantee for any other caller.
+            # Different ratchets may interleave on the shared asyncio loop.
+            async with _RatchetLock(self._decrypt_locks, ratchet), _AsyncBatch(
+                    self._storage_batch('decrypt', from_bare_jid)):
                 if ns == TWOMEMO_NS:
                     omemo_msg = two_parse_message(et_el, from_bare_jid)
                 else:
@@ -0,0 +1,11 @@
+"""Estados de presencia de un contacto XMPP.
+
+Viven fuera de xmpp_client para que la ventana y el roster puedan pintar
+la presencia sin importar nbxmpp: la sesión (y con ella nbxmpp) se
+importa después del primer frame.
+"""
+
+PRESENCE_ONLINE = 'online'
+PRESENCE_BUSY = 'busy'
+PRESENCE_AWAY = 'away'
+PRESENCE_OFFLINE = 'offline'
@@ -0,0 +1,35 @@
+import json
+
+from gtk_llm_chat.chat_preferences import (
+    PREFERENCES_FILE, ChatPreferences, keeps_answer)
+
+
+def test_keep_partial_survives_a_restart(tmp_path):
+    preferences = ChatPreferences(tmp_path)
+    assert preferences.get('keep_partial_on_cancel') is True
+    preferences.set('keep_partial_on_cancel', False)
+
+    # Otra instancia: lo que vería la próxima sesión.
+    restarted = ChatPreferences(tmp_path)
+    assert restarted.get('keep_partial_on_cancel') is False
+    assert json.loads((tmp_path / PREFERENCES_FILE).read_text()) == {
+        'keep_partial_on_cancel': False}
+    # Lo que fijó la ventana en esta sesión manda sobre lo guardado.
+    assert restarted.resolve({'keep_partial_on_cancel': True},
+                             'keep_partial_on_cancel') is True
+    assert restarted.resolve({}, 'keep_partial_on_cancel') is False
+
+
+def test_unreadable_file_falls_back_to_defaults(tmp_path):
+    (tmp_path / PREFERENCES_FILE).write_text("{not json")
+    assert ChatPreferences(tmp_path).get('keep_partial_on_cancel') is True
+
+
+def test_cancel_keeps_partial_answer_only_when_enabled():
+    # Detenido a mitad: se guarda sólo con la opción activa.
+    assert keeps_answer("half an answer", False, True, keep_partial=True)
+    assert not keeps_answer("half an answer", False, True, keep_partial=False)
+    # Un turno completo se guarda siempre; uno vacío, nunca.
+    assert keeps_answer("full answer", True, False, keep_partial=False)
+    assert not keeps_answer("  ", False, True, keep_partial=True)
+    assert not keeps_answer("error midway", False, False, keep_partial=True)
@@ -0,0 +1,97 @@
+import threading
+
+from gtk_llm_chat.chunk_coalescer import ChunkCoalescer
+
+
+class FakeLoop:
+    """Main loop de juguete: guarda los callbacks y los corre a pedido."""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, callback, delay):
+        self.scheduled.append((callback, delay))
+
+    def run_pending(self):
+        pending, self.scheduled = self.scheduled, []
+        for callback, _delay in pending:
+            callback()
+
+
+def _make(**kwargs):
+    loop = FakeLoop()
+    delivered = []
+    coalescer = ChunkCoalescer(delivered.append, loop.schedule, **kwargs)
+    return coalescer, loop, delivered
+
+
+def test_chunks_between_ticks_are_delivered_once():
+    coalescer, loop, delivered = _make()
+    for chunk in ('Ho', 'la', ' ', 'mundo'):
+        coalescer.push(chunk)
+    assert len(loop.scheduled) == 1
+    assert loop.scheduled[0][1] == coalescer.interval
+    loop.run_pending()
+    assert delivered == ['Hola mundo']
+    stats = coalescer.stats()
+    assert stats['chunks'] == 4
+    assert stats['flushes'] == 1
+    assert stats['merged_chunks'] == 3
+
+
+def test_size_threshold_schedules_immediate_flush():
+    coalescer, loop, delivered = _make(max_chars=4)
+    coalescer.push('ab')
+    coalescer.push('cd')
+    assert [delay for _cb, delay in loop.scheduled] == [coalescer.interval, 0]
+    loop.run_pending()
+    assert delivered == ['abcd']
+
+
+def test_flush_soon_delivers_tail_before_finish():
+    coalescer, loop, delivered = _make()
+    coalescer.push('fin')
+    coalescer.flush_soon()
+    # El flush inmediato va detrás del programado por intervalo, pero el
+    # texto sale una sola vez.
+    loop.run_pending()
+    assert delivered == ['fin']
+
+
+def test_flush_soon_without_pending_schedules_nothing():
+    coalescer, loop, _delivered = _make()
+    coalescer.flush_soon()
+    assert loop.scheduled == []
+
+
+def test_flush_latency_is_measured_from_first_buffered_chunk():
+    now = [10.0]
+    coalescer, loop, _delivered = _make(clock=lambda: now[0])
+    coalescer.push('a')
+    now[0] = 10.05
+    coalescer.push('b')
+    now[0] = 10.1
+    loop.run_pending()
+    stats = coalescer.stats()
+    assert round(stats['last_flush_latency_ms']) == 100
+    assert round(stats['max_flush_latency_ms']) == 100
+
+
+def test_concurrent_producers_lose_no_text():
+    coalescer, loop, delivered = _make(max_chars=64)
+
+    def produce(tag):
+        for i in range(500):
+            coalescer.push(f"{tag}{i};")
+
+    threads = [threading.Thread(target=produce, args=(t,)) for t in 'xyz']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    loop.run_pending()
+    coalescer.flush()
+    text = ''.join(delivered)
+    for tag in 'xyz':
+        assert text.count(tag) == 500
+    assert coalescer.stats()['chunks'] == 1500
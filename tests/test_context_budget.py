@@ -0,0 +1,84 @@
+from gtk_llm_chat.context_budget import (ContextStore, Summary, build_summary_prompt,
+                                         estimate_tokens, system_with_summary)
+from gtk_llm_chat.conversation_cache import ConversationCache
+from gtk_llm_chat.db_operations import ChatHistory
+
+
+def make_history(tmp_path, turns):
+    history = ChatHistory(str(tmp_path / "logs.db"))
+    history.create_conversation_if_not_exists('c1', 'Prueba', 'm')
+    conn = history.get_connection()
+    for i in range(turns):
+        conn.execute(
+            "INSERT INTO responses (id, model, prompt, response, conversation_id, "
+            "datetime_utc) VALUES (?, 'm', ?, ?, 'c1', ?)",
+            (f"r{i:03d}", f"pregunta {i}", "respuesta " * 20, f"2024-01-01T00:00:{i:02d}"))
+    conn.commit()
+    return history
+
+
+def build(prompt, response):
+    return ((prompt, response),)
+
+
+class CountingStore(ContextStore):
+    saved = 0
+
+    def save_token_counts(self, counts, estimator=None):
+        self.saved += len(counts)
+        super().save_token_counts(counts, estimator)
+
+
+def test_token_estimates_are_cached_per_response_id(tmp_path):
+    history = make_history(tmp_path, 4)
+    store = CountingStore(str(tmp_path / "context.db"))
+    state = ConversationCache().restore('c1', 'm', history, build, store)
+    assert store.saved == 4
+    assert store.token_counts(['r000', 'r003', 'missing']) == {
+        'r000': state.turns[0].tokens, 'r003': state.turns[3].tokens}
+
+    # Otro proceso (caché vacía): las estimaciones salen de context.db.
+    store.save_token_counts({'r001': 999})
+    again = ConversationCache().restore('c1', 'm', history, build, store)
+    assert again.turns[1].tokens == 999 and store.saved == 5
+    history.close_connection()
+
+
+def test_plan_keeps_recent_turns_and_uses_the_summary_for_the_rest(tmp_path):
+    history = make_history(tmp_path, 6)
+    state = ConversationCache().restore('c1', 'm', history, build)
+    per_turn = state.turns[0].tokens
+    plan = state.plan(max_tokens=per_turn * 3)
+    assert [t.response_id for t in plan.kept] == ['r003', 'r004', 'r005']
+    assert plan.summary is None and len(plan.unsummarized()) == 3
+
+    summary = Summary('c1', 'r001', 2, 'x' * 4 * per_turn)
+    plan = state.plan(max_tokens=per_turn * 3, summary=summary)
+    # El resumen ocupa el lugar de un turno.
+    assert [t.response_id for t in plan.kept] == ['r004', 'r005']
+    assert plan.summary is summary
+    assert [t.response_id for t in plan.unsummarized()] == ['r002', 'r003']
+    assert plan.tokens == summary.tokens + 2 * per_turn
+    # Sin turnos fuera no hace falta resumen.
+    assert state.plan(summary=summary).summary is None
+    history.close_connection()
+
+
+def test_summary_store_and_prompt(tmp_path):
+    store = ContextStore(str(tmp_path / "context.db"))
+    assert store.get_summary('c1') is None
+    store.save_summary(Summary('c1', 'r002', 3, 'resumen', model='m'))
+    summary = store.get_summary('c1')
+    assert (summary.through_id, summary.turns, summary.text) == ('r002', 3, 'resumen')
+    assert summary.tokens == estimate_tokens('resumen')
+    assert summary.covers('r001') and not summary.covers('r003')
+    store.forget_conversation('c1')
+    assert store.get_summary('c1') is None
+
+    class Turn:
+        prompt, response = 'hola', 'qué tal'
+
+    text = build_summary_prompt(summary, [Turn()])
+    assert 'resumen' in text and 'User: hola\nAssistant: qué tal' in text
+    assert system_with_summary('Sé breve.', summary).endswith('\n\nSé breve.')
+    assert system_with_summary(None, None) is None
@@ -0,0 +1,86 @@
+import pytest
+
+from gtk_llm_chat.conversation_cache import ConversationCache, estimate_tokens
+from gtk_llm_chat.db_operations import ChatHistory
+
+
+@pytest.fixture
+def history(tmp_path):
+    chat_history = ChatHistory(str(tmp_path / "logs.db"))
+    chat_history.create_conversation_if_not_exists('c1', 'Prueba', 'm')
+    yield chat_history
+    chat_history.close_connection()
+
+
+def add_rows(history, start, count, prompt='p{}', response='a{}'):
+    conn = history.get_connection()
+    for i in range(start, start + count):
+        # Dos turnos por segundo: el id desempata los datetime_utc iguales.
+        conn.execute(
+            "INSERT INTO responses (id, model, prompt, response, conversation_id, "
+            "datetime_utc) VALUES (?, 'm', ?, ?, 'c1', ?)",
+            (f"r{i:03d}", prompt.format(i), response.format(i),
+             f"2024-01-01T00:{i // 120:02d}:{(i // 2) % 60:02d}"))
+    conn.commit()
+
+
+class Builder:
+    def __init__(self):
+        self.built = []
+
+    def __call__(self, prompt, response):
+        self.built.append(prompt)
+        return (('user', prompt), ('assistant', response))
+
+
+def test_sync_only_builds_rows_after_the_cursor(history):
+    add_rows(history, 0, 5)
+    cache, build = ConversationCache(), Builder()
+    state = cache.restore('c1', 'm', history, build)
+    assert len(state.turns) == 5 and len(build.built) == 5
+
+    add_rows(history, 5, 3)
+    assert cache.restore('c1', 'm', history, build) is state
+    assert build.built == [f"p{i}" for i in range(8)]
+    assert state.window()[-1] == ('assistant', 'a7')
+    assert cache.stats()['hits'] == 1 and cache.stats()['rows_built'] == 8
+
+
+def test_empty_turns_are_skipped_but_advance_the_cursor(history):
+    add_rows(history, 0, 2)
+    add_rows(history, 2, 1, response=' ')
+    cache, build = ConversationCache(), Builder()
+    state = cache.restore('c1', 'm', history, build)
+    assert len(state.turns) == 2 and state.cursor[1] == 'r002'
+
+
+def test_live_turn_is_not_duplicated_when_its_row_is_read(history):
+    cache, build = ConversationCache(), Builder()
+    state = cache.restore('c1', 'm', history, build)
+    live = state.append_live(['real response'], 'hola', 'qué tal')
+    history.add_history_entry('c1', 'hola', 'qué tal', 'm')
+    assert cache.restore('c1', 'm', history, build) is state
+    assert build.built == [] and state.turns == [live]
+    assert live.response_id is not None
+    assert state.window() == ['real response']
+
+
+def test_window_caps_turns_and_token_budget(history):
+    add_rows(history, 0, 6, response='x' * 40 + '{}')
+    state = ConversationCache().restore('c1', 'm', history, Builder())
+    assert len(state.window(max_turns=2)) == 4
+    per_turn = state.turns[-1].tokens
+    assert per_turn == estimate_tokens('p5') + estimate_tokens('x' * 40 + '5')
+    assert len(state.window(max_tokens=per_turn * 3)) == 6
+    # Un turno más grande que el presupuesto se envía igual: nunca vacío.
+    assert len(state.window(max_tokens=1)) == 2
+
+
+def test_lru_eviction_and_invalidate():
+    cache = ConversationCache(max_entries=2)
+    first = cache.state('a', 'm')
+    cache.state('b', 'm')
+    cache.state('c', 'm')
+    assert cache.state('a', 'm') is not first
+    cache.invalidate('a')
+    assert cache.stats()['entries'] == 1 and cache.stats()['evictions'] == 2
@@ -0,0 +1,125 @@
+import threading
+import time
+
+from gtk_llm_chat.generation_scheduler import GenerationScheduler, parse_provider_limits
+
+
+class Owner:
+    pass
+
+
+class Gate:
+    """Un turno que no termina hasta que se le abre la puerta."""
+
+    def __init__(self, log, name):
+        self.log = log
+        self.name = name
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.log.append(self.name)
+        self.started.set()
+        assert self.release.wait(5)
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_owner_turns_run_in_order_and_provider_limit_holds():
+    scheduler = GenerationScheduler(workers=4, provider_limits={'openai': 1})
+    log = []
+    a, b = Owner(), Owner()
+    first, second, other = Gate(log, 'a1'), Gate(log, 'a2'), Gate(log, 'b1')
+    scheduler.submit(first, a, 'openai')
+    scheduler.submit(second, a, 'openai')
+    ticket_b = scheduler.submit(other, b, 'openai')
+    assert first.started.wait(5)
+    time.sleep(0.05)
+    # a2 espera a a1 (mismo dueño) y b1 al cupo de openai.
+    assert log == ['a1'] and scheduler.queue_depth() == 2
+    stats = scheduler.stats()
+    assert stats['providers']['openai'] == {'running': 1, 'queued': 2, 'limit': 1}
+
+    first.release.set()
+    assert second.started.wait(5)
+    assert log == ['a1', 'a2'] and ticket_b.state == 'queued'
+    second.release.set()
+    other.release.set()
+    wait_until(lambda: scheduler.stats()['completed'] == 3)
+    assert scheduler.stats()['wait_max_ms'] > 0
+
+
+def test_focused_owner_jumps_the_queue_and_positions_are_reported():
+    scheduler = GenerationScheduler(workers=1)
+    log = []
+    busy, background, focused = Owner(), Owner(), Owner()
+    blocker = Gate(log, 'busy')
+    scheduler.submit(blocker, busy, 'openai')
+    assert blocker.started.wait(5)
+    positions = []
+    later = [Gate(log, 'background'), Gate(log, 'focused')]
+    scheduler.submit(later[0], background, 'openai')
+    scheduler.submit(later[1], focused, 'openai', on_position=positions.append)
+    assert positions == [1]
+    scheduler.set_focused(focused)
+    assert positions == [1, 0]
+
+    for gate in [blocker] + later:
+        gate.release.set()
+    wait_until(lambda: scheduler.stats()['completed'] == 3)
+    assert log == ['busy', 'focused', 'background']
+    assert scheduler.stats()['focus_boosts'] == 1
+
+
+def test_cancel_queued_and_release_owner_of_a_stuck_turn():
+    scheduler = GenerationScheduler(workers=2)
+    log = []
+    owner = Owner()
+    stuck, queued, after = Gate(log, 'stuck'), Gate(log, 'queued'), Gate(log, 'after')
+    stuck_ticket = scheduler.submit(stuck, owner, 'openai')
+    queued_ticket = scheduler.submit(queued, owner, 'openai')
+    assert stuck.started.wait(5)
+    assert scheduler.cancel(queued_ticket) and not scheduler.cancel(stuck_ticket)
+
+    scheduler.submit(after, owner, 'openai')
+    time.sleep(0.05)
+    assert log == ['stuck']
+    # Cancelado pero bloqueado en el proveedor: el siguiente no lo espera.
+    scheduler.release_owner(stuck_ticket)
+    assert after.started.wait(5)
+    stuck.release.set()
+    after.release.set()
+    wait_until(lambda: scheduler.stats()['completed'] == 2)
+    assert log == ['stuck', 'after'] and scheduler.stats()['cancelled'] == 1
+
+
+def test_ticket_submitted_while_another_runs_starts_a_worker():
+    scheduler = GenerationScheduler(workers=4)
+    log = []
+    a, b = Owner(), Owner()
+    first, second, after = Gate(log, 'a1'), Gate(log, 'b1'), Gate(log, 'a2')
+    first_ticket = scheduler.submit(first, a, 'openai')
+    assert first.started.wait(5)
+    # El hilo de a1 está ocupado: b1 (otro dueño y proveedor) no lo espera.
+    scheduler.submit(second, b, 'anthropic')
+    assert second.started.wait(5)
+    assert scheduler.stats()['running'] == 2
+
+    # Ni el siguiente turno de un dueño liberado con su hilo aún bloqueado.
+    scheduler.submit(after, a, 'openai')
+    scheduler.release_owner(first_ticket)
+    assert after.started.wait(5)
+    assert scheduler.stats()['running'] == 3
+    for gate in (first, second, after):
+        gate.release.set()
+    wait_until(lambda: scheduler.stats()['completed'] == 3)
+
+
+def test_parse_provider_limits():
+    assert parse_provider_limits('openai=3, local=1,bad') == {'openai': 3, None: 1}
+    assert parse_provider_limits(None) == {}
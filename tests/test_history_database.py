@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+
+import pytest
+
+from gtk_llm_chat.db_operations import ChatHistory
+from gtk_llm_chat.history_database import HistoryDatabase, get_history_database
+
+
+def test_histories_on_the_same_file_share_one_database(tmp_path):
+    path = str(tmp_path / "logs.db")
+    first, second = ChatHistory(path), ChatHistory(path)
+    assert first.database is second.database is get_history_database(path)
+
+    first.create_conversation_if_not_exists('c1', 'Uno', 'm')
+    assert second.get_conversation('c1')['name'] == 'Uno'
+    stats = first.database.stats()
+    assert stats['migrations'] == 1
+    assert stats['writer_acquisitions'] == 1 and stats['reader_checkouts'] == 1
+
+
+def test_readers_are_pooled_and_read_only(tmp_path):
+    database = HistoryDatabase(str(tmp_path / "logs.db"), readers=2)
+    database.ensure_schema()
+    gate = threading.Event()
+    inside = threading.Barrier(3)
+
+    def hold(barrier=None):
+        with database.reader() as conn:
+            if barrier is not None:
+                barrier.wait(5)
+            gate.wait(5)
+            conn.execute("SELECT count(*) FROM responses").fetchone()
+
+    threads = [threading.Thread(target=hold, args=(inside,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    inside.wait(5)
+    waiter = threading.Thread(target=hold)
+    waiter.start()  # no hay tercera lectora: espera a que se libere una
+    threading.Timer(0.05, gate.set).start()
+    for thread in threads + [waiter]:
+        thread.join(5)
+
+    stats = database.stats()
+    assert stats['readers_open'] == 2 and stats['readers_peak'] == 2
+    assert stats['reader_checkouts'] == 3 and stats['reader_waits'] == 1
+    assert stats['readers_in_use'] == 0 and stats['reader_utilization'] > 0
+    with database.reader() as conn, pytest.raises(sqlite3.OperationalError):
+        conn.execute("DELETE FROM responses")
+
+
+def test_writer_is_exclusive_and_records_lock_waits(tmp_path):
+    history = ChatHistory(str(tmp_path / "logs.db"))
+    history.create_conversation_if_not_exists('c', 'C', 'm')
+    database = history.database
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold_writer():
+        with database.writer():
+            holding.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_writer)
+    holder.start()
+    holding.wait(5)
+    threading.Timer(0.05, release.set).start()
+    history.add_history_entry('c', 'hola', 'chau', 'm')
+    holder.join(5)
+
+    stats = database.stats()
+    assert stats['writer_waits'] == 1 and stats['writer_wait_ms'] >= 40
+    assert [e['response'] for e in history.get_conversation_history('c')] == ['chau']
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from gtk_llm_chat.db_operations import ChatHistory
+
+
+@pytest.fixture
+def history(tmp_path):
+    chat_history = ChatHistory(str(tmp_path / "logs.db"))
+    chat_history.create_conversation_if_not_exists('c1', 'Prueba', 'm')
+    conn = chat_history.get_connection()
+    for i in range(7):
+        # Dos turnos por segundo: el id desempata los datetime_utc iguales.
+        conn.execute(
+            "INSERT INTO responses (id, model, prompt, response, conversation_id, "
+            "datetime_utc, options_json) VALUES (?, 'm', ?, ?, 'c1', ?, ?)",
+            (f"r{i}", f"p{i}", f"a{i}", f"2024-01-01T00:00:0{i // 2}",
+             json.dumps({'turn': i})))
+    conn.commit()
+    yield chat_history
+    chat_history.close_connection()
+
+
+def _ids(entries):
+    return [entry['id'] for entry in entries]
+
+
+def test_first_page_is_newest_in_chronological_order(history):
+    page = history.get_conversation_history_page('c1', limit=3)
+    assert _ids(page) == ['r4', 'r5', 'r6']
+
+
+def test_keyset_pages_cover_everything_once(history):
+    seen = []
+    page = history.get_conversation_history_page('c1', limit=3)
+    while page:
+        seen[:0] = _ids(page)
+        if len(page) < 3:
+            break
+        first = page[0]
+        page = history.get_conversation_history_page(
+            'c1', before_datetime=first['datetime_utc'], before_id=first['id'], limit=3)
+    assert seen == [f"r{i}" for i in range(7)]
+
+
+def test_page_selects_only_ui_columns(history):
+    entry = history.get_conversation_history_page('c1', limit=1)[0]
+    assert entry.get('options_json') is None
+    assert set(entry) == {'id', 'model', 'prompt', 'response',
+                          'conversation_id', 'datetime_utc'}
+
+
+def test_full_history_decodes_json_on_access(history):
+    entries = history.get_conversation_history('c1')
+    assert _ids(entries) == [f"r{i}" for i in range(7)]
+    assert entries[2]['options_json'] == {'turn': 2}
+    assert dict(entries[0])['prompt'] == 'p0'
+
+
+def test_has_conversation_history(history):
+    assert history.has_conversation_history('c1')
+    assert not history.has_conversation_history('otra')
+
+
+def test_turn_is_written_in_one_transaction_with_its_conversation(tmp_path):
+    chat_history = ChatHistory(str(tmp_path / "logs.db"))
+    conn = chat_history.get_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    chat_history.add_history_entry(
+        'nueva', 'hola', 'chau', 'm', fragments=['contexto literal'],
+        conversation_name='Nueva')
+    conn.set_trace_callback(None)
+    assert sum(s.strip().upper().startswith('BEGIN') for s in statements) == 1
+    assert chat_history.get_connection() is conn
+    assert chat_history.get_conversation('nueva')['name'] == 'Nueva'
+    entry, = chat_history.get_conversation_history('nueva')
+    assert entry['response'] == 'chau'
+    assert chat_history.get_fragments_for_response(
+        entry['id'], 'prompt_fragments') == ['contexto literal']
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    chat_history.close_connection()
@@ -0,0 +1,45 @@
+import json
+import subprocess
+import sys
+
+from gtk_llm_chat.import_warmup import ImportWarmup
+
+
+def test_warmup_runs_tasks_in_order_and_records_failures():
+    calls = []
+
+    def broken():
+        raise ImportError("no omemo")
+
+    warmup = ImportWarmup([('markdown', lambda: calls.append('markdown')),
+                           ('omemo', broken),
+                           ('llm', lambda: calls.append('llm'))]).start()
+    warmup.join(5)
+    assert calls == ['markdown', 'llm']
+    assert list(warmup.results) == ['markdown', 'omemo', 'llm']
+    assert warmup.results['omemo']['error'] == "no omemo"
+    assert warmup.results['llm']['error'] is None
+
+
+def _run(code, env_dir):
+    env = {'LLM_USER_PATH': str(env_dir), 'PATH': '/usr/bin:/bin'}
+    out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True,
+                         text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_startup_modules_do_not_import_llm(tmp_path):
+    # Catálogo en disco de un proceso anterior...
+    _run("import json; from gtk_llm_chat.model_catalog import get_model_catalog; "
+         "print(json.dumps(len(get_model_catalog().models())))", tmp_path)
+    # ...que otro proceso lee sin cargar llm, igual que el historial y el índice.
+    loaded = _run(
+        "import json, sys\n"
+        "from gtk_llm_chat import db_operations, search_index, xmpp_history\n"
+        "from gtk_llm_chat.platform_utils import ensure_user_dir_exists\n"
+        "from gtk_llm_chat.model_catalog import get_model_catalog\n"
+        "ensure_user_dir_exists()\n"
+        "entry = get_model_catalog().get('4o')\n"
+        "print(json.dumps([entry.model_id, 'llm' in sys.modules,\n"
+        "                  'markdown_it' in sys.modules]))", tmp_path)
+    assert loaded == ['gpt-4o', False, False]
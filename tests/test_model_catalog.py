@@ -0,0 +1,55 @@
+import json
+
+import llm
+import pytest
+
+from gtk_llm_chat import model_catalog
+from gtk_llm_chat.model_catalog import CATALOG_FILE, ModelCatalog
+
+
+@pytest.fixture
+def user_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('LLM_USER_PATH', str(tmp_path))
+    monkeypatch.setattr(model_catalog, '_CHECK_INTERVAL', 0)
+    return tmp_path
+
+
+def test_catalog_is_persisted_and_reused(user_dir):
+    first = ModelCatalog(user_dir)
+    entry = first.get('4o')
+    assert entry.model_id == 'gpt-4o'
+    assert (entry.provider, entry.needs_key) == ('openai', 'openai')
+    assert entry.capabilities['can_stream']
+    assert (user_dir / CATALOG_FILE).exists()
+
+    second = ModelCatalog(user_dir)
+    assert [m.model_id for m in second.models()] == [m.model_id for m in first.models()]
+    assert second.stats()['builds'] == 0 and second.stats()['loads'] == 1
+    assert entry.model_id in {m.model_id for m in second.models_for_provider('openai')}
+
+
+def test_keys_and_fingerprint_changes_rebuild(user_dir):
+    catalog = ModelCatalog(user_dir)
+    catalog.models()
+    catalog.get('gpt-4o')
+    assert catalog.stats()['builds'] == 1
+
+    (user_dir / 'keys.json').write_text(json.dumps({'openai': 'sk-test'}))
+    catalog.get('gpt-4o')
+    assert catalog.stats()['builds'] == 2
+
+    data = json.loads((user_dir / CATALOG_FILE).read_text())
+    data['fingerprint']['catalog'] = -1
+    (user_dir / CATALOG_FILE).write_text(json.dumps(data))
+    stale = ModelCatalog(user_dir)
+    stale.models()
+    assert stale.stats()['builds'] == 1
+
+
+def test_get_model_resolves_aliases_once(user_dir):
+    catalog = ModelCatalog(user_dir)
+    model = catalog.get_model('4o')
+    assert model.model_id == 'gpt-4o'
+    assert catalog.get_model('gpt-4o') is model
+    with pytest.raises(llm.UnknownModelError):
+        catalog.get_model('no-such-model')
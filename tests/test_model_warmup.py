@@ -0,0 +1,67 @@
+import socket
+
+from gtk_llm_chat import model_warmup as warmup_module
+from gtk_llm_chat.model_warmup import ModelWarmup, prefetch_enabled
+
+
+class LocalModel:
+    model_id = 'local-7b'
+
+    def __init__(self):
+        self.loads = 0
+
+    def preload(self):
+        self.loads += 1
+
+
+class RemoteModel:
+    model_id = 'remote'
+    needs_key = 'openai'
+    api_base = 'https://llm.example.test/v1'
+
+
+def test_prefetch_enabled_by_config_or_env(monkeypatch):
+    monkeypatch.delenv('GTK_LLM_CHAT_PREFETCH', raising=False)
+    assert not prefetch_enabled({})
+    assert prefetch_enabled({'model_prefetch': True})
+    monkeypatch.setenv('GTK_LLM_CHAT_PREFETCH', '1')
+    assert prefetch_enabled(None)
+
+
+def test_warm_calls_load_hook_once_and_resolves_provider_host(monkeypatch):
+    resolved = []
+    monkeypatch.setattr(warmup_module.socket, 'getaddrinfo',
+                        lambda host, *a, **kw: resolved.append(host) or [])
+    warmup = ModelWarmup()
+    local = LocalModel()
+    assert warmup.warm(local)['hook'] == 'preload'
+    warmup.warm(local)
+    assert local.loads == 1 and resolved == []
+
+    result = warmup.warm(RemoteModel())
+    assert result['host'] == 'llm.example.test' and resolved == ['llm.example.test']
+    assert warmup.is_warm('remote')
+
+
+def test_dns_failure_is_recorded_not_raised(monkeypatch):
+    def fail(*args, **kwargs):
+        raise socket.gaierror('sin red')
+
+    monkeypatch.setattr(warmup_module.socket, 'getaddrinfo', fail)
+    result = ModelWarmup().warm(RemoteModel())
+    assert result['error'].startswith('dns:')
+
+
+def test_ttft_split_between_cold_and_prefetched():
+    warmup = ModelWarmup()
+    warmup.record_ttft('local-7b', 900.0)
+    warmup.warm(LocalModel())
+    for ms in (120.0, 100.0, 140.0):
+        warmup.record_ttft('local-7b', ms)
+
+    stats = warmup.ttft_stats('local-7b')
+    assert stats['first_ms'] == 900.0
+    assert stats['cold']['count'] == 1
+    assert stats['prefetched'] == {'count': 3, 'last_ms': 140.0, 'p50_ms': 120.0,
+                                   'min_ms': 100.0, 'max_ms': 140.0}
+    assert warmup.ttft_stats('otro') is None
@@ -0,0 +1,96 @@
+import threading
+
+from gtk_llm_chat.omemo_decrypt_scheduler import DecryptScheduler
+
+
+def test_same_device_runs_in_order_one_at_a_time():
+    scheduler = DecryptScheduler(workers=4)
+    done = []
+    running = []
+    overlap = []
+    finished = threading.Event()
+
+    def job(i):
+        def run():
+            running.append(i)
+            overlap.append(len(running))
+            threading.Event().wait(0.002)
+            running.remove(i)
+            return i
+        return run
+
+    def on_done(result, wait_ms, run_ms):
+        done.append(result)
+        if len(done) == 20:
+            finished.set()
+
+    for i in range(20):
+        scheduler.submit("a@example.org", "111", job(i), on_done)
+    assert finished.wait(5)
+    assert done == list(range(20))
+    assert max(overlap) == 1
+
+
+def test_different_peers_run_concurrently():
+    scheduler = DecryptScheduler(workers=2)
+    both_started = threading.Barrier(2, timeout=5)
+    results = {}
+    finished = threading.Event()
+
+    def run():
+        both_started.wait()   # sólo pasa si las dos claves corren a la vez
+        return 'ok'
+
+    def on_done(result, wait_ms, run_ms):
+        results[len(results)] = result
+        if len(results) == 2:
+            finished.set()
+
+    scheduler.submit("a@example.org", "1", run, on_done)
+    scheduler.submit("b@example.org", "2", run, on_done)
+    assert finished.wait(5)
+    assert list(results.values()) == ['ok', 'ok']
+
+
+def test_errors_report_none_and_stats():
+    scheduler = DecryptScheduler(workers=1)
+    finished = threading.Event()
+    seen = []
+
+    def boom():
+        raise RuntimeError("bad ratchet")
+
+    def on_done(result, wait_ms, run_ms):
+        seen.append(result)
+        finished.set()
+
+    scheduler.submit("a@example.org", "1", boom, on_done)
+    assert finished.wait(5)
+    assert seen == [None]
+    for _ in range(100):
+        stats = scheduler.stats()
+        if stats['completed'] == 1:
+            break
+        threading.Event().wait(0.01)
+    assert stats['errors'] == 1 and stats['queued'] == 0
+    assert stats['decrypt_p50_ms'] is not None
+
+
+def test_blocked_ratchet_does_not_hold_back_another_peer():
+    scheduler = DecryptScheduler(workers=4)
+    started, release = threading.Event(), threading.Event()
+    bob_done = threading.Event()
+
+    def alice():
+        started.set()
+        assert release.wait(5)
+        return 'alice'
+
+    scheduler.submit("alice@example.org", "1", alice)
+    assert started.wait(5)
+    # Llega con el ratchet de alice ocupado: otro hilo lo descifra igual.
+    scheduler.submit("bob@example.org", "2", lambda: 'bob',
+                     lambda result, wait_ms, run_ms: bob_done.set())
+    assert bob_done.wait(5)
+    assert scheduler.stats()['running'] == 1
+    release.set()
@@ -0,0 +1,46 @@
+from gtk_llm_chat.omemo_device_cache import DeviceListCache, format_encrypt_timings
+
+NS = "urn:xmpp:omemo:2"
+LEGACY = "eu.siacs.conversations.axolotl"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_fresh_until_ttl_expires():
+    clock = FakeClock()
+    cache = DeviceListCache(ttl=60, clock=clock)
+    assert not cache.is_fresh(NS, "a@example.org")
+    cache.mark_refreshed(NS, "a@example.org")
+    clock.now += 59
+    assert cache.is_fresh(NS, "a@example.org")
+    assert not cache.is_fresh(LEGACY, "a@example.org")
+    clock.now += 2
+    assert not cache.is_fresh(NS, "a@example.org")
+    assert cache.stats()['hits'] == 1
+
+
+def test_invalidate_by_jid_namespace_and_all():
+    cache = DeviceListCache(ttl=60, clock=FakeClock())
+    for jid in ("a@example.org", "b@example.org"):
+        cache.mark_refreshed(NS, jid)
+        cache.mark_refreshed(LEGACY, jid)
+    assert cache.invalidate("a@example.org", LEGACY) == 1
+    assert cache.is_fresh(NS, "a@example.org")
+    assert not cache.is_fresh(LEGACY, "a@example.org")
+    assert cache.invalidate("b@example.org") == 2
+    assert cache.invalidate() == 1
+    assert cache.stats()['entries'] == 0
+
+
+def test_format_encrypt_timings():
+    line = format_encrypt_timings("a@example.org", {
+        'total_ms': 12.34, 'refresh_ms': 0.0, 'encrypt_ms': 10.0,
+        'lists_refreshed': 0, 'lists_cached': 3, 'retried': False})
+    assert line == ("recipient=a@example.org total_ms=12.3 refresh_ms=0.0 "
+                    "encrypt_ms=10.0 lists_refreshed=0 lists_cached=3 retried=0")
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from gtk_llm_chat.omemo_store import SQLiteKeyStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    key_store = SQLiteKeyStore(str(tmp_path / "omemo" / "me.sqlite3"))
+    yield key_store
+    key_store.close()
+
+
+def test_roundtrip_and_delete(store):
+    assert store.load('/own_device_id') == (False, None)
+    store.store('/own_device_id', 42)
+    store.store('/devices/a@b/list', [1, 2])
+    assert store.load('/own_device_id') == (True, 42)
+    store.delete('/own_device_id')
+    assert store.load('/own_device_id') == (False, None)
+    assert store.keys() == {'/devices/a@b/list'}
+    assert store.stats()['transactions'] == 3
+
+
+def test_batch_is_one_transaction_visible_before_commit(store):
+    store.store('/gone', 1)
+    with store.batch():
+        store.store('/a', {'x': 1})
+        with store.batch():
+            store.store('/b', [1])
+            store.delete('/gone')
+        # El anidado no confirma: lo pendiente ya se lee.
+        assert store.stats()['transactions'] == 1
+        assert store.load('/b') == (True, [1]) and store.load('/gone') == (False, None)
+    stats = store.stats()
+    assert stats['transactions'] == 2 and stats['batches'] == 1
+    assert stats['rows_written'] == 3 and stats['rows_deleted'] == 1
+    reopened = SQLiteKeyStore(store.db_path)
+    assert reopened.keys() == {'/a', '/b'}
+    reopened.close()
+
+
+def test_batch_commits_what_was_written_before_an_error(store):
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            store.store('/session', 'ratchet')
+            raise RuntimeError('network')
+    assert store.load('/session') == (True, 'ratchet')
+
+
+def test_overlapping_batches_commit_on_their_own(store):
+    # Dos operaciones intercaladas en el mismo loop, como cifrar y
+    # descifrar con ratchets distintos en el worker de OMEMO.
+    async def operation(key, value, entered, release):
+        with store.batch() as batch:
+            store.store(key, value)
+            entered.set()
+            await release.wait()
+            assert store.load(key) == (True, value)
+        return batch
+
+    async def main():
+        a_in, b_in, a_out, b_out = (asyncio.Event() for _ in range(4))
+        a = asyncio.create_task(operation('/a', 'x', a_in, a_out))
+        b = asyncio.create_task(operation('/b', 'yy', b_in, b_out))
+        await a_in.wait()
+        await b_in.wait()
+        # Lo que no se confirmó es sólo de su operación.
+        assert store.load('/a') == (False, None) and store.keys() == set()
+        a_out.set()
+        first = await a
+        # /a se confirmó al salir su bloque, con /b todavía abierta.
+        assert store.stats()['transactions'] == 1
+        assert store.load('/a') == (True, 'x') and store.load('/b') == (False, None)
+        b_out.set()
+        return first, await b
+
+    first, second = asyncio.run(main())
+    assert (first.rows_written, first.bytes_written) == (1, len('/a') + len('"x"'))
+    assert (second.rows_written, second.bytes_written) == (1, len('/b') + len('"yy"'))
+    stats = store.stats()
+    assert stats['transactions'] == 2 and stats['batches'] == 2
+    assert store.keys() == {'/a', '/b'}
+
+
+def test_json_storage_file_is_migrated_once(tmp_path):
+    legacy = tmp_path / "me.json"
+    legacy.write_text(json.dumps({'/own_device_id': 7, '/devices/me/list': [7]}))
+    db_path = str(tmp_path / "me.sqlite3")
+    store = SQLiteKeyStore(db_path, str(legacy))
+    assert store.load('/own_device_id') == (True, 7)
+    assert store.stats()['migrated_keys'] == 2
+    assert not legacy.exists() and (tmp_path / "me.json.migrated").exists()
+    store.store('/own_device_id', 8)
+    store.close()
+
+    # Un JSON que reaparece no pisa las claves ya migradas.
+    legacy.write_text(json.dumps({'/own_device_id': 7}))
+    store = SQLiteKeyStore(db_path, str(legacy))
+    assert store.load('/own_device_id') == (True, 8) and legacy.exists()
+    assert os.stat(db_path).st_mode & 0o777 == 0o600
+    store.close()
@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from gtk_llm_chat.db_operations import ChatHistory
+from gtk_llm_chat.persistence_writer import PersistenceWriter, persistence_writer
+from gtk_llm_chat.xmpp_history import XmppHistory
+
+
+class Target:
+    """Base mínima: una tabla y una conexión por hilo, como los historiales."""
+
+    def __init__(self, path):
+        self.db_path = str(path)
+        self._local = threading.local()
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE t (v TEXT UNIQUE)")
+        conn.close()
+
+    def get_connection(self):
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = sqlite3.connect(self.db_path)
+        return self._local.conn
+
+    def values(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return [row[0] for row in conn.execute("SELECT v FROM t ORDER BY rowid")]
+        finally:
+            conn.close()
+
+
+def _insert(value):
+    return lambda conn: conn.execute("INSERT INTO t (v) VALUES (?)", (value,)).lastrowid
+
+
+def test_queued_jobs_share_a_transaction_and_report_results(tmp_path):
+    writer = PersistenceWriter()
+    target = Target(tmp_path / "a.db")
+    gate = threading.Event()
+    # Bloquear el hilo con un primer trabajo para que el resto se acumule.
+    writer.submit(target, lambda conn: gate.wait(5), batch=False)
+    results = []
+    for i in range(5):
+        writer.submit(target, _insert(f"v{i}"),
+                      on_done=lambda result, error: results.append((result, error)))
+    gate.set()
+    assert writer.flush(timeout=5)
+    assert target.values() == [f"v{i}" for i in range(5)]
+    assert [error for _r, error in results] == [None] * 5
+    stats = writer.stats()
+    assert stats['batches'] == 2
+    assert stats['max_batch'] == 5
+
+
+def test_failed_job_does_not_roll_back_its_batch(tmp_path):
+    writer = PersistenceWriter()
+    target = Target(tmp_path / "b.db")
+    gate = threading.Event()
+    writer.submit(target, lambda conn: gate.wait(5), batch=False)
+    errors = []
+    for value in ('x', 'x', 'y'):
+        writer.submit(target, _insert(value),
+                      on_done=lambda _result, error: errors.append(error))
+    gate.set()
+    assert writer.flush(timeout=5)
+    assert target.values() == ['x', 'y']
+    assert errors[0] is None and isinstance(errors[1], sqlite3.IntegrityError)
+    assert errors[2] is None
+
+
+def test_prepare_runs_before_write(tmp_path):
+    writer = PersistenceWriter()
+    target = Target(tmp_path / "c.db")
+    writer.submit(target, lambda conn, value: _insert(value)(conn),
+                  prepare=lambda: 'preparado')
+    assert writer.flush(timeout=5)
+    assert target.values() == ['preparado']
+
+
+def _hold_writer(*targets):
+    """Deja el escritor compartido ocupado hasta gate.set()."""
+    gate = threading.Event()
+    for target in targets:
+        persistence_writer.submit(target, lambda conn: gate.wait(5), batch=False)
+    return gate
+
+
+def test_main_loop_reads_see_queued_writes_without_waiting(tmp_path):
+    chat_history = ChatHistory(str(tmp_path / "logs.db"))
+    chat_history._ensure_db_exists()
+    xmpp = XmppHistory(str(tmp_path / "xmpp.db"))
+    xmpp.get_recent('ana@example.org')
+    gate = _hold_writer(chat_history, xmpp)
+    response_id = chat_history.queue_history_entry('c', 'hola', 'chau', 'm',
+                                                   conversation_name='C')
+    xmpp.queue_message('ana@example.org', 'hola', 'out',
+                       datetime.now(timezone.utc).isoformat())
+
+    started = time.perf_counter()
+    entry, = chat_history.get_conversation_history('c')
+    assert entry['id'] == response_id and entry['response'] == 'chau'
+    assert [e['id'] for e in chat_history.get_conversation_history_page('c')] == [
+        response_id]
+    assert [c['name'] for c in chat_history.get_conversations(10, 0)] == ['C']
+    assert [m['body'] for m in xmpp.get_recent('ana@example.org')] == ['hola']
+    assert xmpp.has_recent_outgoing('ana@example.org', 'hola')
+    # El título va detrás del turno que crea la conversación, no delante.
+    chat_history.set_conversation_title('c', 'Saludo')
+    assert chat_history.get_conversation('c')['name'] == 'Saludo'
+    assert time.perf_counter() - started < 1
+
+    gate.set()
+    assert persistence_writer.flush(timeout=5)
+    entry, = chat_history.get_conversation_history('c')
+    assert entry['id'] == response_id
+    assert chat_history.get_conversation('c')['name'] == 'Saludo'
+    assert [m['body'] for m in xmpp.get_recent('ana@example.org')] == ['hola']
+
+
+def test_worker_reads_wait_for_queued_writes(tmp_path):
+    chat_history = ChatHistory(str(tmp_path / "logs.db"))
+    gate = _hold_writer(chat_history)
+    chat_history.queue_history_entry('c', 'hola', 'chau', 'm', conversation_name='C')
+    seen = []
+    reader = threading.Thread(
+        target=lambda: seen.extend(chat_history.get_conversation_history('c')))
+    reader.start()
+    reader.join(0.2)
+    assert reader.is_alive()
+    gate.set()
+    reader.join(5)
+    assert [entry['response'] for entry in seen] == ['chau']
+
+
+def test_truncated_turn_is_marked_in_response_json(tmp_path):
+    chat_history = ChatHistory(str(tmp_path / "logs.db"))
+    chat_history.queue_history_entry('c', 'cuenta hasta 100', '1, 2, 3', 'm',
+                                     conversation_name='C', truncated=True)
+    chat_history.add_history_entry('c', 'hola', 'chau', 'm')
+    partial, complete = chat_history.get_conversation_history('c')
+    assert partial['response_json'] == {'truncated': True}
+    assert complete['response_json'] is None
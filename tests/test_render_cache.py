@@ -0,0 +1,51 @@
+from gtk_llm_chat import render_cache as rc
+from gtk_llm_chat.render_cache import RenderCache, cached, content_key
+
+
+def test_same_content_is_computed_once():
+    cache = RenderCache()
+    calls = []
+
+    def render(text):
+        calls.append(text)
+        return text.upper()
+
+    assert cache.get_or_compute('pango', '**hola**', render) == '**HOLA**'
+    assert cache.get_or_compute('pango', '**hola**', render) == '**HOLA**'
+    assert cache.get_or_compute('tables', '**hola**', render) == '**HOLA**'
+    assert calls == ['**hola**', '**hola**']
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 2)
+
+
+def test_key_includes_renderer_version(monkeypatch):
+    before = content_key('pango', 'x')
+    monkeypatch.setattr(rc, 'RENDERER_VERSION', rc.RENDERER_VERSION + 1)
+    assert content_key('pango', 'x') != before
+
+
+def test_memory_budget_evicts_least_recently_used():
+    cache = RenderCache(max_bytes=3000)
+    for name in ('a', 'b', 'c'):
+        cache.get_or_compute('pango', name, lambda _t: 'x' * 800)
+    cache.get_or_compute('pango', 'a', lambda _t: 'unused')  # 'a' pasa a reciente
+    cache.get_or_compute('pango', 'd', lambda _t: 'x' * 800)
+    stats = cache.stats()
+    assert stats['bytes'] <= 3000
+    assert stats['evictions'] == 1
+    calls = []
+    cache.get_or_compute('pango', 'b', lambda t: calls.append(t) or '')
+    cache.get_or_compute('pango', 'a', lambda t: calls.append(t) or '')
+    assert calls == ['b']
+
+
+def test_oversized_values_are_not_stored():
+    cache = RenderCache(max_bytes=100)
+    cache.get_or_compute('pango', 'big', lambda _t: 'x' * 1000)
+    assert cache.stats()['entries'] == 0
+
+
+def test_cached_without_cache_skips_global_store():
+    before = rc.render_cache.stats()
+    assert cached('pango', 'cola en streaming', str.upper, cache=False) == 'COLA EN STREAMING'
+    assert rc.render_cache.stats() == before
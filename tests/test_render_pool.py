@@ -0,0 +1,41 @@
+import threading
+
+from gtk_llm_chat.render_pool import RenderPool
+
+
+def test_results_are_delivered_through_deliver():
+    pool = RenderPool(workers=2)
+    done = threading.Event()
+    delivered = []
+    results = {}
+
+    def deliver(callback, *args):
+        delivered.append(args[0])
+        callback(*args)
+
+    def on_ready(item, result):
+        results[item] = result
+        if len(results) == 3:
+            done.set()
+
+    for item in (1, 2, 3):
+        pool.submit(lambda n: n * 10, item, on_ready, deliver=deliver)
+    assert done.wait(5)
+    assert results == {1: 10, 2: 20, 3: 30}
+    assert sorted(delivered) == [1, 2, 3]
+    stats = pool.stats()
+    assert (stats['submitted'], stats['completed'], stats['queued']) == (3, 3, 0)
+
+
+def test_failed_build_reports_none_and_counts_error():
+    pool = RenderPool(workers=1)
+    done = threading.Event()
+    results = []
+
+    def boom(_item):
+        raise ValueError("markup roto")
+
+    pool.submit(boom, 'x', lambda item, result: (results.append(result), done.set()))
+    assert done.wait(5)
+    assert results == [None]
+    assert pool.stats()['errors'] == 1
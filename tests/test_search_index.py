@@ -0,0 +1,92 @@
+import sqlite3
+import threading
+
+from gtk_llm_chat.db_operations import ChatHistory
+from gtk_llm_chat.persistence_writer import persistence_writer
+from gtk_llm_chat.search_index import (
+    SNIPPET_END, SNIPPET_START, SearchIndex, build_match_query, index_writer,
+    snippet_to_markup)
+from gtk_llm_chat.xmpp_history import XmppHistory
+
+
+def _index(tmp_path):
+    index = SearchIndex(str(tmp_path / "search_index.db"))
+    history = ChatHistory(str(tmp_path / "logs.db"), search_index=index)
+    xmpp = XmppHistory(str(tmp_path / "xmpp_history.db"), search_index=index)
+    return index, history, xmpp
+
+
+def test_build_match_query_quotes_words_and_prefixes_last():
+    assert build_match_query('  ') is None
+    assert build_match_query('hola "mundo" OR') == '"hola" "mundo" "OR"*'
+
+
+def test_snippet_to_markup_escapes_before_highlighting():
+    snippet = f"a < {SNIPPET_START}b{SNIPPET_END}"
+    escape = lambda text: text.replace('<', '&lt;')  # noqa: E731
+    assert snippet_to_markup(snippet, escape) == "a &lt; <b>b</b>"
+
+
+def test_sync_is_incremental_and_searches_both_sources(tmp_path):
+    index, history, xmpp = _index(tmp_path)
+    history.add_history_entry('c1', 'receta de café', 'Moler el grano', 'm',
+                              conversation_name='Cocina')
+    xmpp.record_message('ana@example.org', 'El cafe está listo', 'in',
+                        '2024-01-01T00:00:00+00:00')
+    index.flush()  # el hilo del índice ya sincronizó
+
+    results = index.search('cafe')
+    assert {r['source'] for r in results} == {'llm', 'xmpp'}
+    assert {r['conversation'] for r in results} == {'c1', 'ana@example.org'}
+
+    history.add_history_entry('c1', 'otra pregunta', 'sin relación', 'm')
+    index.flush()
+    assert index.sync() == 0
+    assert [r['conversation'] for r in index.search('relacion')] == ['c1']
+    assert [r['conversation'] for r in index.search('caf', source='xmpp')] == [
+        'ana@example.org']
+
+
+def test_rewritten_and_deleted_rows_are_reindexed(tmp_path):
+    index, _history, xmpp = _index(tmp_path)
+    xmpp.record_message('bob@example.org', '¿Apruebas el despliegue?', 'in',
+                        '2024-01-01T00:00:00+00:00', request_id='r1')
+    index.sync()
+    xmpp.update_by_request_id('bob@example.org', 'r1', 'Aprobado: cancelar despliegue')
+    index.sync()
+    assert index.search('cancelar')
+    assert index.search('Apruebas') == []
+
+    conn = sqlite3.connect(xmpp.db_path)
+    conn.execute("DELETE FROM messages")
+    conn.commit()
+    conn.close()
+    index.mark_dirty('xmpp', [1])
+    index.sync()
+    assert index.search('despliegue') == []
+
+
+def test_ranking_snippet_and_forget_conversation(tmp_path):
+    index, history, _xmpp = _index(tmp_path)
+    history.add_history_entry('c1', 'gato', 'un gato', 'm')
+    history.add_history_entry('c2', 'gato gato gato', 'gato gato', 'm')
+    index.sync()
+    results = index.search('gato')
+    assert [r['conversation'] for r in results] == ['c2', 'c1']
+    assert f"{SNIPPET_START}gato{SNIPPET_END}" in results[0]['snippet']
+
+    history.delete_conversation('c2')
+    index.flush()
+    assert [r['conversation'] for r in index.search('gato')] == ['c1']
+
+
+def test_indexing_does_not_hold_up_history_writes(tmp_path):
+    index, history, _xmpp = _index(tmp_path)
+    gate = threading.Event()
+    # Una sincronización larga (la primera, sobre todo el historial).
+    index_writer.submit(index, lambda conn: gate.wait(5), batch=False)
+    history.queue_history_entry('c1', 'hola', 'chau', 'm', conversation_name='C')
+    assert persistence_writer.flush(timeout=1)
+    gate.set()
+    assert index.flush(timeout=5)
+    assert [r['conversation'] for r in index.search('chau')] == ['c1']
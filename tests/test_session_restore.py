@@ -0,0 +1,84 @@
+import queue
+import threading
+
+from gtk_llm_chat.session_restore import RestorePipeline, order_descriptors
+
+
+class MainLoop:
+    """Cola de callbacks del 'hilo de UI' y de frames pendientes."""
+
+    def __init__(self):
+        self.posted = queue.Queue()
+        self.frames = []
+
+    def post(self, callback):
+        self.posted.put(callback)
+
+    def after_frame(self, window, callback):
+        self.frames.append((window, callback))
+
+    def run_posted(self, count):
+        for _ in range(count):
+            self.posted.get(timeout=5)()
+
+
+def test_focused_window_goes_first():
+    descriptors = [{'cid': 'a'}, {'cid': 'b', 'focused': True}, {'cid': 'c'}]
+    assert [d['cid'] for d in order_descriptors(descriptors)] == ['b', 'a', 'c']
+
+
+def test_windows_materialize_in_order_one_per_frame():
+    loop = MainLoop()
+    release = {cid: threading.Event() for cid in 'abc'}
+    materialized = []
+
+    def prepare(descriptor):
+        release[descriptor['cid']].wait(5)
+        if descriptor['cid'] == 'c':
+            raise RuntimeError("sin modelo")
+        return descriptor['cid'].upper()
+
+    def materialize(descriptor, prepared):
+        materialized.append((descriptor['cid'], prepared))
+        return f"window-{descriptor['cid']}"
+
+    done = []
+    pipeline = RestorePipeline(
+        [{'cid': 'a'}, {'cid': 'b', 'focused': True}, {'cid': 'c'}],
+        prepare, materialize, loop.post, loop.after_frame, on_done=done.append).start()
+
+    # 'a' está lista antes que 'b', pero 'b' tenía el foco: nada se abre aún.
+    release['a'].set()
+    loop.run_posted(1)
+    assert materialized == []
+
+    release['b'].set()
+    release['c'].set()
+    loop.run_posted(2)
+    # Una sola ventana hasta que se pinte.
+    assert materialized == [('b', 'B')]
+    window, painted = loop.frames.pop(0)
+    assert window == 'window-b'
+    painted()
+    # 'a' entra en el frame siguiente; 'c' (prepare falló) con None, después.
+    assert materialized == [('b', 'B'), ('a', 'A')]
+    loop.frames.pop(0)[1]()
+    assert materialized[-1] == ('c', None)
+    assert not done
+    loop.frames.pop(0)[1]()
+
+    assert done == [pipeline] and pipeline.done
+    assert pipeline.windows == ['window-b', 'window-a', 'window-c']
+    stats = pipeline.stats
+    assert stats['windows'] == 3 and stats['prepare_errors'] == 1
+    assert 0 <= stats['first_window_ms'] <= stats['all_windows_ms']
+
+
+def test_descriptors_without_window_do_not_wait_for_a_frame():
+    loop = MainLoop()
+    done = []
+    RestorePipeline([{'cid': 'x'}, {'cid': 'y'}], lambda d: None, lambda d, p: None,
+                    loop.post, loop.after_frame, on_done=done.append).start()
+    loop.run_posted(2)
+    assert loop.frames == []
+    assert done and done[0].windows == [] and done[0].stats['first_window_ms'] is None
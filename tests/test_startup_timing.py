@@ -0,0 +1,65 @@
+import io
+import time
+
+import pytest
+
+from gtk_llm_chat import startup_timing
+
+
+@pytest.fixture(autouse=True)
+def _reset():
+    startup_timing.reset()
+    yield
+    startup_timing.reset()
+
+
+def test_disabled_records_nothing():
+    with startup_timing.phase('load_plugins'):
+        pass
+    startup_timing.mark('first_frame')
+    assert startup_timing.report() == {'phases': {}, 'marks': {}, 'total_ms': None}
+
+
+def test_phases_accumulate_and_marks_keep_first():
+    startup_timing.enable(time.time() - 0.5)
+    for _ in range(2):
+        with startup_timing.phase('load_plugins'):
+            time.sleep(0.01)
+    startup_timing.mark('first_frame')
+    first = startup_timing.report()['marks']['first_frame']
+    startup_timing.mark('first_frame')
+
+    report = startup_timing.report()
+    assert report['phases']['load_plugins']['count'] == 2
+    assert report['phases']['load_plugins']['ms'] >= 20
+    assert report['marks']['first_frame'] == first >= 500
+    assert report['total_ms'] >= first
+
+
+def test_emit_roundtrips_through_parse_report():
+    startup_timing.enable()
+    with startup_timing.phase('history_connect'):
+        pass
+    out = io.StringIO()
+    out.write("DEBUG: ruido del arranque\n")
+    startup_timing.emit(out)
+    parsed = startup_timing.parse_report(out.getvalue())
+    assert list(parsed['phases']) == ['history_connect']
+    assert startup_timing.parse_report("sin informe\n") is None
+
+
+def test_importtime_report_attributes_children_to_their_subsystem():
+    stderr = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       100 |        100 |     email.parser",
+        "import time:       300 |        300 |     sqlite_utils",
+        "import time:      1000 |       1400 |   llm",
+        "import time:        50 |         50 |   json",
+        "import time:        20 |       1470 | gtk_llm_chat.llm_client",
+        "import time:         5 |          5 | zipfile",
+    ])
+    report = startup_timing.importtime_report(stderr)
+    assert report['subsystems']['llm'] == {'self_ms': 1.4, 'modules': 3}
+    assert report['subsystems']['app'] == {'self_ms': 0.07, 'modules': 2}
+    assert report['subsystems']['other'] == {'self_ms': 0.005, 'modules': 1}
+    assert report['total_ms'] == 1.475
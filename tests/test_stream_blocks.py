@@ -0,0 +1,61 @@
+from gtk_llm_chat.stream_blocks import stable_prefix_length
+
+
+def _split(text):
+    n = stable_prefix_length(text)
+    return text[:n], text[n:]
+
+
+class TestStablePrefix:
+
+    def test_single_open_paragraph_is_not_frozen(self):
+        assert _split("Hola mundo") == ("", "Hola mundo")
+
+    def test_paragraph_frozen_once_next_block_starts(self):
+        assert _split("uno\n\ndos") == ("uno\n\n", "dos")
+
+    def test_trailing_blank_line_does_not_freeze(self):
+        # Sin texto después no se sabe si viene una continuación.
+        assert _split("uno\n\n") == ("", "uno\n\n")
+
+    def test_open_code_fence_stays_in_tail(self):
+        text = "intro\n\n```python\ndef f():\n\n    return 1"
+        frozen, tail = _split(text)
+        assert frozen == "intro\n\n"
+        assert tail.startswith("```python")
+
+    def test_closed_code_fence_is_frozen(self):
+        text = "```python\nx = 1\n```\nsigue"
+        assert _split(text) == ("```python\nx = 1\n```", "\nsigue")
+
+    def test_list_items_are_not_split(self):
+        assert _split("1. uno\n\n2. dos") == ("", "1. uno\n\n2. dos")
+        assert _split("- a\n\n- b\n\nfin") == ("- a\n\n- b\n\n", "fin")
+
+    def test_indented_continuation_is_not_split(self):
+        assert _split("- a\n\n  más de a") == ("", "- a\n\n  más de a")
+
+    def test_table_frozen_after_blank_line(self):
+        text = "| a | b |\n| - | - |\n| 1 | 2 |\n\nDespués"
+        assert _split(text) == ("| a | b |\n| - | - |\n| 1 | 2 |\n\n", "Después")
+
+    def test_open_think_block_is_not_split(self):
+        text = "antes\n\n<think>uno\n\ndos"
+        assert _split(text) == ("antes\n\n", "<think>uno\n\ndos")
+
+    def test_closed_think_block_is_not_split_inside(self):
+        text = "<think>uno\n\ndos</think>\n\nrespuesta"
+        assert _split(text) == ("<think>uno\n\ndos</think>\n\n", "respuesta")
+
+    def test_frozen_prefix_only_grows_while_streaming(self):
+        text = (
+            "# Título\n\nPárrafo uno.\n\n```sh\necho hola\n\necho chau\n```\n\n"
+            "| x | y |\n| - | - |\n| 1 | 2 |\n\n- a\n- b\n\nFin del texto.\n"
+        )
+        previous = ""
+        for end in range(len(text) + 1):
+            frozen, _tail = _split(text[:end])
+            assert frozen.startswith(previous)
+            assert text.startswith(frozen)
+            previous = frozen
+        assert previous == text[:text.index("Fin del texto.")]
@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+from gtk_llm_chat.transcript import TranscriptModel
+
+
+def _msg(ts, text=''):
+    return SimpleNamespace(timestamp=ts, content=text or f"m{ts}")
+
+
+def _model():
+    return TranscriptModel(lambda message: message.timestamp)
+
+
+def test_load_keeps_only_newest_entries_live():
+    model = _model()
+    live = model.load([_msg(t) for t in range(10)], keep=3)
+    assert [e.message.timestamp for e in live] == [7, 8, 9]
+    assert model.hidden_count == 7
+    assert model.live_count == 3
+
+
+def test_load_is_stable_for_equal_timestamps():
+    model = _model()
+    prompt, response = _msg(5, 'prompt'), _msg(5, 'response')
+    live = model.load([prompt, response], keep=10)
+    assert [e.message for e in live] == [prompt, response]
+
+
+def test_insert_older_than_live_window_stays_hidden():
+    model = _model()
+    model.load([_msg(t) for t in (10, 20, 30, 40)], keep=2)
+    _entry, live = model.insert(_msg(15))
+    assert not live
+    assert model.hidden_count == 3
+    _entry, live = model.insert(_msg(35))
+    assert live
+    assert model.live_count == 3
+
+
+def test_hidden_insert_keeps_its_widget_until_revealed():
+    # display_message: un mensaje del historial repuesto, más viejo que la
+    # ventana viva, no se pinta, pero su widget vuelve al revelarlo.
+    model = _model()
+    model.load([_msg(t) for t in (10, 20, 30, 40)], keep=2)
+    entry, live = model.insert(_msg(15), widget='w15')
+    assert not live and entry.widget == 'w15'
+    page = model.reveal_older(10)
+    assert [(e.message.timestamp, e.widget) for e in page] == [
+        (10, None), (15, 'w15'), (20, None)]
+
+
+def test_reveal_older_returns_pages_oldest_first():
+    model = _model()
+    model.load([_msg(t) for t in range(10)], keep=2)
+    page = model.reveal_older(3)
+    assert [e.message.timestamp for e in page] == [5, 6, 7]
+    assert model.hidden_count == 5
+    assert [e.message.timestamp for e in model.reveal_older(100)] == [0, 1, 2, 3, 4]
+    assert model.reveal_older(3) == []
+
+
+def test_hide_oldest_stops_at_pinned_widget():
+    model = _model()
+    for entry in model.load([_msg(t) for t in range(6)], keep=6):
+        entry.widget = f"w{entry.message.timestamp}"
+    released = []
+
+    def release(entry):
+        if entry.widget == 'w2':
+            return False
+        released.append(entry.widget)
+        return True
+
+    assert model.hide_oldest(1, release) == 2
+    assert released == ['w0', 'w1']
+    assert model.hidden_count == 2
+    assert all(e.widget is None for e in list(model)[:2])
+
+
+def test_discard_forgets_widget_and_keeps_boundary():
+    model = _model()
+    widgets = {}
+    for entry in model.load([_msg(t) for t in range(4)], keep=2):
+        entry.widget = widgets[entry.message.timestamp] = object()
+    assert model.discard(widgets[3])
+    assert not model.discard(widgets[3])
+    assert len(model) == 3
+    assert model.hidden_count == 2
+
+
+def test_entries_between_includes_hidden_entries():
+    model = _model()
+    model.load([_msg(t) for t in range(0, 100, 10)], keep=1)
+    found = model.entries_between(15, 40)
+    assert [e.message.timestamp for e in found] == [20, 30, 40]
+
+
+def test_prepend_older_enters_hidden_before_everything():
+    model = _model()
+    model.load([_msg(t) for t in (50, 60)], keep=10)
+    assert model.prepend_older([_msg(40), _msg(30)]) == 2
+    assert model.hidden_count == 2
+    assert model.live_count == 2
+    assert [e.message.timestamp for e in model.reveal_older(10)] == [30, 40]
+
+
+def test_peek_older_does_not_reveal():
+    model = _model()
+    model.load([_msg(t) for t in range(10)], keep=2)
+    assert [e.message.timestamp for e in model.peek_older(3)] == [5, 6, 7]
+    assert model.hidden_count == 8
+    assert all(e.plan is None for e in model)
+
+
+def test_clear_on_rebind_forgets_the_previous_conversation():
+    # La ventana vacía messages_box al cambiar de backend; el modelo también.
+    model = _model()
+    model.load([_msg(t) for t in range(100, 110)], keep=2)
+    model.clear()
+    entry, live = model.insert(_msg(5, 'new conversation'))
+    assert live
+    assert model.hidden_count == 0
+    assert [e.message for e in model] == [entry.message]
@@ -0,0 +1,71 @@
+from gtk_llm_chat.turn_metrics import (
+    MetricsLog, TurnMetrics, format_summary, get_metrics_log, load_metrics)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += ms / 1000.0
+
+
+def run_turn(clock, gaps_ms, output_tokens=None):
+    metrics = TurnMetrics('m', 'cid', clock=clock)
+    clock.advance(5)
+    metrics.started()
+    clock.advance(2)
+    metrics.prompt_sent()
+    clock.advance(300)
+    metrics.chunk('Hola')
+    for gap in gaps_ms:
+        clock.advance(gap)
+        metrics.chunk(' mundo')
+    clock.advance(1)
+    metrics.finish(True, output_tokens, {'flushes': 3, 'mean_flush_latency_ms': 4.0,
+                                         'max_flush_latency_ms': 9.0})
+    return metrics
+
+
+def test_turn_timings_and_percentiles():
+    metrics = run_turn(FakeClock(), [10] * 9 + [100])
+    data = metrics.as_dict()
+    assert data['queue_ms'] == 5.0
+    assert data['prompt_ms'] == 2.0
+    assert data['ttft_ms'] == 307.0
+    assert data['inter_token_p50_ms'] == 10.0
+    assert data['inter_token_p99_ms'] == data['inter_token_max_ms'] == 100.0
+    assert data['chunks'] == 11
+    # Sin recuento del modelo, los chunks hacen de tokens: 11 en 190 ms.
+    assert data['tokens_per_s'] == round(11 / 0.19, 2)
+    assert data['flush_mean_ms'] == 4.0 and data['persist_ms'] is None
+    assert format_summary(data) == "0.31 s · 58 tok/s"
+
+
+def test_model_token_count_wins_over_chunks():
+    data = run_turn(FakeClock(), [50, 50], output_tokens=20).as_dict()
+    assert data['tokens_per_s'] == 200.0
+
+
+def test_turn_without_chunks_has_no_rates():
+    metrics = TurnMetrics('m', clock=FakeClock())
+    metrics.finish(False)
+    data = metrics.as_dict()
+    assert data['ttft_ms'] is None and data['tokens_per_s'] is None
+    assert format_summary(data) == ""
+
+
+def test_metrics_log_appends_json_lines(tmp_path, monkeypatch):
+    path = tmp_path / 'sub' / 'turns.jsonl'
+    log = MetricsLog(str(path))
+    log.write({'model': 'a', 'ttft_ms': 1.0})
+    log.write({'model': 'b', 'ttft_ms': 2.0})
+    assert [r['model'] for r in load_metrics(str(path))] == ['a', 'b']
+
+    monkeypatch.delenv('GTK_LLM_CHAT_METRICS_LOG', raising=False)
+    assert get_metrics_log({}) is None
+    assert get_metrics_log({'metrics_log': str(path)}) is get_metrics_log(
+        {'metrics_log': str(path)})
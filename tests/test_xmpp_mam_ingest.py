@@ -0,0 +1,91 @@
+import pytest
+
+from gtk_llm_chat.xmpp_history import XmppHistory, fold_mam_corrections
+
+JID = "agent@example.org"
+APPROVE = [{"label": "Allow", "value": "/approve 1"}]
+
+
+def _seed(history):
+    history.record_message(JID, "archived", "in", "2024-01-01T09:00:00+00:00", "m5")
+    # Enviado en vivo, sin mam_id: MAM lo trae unos segundos después.
+    history.record_message(JID, "hi", "out", "2024-01-01T10:00:00+00:00")
+    # Seed de streaming cuyo body ya reescribieron las correcciones.
+    history.record_message(JID, "streamed final", "in", "2024-01-01T10:00:01+00:00",
+                           request_id="r1")
+    # Aprobación pendiente grabada en vivo.
+    history.record_message(JID, "Approval needed", "in", "2024-01-01T09:59:00+00:00",
+                           quick_responses=APPROVE, request_id="r0")
+
+
+PAGE = [
+    ("hi", "out", "2024-01-01T10:00:04+00:00", "m1", [], [], None, None),
+    ("streamed seed", "in", "2024-01-01T10:00:05+00:00", "m2", [], [], "r1", None),
+    ("streamed final!", "in", "2024-01-01T10:00:06+00:00", "m3", [], [], None, "r1"),
+    ("archived", "in", "2024-01-01T09:00:00+00:00", "m5", [], [], None, None),
+    ("Approval needed", "in", "2024-01-01T10:01:00+00:00", "m6", APPROVE, [], "r9", None),
+    ("half", "in", "2024-01-01T10:01:01+00:00", "m7", [], [], "r8", None),
+    ("whole", "in", "2024-01-01T10:01:02+00:00", "m8", [], [], None, "r8"),
+    ("done", "in", "2024-01-01T10:02:00+00:00", "m9", [], [], None, None),
+]
+
+
+def _legacy_reconcile(history, messages):
+    """La reconciliación mensaje a mensaje que reemplaza ingest_mam_page."""
+    decisions = []
+    folded = fold_mam_corrections(
+        messages, lambda replace_id, body: history.update_by_request_id(JID, replace_id, body))
+    for item in folded:
+        body, direction, timestamp, mam_id, quick, commands, request_id = item
+        if request_id and history.attach_mam_to_request_id(JID, request_id, timestamp, mam_id):
+            decisions.append((item, None))
+            continue
+        if history.attach_mam_to_recent_message(
+                JID, body, direction, timestamp, mam_id, quick_responses=quick,
+                commands=commands, request_id=request_id):
+            decisions.append((item, None))
+            continue
+        decisions.append((item, history.record_message(
+            JID, body, direction, timestamp, mam_id, quick_responses=quick,
+            commands=commands, request_id=request_id)))
+    return decisions
+
+
+def _table(history):
+    conn = history.get_connection()
+    return [tuple(row) for row in conn.execute(
+        "SELECT id, body, direction, timestamp, mam_id, quick_responses, commands, "
+        "request_id FROM messages ORDER BY id")] + [tuple(row) for row in conn.execute(
+            "SELECT message_id, bare_jid FROM pending_approvals ORDER BY message_id")]
+
+
+@pytest.fixture
+def histories(tmp_path):
+    legacy = XmppHistory(str(tmp_path / "legacy.db"))
+    batched = XmppHistory(str(tmp_path / "batched.db"))
+    for history in (legacy, batched):
+        _seed(history)
+    yield legacy, batched
+    legacy.close_connection()
+    batched.close_connection()
+
+
+def test_ingest_matches_message_by_message_reconciliation(histories):
+    legacy, batched = histories
+    expected = _legacy_reconcile(legacy, PAGE)
+    assert batched.ingest_mam_page(JID, PAGE) == expected
+    assert _table(batched) == _table(legacy)
+    inserted = [item[3] for item, new in expected if new]
+    # m6 es la aprobación viva (se fusiona por body), m8 corrige a m7.
+    assert inserted == ["m7", "m9"]
+    # "done" resolvió la aprobación pendiente.
+    assert not [row for row in _table(batched) if row[5] and "Allow" in row[5]]
+
+
+def test_replayed_page_inserts_nothing(histories):
+    _legacy, batched = histories
+    batched.ingest_mam_page(JID, PAGE)
+    before = _table(batched)
+    again = batched.ingest_mam_page(JID, PAGE)
+    assert not [item for item, new in again if new]
+    assert _table(batched) == before
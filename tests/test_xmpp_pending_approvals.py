@@ -0,0 +1,77 @@
+import json
+import sqlite3
+
+from gtk_llm_chat.xmpp_history import SCHEMA, XmppHistory
+
+JID = "agent@example.org"
+APPROVE = [{"label": "Allow", "value": "/approve 1"}]
+CHOICES = [{"label": "Red", "value": "red"}]
+
+
+def _pending(history):
+    return {row[0] for row in history.get_connection().execute(
+        "SELECT message_id FROM pending_approvals")}
+
+
+def _expected_pending(history):
+    rows = history.get_connection().execute(
+        "SELECT id, body, direction, quick_responses, commands FROM messages").fetchall()
+    return {row["id"] for row in rows if XmppHistory._is_pending_approval(
+        row["direction"], row["body"], row["quick_responses"], row["commands"])}
+
+
+def test_side_table_tracks_approvals_through_writes(tmp_path):
+    history = XmppHistory(str(tmp_path / "xmpp.db"))
+    history.record_message(JID, "pick one", "in", "2024-01-01T10:00:00",
+                           "m1", quick_responses=CHOICES, request_id="c1")
+    history.record_message(JID, "Approval needed", "in", "2024-01-01T10:00:01",
+                           "m2", quick_responses=APPROVE, request_id="a1")
+    # Sólo la aprobación: las quick responses comunes no cuentan.
+    first = _pending(history)
+    assert len(first) == 1 and first == _expected_pending(history)
+
+    # Una aprobación nueva reemplaza a la anterior.
+    history.record_message(JID, "Approval needed again", "in", "2024-01-01T10:01:00",
+                           "m3", quick_responses=APPROVE, request_id="a2")
+    assert _pending(history) == _expected_pending(history)
+    assert len(_pending(history)) == 1 and _pending(history) != first
+
+    # Resolverla por request_id la quita; una respuesta vacía no resuelve nada.
+    history.mark_resolved_by_request_id(JID, "a2")
+    assert _pending(history) == set()
+    history.record_message(JID, "Approval needed", "in", "2024-01-01T10:02:00",
+                           "m4", quick_responses=APPROVE, request_id="a3")
+    history.record_message(JID, "  ", "in", "2024-01-01T10:02:01", "m5")
+    assert len(_pending(history)) == 1
+    history.record_message(JID, "done", "in", "2024-01-01T10:03:00", "m6")
+    assert _pending(history) == set() == _expected_pending(history)
+    history.close_connection()
+
+
+def test_existing_cache_is_backfilled_and_superseded_cards_cleared(tmp_path):
+    path = str(tmp_path / "xmpp.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    rows = [
+        ("Approval needed", "in", "2099-01-01T10:00:00", json.dumps(APPROVE), "a1"),
+        ("later reply", "in", "2099-01-01T10:00:05", None, None),
+        ("Approval needed", "in", "2099-01-01T10:01:00", json.dumps(APPROVE), "a2"),
+        ("sent by me", "out", "2099-01-01T10:02:00", None, None),
+    ]
+    conn.executemany(
+        "INSERT INTO messages (bare_jid, body, direction, timestamp, quick_responses, "
+        "request_id) VALUES (?, ?, ?, ?, ?, ?)", [(JID,) + row for row in rows])
+    conn.commit()
+    conn.close()
+
+    history = XmppHistory(path)
+    # La primera la resolvió "later reply"; la segunda sigue pendiente (lo
+    # saliente no cuenta).
+    cards = {row["request_id"]: row["quick_responses"]
+             for row in history.get_connection().execute(
+                 "SELECT request_id, quick_responses FROM messages "
+                 "WHERE request_id IS NOT NULL")}
+    assert cards["a1"] is None and cards["a2"] is not None
+    assert _pending(history) == _expected_pending(history)
+    assert len(_pending(history)) == 1
+    history.close_connection()